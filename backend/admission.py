@@ -0,0 +1,213 @@
+"""
+アドミッション制御（過負荷時の負荷遮断）
+
+Gemini API の応答が遅くなると、リクエスト（それぞれがアップロードされたファイルをメモリに保持する）が
+プロセス内に滞留し、メモリ不足やフロントエンドのタイムアウト（60秒）につながる。
+ルートの種類ごとに実行中のリクエスト数と推定待ち時間を追跡し、受け付けても期限内に処理できない
+リクエストは早期に 503 + Retry-After で拒否する。大きなアップロードの同時受付数も制限する。
+"""
+import logging
+import math
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from starlette.responses import JSONResponse
+
+from backend.config import (
+    ADMISSION_ENABLED,
+    ADMISSION_LARGE_UPLOAD_BYTES,
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MAX_LARGE_UPLOADS,
+    ADMISSION_MAX_QUEUE_WAIT_SECONDS,
+    UPSTREAM_MAX_CONCURRENCY,
+)
+from backend.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# パスの接頭辞とルートの種類（http_transport のルートの種類と対応）
+_ROUTE_CLASS_PREFIXES = (
+    ("/api/embedding", "embedding"),
+    ("/api/image", "media"),
+    ("/api/video", "media"),
+    ("/api/audio", "media"),
+    ("/api/document", "media"),
+)
+# 処理時間の指数移動平均の重み
+_LATENCY_EWMA_ALPHA = 0.2
+# 処理時間の実績が無い場合の初期値（秒）
+_INITIAL_LATENCY_SECONDS = 5.0
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """リクエストのルートの種類（アドミッション制御の対象外の場合はNone）
+
+    取得系（GET など）と /api 以外のパス（ヘルスチェック・メトリクス）は制御しない。
+    """
+    if method != "POST" or not path.startswith("/api/"):
+        return None
+    if "/stream" in path:
+        return "streaming"
+    for prefix, route_class in _ROUTE_CLASS_PREFIXES:
+        if path.startswith(prefix):
+            return route_class
+    return "default"
+
+
+@dataclass
+class AdmissionDecision:
+    """1つのリクエストの受付判定"""
+
+    route_class: str
+    admitted: bool
+    reason: str  # admitted / in_flight / queue_wait / large_upload
+    estimated_wait: float
+    large_upload: bool = False
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def retry_after(self) -> int:
+        """クライアントが再試行するまでの秒数"""
+        return max(1, min(60, math.ceil(self.estimated_wait)))
+
+
+class AdmissionController:
+    """ルートの種類ごとの実行中リクエスト数と処理時間から受付可否を判定する"""
+
+    def __init__(
+        self,
+        max_in_flight: Mapping[str, int] = ADMISSION_MAX_IN_FLIGHT,
+        max_queue_wait: float = ADMISSION_MAX_QUEUE_WAIT_SECONDS,
+        large_upload_bytes: int = ADMISSION_LARGE_UPLOAD_BYTES,
+        max_large_uploads: int = ADMISSION_MAX_LARGE_UPLOADS,
+        upstream_concurrency: int = UPSTREAM_MAX_CONCURRENCY,
+    ) -> None:
+        self.max_in_flight = dict(max_in_flight)
+        self.max_queue_wait = max_queue_wait
+        self.large_upload_bytes = large_upload_bytes
+        self.max_large_uploads = max_large_uploads
+        self.upstream_concurrency = max(1, upstream_concurrency)
+        self.in_flight: Dict[str, int] = {route_class: 0 for route_class in self.max_in_flight}
+        self.latency: Dict[str, float] = {}
+        self.large_uploads = 0
+
+    def estimated_wait(self, route_class: str) -> float:
+        """新しいリクエストが上流の実行枠を得るまでの推定待ち時間（秒）
+
+        上流の同時実行数を超えた分のリクエストが、平均処理時間ごとに同時実行数ずつ捌けるとみなす。
+        """
+        total = sum(self.in_flight.values())
+        waiting = max(0, total + 1 - self.upstream_concurrency)
+        latency = self.latency.get(route_class, _INITIAL_LATENCY_SECONDS)
+        return latency * math.ceil(waiting / self.upstream_concurrency)
+
+    def admit(self, route_class: str, content_length: Optional[int]) -> AdmissionDecision:
+        """受付可否を判定し、受け付ける場合は実行中として計上する
+
+        Args:
+            route_class: ルートの種類
+            content_length: リクエスト本文のサイズ（Content-Length。不明な場合はNone）
+
+        Returns:
+            AdmissionDecision: 判定結果（受け付けた場合は処理後に release() を呼ぶこと）
+        """
+        in_flight = self.in_flight.get(route_class, 0)
+        wait = self.estimated_wait(route_class)
+        large_upload = content_length is not None and content_length >= self.large_upload_bytes
+
+        if in_flight >= self.max_in_flight.get(route_class, self.max_in_flight["default"]):
+            decision = AdmissionDecision(route_class, False, "in_flight", max(wait, self.latency.get(route_class, 1.0)))
+        elif wait > self.max_queue_wait:
+            decision = AdmissionDecision(route_class, False, "queue_wait", wait)
+        elif large_upload and self.large_uploads >= self.max_large_uploads:
+            decision = AdmissionDecision(route_class, False, "large_upload", max(wait, self.latency.get(route_class, 1.0)))
+        else:
+            decision = AdmissionDecision(route_class, True, "admitted", wait, large_upload=large_upload)
+            self.in_flight[route_class] = in_flight + 1
+            if large_upload:
+                self.large_uploads += 1
+
+        metrics.inc("admission_decisions_total", route_class=route_class, decision=decision.reason)
+        metrics.observe("admission_estimated_wait_seconds", wait, route_class=route_class)
+        return decision
+
+    def release(self, decision: AdmissionDecision) -> None:
+        """受け付けたリクエストの完了を計上し、処理時間の平均を更新する
+
+        上流のタイムアウトによるエラーも混雑の兆候であるため、失敗したリクエストの処理時間も含める。
+        """
+        if not decision.admitted:
+            return
+        self.in_flight[decision.route_class] = max(0, self.in_flight.get(decision.route_class, 0) - 1)
+        if decision.large_upload:
+            self.large_uploads = max(0, self.large_uploads - 1)
+        elapsed = time.perf_counter() - decision.started
+        previous = self.latency.get(decision.route_class)
+        self.latency[decision.route_class] = (
+            elapsed if previous is None else previous + _LATENCY_EWMA_ALPHA * (elapsed - previous)
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """ルートの種類ごとの実行中リクエスト数・平均処理時間・推定待ち時間"""
+        return {
+            "large_uploads": self.large_uploads,
+            "max_large_uploads": self.max_large_uploads,
+            "routes": {
+                route_class: {
+                    "in_flight": self.in_flight.get(route_class, 0),
+                    "max_in_flight": limit,
+                    "latency_seconds": self.latency.get(route_class),
+                    "estimated_wait_seconds": self.estimated_wait(route_class),
+                }
+                for route_class, limit in self.max_in_flight.items()
+            },
+        }
+
+
+# グローバルアドミッション制御
+admission = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """受付判定を行い、受け付けたリクエストの完了時に実行枠を解放するASGIミドルウェア
+
+    拒否するリクエストは本文を読み込む前に 503 を返す。ストリーミングレスポンスは本文の送信完了まで
+    実行中として扱い、応答の開始前にクライアントが切断した場合やキャンセルされた場合も必ず解放する。
+    """
+
+    def __init__(self, app: Callable, controller: Optional[AdmissionController] = None, enabled: bool = ADMISSION_ENABLED) -> None:
+        self.app = app
+        self.controller = controller or admission
+        self.enabled = enabled
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        route_class = (
+            classify(scope["method"], scope.get("path", "")) if self.enabled and scope["type"] == "http" else None
+        )
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        content_length = None
+        for key, value in scope.get("headers") or []:
+            if key.lower() == b"content-length" and value.isdigit():
+                content_length = int(value)
+        decision = self.controller.admit(route_class, content_length)
+        if not decision.admitted:
+            logger.warning(
+                f"Request shed: {scope.get('path')} route_class={route_class} reason={decision.reason} "
+                f"estimated_wait={decision.estimated_wait:.1f}s"
+            )
+            response = JSONResponse(
+                status_code=503,
+                content={"detail": "サーバーが混雑しています。しばらくしてから再試行してください", "reason": decision.reason},
+                headers={"Retry-After": str(decision.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(decision)
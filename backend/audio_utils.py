@@ -0,0 +1,271 @@
+"""
+音声データ処理ユーティリティ
+
+TTSモデルが返す生PCM（audio/L16）をWAVとしてフレーミングする処理、
+長文TTS用の文分割、長時間音声の文字起こし用の区間分割を提供する。
+"""
+import asyncio
+import difflib
+import re
+import shutil
+import struct
+import wave
+from array import array
+from typing import List, Optional, Tuple
+
+from backend.config import TRANSCRIBE_SAMPLE_RATE
+
+# Gemini TTSの既定出力形式（16bit リニアPCM, 24kHz, モノラル）
+DEFAULT_PCM_RATE = 24000
+DEFAULT_PCM_CHANNELS = 1
+DEFAULT_PCM_SAMPLE_WIDTH = 2
+
+# ストリーミングWAVでデータ長が未確定の場合に使用する値
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+_SENTENCE_PATTERN = re.compile(r".+?(?:[。！？!?]+|[.](?=\s)|\n+|$)", re.S)
+
+
+def parse_pcm_mime(mime_type: str) -> Tuple[int, int]:
+    """audio/L16;codec=pcm;rate=24000 形式のMIMEタイプからサンプルレートとチャンネル数を取得する"""
+    rate = DEFAULT_PCM_RATE
+    channels = DEFAULT_PCM_CHANNELS
+    for param in (mime_type or "").split(";")[1:]:
+        key, _, value = param.strip().partition("=")
+        if key == "rate" and value.isdigit():
+            rate = int(value)
+        elif key == "channels" and value.isdigit():
+            channels = int(value)
+    return rate, channels
+
+
+def is_raw_pcm(mime_type: str) -> bool:
+    """MIMEタイプが生PCMかどうか"""
+    mime = (mime_type or "").lower()
+    return mime.startswith("audio/l16") or "codec=pcm" in mime or mime.startswith("audio/pcm")
+
+
+def wav_header(
+    sample_rate: int = DEFAULT_PCM_RATE,
+    channels: int = DEFAULT_PCM_CHANNELS,
+    sample_width: int = DEFAULT_PCM_SAMPLE_WIDTH,
+    data_size: int = _UNKNOWN_SIZE,
+) -> bytes:
+    """WAV（RIFF）ヘッダーを作成する
+
+    Args:
+        sample_rate: サンプルレート
+        channels: チャンネル数
+        sample_width: 1サンプルのバイト数
+        data_size: PCMデータのバイト数（ストリーミングで未確定の場合は既定値）
+
+    Returns:
+        bytes: 44バイトのWAVヘッダー
+    """
+    byte_rate = sample_rate * channels * sample_width
+    riff_size = _UNKNOWN_SIZE if data_size == _UNKNOWN_SIZE else 36 + data_size
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF",
+        riff_size,
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        channels,
+        sample_rate,
+        byte_rate,
+        channels * sample_width,
+        sample_width * 8,
+        b"data",
+        data_size,
+    )
+
+
+def pcm_to_wav(pcm: bytes, sample_rate: int = DEFAULT_PCM_RATE, channels: int = DEFAULT_PCM_CHANNELS) -> bytes:
+    """生PCMをWAVファイルに変換する"""
+    return wav_header(sample_rate, channels, data_size=len(pcm)) + pcm
+
+
+def split_text_for_tts(text: str, max_chars: int, first_chunk_max_chars: int) -> List[str]:
+    """テキストを文の境界で分割し、TTS用のチャンクにまとめる
+
+    最初のチャンクは音声の再生開始までの時間を短くするため小さく保つ。
+
+    Args:
+        text: 入力テキスト
+        max_chars: 2番目以降のチャンクの最大文字数
+        first_chunk_max_chars: 最初のチャンクの最大文字数
+
+    Returns:
+        List[str]: チャンクのリスト
+    """
+    sentences = [m.group(0).strip() for m in _SENTENCE_PATTERN.finditer(text)]
+    sentences = [s for s in sentences if s]
+
+    chunks: List[str] = []
+    current = ""
+    for sentence in sentences:
+        limit = first_chunk_max_chars if not chunks else max_chars
+        # 1文が上限を超える場合は文字数で分割する
+        while len(sentence) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+                limit = max_chars
+            chunks.append(sentence[:limit])
+            sentence = sentence[limit:].lstrip()
+            limit = max_chars
+        if current and len(current) + len(sentence) + 1 > limit:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip() if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _read_wav_pcm16(path: str) -> Optional[Tuple[bytes, int, int]]:
+    """16bit PCMのWAVファイルを読み込む（それ以外の形式はNone）"""
+    try:
+        with wave.open(path, "rb") as wav:
+            if wav.getsampwidth() != 2 or wav.getcomptype() != "NONE":
+                return None
+            return wav.readframes(wav.getnframes()), wav.getframerate(), wav.getnchannels()
+    except (wave.Error, EOFError):
+        return None
+
+
+def _downmix_to_mono(pcm: bytes, channels: int) -> bytes:
+    """多チャンネルのPCM16を左チャンネルのみのモノラルに変換する"""
+    if channels == 1:
+        return pcm
+    samples = array("h")
+    samples.frombytes(pcm[: len(pcm) - len(pcm) % (2 * channels)])
+    return samples[::channels].tobytes()
+
+
+async def decode_to_pcm(path: str, sample_rate: int = TRANSCRIBE_SAMPLE_RATE) -> Tuple[bytes, int]:
+    """音声ファイルをモノラルの16bit PCMにデコードする
+
+    16bit PCMのWAVは標準ライブラリで読み込み、それ以外の形式（MP3, M4A等）は ffmpeg で変換する。
+
+    Args:
+        path: 音声ファイルのパス
+        sample_rate: ffmpegで変換する場合のサンプルレート
+
+    Returns:
+        Tuple[bytes, int]: PCMデータとサンプルレート
+
+    Raises:
+        RuntimeError: ffmpegが利用できない、または変換に失敗した場合
+    """
+    wav_data = await asyncio.to_thread(_read_wav_pcm16, path)
+    if wav_data is not None:
+        pcm, rate, channels = wav_data
+        return await asyncio.to_thread(_downmix_to_mono, pcm, channels), rate
+
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("WAV以外の音声をデコードするには ffmpeg が必要です")
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-v", "error", "-i", path,
+        "-f", "s16le", "-ac", "1", "-ar", str(sample_rate), "-",
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpegによるデコードに失敗しました: {stderr.decode(errors='ignore')[:500]}")
+    return stdout, sample_rate
+
+
+def _quietest_offset(pcm: bytes, center: int, search: int, frame: int) -> int:
+    """center±search サンプルの範囲で、最もエネルギーが小さいフレームの位置を返す"""
+    total = len(pcm) // 2
+    start = max(0, center - search)
+    end = min(total, center + search)
+    samples = array("h")
+    samples.frombytes(pcm[start * 2:end * 2])
+    best_offset = center
+    best_energy = None
+    # 高速化のため4サンプルおきに間引いてエネルギーを計算する
+    for offset in range(0, len(samples) - frame + 1, frame):
+        window = samples[offset:offset + frame:4]
+        energy = sum(s * s for s in window)
+        if best_energy is None or energy < best_energy:
+            best_energy = energy
+            best_offset = start + offset + frame // 2
+    return best_offset
+
+
+def plan_segments(
+    pcm: bytes,
+    rate: int,
+    segment_seconds: float,
+    overlap_seconds: float,
+    search_seconds: float = 5.0,
+) -> List[Tuple[float, float]]:
+    """PCMを無音付近で区切り、重複付きの区間（開始秒, 終了秒）のリストを作成する
+
+    Args:
+        pcm: モノラル16bit PCM
+        rate: サンプルレート
+        segment_seconds: 目安となる区間の長さ
+        overlap_seconds: 隣接区間との重複秒数
+        search_seconds: 区切り位置の前後で無音を探す範囲
+
+    Returns:
+        List[Tuple[float, float]]: 区間のリスト
+
+    Raises:
+        ValueError: 区間長が1サンプル未満、重複・探索範囲が負、または重複が区間長以上の場合
+    """
+    target = int(segment_seconds * rate)
+    if target <= 0:
+        raise ValueError(f"区間長は正の値である必要があります: segment_seconds={segment_seconds}")
+    if overlap_seconds < 0 or search_seconds < 0:
+        raise ValueError("重複秒数と探索範囲は0以上である必要があります")
+    if overlap_seconds >= segment_seconds:
+        raise ValueError(f"重複秒数は区間長未満である必要があります: overlap_seconds={overlap_seconds}")
+
+    total = len(pcm) // 2
+    duration = total / rate
+    if duration <= segment_seconds + search_seconds:
+        return [(0.0, duration)]
+
+    frame = max(1, int(rate * 0.02))  # 20msフレーム
+    # 区切り位置が必ず前進するよう、探索範囲は区間長の1/4までに制限する
+    search = min(int(search_seconds * rate), target // 4)
+    cuts = [0]
+    while cuts[-1] + target + search < total:
+        cuts.append(_quietest_offset(pcm, cuts[-1] + target, search, frame))
+    cuts.append(total)
+
+    segments = []
+    for i in range(len(cuts) - 1):
+        start = max(0.0, cuts[i] / rate - (overlap_seconds if i > 0 else 0.0))
+        segments.append((start, cuts[i + 1] / rate))
+    return segments
+
+
+def slice_pcm(pcm: bytes, rate: int, start: float, end: float) -> bytes:
+    """秒単位の区間でPCMを切り出す"""
+    return pcm[int(start * rate) * 2:int(end * rate) * 2]
+
+
+def merge_overlap(previous: str, current: str, window: int = 200, min_match: int = 8) -> Tuple[str, str]:
+    """重複区間の文字起こしを除去して連結できるようにする
+
+    前の区間の末尾と現在の区間の先頭で最長一致部分を探し、一致が十分長ければ
+    前の区間は一致の終わりまで、現在の区間は一致の後ろから使用する。
+
+    Returns:
+        Tuple[str, str]: 調整後の (前の区間, 現在の区間)
+    """
+    tail = previous[-window:]
+    head = current[:window]
+    match = difflib.SequenceMatcher(None, tail, head, autojunk=False).find_longest_match(0, len(tail), 0, len(head))
+    if match.size < min_match:
+        return previous, current
+    cut_previous = len(previous) - len(tail) + match.a + match.size
+    return previous[:cut_previous], current[match.b + match.size:].lstrip()
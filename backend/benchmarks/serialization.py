@@ -0,0 +1,125 @@
+"""
+レスポンスのシリアライズのマイクロベンチマーク
+
+response_model を返す通常の経路（モデル構築時の検証 + FastAPI による再検証・変換）と、
+trusted_response（検証なし + orjson）の経路で、同じレスポンスの作成にかかる時間と
+メモリ割り当て（tracemalloc のピーク）を比較する。Gemini API は呼び出さない。
+tracemalloc はPythonのアロケータ経由の割り当てのみを計上するため、pydantic-core（Rust）内部の
+バッファは通常の経路のピークに含まれない点に注意する。
+
+実行方法:
+    python -m backend.benchmarks.serialization [--count 1000] [--dimensions 3072] [--repeat 5]
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+import statistics
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from fastapi import FastAPI
+
+from backend.routers.embedding import BatchEmbeddingResponse
+from backend.routers.image import ImageGenerateResponse
+from backend.serialization import trusted_response
+
+
+def _build_app(embeddings: List[List[float]], image_url: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/embedding/model", response_model=BatchEmbeddingResponse)
+    async def embedding_model():
+        return BatchEmbeddingResponse(embeddings=embeddings, count=len(embeddings), model="bench", dimensions=len(embeddings[0]))
+
+    @app.get("/embedding/fast", response_model=BatchEmbeddingResponse)
+    async def embedding_fast():
+        return trusted_response(BatchEmbeddingResponse, embeddings=embeddings, count=len(embeddings), model="bench", dimensions=len(embeddings[0]))
+
+    @app.get("/image/model", response_model=ImageGenerateResponse)
+    async def image_model():
+        return ImageGenerateResponse(image_url=image_url, model="bench", image_id="bench")
+
+    @app.get("/image/fast", response_model=ImageGenerateResponse)
+    async def image_fast():
+        return trusted_response(ImageGenerateResponse, image_url=image_url, model="bench", image_id="bench")
+
+    return app
+
+
+async def _request(app: FastAPI, path: str) -> int:
+    """ASGIアプリを直接呼び出してレスポンス本文のサイズを返す（HTTPクライアントの負荷を含めない）"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [],
+        "client": ("127.0.0.1", 0),
+        "server": ("127.0.0.1", 80),
+    }
+    size = 0
+
+    async def receive() -> Dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Dict[str, Any]) -> None:
+        nonlocal size
+        if message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return size
+
+
+async def _measure(call: Callable[[], Any], repeat: int) -> Tuple[float, int, int]:
+    """中央値の所要時間（秒）・ピークのメモリ割り当て（バイト）・本文サイズを返す"""
+    size = await call()  # ウォームアップ
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await call()
+        durations.append(time.perf_counter() - started)
+    tracemalloc.start()
+    await call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(durations), peak, size
+
+
+async def run(count: int, dimensions: int, image_bytes: int, repeat: int) -> None:
+    rng = random.Random(0)
+    embeddings = [[rng.uniform(-1, 1) for _ in range(dimensions)] for _ in range(count)]
+    image_url = f"data:image/png;base64,{base64.b64encode(os.urandom(image_bytes)).decode('ascii')}"
+    app = _build_app(embeddings, image_url)
+
+    print(f"embeddings: {count} x {dimensions}, image: {image_bytes / 1024 / 1024:.1f} MiB, repeat={repeat}")
+    print(f"{'case':<12}{'path':<8}{'median ms':>12}{'peak MiB':>12}{'body MiB':>12}")
+    for case in ("embedding", "image"):
+        results = {}
+        for path in ("model", "fast"):
+            seconds, peak, size = await _measure(lambda: _request(app, f"/{case}/{path}"), repeat)
+            results[path] = seconds
+            print(f"{case:<12}{path:<8}{seconds * 1000:>12.1f}{peak / 1024 / 1024:>12.1f}{size / 1024 / 1024:>12.1f}")
+        print(f"{case:<12}{'speedup':<8}{results['model'] / results['fast']:>11.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=1000, help="エンベディングの件数")
+    parser.add_argument("--dimensions", type=int, default=3072, help="エンベディングの次元数")
+    parser.add_argument("--image-bytes", type=int, default=4 * 1024 * 1024, help="画像データのサイズ")
+    parser.add_argument("--repeat", type=int, default=5, help="計測回数")
+    args = parser.parse_args()
+    asyncio.run(run(args.count, args.dimensions, args.image_bytes, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+インメモリLRUキャッシュ
+
+スキーマ、コンパイル済みオブジェクト、変換済みメディアなど、
+プロセス内で再利用する値を件数上限付きで保持する。
+キャッシュに無い値を作る処理の重複を防ぐための SingleFlight もここに置く。
+"""
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class LRUCache(Generic[V]):
+    """スレッドセーフなLRUキャッシュ
+
+    件数上限（max_entries）に加え、sizeofを指定した場合は
+    合計サイズ上限（max_bytes）でも古いエントリから追い出す。
+    ttl_seconds を指定した場合は、格納から一定時間が経過したエントリを見つからない扱いにする。
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[V], int]] = None,
+        ttl_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._sizeof = sizeof
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, V]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._expires: Dict[Hashable, float] = {}
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expire(self, key: Hashable) -> bool:
+        """有効期限切れのエントリを削除し、削除した場合はTrueを返す（ロック取得済みで呼び出す）"""
+        expires_at = self._expires.get(key)
+        if expires_at is None or self._clock() < expires_at:
+            return False
+        del self._data[key]
+        del self._expires[key]
+        self._total_bytes -= self._sizes.pop(key, 0)
+        self.expirations += 1
+        return True
+
+    def get(self, key: Hashable) -> Optional[V]:
+        """値を取得する（見つからない場合・有効期限切れの場合はNone）"""
+        with self._lock:
+            if key in self._data and not self._expire(key):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def set(self, key: Hashable, value: V) -> None:
+        """値を格納し、上限を超えた分を古い順に追い出す"""
+        size = self._sizeof(value) if self._sizeof else 0
+        with self._lock:
+            if key in self._data:
+                self._total_bytes -= self._sizes.pop(key, 0)
+                del self._data[key]
+            self._data[key] = value
+            self._sizes[key] = size
+            self._total_bytes += size
+            if self.ttl_seconds is not None:
+                self._expires[key] = self._clock() + self.ttl_seconds
+            while self._data and (
+                len(self._data) > self.max_entries
+                or (self.max_bytes is not None and self._total_bytes > self.max_bytes)
+            ):
+                old_key, _ = self._data.popitem(last=False)
+                self._total_bytes -= self._sizes.pop(old_key, 0)
+                self._expires.pop(old_key, None)
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        """値を削除して返す"""
+        with self._lock:
+            if key not in self._data or self._expire(key):
+                return None
+            self._total_bytes -= self._sizes.pop(key, 0)
+            self._expires.pop(key, None)
+            return self._data.pop(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data and not self._expire(key)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        """ヒット率などの統計を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class SingleFlight(Generic[V]):
+    """同じキーの非同期処理が実行中であれば、新たに実行せずその結果を共有する
+
+    キャッシュミス時の変換やアップロードなど、同時リクエストで重複させたくない処理に使う。
+    イベントループ内でのみ使用する（スレッドセーフではない）。
+    """
+
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, "asyncio.Future[V]"] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        """キーの処理が実行中かどうか"""
+        return key in self._inflight
+
+    async def run(self, key: Hashable, producer: Callable[[], Awaitable[V]]) -> V:
+        """producer を実行して結果を返す（同じキーの処理が実行中であればその結果を待つ）
+
+        Args:
+            key: 処理を識別するキー
+            producer: 値を作るコルーチン関数
+
+        Returns:
+            V: producer の結果（失敗した場合は待機中の呼び出し元にも同じ例外を送出する）
+        """
+        existing = self._inflight.get(key)
+        if existing is not None:
+            return await existing
+        future: "asyncio.Future[V]" = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await producer()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # 待機者がいない場合に "Future exception was never retrieved" を出さない
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
@@ -0,0 +1,297 @@
+"""
+上流（Gemini API）通信の記録・再生
+
+負荷試験やローカル開発で実際のAPIを呼ばずに済むよう、クライアントの呼び出しと結果を
+正規化したリクエストのハッシュをキーにローカルのカセット（JSONファイル）へ記録し、
+観測したレイテンシ（または倍率を掛けたレイテンシ）で再生する。
+
+- UPSTREAM_CASSETTE_MODE=record: 実際のAPIを呼び出し、結果を記録する
+- UPSTREAM_CASSETTE_MODE=replay: 記録済みの結果のみを返す（未記録のリクエストは CassetteMiss）
+- ストリーミング（generate_content_stream）はチャンクごとの到着時刻も記録・再生する
+- 画像などのバイナリはbase64で保存する
+- 同じリクエストの記録は複数保持し、再生時は順に返して本番のばらつきを再現する
+"""
+import asyncio
+import base64
+import hashlib
+import importlib
+import io
+import json
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence
+
+from pydantic import BaseModel
+
+from backend.config import (
+    UPSTREAM_CASSETTE_DIR,
+    UPSTREAM_CASSETTE_LATENCY_SCALE,
+    UPSTREAM_CASSETTE_MAX_RECORDINGS,
+    UPSTREAM_CASSETTE_MODE,
+)
+from backend.metrics import metrics
+
+# リクエストのキーに含めない設定（期限によって変わるタイムアウトなど）
+_IGNORED_KEYS = {"http_options"}
+
+
+class CassetteMiss(LookupError):
+    """再生モードで記録済みの結果が見つからない"""
+
+
+def _digest(data: bytes) -> str:
+    return "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def normalize(value: Any, key: Optional[str] = None) -> Any:
+    """リクエストの引数を、ハッシュ計算用のJSON互換の値に正規化する
+
+    バイト列・ファイルはハッシュに置き換え、一時ファイルのパスのような実行ごとに変わる値を含めない。
+    """
+    if isinstance(value, BaseModel):
+        return normalize(value.model_dump(exclude_none=True))
+    if isinstance(value, dict):
+        return {str(k): normalize(v, str(k)) for k, v in sorted(value.items(), key=lambda kv: str(kv[0])) if k not in _IGNORED_KEYS and v is not None}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    if isinstance(value, (bytes, bytearray)):
+        return _digest(bytes(value))
+    if isinstance(value, io.BytesIO):
+        return _digest(value.getvalue())
+    if key == "file" and isinstance(value, (str, os.PathLike)) and os.path.isfile(value):
+        with open(value, "rb") as f:
+            return _digest(f.read())
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return repr(value)
+
+
+def request_key(path: Sequence[str], args: tuple, kwargs: Dict[str, Any]) -> str:
+    """呼び出しのキー（同期・非同期で同じキーになるよう aio を除いたパスを使う）"""
+    method = ".".join(name for name in path if name != "aio")
+    payload = json.dumps({"method": method, "args": normalize(list(args)), "kwargs": normalize(kwargs)}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _encode_value(value: Any) -> Optional[Dict[str, Any]]:
+    """結果をJSONで保存できる形に変換する（対応していない型はNone）"""
+    if isinstance(value, BaseModel):
+        cls = type(value)
+        return {"class": f"{cls.__module__}:{cls.__qualname__}", "data": json.loads(value.model_dump_json(exclude_none=True))}
+    if isinstance(value, (bytes, bytearray)):
+        return {"class": "bytes", "data": base64.b64encode(bytes(value)).decode("ascii")}
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return {"class": "json", "data": value}
+    return None
+
+
+def _decode_value(encoded: Dict[str, Any]) -> Any:
+    if encoded["class"] == "bytes":
+        return base64.b64decode(encoded["data"])
+    if encoded["class"] == "json":
+        return encoded["data"]
+    module, _, name = encoded["class"].partition(":")
+    cls: Any = importlib.import_module(module)
+    for part in name.split("."):
+        cls = getattr(cls, part)
+    # バイト列はbase64で保存しているため、JSONとして検証する
+    return cls.model_validate_json(json.dumps(encoded["data"]))
+
+
+def _encode_error(error: BaseException) -> Optional[Dict[str, Any]]:
+    """APIエラー（429 など）は再生できるよう記録する"""
+    from google.genai import errors
+
+    if isinstance(error, errors.APIError):
+        cls = type(error)
+        return {"class": f"{cls.__module__}:{cls.__qualname__}", "code": error.code, "details": error.details}
+    return None
+
+
+def _decode_error(encoded: Dict[str, Any]) -> BaseException:
+    module, _, name = encoded["class"].partition(":")
+    cls = getattr(importlib.import_module(module), name)
+    return cls(encoded["code"], encoded["details"])
+
+
+class CassetteStore:
+    """リクエストのキーごとに記録をファイルへ保存・再生する"""
+
+    def __init__(
+        self,
+        directory: str = UPSTREAM_CASSETTE_DIR,
+        mode: str = UPSTREAM_CASSETTE_MODE,
+        latency_scale: float = UPSTREAM_CASSETTE_LATENCY_SCALE,
+        max_recordings: int = UPSTREAM_CASSETTE_MAX_RECORDINGS,
+    ) -> None:
+        if mode not in ("off", "record", "replay"):
+            raise ValueError(f"未対応のカセットモードです: {mode}")
+        self.directory = directory
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.max_recordings = max_recordings
+        self._cursors: Dict[str, int] = {}
+        self._cache: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return self.mode != "off"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _load(self, key: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            if key not in self._cache:
+                try:
+                    with open(self._path(key), encoding="utf-8") as f:
+                        self._cache[key] = json.load(f)["recordings"]
+                except FileNotFoundError:
+                    self._cache[key] = []
+            return self._cache[key]
+
+    def _save(self, key: str, method: str, recording: Dict[str, Any]) -> None:
+        recordings = self._load(key)
+        with self._lock:
+            recordings.append(recording)
+            del recordings[: max(0, len(recordings) - self.max_recordings)]
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"method": method, "recordings": recordings}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        metrics.inc("cassette_requests_total", mode="record", result="recorded")
+
+    def _next(self, key: str, method: str) -> Dict[str, Any]:
+        """再生する記録（複数ある場合は順に返す）"""
+        recordings = self._load(key)
+        if not recordings:
+            metrics.inc("cassette_requests_total", mode="replay", result="miss")
+            raise CassetteMiss(f"記録済みの結果がありません: method={method}, key={key}")
+        with self._lock:
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+        metrics.inc("cassette_requests_total", mode="replay", result="hit")
+        return recordings[index % len(recordings)]
+
+    def _delay(self, seconds: float) -> float:
+        return max(0.0, seconds * self.latency_scale)
+
+    # --- 非同期 ---
+
+    async def call_async(self, path: Sequence[str], args: tuple, kwargs: Dict[str, Any], call: Callable[[], Awaitable[Any]]) -> Any:
+        """非同期呼び出しを記録または再生する"""
+        method = ".".join(path)
+        key = request_key(path, args, kwargs)
+        if self.mode == "replay":
+            recording = self._next(key, method)
+            if recording["type"] == "stream":
+                return self._replay_stream_async(recording)
+            await asyncio.sleep(self._delay(recording["latency"]))
+            if recording["type"] == "error":
+                raise _decode_error(recording["error"])
+            return _decode_value(recording["value"])
+
+        started = time.perf_counter()
+        try:
+            result = await call()
+        except Exception as e:
+            encoded = _encode_error(e)
+            if encoded is not None:
+                recording = {"type": "error", "latency": time.perf_counter() - started, "error": encoded}
+                await asyncio.to_thread(self._save, key, method, recording)
+            raise
+        if hasattr(result, "__aiter__"):
+            return self._record_stream_async(key, method, started, result)
+        encoded = _encode_value(result)
+        if encoded is None:
+            metrics.inc("cassette_requests_total", mode="record", result="unsupported")
+            return result
+        recording = {"type": "value", "latency": time.perf_counter() - started, "value": encoded}
+        await asyncio.to_thread(self._save, key, method, recording)
+        return result
+
+    async def _record_stream_async(self, key: str, method: str, started: float, stream: AsyncIterator[Any]) -> AsyncIterator[Any]:
+        chunks = []
+        async for chunk in stream:
+            encoded = _encode_value(chunk)
+            if encoded is not None:
+                chunks.append({"offset": time.perf_counter() - started, **encoded})
+            yield chunk
+        # 途中で中断されたストリームは記録しない
+        recording = {"type": "stream", "latency": time.perf_counter() - started, "chunks": chunks}
+        await asyncio.to_thread(self._save, key, method, recording)
+
+    async def _replay_stream_async(self, recording: Dict[str, Any]) -> AsyncIterator[Any]:
+        started = time.perf_counter()
+        for chunk in recording["chunks"]:
+            wait = self._delay(chunk["offset"]) - (time.perf_counter() - started)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield _decode_value(chunk)
+
+    # --- 同期 ---
+
+    def call(self, path: Sequence[str], args: tuple, kwargs: Dict[str, Any], call: Callable[[], Any]) -> Any:
+        """同期呼び出しを記録または再生する"""
+        method = ".".join(path)
+        key = request_key(path, args, kwargs)
+        if self.mode == "replay":
+            recording = self._next(key, method)
+            if recording["type"] == "stream":
+                return self._replay_stream(recording)
+            time.sleep(self._delay(recording["latency"]))
+            if recording["type"] == "error":
+                raise _decode_error(recording["error"])
+            return _decode_value(recording["value"])
+
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception as e:
+            encoded = _encode_error(e)
+            if encoded is not None:
+                self._save(key, method, {"type": "error", "latency": time.perf_counter() - started, "error": encoded})
+            raise
+        if hasattr(result, "__next__"):
+            return self._record_stream(key, method, started, result)
+        encoded = _encode_value(result)
+        if encoded is None:
+            metrics.inc("cassette_requests_total", mode="record", result="unsupported")
+            return result
+        self._save(key, method, {"type": "value", "latency": time.perf_counter() - started, "value": encoded})
+        return result
+
+    def _record_stream(self, key: str, method: str, started: float, stream: Iterator[Any]) -> Iterator[Any]:
+        chunks = []
+        for chunk in stream:
+            encoded = _encode_value(chunk)
+            if encoded is not None:
+                chunks.append({"offset": time.perf_counter() - started, **encoded})
+            yield chunk
+        self._save(key, method, {"type": "stream", "latency": time.perf_counter() - started, "chunks": chunks})
+
+    def _replay_stream(self, recording: Dict[str, Any]) -> Iterator[Any]:
+        started = time.perf_counter()
+        for chunk in recording["chunks"]:
+            wait = self._delay(chunk["offset"]) - (time.perf_counter() - started)
+            if wait > 0:
+                time.sleep(wait)
+            yield _decode_value(chunk)
+
+    def stats(self) -> Dict[str, Any]:
+        """カセットの設定と読み込み済みのキー数"""
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "directory": self.directory,
+                "latency_scale": self.latency_scale,
+                "loaded_keys": len(self._cache),
+            }
+
+
+# グローバルカセットストア
+cassettes = CassetteStore()
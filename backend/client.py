@@ -1,9 +1,17 @@
 """
 Gemini API クライアント
+
+設定された各APIキーのクライアントをプールし、`client` は genai.Client と同じ属性で
+アクセスするとリクエストごとにキーを選択して実行する。
+UPSTREAM_CASSETTE_MODE が record / replay の場合は、呼び出しをカセットに記録・再生する。
 """
-from google import genai
-from backend.config import GEMINI_API_KEY
+from backend.cassettes import cassettes
+from backend.client_pool import ClientPool, PooledClient
+from backend.config import GEMINI_API_KEYS
+from backend.http_transport import build_http_options
 
-# グローバルクライアントインスタンス
-client = genai.Client(api_key=GEMINI_API_KEY)
+# APIキーごとのクライアント（それぞれコネクションプール・タイムアウトを設定済み）
+client_pool = ClientPool.from_api_keys(GEMINI_API_KEYS, http_options_factory=build_http_options)
 
+# グローバルクライアントインスタンス
+client = PooledClient(client_pool, cassette=cassettes)
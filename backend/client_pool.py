@@ -0,0 +1,324 @@
+"""
+複数APIキーのクライアントプール
+
+複数のAPIキー（プロジェクト）に対応する genai.Client を保持し、リクエストごとに
+負荷の最も低いキー（least_load）または重み付きラウンドロビン（weighted_round_robin）で振り分ける。
+クォータ超過（429 / RESOURCE_EXHAUSTED）を返したキーは一定時間隔離し、別のキーで再試行する。
+
+キャッシュ済みコンテンツ・アップロード済みファイルなど、作成したキーでしか参照できないリソースは
+作成時に所有キーを記録し、そのリソースを参照するリクエストは同じキーへ送る。
+所有キーの記録は件数上限付きで、リソースの保存期間（Files API は48時間）を過ぎたものは破棄する。
+"""
+import contextvars
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from google import genai
+from google.genai import errors
+
+from backend.cache import LRUCache
+from backend.config import (
+    CLIENT_POOL_OWNER_MAX_ENTRIES,
+    CLIENT_POOL_OWNER_TTL_SECONDS,
+    CLIENT_POOL_QUARANTINE_SECONDS,
+    CLIENT_POOL_STRATEGY,
+)
+from backend.metrics import metrics
+
+# 作成したキーに紐づくリソースを返すメソッド（戻り値の name / uri を所有キーとして記録する）
+_OWNED_RESULT_METHODS = {("files", "upload"), ("caches", "create"), ("models", "generate_videos")}
+# name 引数で既存リソースを参照するメソッド
+_NAME_ARGUMENT_PREFIXES = ("files", "caches", "operations")
+
+# 現在のコンテキストで使用するキー（session() で固定）
+_pinned_key: contextvars.ContextVar[Optional["PooledKey"]] = contextvars.ContextVar("pinned_key", default=None)
+
+
+@dataclass
+class PooledKey:
+    """プール内の1つのAPIキー"""
+
+    key_id: str
+    client: Any  # genai.Client
+    weight: int = 1
+    hint: str = ""  # ログ・統計用のキー末尾
+    in_flight: int = 0
+    requests: int = 0
+    errors: int = 0
+    quota_errors: int = 0
+    quarantined_until: float = 0.0
+    current_weight: int = field(default=0, repr=False)  # 重み付きラウンドロビン用
+
+    @property
+    def quarantined(self) -> bool:
+        return time.monotonic() < self.quarantined_until
+
+
+def is_quota_error(error: BaseException) -> bool:
+    """クォータ超過のエラーかどうか"""
+    if isinstance(error, errors.APIError):
+        return error.code == 429 or (error.status or "").upper() == "RESOURCE_EXHAUSTED"
+    return False
+
+
+class ClientPool:
+    """APIキーごとのクライアントと振り分け状態を管理する"""
+
+    def __init__(
+        self,
+        keys: Sequence[PooledKey],
+        strategy: str = CLIENT_POOL_STRATEGY,
+        max_owners: int = CLIENT_POOL_OWNER_MAX_ENTRIES,
+        owner_ttl_seconds: float = CLIENT_POOL_OWNER_TTL_SECONDS,
+    ) -> None:
+        if not keys:
+            raise ValueError("APIキーが1つも設定されていません")
+        if strategy not in ("least_load", "weighted_round_robin"):
+            raise ValueError(f"未対応の振り分け方式です: {strategy}")
+        self.keys: List[PooledKey] = list(keys)
+        self.strategy = strategy
+        self._owners: LRUCache[PooledKey] = LRUCache(max_entries=max_owners, ttl_seconds=owner_ttl_seconds)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_api_keys(cls, api_keys: Sequence[str], http_options_factory: Any = None, strategy: str = CLIENT_POOL_STRATEGY) -> "ClientPool":
+        """「キー」または「キー:重み」のリストからプールを作成する"""
+        keys = []
+        for i, entry in enumerate(api_keys):
+            api_key, _, weight = entry.partition(":")
+            http_options = http_options_factory() if http_options_factory else None
+            keys.append(
+                PooledKey(
+                    key_id=f"key{i}",
+                    client=genai.Client(api_key=api_key, http_options=http_options),
+                    weight=max(1, int(weight)) if weight.isdigit() else 1,
+                    hint=f"...{api_key[-4:]}",
+                )
+            )
+        return cls(keys, strategy)
+
+    # --- 振り分け ---
+
+    def select(self, exclude: Sequence[PooledKey] = ()) -> PooledKey:
+        """次のリクエストに使用するキーを選択する
+
+        隔離中のキーは除外し、全て隔離中の場合は最も早く隔離が解けるキーを返す。
+        """
+        with self._lock:
+            candidates = [k for k in self.keys if k not in exclude and not k.quarantined]
+            if not candidates:
+                candidates = sorted((k for k in self.keys if k not in exclude), key=lambda k: k.quarantined_until)[:1]
+            if not candidates:
+                candidates = sorted(self.keys, key=lambda k: k.quarantined_until)[:1]
+            if self.strategy == "least_load":
+                return min(candidates, key=lambda k: ((k.in_flight + 1) / k.weight, k.requests))
+            # スムーズな重み付きラウンドロビン（nginx方式）
+            total = sum(k.weight for k in candidates)
+            for k in candidates:
+                k.current_weight += k.weight
+            chosen = max(candidates, key=lambda k: k.current_weight)
+            chosen.current_weight -= total
+            return chosen
+
+    def owner_of(self, resource_name: str) -> Optional[PooledKey]:
+        """リソース（ファイル・キャッシュ・オペレーション）を作成したキー"""
+        return self._owners.get(resource_name)
+
+    def register_owner(self, resource: Any, key: PooledKey) -> None:
+        """APIが返したリソースの所有キーを記録する"""
+        for attr in ("name", "uri"):
+            value = getattr(resource, attr, None)
+            if isinstance(value, str) and value:
+                self._owners.set(value, key)
+
+    def quarantine(self, key: PooledKey, seconds: float = CLIENT_POOL_QUARANTINE_SECONDS) -> None:
+        """キーを一定時間振り分け対象から外す"""
+        key.quarantined_until = time.monotonic() + seconds
+        metrics.inc("client_pool_quarantines_total", key=key.key_id)
+
+    @contextmanager
+    def lease(self, key: PooledKey) -> Iterator[PooledKey]:
+        """実行中リクエスト数を計上する"""
+        with self._lock:
+            key.in_flight += 1
+            key.requests += 1
+        metrics.inc("client_pool_requests_total", key=key.key_id)
+        try:
+            yield key
+        finally:
+            with self._lock:
+                key.in_flight -= 1
+
+    @contextmanager
+    def session(self, key: Optional[PooledKey] = None) -> Iterator[PooledKey]:
+        """ブロック内のリクエスト（そこから作成したタスクも含む）を同じキーに固定する
+
+        複数のリソースを作成して1つのリクエストで参照する場合に使用する。
+        """
+        pinned = _pinned_key.get() or key or self.select()
+        token = _pinned_key.set(pinned)
+        try:
+            yield pinned
+        finally:
+            _pinned_key.reset(token)
+
+    def stats(self) -> Dict[str, Any]:
+        """キーごとの使用状況"""
+        with self._lock:
+            return {
+                "strategy": self.strategy,
+                "pinned_resources": len(self._owners),
+                "keys": [
+                    {
+                        "key_id": k.key_id,
+                        "hint": k.hint,
+                        "weight": k.weight,
+                        "in_flight": k.in_flight,
+                        "requests": k.requests,
+                        "errors": k.errors,
+                        "quota_errors": k.quota_errors,
+                        "quarantined": k.quarantined,
+                    }
+                    for k in self.keys
+                ],
+            }
+
+
+def current_key() -> Optional[PooledKey]:
+    """session() で固定されているキー"""
+    return _pinned_key.get()
+
+
+def _referenced_resources(value: Any, depth: int = 0) -> Iterator[str]:
+    """引数に含まれるキャッシュ済みコンテンツ名・ファイルURIを列挙する"""
+    if value is None or depth > 6 or isinstance(value, (str, bytes, int, float, bool)):
+        return
+    if isinstance(value, dict):
+        for key in ("cached_content", "file_uri"):
+            if isinstance(value.get(key), str):
+                yield value[key]
+        for item in value.values():
+            yield from _referenced_resources(item, depth + 1)
+        return
+    if isinstance(value, (list, tuple)):
+        for item in value:
+            yield from _referenced_resources(item, depth + 1)
+        return
+    for attr in ("cached_content", "file_uri"):
+        if isinstance(getattr(value, attr, None), str):
+            yield getattr(value, attr)
+    for attr in ("file_data", "parts", "contents", "config"):
+        yield from _referenced_resources(getattr(value, attr, None), depth + 1)
+    if getattr(value, "uri", None) and getattr(value, "mime_type", None) and hasattr(value, "size_bytes"):
+        yield value.uri  # types.File
+
+
+class _PooledPath:
+    """`client.aio.models.generate_content` のような属性参照を記録し、呼び出し時にキーを選んで実行する"""
+
+    def __init__(self, pool: ClientPool, path: Tuple[str, ...], cassette: Any = None) -> None:
+        self._pool = pool
+        self._path = path
+        self._cassette = cassette
+
+    def __getattr__(self, name: str) -> "_PooledPath":
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _PooledPath(self._pool, self._path + (name,), self._cassette)
+
+    def _resolve(self, key: PooledKey) -> Any:
+        target = key.client
+        for name in self._path:
+            target = getattr(target, name)
+        return target
+
+    def _pinned(self, args: tuple, kwargs: Dict[str, Any]) -> Optional[PooledKey]:
+        """参照しているリソースの所有キー（セッションで固定されている場合はそのキー）"""
+        key = current_key()
+        if key is not None:
+            return key
+        method = self._path[-2:] if self._path[0] != "aio" else self._path[1:]
+        if method and method[0] in _NAME_ARGUMENT_PREFIXES:
+            name = kwargs.get("name") or kwargs.get("operation") or (args[0] if args else None)
+            name = getattr(name, "name", name)
+            if isinstance(name, str) and self._pool.owner_of(name):
+                return self._pool.owner_of(name)
+        for resource in _referenced_resources([args, kwargs]):
+            owner = self._pool.owner_of(resource)
+            if owner is not None:
+                return owner
+        return None
+
+    def _after(self, key: PooledKey, result: Any) -> Any:
+        if tuple(self._path[-2:]) in _OWNED_RESULT_METHODS:
+            self._pool.register_owner(result, key)
+        return result
+
+    def _on_error(self, key: PooledKey, error: BaseException) -> bool:
+        """エラーを計上し、別のキーで再試行できる場合はTrueを返す"""
+        key.errors += 1
+        if is_quota_error(error):
+            key.quota_errors += 1
+            self._pool.quarantine(key)
+            return True
+        return False
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        if self._cassette is not None and self._cassette.active:
+            # 記録・再生モードではカセットを経由する（再生時は上流を呼び出さない）
+            if self._path[0] == "aio":
+                return self._cassette.call_async(self._path, args, kwargs, lambda: self._call(args, kwargs))
+            return self._cassette.call(self._path, args, kwargs, lambda: self._call(args, kwargs))
+        return self._call(args, kwargs)
+
+    def _call(self, args: tuple, kwargs: Dict[str, Any]) -> Any:
+        pinned = self._pinned(args, kwargs)
+        if self._path[0] == "aio":
+            return self._call_async(pinned, args, kwargs)
+        tried: List[PooledKey] = []
+        while True:
+            key = pinned or self._pool.select(exclude=tried)
+            tried.append(key)
+            with self._pool.lease(key):
+                try:
+                    return self._after(key, self._resolve(key)(*args, **kwargs))
+                except Exception as e:
+                    if not self._on_error(key, e) or pinned or len(tried) >= len(self._pool.keys):
+                        raise
+                    metrics.inc("client_pool_retries_total", key=key.key_id)
+
+    async def _call_async(self, pinned: Optional[PooledKey], args: tuple, kwargs: Dict[str, Any]) -> Any:
+        tried: List[PooledKey] = []
+        while True:
+            key = pinned or self._pool.select(exclude=tried)
+            tried.append(key)
+            with self._pool.lease(key):
+                try:
+                    result = self._resolve(key)(*args, **kwargs)
+                    if inspect.isawaitable(result):
+                        result = await result
+                    return self._after(key, result)
+                except Exception as e:
+                    if not self._on_error(key, e) or pinned or len(tried) >= len(self._pool.keys):
+                        raise
+                    metrics.inc("client_pool_retries_total", key=key.key_id)
+
+
+class PooledClient:
+    """genai.Client と同じ属性でアクセスできる、プールに振り分けるクライアント
+
+    cassette を指定すると、呼び出しを記録・再生する（backend.cassettes.CassetteStore）。
+    """
+
+    def __init__(self, pool: ClientPool, cassette: Any = None) -> None:
+        self.pool = pool
+        self.cassette = cassette
+
+    def __getattr__(self, name: str) -> _PooledPath:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return _PooledPath(self.pool, (name,), self.cassette)
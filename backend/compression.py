@@ -0,0 +1,268 @@
+"""
+レスポンス圧縮ミドルウェア
+
+Accept-Encoding に応じて zstd / br / gzip でレスポンスを圧縮する。
+- 一定サイズ未満のレスポンスと、画像・音声・動画など圧縮済みのメディアは圧縮しない
+- SSE / NDJSON などのストリーミングレスポンスはチャンクごとにフラッシュし、逐次配信を維持する
+- ルートごとの圧縮率と圧縮にかかったCPU時間をメトリクスとして記録する
+"""
+import time
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from backend.config import (
+    COMPRESSION_BROTLI_QUALITY,
+    COMPRESSION_ENCODINGS,
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_MIN_BYTES,
+    COMPRESSION_ZSTD_LEVEL,
+)
+from backend.metrics import metrics, route_label
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli は任意
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard は任意
+    zstandard = None
+
+# 圧縮しない（圧縮済みの）Content-Type
+_SKIP_CONTENT_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zstd",
+    "application/pdf",
+)
+# 逐次配信するContent-Type
+_STREAMING_CONTENT_TYPES = ("text/event-stream", "application/x-ndjson")
+
+
+class _Compressor:
+    """エンコーディングごとの圧縮器（flush でそれまでの入力を出力し切る）"""
+
+    def __init__(self, encoding: str) -> None:
+        self.encoding = encoding
+        if encoding == "gzip":
+            self._impl = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        elif encoding == "br":
+            self._impl = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        elif encoding == "zstd":
+            self._impl = zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compressobj()
+        else:
+            raise ValueError(f"未対応のエンコーディングです: {encoding}")
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._impl.process(data)
+        return self._impl.compress(data)
+
+    def flush(self) -> bytes:
+        if self.encoding == "gzip":
+            return self._impl.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self._impl.flush()
+        return self._impl.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._impl.finish()
+        return self._impl.flush()
+
+
+def available_encodings(preferred: Sequence[str] = COMPRESSION_ENCODINGS) -> List[str]:
+    """インストール済みのライブラリで使用できるエンコーディング（優先順）"""
+    installed = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+    return [encoding for encoding in preferred if installed.get(encoding)]
+
+
+def negotiate_encoding(accept_encoding: str, encodings: Sequence[str]) -> Optional[str]:
+    """Accept-Encoding から使用するエンコーディングを選ぶ（q値が同じ場合はサーバー側の優先順）
+
+    Args:
+        accept_encoding: リクエストの Accept-Encoding ヘッダー
+        encodings: サーバーが対応するエンコーディング（優先順）
+
+    Returns:
+        Optional[str]: エンコーディング（圧縮しない場合はNone）
+    """
+    accepted: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    best: Optional[str] = None
+    best_q = 0.0
+    for encoding in encodings:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _header(headers: List[tuple], name: bytes) -> Optional[str]:
+    for key, value in headers:
+        if key.lower() == name:
+            return value.decode("latin-1")
+    return None
+
+
+class CompressionMiddleware:
+    """Accept-Encoding に応じてレスポンスを圧縮するASGIミドルウェア"""
+
+    def __init__(self, app: Callable, minimum_size: int = COMPRESSION_MIN_BYTES, encodings: Sequence[str] = COMPRESSION_ENCODINGS) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = available_encodings(encodings)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not self.encodings:
+            await self.app(scope, receive, send)
+            return
+        request_headers = scope.get("headers") or []
+        encoding = negotiate_encoding(_header(request_headers, b"accept-encoding") or "", self.encodings)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponse(scope, send, encoding, self.minimum_size).run(self.app, receive)
+
+
+class _CompressedResponse:
+    """1つのレスポンスの圧縮状態"""
+
+    def __init__(self, scope: Dict[str, Any], send: Callable, encoding: str, minimum_size: int) -> None:
+        self.scope = scope
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.start: Optional[Dict[str, Any]] = None
+        self.compressor: Optional[_Compressor] = None
+        self.passthrough = False
+        self.streaming = False
+        self.original_bytes = 0
+        self.compressed_bytes = 0
+        self.cpu_seconds = 0.0
+
+    async def run(self, app: Callable, receive: Callable) -> None:
+        await app(self.scope, receive, self._send)
+
+    def _skip_reason(self, headers: List[tuple]) -> Optional[str]:
+        """圧縮しない理由（圧縮する場合はNone）"""
+        if self.start["status"] < 200 or self.start["status"] in (204, 304):
+            return "status"
+        if _header(headers, b"content-encoding") or _header(headers, b"content-range"):
+            return "encoded"
+        content_type = (_header(headers, b"content-type") or "").lower()
+        if content_type.startswith(_SKIP_CONTENT_TYPES):
+            return "media"
+        content_length = _header(headers, b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) < self.minimum_size:
+            return "small"
+        return None
+
+    def _compress(self, data: bytes, final: bool) -> bytes:
+        started = time.thread_time()
+        output = self.compressor.compress(data)
+        output += self.compressor.finish() if final else self.compressor.flush() if self.streaming else b""
+        self.cpu_seconds += time.thread_time() - started
+        self.original_bytes += len(data)
+        self.compressed_bytes += len(output)
+        return output
+
+    def _start_headers(self, content_length: Optional[int]) -> List[tuple]:
+        headers = [
+            (key, value)
+            for key, value in self.start["headers"]
+            if key.lower() not in (b"content-length", b"content-encoding")
+        ]
+        headers.append((b"content-encoding", self.encoding.encode("latin-1")))
+        vary = _header(headers, b"vary")
+        if vary is None:
+            headers.append((b"vary", b"Accept-Encoding"))
+        elif "accept-encoding" not in vary.lower():
+            headers = [(k, v) for k, v in headers if k.lower() != b"vary"]
+            headers.append((b"vary", f"{vary}, Accept-Encoding".encode("latin-1")))
+        if content_length is not None:
+            headers.append((b"content-length", str(content_length).encode("latin-1")))
+        return headers
+
+    def _record(self) -> None:
+        route = route_label(self.scope)
+        labels = {"route": route, "encoding": self.encoding}
+        metrics.inc("response_compression_total", **labels)
+        metrics.inc("response_compression_original_bytes", self.original_bytes, **labels)
+        metrics.inc("response_compression_compressed_bytes", self.compressed_bytes, **labels)
+        metrics.observe("response_compression_cpu_seconds", self.cpu_seconds, **labels)
+        if self.original_bytes:
+            metrics.observe("response_compression_ratio", self.compressed_bytes / self.original_bytes, **labels)
+
+    async def _send(self, message: Dict[str, Any]) -> None:
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = list(message.get("headers") or [])
+            reason = self._skip_reason(headers)
+            self.passthrough = reason is not None
+            if self.passthrough:
+                metrics.inc("response_compression_skipped_total", reason=reason)
+                await self.send(message)
+            else:
+                content_type = (_header(headers, b"content-type") or "").lower()
+                self.streaming = content_type.startswith(_STREAMING_CONTENT_TYPES)
+            return
+
+        if self.passthrough:
+            await self.send(message)
+            return
+        if message["type"] != "http.response.body":
+            # ファイル送信の拡張（http.response.pathsend）などは圧縮せずにそのまま送る
+            if self.compressor is None:
+                self.passthrough = True
+                await self.send(self.start)
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            # 本文全体が一度に送られ、閾値未満であれば圧縮しない
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                metrics.inc("response_compression_skipped_total", reason="small")
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(self.encoding)
+            if more_body:
+                # 長さが確定しないため Content-Length を外してチャンク転送にする
+                self.streaming = True
+                await self.send({**self.start, "headers": self._start_headers(None)})
+            else:
+                compressed = self._compress(body, final=True)
+                await self.send({**self.start, "headers": self._start_headers(len(compressed))})
+                await self.send({"type": "http.response.body", "body": compressed})
+                self._record()
+                return
+
+        compressed = self._compress(body, final=not more_body)
+        if compressed or not more_body:
+            await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
+        if not more_body:
+            self._record()
@@ -0,0 +1,53 @@
+"""
+並行実行ユーティリティ
+
+Gemini APIへの同時リクエスト数をプロセス全体で制限するセマフォと、
+同時実行数を制限した gather を提供する。
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Iterable, List, TypeVar
+
+from backend.config import UPSTREAM_MAX_CONCURRENCY
+from backend.metrics import metrics
+
+T = TypeVar("T")
+
+# プロセス全体での上流（Gemini API）同時リクエスト数の上限
+_upstream_semaphore = asyncio.Semaphore(UPSTREAM_MAX_CONCURRENCY)
+
+
+@asynccontextmanager
+async def upstream_slot(route: str = "default") -> AsyncIterator[None]:
+    """上流リクエストの実行枠を確保する
+
+    Args:
+        route: メトリクス用のルート名
+    """
+    start = time.perf_counter()
+    async with _upstream_semaphore:
+        metrics.observe("upstream_slot_wait_seconds", time.perf_counter() - start, route=route)
+        yield
+
+
+async def bounded_gather(
+    aws: Iterable[Awaitable[T]], limit: int, return_exceptions: bool = False
+) -> List[Any]:
+    """同時実行数を制限して awaitable を並行実行する（結果は入力順）
+
+    Args:
+        aws: 実行する awaitable
+        limit: 同時実行数の上限
+        return_exceptions: True の場合、例外を結果として返す
+
+    Returns:
+        List[Any]: 各 awaitable の結果
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(aw: Awaitable[T]) -> T:
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*(run(aw) for aw in aws), return_exceptions=return_exceptions)
@@ -8,7 +8,16 @@ load_dotenv()
 
 # GEMINI_API_KEYまたはGOOGLE_API_KEYのいずれかから読み込む
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY", "")
-if not GEMINI_API_KEY:
+# 複数のAPIキー（カンマ区切り。各要素は「キー」または「キー:重み」）。未設定時は GEMINI_API_KEY のみを使用
+GEMINI_API_KEYS = [key.strip() for key in os.getenv("GEMINI_API_KEYS", "").split(",") if key.strip()] or (
+    [GEMINI_API_KEY] if GEMINI_API_KEY else []
+)
+# 上流通信の記録・再生モード（off / record / replay）
+UPSTREAM_CASSETTE_MODE = os.getenv("UPSTREAM_CASSETTE_MODE", "off").lower()
+if not GEMINI_API_KEYS and UPSTREAM_CASSETTE_MODE == "replay":
+    # 再生モードでは上流を呼び出さないため、APIキーは不要
+    GEMINI_API_KEYS = ["replay"]
+if not GEMINI_API_KEYS:
     raise ValueError("GEMINI_API_KEYまたはGOOGLE_API_KEY環境変数が設定されていません")
 
 # デフォルトモデル設定
@@ -22,3 +31,129 @@ DEFAULT_EMBEDDING_MODEL = "text-embedding-004"
 DEFAULT_TTS_MODEL = "gemini-2.5-flash-preview-tts"  # TTS用モデル
 DEFAULT_PRODUCTIVITY_MODEL = "gemini-3-pro"  # タスク & ナレッジ用
 
+
+# 構造化出力設定
+SCHEMA_CACHE_SIZE = int(os.getenv("SCHEMA_CACHE_SIZE", "256"))  # コンパイル済みスキーマの保持件数
+STRUCTURED_OUTPUT_MAX_RETRIES = int(os.getenv("STRUCTURED_OUTPUT_MAX_RETRIES", "2"))  # 検証失敗時の再試行回数
+
+# 関数呼び出し設定
+FUNCTION_TOOL_TIMEOUT_SECONDS = float(os.getenv("FUNCTION_TOOL_TIMEOUT_SECONDS", "10"))  # ツールごとの実行タイムアウト
+FUNCTION_MAX_STEPS = int(os.getenv("FUNCTION_MAX_STEPS", "5"))  # 実行ループの最大ステップ数
+TOOLSET_CACHE_SIZE = int(os.getenv("TOOLSET_CACHE_SIZE", "128"))  # コンパイル済みツールセットの保持件数
+TOOLSET_CACHE_TTL_SECONDS = int(os.getenv("TOOLSET_CACHE_TTL_SECONDS", "3600"))  # ツール定義のコンテキストキャッシュ有効期間
+
+# 並行実行設定
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "16"))  # Gemini APIへの同時リクエスト数の上限
+
+# エージェント（リサーチモード）設定
+AGENT_RESEARCH_MAX_BRANCHES = int(os.getenv("AGENT_RESEARCH_MAX_BRANCHES", "5"))  # サブクエリの最大数
+AGENT_RESEARCH_CONCURRENCY = int(os.getenv("AGENT_RESEARCH_CONCURRENCY", "4"))  # サブクエリの同時実行数
+
+# 音声設定
+TTS_CHUNK_MAX_CHARS = int(os.getenv("TTS_CHUNK_MAX_CHARS", "400"))  # 長文TTSのチャンク最大文字数
+TTS_FIRST_CHUNK_MAX_CHARS = int(os.getenv("TTS_FIRST_CHUNK_MAX_CHARS", "120"))  # 最初のチャンクの最大文字数
+TTS_STREAM_CONCURRENCY = int(os.getenv("TTS_STREAM_CONCURRENCY", "4"))  # チャンク合成の同時実行数
+TRANSCRIBE_SEGMENT_SECONDS = float(os.getenv("TRANSCRIBE_SEGMENT_SECONDS", "120"))  # 長時間音声の区間長（秒）
+TRANSCRIBE_OVERLAP_SECONDS = float(os.getenv("TRANSCRIBE_OVERLAP_SECONDS", "2"))  # 区間の重複（秒）
+TRANSCRIBE_CONCURRENCY = int(os.getenv("TRANSCRIBE_CONCURRENCY", "4"))  # 区間の同時文字起こし数
+TRANSCRIBE_SAMPLE_RATE = int(os.getenv("TRANSCRIBE_SAMPLE_RATE", "16000"))  # デコード時のサンプルレート
+
+# 動画分析設定
+VIDEO_FRAME_RATE = float(os.getenv("VIDEO_FRAME_RATE", "1"))  # フレームを抽出する間隔（1秒あたりの枚数）
+VIDEO_FRAME_WIDTH = int(os.getenv("VIDEO_FRAME_WIDTH", "768"))  # 抽出するフレームの最大幅（px）
+VIDEO_SCENE_THRESHOLD = float(os.getenv("VIDEO_SCENE_THRESHOLD", "0.1"))  # 直前のキーフレームとの差分がこれ以下のフレームを除外（0〜1）
+VIDEO_MAX_FRAMES = int(os.getenv("VIDEO_MAX_FRAMES", "256"))  # 分析に使用するキーフレームの最大数
+VIDEO_BATCH_FRAMES = int(os.getenv("VIDEO_BATCH_FRAMES", "32"))  # 1回のリクエストで送るキーフレーム数
+VIDEO_ANALYZE_CONCURRENCY = int(os.getenv("VIDEO_ANALYZE_CONCURRENCY", "4"))  # 区間の同時分析数
+
+# ドキュメント設定
+DOCUMENT_EXTRACT_WORKERS = int(os.getenv("DOCUMENT_EXTRACT_WORKERS", "2"))  # テキスト抽出のプロセス数（0でスレッドで実行）
+DOCUMENT_TEXT_CACHE_MAX_BYTES = int(os.getenv("DOCUMENT_TEXT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))  # 抽出結果の保持上限
+DOCUMENT_SCANNED_PAGE_MIN_CHARS = int(os.getenv("DOCUMENT_SCANNED_PAGE_MIN_CHARS", "20"))  # テキスト層の文字数がこれ未満のページはスキャンとみなす
+DOCUMENT_EXTRACT_TIMEOUT_SECONDS = float(os.getenv("DOCUMENT_EXTRACT_TIMEOUT_SECONDS", "60"))  # 1ファイルの抽出の制限時間（超過時は元のファイルを送る）
+DOCUMENT_DOCX_MAX_XML_BYTES = int(os.getenv("DOCUMENT_DOCX_MAX_XML_BYTES", str(32 * 1024 * 1024)))  # DOCX本文（word/document.xml）の展開後サイズの上限
+DOCUMENT_BATCH_CONCURRENCY = int(os.getenv("DOCUMENT_BATCH_CONCURRENCY", "4"))  # バッチ分析の同時処理ファイル数
+DOCUMENT_BATCH_MAX_RETRIES = int(os.getenv("DOCUMENT_BATCH_MAX_RETRIES", "2"))  # ファイルごとの再試行回数
+DOCUMENT_BATCH_RETRY_BASE_SECONDS = float(os.getenv("DOCUMENT_BATCH_RETRY_BASE_SECONDS", "1"))  # 再試行の待ち時間の基準（指数的に増加）
+DOCUMENT_BATCH_MAX_FILES = int(os.getenv("DOCUMENT_BATCH_MAX_FILES", "500"))  # 1回のバッチで受け付けるファイル数の上限
+DOCUMENT_BATCH_MAX_FILE_BYTES = int(os.getenv("DOCUMENT_BATCH_MAX_FILE_BYTES", str(50 * 1024 * 1024)))  # 1ファイルのサイズ上限（アーカイブ展開後）
+
+# 画像設定
+IMAGE_STORE_MAX_BYTES = int(os.getenv("IMAGE_STORE_MAX_BYTES", str(256 * 1024 * 1024)))  # 生成画像（元画像）の保持上限
+IMAGE_VARIANT_CACHE_MAX_BYTES = int(os.getenv("IMAGE_VARIANT_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))  # 変換済み画像の保持上限
+IMAGE_INPUT_MAX_DIMENSION = int(os.getenv("IMAGE_INPUT_MAX_DIMENSION", "2048"))  # 入力画像の長辺の最大ピクセル数
+IMAGE_INPUT_JPEG_QUALITY = int(os.getenv("IMAGE_INPUT_JPEG_QUALITY", "85"))  # 入力画像の再エンコード品質
+IMAGE_INPUT_CACHE_MAX_BYTES = int(os.getenv("IMAGE_INPUT_CACHE_MAX_BYTES", str(128 * 1024 * 1024)))  # 前処理済み入力画像の保持上限
+IMAGE_PREPROCESS_WORKERS = int(os.getenv("IMAGE_PREPROCESS_WORKERS", "4"))  # 画像処理ワーカー数
+REFERENCE_IMAGE_CACHE_SIZE = int(os.getenv("REFERENCE_IMAGE_CACHE_SIZE", "512"))  # Files APIにアップロードした参照画像の保持件数
+REFERENCE_IMAGE_TTL_SECONDS = int(os.getenv("REFERENCE_IMAGE_TTL_SECONDS", str(47 * 3600)))  # 参照画像の再利用期間（Files APIの保持期間は48時間）
+IMAGE_GENERATE_MAX_VARIANTS = int(os.getenv("IMAGE_GENERATE_MAX_VARIANTS", "8"))  # 候補画像の並行生成の最大枚数
+
+# セマンティックキャッシュ設定
+SEMANTIC_CACHE_ROUTES = [
+    route.strip() for route in os.getenv("SEMANTIC_CACHE_ROUTES", "").split(",") if route.strip()
+]  # キャッシュを有効にするルート（カンマ区切り。既定は空で無効。例: text.generate）
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))  # キャッシュを返すコサイン類似度の下限
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2048"))  # 保持する回答数
+SEMANTIC_CACHE_TTL_SECONDS = int(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))  # 回答の有効期間
+SEMANTIC_CACHE_EMBEDDING_MODEL = os.getenv("SEMANTIC_CACHE_EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)  # プロンプトのエンベディングモデル
+
+# エンベディング設定
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "100"))  # 1リクエストあたりのテキスト数
+EMBEDDING_BATCH_CONCURRENCY = int(os.getenv("EMBEDDING_BATCH_CONCURRENCY", "4"))  # バッチの同時実行数
+
+# RAG設定
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", "data/rag")  # インデックスの保存先
+RAG_CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", "1200"))  # チャンクの最大文字数
+RAG_CHUNK_OVERLAP_CHARS = int(os.getenv("RAG_CHUNK_OVERLAP_CHARS", "200"))  # 前のチャンクから引き継ぐ文字数
+RAG_MAX_TOP_K = int(os.getenv("RAG_MAX_TOP_K", "20"))  # 検索で返すチャンク数の上限
+
+# HTTPトランスポート設定
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))  # コネクションプールの最大接続数
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))  # 保持するアイドル接続数
+HTTP_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))  # アイドル接続の保持時間
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")  # HTTP/2を使用する（h2パッケージが必要）
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "10"))  # 接続確立のタイムアウト
+HTTP_TIMEOUT_DEFAULT_SECONDS = float(os.getenv("HTTP_TIMEOUT_DEFAULT_SECONDS", "120"))  # 通常のリクエストのタイムアウト
+HTTP_TIMEOUT_STREAMING_SECONDS = float(os.getenv("HTTP_TIMEOUT_STREAMING_SECONDS", "600"))  # ストリーミングのタイムアウト
+HTTP_TIMEOUT_MEDIA_SECONDS = float(os.getenv("HTTP_TIMEOUT_MEDIA_SECONDS", "300"))  # 画像・音声・動画のタイムアウト
+HTTP_TIMEOUT_EMBEDDING_SECONDS = float(os.getenv("HTTP_TIMEOUT_EMBEDDING_SECONDS", "30"))  # エンベディングのタイムアウト
+HTTP_WARMUP_CONNECTIONS = int(os.getenv("HTTP_WARMUP_CONNECTIONS", "2"))  # 起動時に確立する接続数（0で無効）
+
+# クライアントプール設定
+CLIENT_POOL_STRATEGY = os.getenv("CLIENT_POOL_STRATEGY", "least_load")  # least_load / weighted_round_robin
+CLIENT_POOL_QUARANTINE_SECONDS = float(os.getenv("CLIENT_POOL_QUARANTINE_SECONDS", "60"))  # クォータ超過したキーを外す時間
+CLIENT_POOL_OWNER_MAX_ENTRIES = int(os.getenv("CLIENT_POOL_OWNER_MAX_ENTRIES", "10000"))  # 所有キーを記録するリソースの最大数
+CLIENT_POOL_OWNER_TTL_SECONDS = float(os.getenv("CLIENT_POOL_OWNER_TTL_SECONDS", str(48 * 3600)))  # 所有キーの記録の保持時間（Files API の保存期間）
+
+# レスポンス圧縮設定
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() in ("1", "true", "yes")  # レスポンスを圧縮する
+COMPRESSION_ENCODINGS = [
+    encoding.strip() for encoding in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if encoding.strip()
+]  # 使用するエンコーディング（優先順。zstd は zstandard、br は brotli パッケージが必要）
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))  # 圧縮するレスポンスの最小サイズ
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))  # gzip の圧縮レベル（1-9）
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))  # brotli の品質（0-11。動的レスポンス向けに低め）
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))  # zstd の圧縮レベル
+
+# アドミッション制御（過負荷時の負荷遮断）設定
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")  # 過負荷時にリクエストを拒否する
+ADMISSION_MAX_IN_FLIGHT = {
+    "default": int(os.getenv("ADMISSION_MAX_IN_FLIGHT_DEFAULT", "64")),  # 通常のルートの同時受付数
+    "streaming": int(os.getenv("ADMISSION_MAX_IN_FLIGHT_STREAMING", "32")),  # ストリーミングの同時受付数
+    "media": int(os.getenv("ADMISSION_MAX_IN_FLIGHT_MEDIA", "16")),  # 画像・音声・動画・文書の同時受付数
+    "embedding": int(os.getenv("ADMISSION_MAX_IN_FLIGHT_EMBEDDING", "32")),  # エンベディングの同時受付数
+}
+ADMISSION_MAX_QUEUE_WAIT_SECONDS = float(os.getenv("ADMISSION_MAX_QUEUE_WAIT_SECONDS", "30"))  # 推定待ち時間がこれを超えると拒否（フロントエンドのタイムアウトは60秒）
+ADMISSION_LARGE_UPLOAD_BYTES = int(os.getenv("ADMISSION_LARGE_UPLOAD_BYTES", str(8 * 1024 * 1024)))  # 大きなアップロードとみなすサイズ
+ADMISSION_MAX_LARGE_UPLOADS = int(os.getenv("ADMISSION_MAX_LARGE_UPLOADS", "4"))  # 大きなアップロードの同時受付数
+
+# リクエストの期限（デッドライン）設定
+DEADLINE_MAX_MS = int(os.getenv("DEADLINE_MAX_MS", "600000"))  # 指定できる期限の上限（ミリ秒）
+DEADLINE_TIGHT_BUDGET_MS = int(os.getenv("DEADLINE_TIGHT_BUDGET_MS", "15000"))  # 残り時間がこれ未満なら軽量な設定に切り替える
+DEADLINE_FALLBACK_MODEL = os.getenv("DEADLINE_FALLBACK_MODEL", "gemini-2.5-flash-lite")  # 残り時間が少ない場合のテキスト生成モデル（空で切り替えない）
+
+# 上流通信の記録・再生設定（UPSTREAM_CASSETTE_MODE はAPIキーの設定の直後で定義）
+UPSTREAM_CASSETTE_DIR = os.getenv("UPSTREAM_CASSETTE_DIR", "data/cassettes")  # カセットの保存先
+UPSTREAM_CASSETTE_LATENCY_SCALE = float(os.getenv("UPSTREAM_CASSETTE_LATENCY_SCALE", "1.0"))  # 再生時のレイテンシの倍率（0で待たない）
+UPSTREAM_CASSETTE_MAX_RECORDINGS = int(os.getenv("UPSTREAM_CASSETTE_MAX_RECORDINGS", "5"))  # 同じリクエストについて保持する記録数
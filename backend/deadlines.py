@@ -0,0 +1,238 @@
+"""
+リクエストの期限（デッドライン）とキャンセル
+
+クライアントは X-Request-Deadline-Ms ヘッダー、または対応するルートの deadline_ms フィールドで
+リクエストの処理に使える時間（ミリ秒）を指定できる。
+- 期限を過ぎた場合は処理中の上流呼び出しをキャンセルし、504 を返す
+- クライアントが切断した場合（タブを閉じたなど）も処理中の上流呼び出しをキャンセルする
+- 残り時間が少ない場合は、軽量なモデル・思考なしの設定に切り替える
+"""
+import asyncio
+import contextvars
+import json
+import time
+from typing import Any, Callable, Dict, Optional
+
+from backend.config import (
+    DEADLINE_FALLBACK_MODEL,
+    DEADLINE_MAX_MS,
+    DEADLINE_TIGHT_BUDGET_MS,
+)
+from backend.metrics import metrics, route_label
+
+DEADLINE_HEADER = "x-request-deadline-ms"
+# 上流呼び出しのタイムアウトに加える猶予（期限切れの判定はミドルウェア側で先に行う）
+_UPSTREAM_GRACE_SECONDS = 1.0
+
+
+class RequestDeadline:
+    """1つのリクエストの期限（期限なしの場合は expires_at が None）"""
+
+    def __init__(self, budget_ms: Optional[int] = None) -> None:
+        self.started = time.monotonic()
+        self.budget_ms: Optional[int] = None
+        self.expires_at: Optional[float] = None
+        self.changed = asyncio.Event()
+        if budget_ms is not None:
+            self.tighten(budget_ms)
+
+    def tighten(self, budget_ms: Optional[int]) -> None:
+        """期限を設定する（既に設定されている期限より遅くはしない）
+
+        Args:
+            budget_ms: リクエスト受信時からの処理時間の上限（ミリ秒）
+        """
+        if budget_ms is None or budget_ms <= 0:
+            return
+        budget_ms = min(budget_ms, DEADLINE_MAX_MS)
+        expires_at = self.started + budget_ms / 1000
+        if self.expires_at is None or expires_at < self.expires_at:
+            self.budget_ms = budget_ms
+            self.expires_at = expires_at
+            self.changed.set()
+
+    def remaining(self) -> Optional[float]:
+        """残り時間（秒。期限なしの場合はNone）"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    @property
+    def tight(self) -> bool:
+        """残り時間が少なく、軽量な設定に切り替えるべきかどうか"""
+        remaining = self.remaining()
+        return remaining is not None and remaining * 1000 < DEADLINE_TIGHT_BUDGET_MS
+
+
+_current: contextvars.ContextVar[Optional[RequestDeadline]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def current_deadline() -> Optional[RequestDeadline]:
+    """処理中のリクエストの期限"""
+    return _current.get()
+
+
+def apply_deadline(deadline_ms: Optional[int]) -> Optional[RequestDeadline]:
+    """リクエストボディの deadline_ms を期限に反映する（ヘッダーと両方ある場合は短い方）"""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.tighten(deadline_ms)
+    return deadline
+
+
+def upstream_timeout(default_seconds: float) -> float:
+    """上流呼び出しのタイムアウト（期限がある場合は残り時間に合わせて短くする）"""
+    deadline = current_deadline()
+    remaining = deadline.remaining() if deadline else None
+    if remaining is None:
+        return default_seconds
+    return max(0.1, min(default_seconds, remaining + _UPSTREAM_GRACE_SECONDS))
+
+
+def budget_model(model: str, route: str) -> str:
+    """残り時間が少ない場合は軽量なモデルに切り替える
+
+    Args:
+        model: リクエストで指定されたモデル
+        route: メトリクス用のルート名
+
+    Returns:
+        str: 使用するモデル
+    """
+    deadline = current_deadline()
+    if deadline is None or not deadline.tight or not DEADLINE_FALLBACK_MODEL or model == DEADLINE_FALLBACK_MODEL:
+        return model
+    metrics.inc("deadline_downgrades_total", route=route, model=model)
+    return DEADLINE_FALLBACK_MODEL
+
+
+def budget_overrides(model: str) -> Dict[str, Any]:
+    """軽量なモデルに切り替えた場合に生成設定へ追加する項目（思考を無効にして応答を速くする）"""
+    deadline = current_deadline()
+    if model == DEADLINE_FALLBACK_MODEL and deadline is not None and deadline.tight:
+        return {"thinking_config": {"thinking_budget": 0}}
+    return {}
+
+
+class _DisconnectWatcher:
+    """リクエスト本文を読み終えた後、クライアントの切断を監視する"""
+
+    def __init__(self, receive: Callable) -> None:
+        self._receive = receive
+        self._body_complete = False
+        self._watch_task: Optional[asyncio.Task] = None
+        self.disconnected = asyncio.Event()
+
+    async def receive(self) -> Dict[str, Any]:
+        if self._body_complete:
+            # 本文の受信後はアプリからの receive（切断の監視）に監視タスクの結果を返す
+            await self.disconnected.wait()
+            return {"type": "http.disconnect"}
+        message = await self._receive()
+        if message["type"] == "http.disconnect":
+            self.disconnected.set()
+        elif not message.get("more_body", False):
+            self._body_complete = True
+            self._watch_task = asyncio.create_task(self._watch())
+        return message
+
+    async def _watch(self) -> None:
+        while True:
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                self.disconnected.set()
+                return
+
+    def close(self) -> None:
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+
+
+class DeadlineMiddleware:
+    """期限切れ・クライアント切断時に処理中のリクエストをキャンセルするASGIミドルウェア"""
+
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not scope.get("path", "").startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        budget_ms = None
+        for key, value in scope.get("headers") or []:
+            if key.lower() == DEADLINE_HEADER.encode() and value.isdigit():
+                budget_ms = int(value)
+        deadline = RequestDeadline(budget_ms)
+        watcher = _DisconnectWatcher(receive)
+        response_started = False
+
+        async def guarded_send(message: Dict[str, Any]) -> None:
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        token = _current.set(deadline)
+        try:
+            task = asyncio.create_task(self.app(scope, watcher.receive, guarded_send))
+        finally:
+            _current.reset(token)
+
+        reason = None
+        disconnected = asyncio.create_task(watcher.disconnected.wait())
+        try:
+            while reason is None:
+                deadline.changed.clear()
+                changed = asyncio.create_task(deadline.changed.wait())
+                done, _ = await asyncio.wait(
+                    {task, disconnected, changed}, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED
+                )
+                changed.cancel()
+                if task in done:
+                    break
+                if disconnected in done:
+                    reason = "disconnect"
+                elif deadline.expired:
+                    reason = "deadline"
+            if reason is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+            else:
+                await task
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            disconnected.cancel()
+            watcher.close()
+
+        if reason is None:
+            return
+        route = route_label(scope)
+        metrics.inc("request_cancellations_total", route=route, reason=reason)
+        metrics.observe("request_cancelled_after_seconds", time.monotonic() - deadline.started, route=route, reason=reason)
+        if response_started:
+            return
+        if reason == "deadline":
+            status, body = 504, {
+                "detail": f"リクエストの期限（{deadline.budget_ms}ms）を超過したため処理を中止しました",
+                "reason": "deadline_exceeded",
+            }
+        else:
+            # クライアントには届かないが、外側のミドルウェアが応答なしで失敗しないようにする
+            status, body = 499, {"detail": "クライアントが切断したため処理を中止しました", "reason": "client_disconnected"}
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        })
+        await send({"type": "http.response.body", "body": payload})
@@ -0,0 +1,291 @@
+"""
+ドキュメントのテキスト抽出
+
+テキストファイル・DOCX・テキスト層のあるPDFはローカルで本文を抽出し、ファイル全体ではなく
+コンパクトなテキストを上流に送る。テキスト層の無い（スキャンされた）PDFのページのみ、
+そのページだけを切り出したPDFとしてバイナリで送る。
+抽出はCPUを使うためプロセスプールで実行し、結果はファイルのハッシュをキーにキャッシュする。
+制限時間を超えた抽出はワーカーごとプールを作り直し、元のファイルをそのまま送る。
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import time
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from typing import Any, List, Optional
+from xml.etree import ElementTree
+
+from backend.cache import LRUCache
+from backend.config import (
+    DOCUMENT_DOCX_MAX_XML_BYTES,
+    DOCUMENT_EXTRACT_TIMEOUT_SECONDS,
+    DOCUMENT_EXTRACT_WORKERS,
+    DOCUMENT_SCANNED_PAGE_MIN_CHARS,
+    DOCUMENT_TEXT_CACHE_MAX_BYTES,
+)
+from backend.metrics import metrics
+
+try:
+    import pypdf
+except ImportError:  # pragma: no cover - pypdf は任意
+    pypdf = None
+
+TEXT_EXTENSIONS = (".txt", ".md", ".markdown", ".csv", ".json", ".html", ".htm", ".xml")
+PDF_MIME_TYPE = "application/pdf"
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+logger = logging.getLogger(__name__)
+
+_WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+@dataclass
+class ExtractedDocument:
+    """抽出結果
+
+    method が "binary" の場合はローカルで抽出できなかったため、元のファイルをそのまま送る。
+    fallback はテキスト層の無いページのみを含むPDF（すべてのページがスキャンの場合は元のファイル）。
+    """
+
+    method: str  # text / docx / pdf / binary
+    text: str = ""
+    page_count: Optional[int] = None
+    scanned_pages: List[int] = field(default_factory=list)  # 1始まりのページ番号
+    fallback: Optional[bytes] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.text) * 2 + len(self.fallback or b"")
+
+
+def guess_mime_type(filename: str, content_type: Optional[str]) -> str:
+    """ファイル名とContent-TypeからMIMEタイプを判定する"""
+    name = (filename or "").lower()
+    if name.endswith(".pdf"):
+        return PDF_MIME_TYPE
+    if name.endswith(".docx"):
+        return DOCX_MIME_TYPE
+    if name.endswith(".txt"):
+        return "text/plain"
+    return content_type or PDF_MIME_TYPE
+
+
+def _detect_kind(data: bytes, filename: str, content_type: Optional[str]) -> Optional[str]:
+    name = (filename or "").lower()
+    if data.startswith(b"%PDF-"):
+        return "pdf"
+    if name.endswith(TEXT_EXTENSIONS) or (content_type or "").startswith("text/"):
+        return "text"
+    if name.endswith(".docx") or content_type == DOCX_MIME_TYPE:
+        return "docx"
+    return None
+
+
+def _decode_text(data: bytes) -> str:
+    """テキストファイルをデコードする（UTF-8 で読めない場合は Shift_JIS を試す）"""
+    for encoding in ("utf-8-sig", "cp932"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="replace")
+
+
+def _extract_docx(data: bytes) -> str:
+    """DOCX の本文（word/document.xml）を段落ごとの行として取り出す
+
+    展開後のサイズが DOCUMENT_DOCX_MAX_XML_BYTES を超える場合（ZIP爆弾など）は ValueError を送出する。
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        # ヘッダーのサイズは偽装できるため、上限＋1バイトまでしか展開せずに判定する
+        with archive.open("word/document.xml") as member:
+            xml = member.read(DOCUMENT_DOCX_MAX_XML_BYTES + 1)
+    if len(xml) > DOCUMENT_DOCX_MAX_XML_BYTES:
+        raise ValueError(f"word/document.xml の展開後のサイズが上限（{DOCUMENT_DOCX_MAX_XML_BYTES}バイト）を超えています")
+    paragraphs = []
+    for paragraph in ElementTree.fromstring(xml).iter(f"{_WORD_NAMESPACE}p"):
+        pieces = []
+        for node in paragraph.iter():
+            if node.tag == f"{_WORD_NAMESPACE}t":
+                pieces.append(node.text or "")
+            elif node.tag == f"{_WORD_NAMESPACE}tab":
+                pieces.append("\t")
+            elif node.tag in (f"{_WORD_NAMESPACE}br", f"{_WORD_NAMESPACE}cr"):
+                pieces.append("\n")
+        paragraphs.append("".join(pieces))
+    return "\n".join(paragraphs).strip()
+
+
+def _extract_pdf(data: bytes) -> ExtractedDocument:
+    """PDF のテキスト層をページごとに取り出し、テキストの無いページはPDFとして切り出す"""
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    pages = []
+    scanned = []
+    for number, page in enumerate(reader.pages, start=1):
+        text = (page.extract_text() or "").strip()
+        if len(text) < DOCUMENT_SCANNED_PAGE_MIN_CHARS:
+            scanned.append(number)
+            pages.append(f"[ページ {number}]\n（テキスト層なし: 添付のPDFを参照）")
+        else:
+            pages.append(f"[ページ {number}]\n{text}")
+
+    fallback = None
+    if len(scanned) == len(reader.pages):
+        fallback = data
+    elif scanned:
+        writer = pypdf.PdfWriter()
+        for number in scanned:
+            writer.add_page(reader.pages[number - 1])
+        out = io.BytesIO()
+        writer.write(out)
+        fallback = out.getvalue()
+    return ExtractedDocument(
+        method="pdf",
+        text="\n\n".join(pages),
+        page_count=len(reader.pages),
+        scanned_pages=scanned,
+        fallback=fallback,
+    )
+
+
+def extract_document_sync(data: bytes, filename: str, content_type: Optional[str]) -> ExtractedDocument:
+    """ファイルからテキストを抽出する（ワーカープロセスで実行する）
+
+    抽出できない形式や壊れたファイルは method="binary" として元のファイルを送る。
+    """
+    kind = _detect_kind(data, filename, content_type)
+    try:
+        if kind == "text":
+            return ExtractedDocument(method="text", text=_decode_text(data))
+        if kind == "docx":
+            text = _extract_docx(data)
+            if text:
+                return ExtractedDocument(method="docx", text=text)
+        if kind == "pdf" and pypdf is not None:
+            return _extract_pdf(data)
+    except Exception as e:
+        logger.warning(f"Local text extraction failed, sending original file: filename={filename}, error={type(e).__name__}: {e}")
+    return ExtractedDocument(method="binary", fallback=data)
+
+
+# 抽出結果（ファイルのハッシュ -> ExtractedDocument）
+_extracted: LRUCache[ExtractedDocument] = LRUCache(
+    max_entries=1024, max_bytes=DOCUMENT_TEXT_CACHE_MAX_BYTES, sizeof=lambda v: v.size
+)
+_executor: Optional[Executor] = None
+
+
+def _get_executor() -> Optional[Executor]:
+    """抽出用のプロセスプール（初回使用時に起動する。ワーカー数0の場合はNone）"""
+    global _executor
+    if _executor is None and DOCUMENT_EXTRACT_WORKERS > 0:
+        _executor = ProcessPoolExecutor(max_workers=DOCUMENT_EXTRACT_WORKERS)
+    return _executor
+
+
+def _discard_executor(executor: Executor) -> None:
+    """プロセスプールを破棄する（実行中のワーカーも終了させる）
+
+    同じプールで実行中・待機中の他の抽出は BrokenProcessPool となり、スレッドでの抽出に切り替わる。
+    """
+    global _executor
+    if _executor is executor:
+        _executor = None
+    # ProcessPoolExecutor.shutdown は実行中のワーカーを待つ（wait=False でも停止はしない）ため、直接終了させる
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.terminate()
+    executor.shutdown(wait=False)
+
+
+def shutdown_executor() -> None:
+    """抽出用のプロセスプールを停止する（アプリケーションの終了時に呼び出す）"""
+    global _executor
+    executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+async def extract_document(data: bytes, filename: str, content_type: Optional[str]) -> ExtractedDocument:
+    """ファイルからテキストを抽出する（同じ内容のファイルはキャッシュから返す）
+
+    Args:
+        data: ファイルのバイト列
+        filename: ファイル名（形式の判定に使用）
+        content_type: Content-Type
+
+    Returns:
+        ExtractedDocument: 抽出結果
+    """
+    kind = _detect_kind(data, filename, content_type)
+    if kind is None or (kind == "pdf" and pypdf is None):
+        metrics.inc("document_extract_total", method="binary", cache="skip")
+        return ExtractedDocument(method="binary", fallback=data)
+    key = (hashlib.sha256(data).hexdigest(), kind)
+    cached = _extracted.get(key)
+    if cached is not None:
+        metrics.inc("document_extract_total", method=cached.method, cache="hit")
+        return cached
+
+    started = time.perf_counter()
+    executor = _get_executor()
+    try:
+        if executor is None:
+            # スレッドは中断できないため、制限時間を超えた場合は結果を待たずに元のファイルを送る
+            result = await asyncio.wait_for(
+                asyncio.to_thread(extract_document_sync, data, filename, content_type),
+                timeout=DOCUMENT_EXTRACT_TIMEOUT_SECONDS,
+            )
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                result = await asyncio.wait_for(
+                    loop.run_in_executor(executor, extract_document_sync, data, filename, content_type),
+                    timeout=DOCUMENT_EXTRACT_TIMEOUT_SECONDS,
+                )
+            except BrokenProcessPool:
+                # ワーカーが異常終了した場合はプールを作り直し、今回はスレッドで抽出する
+                _discard_executor(executor)
+                result = await asyncio.to_thread(extract_document_sync, data, filename, content_type)
+    except asyncio.TimeoutError:
+        # 抽出が終わらないワーカーを残さないよう、プールごと作り直す
+        logger.warning(
+            f"Local text extraction timed out, sending original file: filename={filename}, "
+            f"timeout={DOCUMENT_EXTRACT_TIMEOUT_SECONDS}s"
+        )
+        if executor is not None:
+            _discard_executor(executor)
+        metrics.inc("document_extract_timeouts_total")
+        result = ExtractedDocument(method="binary", fallback=data)
+    metrics.inc("document_extract_total", method=result.method, cache="miss")
+    metrics.observe("document_extract_seconds", time.perf_counter() - started, method=result.method)
+    if result.method != "binary":
+        metrics.inc("document_extract_uploaded_bytes", len(result.text.encode("utf-8")) + len(result.fallback or b""))
+        metrics.inc("document_extract_original_bytes", len(data))
+        _extracted.set(key, result)
+    return result
+
+
+def content_parts(extracted: ExtractedDocument, mime_type: str) -> List[Any]:
+    """抽出結果をリクエストのパートにする（テキストと、必要な場合のみバイナリ）
+
+    Args:
+        extracted: 抽出結果
+        mime_type: 元のファイルのMIMEタイプ（method="binary" の場合に使用）
+
+    Returns:
+        List[Any]: generate_content の contents に追加するパート
+    """
+    from google.genai import types
+
+    parts: List[Any] = []
+    if extracted.text:
+        parts.append(f"ドキュメントの本文:\n{extracted.text}")
+    if extracted.fallback is not None:
+        fallback_mime = mime_type if extracted.method == "binary" else PDF_MIME_TYPE
+        parts.append(types.Part.from_bytes(data=extracted.fallback, mime_type=fallback_mime))
+    return parts
+
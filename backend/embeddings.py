@@ -0,0 +1,115 @@
+"""
+エンベディング生成
+
+複数テキストのエンベディングを、APIの1リクエストあたりの上限件数ごとのバッチに分けて並行に生成する。
+また、レスポンスサイズを抑えるためのバイナリ表現（float32 / float16 / int8 / 1bit）への変換を提供する。
+"""
+from typing import Any, List, Literal, Optional, Tuple
+
+import numpy as np
+from google.genai import types
+
+from backend.concurrency import bounded_gather, upstream_slot
+from backend.config import EMBEDDING_BATCH_CONCURRENCY, EMBEDDING_BATCH_SIZE
+from backend.http_transport import http_options_for
+from backend.metrics import metrics
+
+
+def extract_embeddings(response: Any) -> List[List[float]]:
+    """embed_content のレスポンスからベクトルのリストを取得する"""
+    if hasattr(response, "embeddings") and response.embeddings is not None:
+        return [list(e.values) if getattr(e, "values", None) is not None else [] for e in response.embeddings]
+    if hasattr(response, "embedding"):
+        embedding = response.embedding
+        return [list(embedding.values if hasattr(embedding, "values") else embedding)]
+    if hasattr(response, "values"):
+        return [list(response.values)]
+    return []
+
+
+async def embed_texts(
+    client: Any,
+    texts: List[str],
+    model: str,
+    task_type: Optional[str] = None,
+    output_dimensionality: Optional[int] = None,
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+) -> List[List[float]]:
+    """テキストのエンベディングをバッチで生成する（結果は入力順）
+
+    Args:
+        client: genai.Client
+        texts: エンベディングするテキスト
+        model: エンベディングモデル
+        task_type: RETRIEVAL_DOCUMENT / RETRIEVAL_QUERY / SEMANTIC_SIMILARITY など
+        output_dimensionality: 出力次元数（未指定時はモデルの既定値）
+        batch_size: 1リクエストあたりのテキスト数
+
+    Returns:
+        List[List[float]]: 各テキストのエンベディング
+
+    Raises:
+        ValueError: 返されたエンベディングの件数が入力と一致しない場合
+    """
+    if not texts:
+        return []
+    config = types.EmbedContentConfig(
+        task_type=task_type,
+        output_dimensionality=output_dimensionality,
+        http_options=http_options_for("embedding"),
+    )
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+
+    async def embed_batch(batch: List[str]) -> List[List[float]]:
+        async with upstream_slot("embedding"):
+            with metrics.timer("embedding_batch_seconds", model=model):
+                response = await client.aio.models.embed_content(model=model, contents=batch, config=config)
+        embeddings = extract_embeddings(response)
+        if len(embeddings) != len(batch):
+            raise ValueError(f"エンベディングの件数が一致しません: {len(embeddings)} != {len(batch)}")
+        return embeddings
+
+    results = await bounded_gather((embed_batch(batch) for batch in batches), EMBEDDING_BATCH_CONCURRENCY)
+    metrics.inc("embedding_texts_total", len(texts), model=model)
+    return [embedding for batch in results for embedding in batch]
+
+
+# エンベディングのバイナリ表現
+EmbeddingDtype = Literal["float32", "float16", "int8", "binary"]
+
+
+def encode_embeddings(embeddings: List[List[float]], dtype: EmbeddingDtype) -> Tuple[bytes, Optional[List[float]]]:
+    """エンベディングを行優先のリトルエンディアンのバイト列に変換する
+
+    - float32 / float16: 各要素をそのまま格納（1要素4 / 2バイト）
+    - int8: ベクトルごとに最大絶対値を127に対応させて量子化（元の値 ≒ int8値 × scale）
+    - binary: 各要素の符号（正なら1）をビットに詰める（上位ビットから、1ベクトル ceil(次元数/8) バイト）
+
+    Args:
+        embeddings: エンベディングのリスト（次元数は揃っていること）
+        dtype: 変換後の型
+
+    Returns:
+        Tuple[bytes, Optional[List[float]]]: バイト列と、int8の場合はベクトルごとのscale
+
+    Raises:
+        ValueError: 次元数が揃っていない場合、または未対応の型の場合
+    """
+    try:
+        matrix = np.asarray(embeddings, dtype=np.float32)
+    except ValueError as e:
+        raise ValueError("エンベディングの次元数が揃っていません") from e
+    if matrix.ndim != 2:
+        raise ValueError("エンベディングの次元数が揃っていません")
+    if dtype == "float32":
+        return matrix.astype("<f4").tobytes(), None
+    if dtype == "float16":
+        return matrix.astype("<f2").tobytes(), None
+    if dtype == "int8":
+        max_abs = np.abs(matrix).max(axis=1)
+        scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized.tobytes(), scales.tolist()
+    if dtype == "binary":
+        return np.packbits(matrix > 0, axis=1).tobytes(), None
+    raise ValueError(f"未対応の型です: {dtype}")
@@ -0,0 +1,153 @@
+"""
+Gemini API 用のHTTPトランスポート設定
+
+genai.Client が使用する httpx のコネクションプール（上限数・keep-alive・HTTP/2）と
+タイムアウトを設定し、新規接続数・TLSハンドシェイク時間をメトリクスとして記録する。
+起動時のウォームアップで接続を事前に確立し、コールドスタート直後のリクエストが
+TCP/TLSハンドシェイクを待たないようにする。
+"""
+import asyncio
+import importlib.util
+import logging
+import time
+from typing import Any, Callable, Dict, Literal
+
+import httpx
+from google.genai import types
+
+from backend.config import (
+    HTTP2_ENABLED,
+    HTTP_CONNECT_TIMEOUT_SECONDS,
+    HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_TIMEOUT_DEFAULT_SECONDS,
+    HTTP_TIMEOUT_EMBEDDING_SECONDS,
+    HTTP_TIMEOUT_MEDIA_SECONDS,
+    HTTP_TIMEOUT_STREAMING_SECONDS,
+)
+from backend.deadlines import upstream_timeout
+from backend.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# ルートの種類ごとのリクエスト全体のタイムアウト（秒）
+RouteClass = Literal["default", "streaming", "media", "embedding"]
+ROUTE_TIMEOUTS: Dict[str, float] = {
+    "default": HTTP_TIMEOUT_DEFAULT_SECONDS,
+    "streaming": HTTP_TIMEOUT_STREAMING_SECONDS,
+    "media": HTTP_TIMEOUT_MEDIA_SECONDS,
+    "embedding": HTTP_TIMEOUT_EMBEDDING_SECONDS,
+}
+
+# 接続確立の各段階（httpcore のトレースイベント名）
+_CONNECT_STEPS = {"connection.connect_tcp": "tcp", "connection.start_tls": "tls"}
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def _tracer(transport: str) -> Callable[[str, Dict[str, Any]], Any]:
+    """新規接続の確立時間を記録するトレース関数を作成する
+
+    httpcore は新しい接続を張る場合にのみ connect_tcp / start_tls イベントを発行するため、
+    リクエスト数との差が接続の再利用数になる。
+    """
+    started: Dict[str, float] = {}
+
+    def record(event_name: str) -> None:
+        step, _, phase = event_name.rpartition(".")
+        if step not in _CONNECT_STEPS:
+            return
+        if phase == "started":
+            started[step] = time.perf_counter()
+        elif phase == "complete" and step in started:
+            metrics.observe("upstream_http_connect_seconds", time.perf_counter() - started.pop(step), step=_CONNECT_STEPS[step])
+            if step == "connection.connect_tcp":
+                metrics.inc("upstream_http_connections_total", transport=transport)
+
+    if transport == "async":
+        async def trace(event_name: str, info: Dict[str, Any]) -> None:
+            record(event_name)
+        return trace
+
+    def trace_sync(event_name: str, info: Dict[str, Any]) -> None:
+        record(event_name)
+    return trace_sync
+
+
+def _prepare(request: httpx.Request, transport: str) -> None:
+    """接続タイムアウトの上限とトレースを設定する
+
+    genai はリクエストごとに単一のタイムアウト値を渡すため、接続確立のみ短い上限を適用する。
+    """
+    timeout = dict(request.extensions.get("timeout") or {})
+    connect = timeout.get("connect")
+    timeout["connect"] = HTTP_CONNECT_TIMEOUT_SECONDS if connect is None else min(connect, HTTP_CONNECT_TIMEOUT_SECONDS)
+    request.extensions["timeout"] = timeout
+    request.extensions.setdefault("trace", _tracer(transport))
+    metrics.inc("upstream_http_requests_total", transport=transport)
+
+
+class _TunedAsyncTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        _prepare(request, "async")
+        return await super().handle_async_request(request)
+
+
+class _TunedSyncTransport(httpx.HTTPTransport):
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        _prepare(request, "sync")
+        return super().handle_request(request)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+def build_http_options() -> types.HttpOptions:
+    """genai.Client 用の HttpOptions を作成する（クライアントごとに専用のコネクションプールを持つ）"""
+    http2 = HTTP2_ENABLED
+    if http2 and not _http2_available():
+        logger.warning("HTTP2_ENABLED is set but the 'h2' package is not installed; falling back to HTTP/1.1")
+        http2 = False
+    return types.HttpOptions(
+        timeout=int(ROUTE_TIMEOUTS["default"] * 1000),
+        client_args={"transport": _TunedSyncTransport(limits=_limits(), http2=http2)},
+        async_client_args={"transport": _TunedAsyncTransport(limits=_limits(), http2=http2)},
+    )
+
+
+def http_options_for(route_class: RouteClass) -> types.HttpOptions:
+    """ルートの種類に応じたタイムアウトを設定した HttpOptions（生成設定の http_options に指定する）
+
+    リクエストに期限が指定されている場合は、残り時間に合わせてタイムアウトを短くする。
+    """
+    return types.HttpOptions(timeout=int(upstream_timeout(ROUTE_TIMEOUTS[route_class]) * 1000))
+
+
+async def warm_up(client: Any, model: str, connections: int) -> None:
+    """軽量なモデル情報取得を並行して行い、コネクションプールに接続を確立しておく
+
+    Args:
+        client: genai.Client
+        model: 取得するモデル名（トークンを消費しないメタデータ取得のみ）
+        connections: 確立する接続数
+    """
+    if connections <= 0:
+        return
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(client.aio.models.get(model=model) for _ in range(connections)), return_exceptions=True
+    )
+    failures = [r for r in results if isinstance(r, BaseException)]
+    metrics.observe("upstream_http_warmup_seconds", time.perf_counter() - started)
+    if failures:
+        logger.warning(f"HTTP warm-up partially failed: {len(failures)}/{connections}: {type(failures[0]).__name__}: {failures[0]}")
+    else:
+        logger.info(f"HTTP warm-up completed: connections={connections}, elapsed={time.perf_counter() - started:.2f}s")
@@ -0,0 +1,208 @@
+"""
+画像処理
+
+生成画像の保存（コンテンツハッシュで参照）と、幅・形式を指定した変換結果（バリアント）の
+キャッシュ、およびGeminiへ送信する前の入力画像の前処理（向き補正・縮小・再エンコード）を提供する。
+変換はCPU負荷が高いため、イベントループ外のワーカープールで実行する。
+"""
+import asyncio
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from backend.cache import LRUCache, SingleFlight
+from backend.config import (
+    IMAGE_INPUT_CACHE_MAX_BYTES,
+    IMAGE_INPUT_JPEG_QUALITY,
+    IMAGE_INPUT_MAX_DIMENSION,
+    IMAGE_PREPROCESS_WORKERS,
+    IMAGE_STORE_MAX_BYTES,
+    IMAGE_VARIANT_CACHE_MAX_BYTES,
+)
+from backend.metrics import metrics
+
+# 出力形式とPILの保存形式・MIMEタイプ
+OUTPUT_FORMATS: Dict[str, Tuple[str, str]] = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+MAX_OUTPUT_WIDTH = 4096
+
+# 元画像（image_id -> (bytes, mime)）
+_originals: LRUCache[Tuple[bytes, str]] = LRUCache(
+    max_entries=1024, max_bytes=IMAGE_STORE_MAX_BYTES, sizeof=lambda v: len(v[0])
+)
+# 変換結果（(image_id, width, format, quality) -> (bytes, mime)）
+_variants: LRUCache[Tuple[bytes, str]] = LRUCache(
+    max_entries=4096, max_bytes=IMAGE_VARIANT_CACHE_MAX_BYTES, sizeof=lambda v: len(v[0])
+)
+# 前処理済みの入力画像（(元画像のハッシュ, 最大辺) -> (bytes, mime)）
+_processed_inputs: LRUCache[Tuple[bytes, str]] = LRUCache(
+    max_entries=1024, max_bytes=IMAGE_INPUT_CACHE_MAX_BYTES, sizeof=lambda v: len(v[0])
+)
+# 画像処理用のワーカープール
+_executor = ThreadPoolExecutor(max_workers=IMAGE_PREPROCESS_WORKERS, thread_name_prefix="image-worker")
+# 同一バリアントへの同時リクエストで変換を重複させないための実行中タスク
+_inflight: SingleFlight[Tuple[bytes, str]] = SingleFlight()
+
+
+def content_hash(data: bytes) -> str:
+    """画像データのハッシュ（image_id）を計算する"""
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def store_image(data: bytes, mime_type: str) -> str:
+    """元画像を保存し、image_id を返す"""
+    image_id = content_hash(data)
+    if image_id not in _originals:
+        _originals.set(image_id, (data, mime_type))
+    return image_id
+
+
+def get_image(image_id: str) -> Optional[Tuple[bytes, str]]:
+    """保存済みの元画像を取得する"""
+    return _originals.get(image_id)
+
+
+def transcode(data: bytes, width: Optional[int], output_format: str, quality: int) -> Tuple[bytes, str]:
+    """画像を指定の幅・形式に変換する（アスペクト比は維持し、拡大はしない）
+
+    Args:
+        data: 元画像のバイト列
+        width: 出力幅（Noneの場合は元のサイズ）
+        output_format: webp / jpeg / png
+        quality: 品質（1-100、PNGでは無視）
+
+    Returns:
+        Tuple[bytes, str]: 変換後のバイト列とMIMEタイプ
+    """
+    pil_format, mime_type = OUTPUT_FORMATS[output_format]
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        if width and width < image.width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.Resampling.LANCZOS)
+        if pil_format == "JPEG" and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        if pil_format == "PNG":
+            image.save(out, format=pil_format, optimize=True)
+        elif pil_format == "JPEG":
+            image.save(out, format=pil_format, quality=quality, optimize=True, progressive=True)
+        else:
+            image.save(out, format=pil_format, quality=quality)
+    return out.getvalue(), mime_type
+
+
+async def get_variant(
+    image_id: str, data: bytes, width: Optional[int], output_format: str, quality: int
+) -> Tuple[bytes, str]:
+    """バリアントを取得する（未作成の場合はスレッドプールで変換してキャッシュする）
+
+    Args:
+        image_id: 元画像のID
+        data: 元画像のバイト列
+        width: 出力幅
+        output_format: webp / jpeg / png
+        quality: 品質
+
+    Returns:
+        Tuple[bytes, str]: 変換後のバイト列とMIMEタイプ
+    """
+    key = (image_id, width, output_format, quality)
+    cached = _variants.get(key)
+    if cached is not None:
+        metrics.inc("image_variant_requests_total", result="hit")
+        return cached
+
+    async def produce() -> Tuple[bytes, str]:
+        with metrics.timer("image_transcode_seconds", format=output_format):
+            result = await asyncio.get_running_loop().run_in_executor(
+                _executor, transcode, data, width, output_format, quality
+            )
+        _variants.set(key, result)
+        metrics.observe("image_variant_bytes_saved", max(0, len(data) - len(result[0])), format=output_format)
+        return result
+
+    metrics.inc("image_variant_requests_total", result="miss")
+    return await _inflight.run(key, produce)
+
+
+def normalize_input(data: bytes, max_dimension: int, jpeg_quality: int) -> Optional[Tuple[bytes, str]]:
+    """入力画像のEXIFの向きを適用し、最大辺を制限して再エンコードする
+
+    透過を含む画像はWebP（ロスレス）、それ以外はJPEGで再エンコードする。
+
+    Args:
+        data: 元画像のバイト列
+        max_dimension: 長辺の最大ピクセル数
+        jpeg_quality: JPEGの品質
+
+    Returns:
+        Optional[Tuple[bytes, str]]: 処理後のバイト列とMIMEタイプ（デコードできない形式はNone）
+    """
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info)
+            if has_alpha:
+                image.save(out, format="WEBP", lossless=True)
+                return out.getvalue(), "image/webp"
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(out, format="JPEG", quality=jpeg_quality, optimize=True)
+            return out.getvalue(), "image/jpeg"
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+
+async def preprocess_input_image(
+    data: bytes, mime_type: str, max_dimension: int = IMAGE_INPUT_MAX_DIMENSION
+) -> Tuple[bytes, str]:
+    """Geminiへ送信する入力画像を前処理する（結果は元画像のハッシュでキャッシュ）
+
+    処理後の方が大きくなる場合やデコードできない形式（HEIC等）の場合は元画像をそのまま返す。
+
+    Args:
+        data: アップロードされた画像のバイト列
+        mime_type: アップロード時のMIMEタイプ
+        max_dimension: 長辺の最大ピクセル数
+
+    Returns:
+        Tuple[bytes, str]: 送信する画像のバイト列とMIMEタイプ
+    """
+    key = (content_hash(data), max_dimension)
+    cached = _processed_inputs.get(key)
+    if cached is not None:
+        metrics.inc("image_preprocess_total", result="cache_hit")
+        metrics.observe("image_preprocess_bytes_saved", len(data) - len(cached[0]))
+        return cached
+
+    with metrics.timer("image_preprocess_seconds"):
+        processed = await asyncio.get_running_loop().run_in_executor(
+            _executor, normalize_input, data, max_dimension, IMAGE_INPUT_JPEG_QUALITY
+        )
+    if processed is None or len(processed[0]) >= len(data):
+        result = (data, mime_type)
+        metrics.inc("image_preprocess_total", result="passthrough")
+    else:
+        result = processed
+        metrics.inc("image_preprocess_total", result="processed")
+    _processed_inputs.set(key, result)
+    metrics.observe("image_preprocess_bytes_saved", len(data) - len(result[0]))
+    return result
+
+
+def cache_stats() -> Dict[str, Dict[str, float]]:
+    """元画像・バリアント・前処理済み入力画像のキャッシュ統計"""
+    return {
+        "originals": _originals.stats(),
+        "variants": _variants.stats(),
+        "inputs": _processed_inputs.stats(),
+    }
@@ -0,0 +1,149 @@
+"""
+インクリメンタルJSONパーサー
+
+ストリーミング生成されるJSONテキストを断片ごとに受け取り、
+構文的に完結した要素から順に取り出す。
+
+- ルートがオブジェクトの場合: トップレベルのフィールドが完結するたびに "field" を、
+  値が配列のフィールドは要素が完結するたびに "item" を発行する
+- ルートが配列の場合: 要素が完結するたびに "item" を発行する
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+_WHITESPACE = " \t\r\n"
+
+
+class IncrementalJSONParser:
+    """JSONテキストの断片から完結した要素を取り出すパーサー"""
+
+    def __init__(self) -> None:
+        self._buf = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        # ルートオブジェクト直下の状態
+        self._expect = "key"  # key / colon / value / comma
+        self._key: Optional[str] = None
+        self._value_start: Optional[int] = None
+        self._array_field = False
+        # 配列要素の状態（ルート配列、またはトップレベルの配列フィールド）
+        self._item_start: Optional[int] = None
+        self._item_index = 0
+        self.finished = False
+
+    @property
+    def text(self) -> str:
+        """これまでに受け取ったテキスト全体"""
+        return self._buf
+
+    def _item_depth(self) -> int:
+        """配列要素を取り出す対象のネスト深さ"""
+        return 1 if self._stack[:1] == ["["] else 2
+
+    def _emit_item(self, end: int, events: List[Dict[str, Any]]) -> None:
+        raw = self._buf[self._item_start:end].strip()
+        self._item_start = None
+        if not raw:
+            return
+        path = "" if self._stack[:1] == ["["] else self._key
+        events.append({"type": "item", "path": path, "index": self._item_index, "data": json.loads(raw)})
+        self._item_index += 1
+
+    def _emit_field(self, end: int, events: List[Dict[str, Any]]) -> None:
+        if self._array_field:
+            events.append({"type": "field_end", "path": self._key, "count": self._item_index})
+        else:
+            raw = self._buf[self._value_start:end].strip()
+            events.append({"type": "field", "path": self._key, "data": json.loads(raw)})
+        self._value_start = None
+        self._array_field = False
+        self._expect = "comma"
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """テキスト断片を追加し、新たに完結した要素のイベントを返す
+
+        Args:
+            chunk: JSONテキストの断片
+
+        Returns:
+            List[Dict[str, Any]]: "field" / "field_end" / "item" イベントのリスト
+
+        Raises:
+            json.JSONDecodeError: 完結した要素が不正なJSONだった場合
+        """
+        events: List[Dict[str, Any]] = []
+        self._buf += chunk
+        buf = self._buf
+        i = self._pos
+        n = len(buf)
+        while i < n:
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1 and self._stack[0] == "{" and self._expect == "key":
+                        self._key = json.loads(buf[self._string_start:i + 1])
+                        self._expect = "colon"
+                i += 1
+                continue
+
+            depth = len(self._stack)
+            if ch in _WHITESPACE:
+                i += 1
+                continue
+
+            # ルートオブジェクト直下で値が始まる位置を記録
+            if depth == 1 and self._stack[0] == "{" and self._expect == "value" and self._value_start is None:
+                self._value_start = i
+                self._array_field = ch == "["
+                self._item_index = 0
+            # 配列要素が始まる位置を記録
+            if (
+                self._item_start is None
+                and depth == self._item_depth()
+                and depth >= 1
+                and self._stack[-1] == "["
+                and ch not in ",]"
+                and (depth == 1 or self._array_field)
+            ):
+                self._item_start = i
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch in "{[":
+                self._stack.append(ch)
+            elif ch in "}]":
+                if depth == self._item_depth() and self._stack[-1] == "[" and self._item_start is not None:
+                    if depth == 1 or self._array_field:
+                        self._emit_item(i, events)
+                self._stack.pop()
+                depth = len(self._stack)
+                if depth == 1 and self._stack[0] == "{" and self._value_start is not None:
+                    # コンテナ値の終端
+                    self._emit_field(i + 1, events)
+                elif depth == 0:
+                    if ch == "}" and self._value_start is not None:
+                        self._emit_field(i, events)
+                    self.finished = True
+            elif ch == ",":
+                if depth == self._item_depth() and self._stack[-1] == "[" and self._item_start is not None:
+                    if depth == 1 or self._array_field:
+                        self._emit_item(i, events)
+                if depth == 1 and self._stack[0] == "{":
+                    if self._value_start is not None:
+                        self._emit_field(i, events)
+                    self._expect = "key"
+            elif ch == ":":
+                if depth == 1 and self._stack[0] == "{" and self._expect == "colon":
+                    self._expect = "value"
+            i += 1
+        self._pos = i
+        return events
@@ -2,10 +2,21 @@
 FastAPI メインアプリケーション
 Gemini APIの各種機能を提供するエンドポイント
 """
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from backend.admission import AdmissionMiddleware, admission
+from backend.cassettes import cassettes
+from backend.client import client_pool
+from backend.compression import CompressionMiddleware
+from backend.config import COMPRESSION_ENABLED, DEFAULT_TEXT_MODEL, HTTP_WARMUP_CONNECTIONS
+from backend.deadlines import DeadlineMiddleware
+from backend.documents import shutdown_executor
+from backend.http_transport import warm_up
+from backend.metrics import metrics
 from backend.routers import (
     text,
     image,
@@ -16,6 +27,7 @@ from backend.routers import (
     structured_output,
     document,
     agent,
+    rag,
 )
 
 # ロギング設定
@@ -25,12 +37,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 各APIキーのクライアントでGemini APIへの接続を事前に確立する（起動はブロックしない）
+    # 再生モードでは上流を呼び出さないため、接続を確立しない
+    warm_up_tasks = [
+        asyncio.create_task(warm_up(key.client, DEFAULT_TEXT_MODEL, HTTP_WARMUP_CONNECTIONS))
+        for key in client_pool.keys
+        if cassettes.mode != "replay"
+    ]
+    yield
+    for task in warm_up_tasks:
+        task.cancel()
+    # テキスト抽出のワーカープロセスを停止する
+    shutdown_executor()
+
+
 app = FastAPI(
     title="Gemini API Backend",
     description="Gemini APIの各種機能を提供するバックエンドAPI",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
+# リクエストの期限・クライアント切断による処理中の上流呼び出しのキャンセル
+# （最も内側に置き、キャンセル時も外側のミドルウェアには応答を返す）
+app.add_middleware(DeadlineMiddleware)
+
+# アドミッション制御ミドルウェア
+# 推定待ち時間・同時受付数の上限を超えるリクエストは、本文を読み込む前に 503 で拒否する
+app.add_middleware(AdmissionMiddleware)
+
 # リクエストログミドルウェア
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -48,6 +85,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# レスポンス圧縮（Accept-Encoding に応じて zstd / br / gzip）
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
 # ルーターの登録
 app.include_router(text.router, prefix="/api/text", tags=["text"])
 app.include_router(image.router, prefix="/api/image", tags=["image"])
@@ -64,6 +105,7 @@ app.include_router(
 )
 app.include_router(document.router, prefix="/api/document", tags=["document"])
 app.include_router(agent.router, prefix="/api/agent", tags=["agent"])
+app.include_router(rag.router, prefix="/api/rag", tags=["rag"])
 
 
 @app.get("/")
@@ -75,3 +117,14 @@ async def root():
 async def health():
     return {"status": "healthy"}
 
+
+@app.get("/metrics")
+async def get_metrics():
+    """プロセス内メトリクスの取得"""
+    return {
+        **metrics.snapshot(),
+        "client_pool": client_pool.stats(),
+        "admission": admission.stats(),
+        "cassettes": cassettes.stats(),
+    }
+
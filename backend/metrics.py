@@ -0,0 +1,130 @@
+"""
+プロセス内メトリクス
+
+外部の監視基盤を前提とせず、カウンターと観測値（レイテンシ等）の集計を
+メモリ上で保持する。集計結果は `/metrics` エンドポイントから参照できる。
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, Any]) -> LabelKey:
+    """ラベルを辞書のキーとして使える形に正規化する"""
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Summary:
+    """観測値の件数・合計・最小・最大を保持する"""
+
+    __slots__ = ("count", "total", "min", "max")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def to_dict(self) -> Dict[str, float]:
+        if not self.count:
+            return {"count": 0, "sum": 0.0, "avg": 0.0, "min": 0.0, "max": 0.0}
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "avg": self.total / self.count,
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+class Metrics:
+    """スレッドセーフなメトリクスレジストリ"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._summaries: Dict[str, Dict[LabelKey, _Summary]] = {}
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """カウンターを加算する
+
+        Args:
+            name: メトリクス名
+            value: 加算する値
+            **labels: ラベル（route, model など）
+        """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """観測値を記録する
+
+        Args:
+            name: メトリクス名
+            value: 観測値（秒、バイト数など）
+            **labels: ラベル
+        """
+        key = _label_key(labels)
+        with self._lock:
+            series = self._summaries.setdefault(name, {})
+            summary = series.get(key)
+            if summary is None:
+                summary = series[key] = _Summary()
+            summary.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: Any) -> Iterator[None]:
+        """ブロックの実行時間（秒）を観測値として記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """現在の集計値をJSONシリアライズ可能な形で返す"""
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+            summaries = {
+                name: [{"labels": dict(key), **summary.to_dict()} for key, summary in series.items()]
+                for name, series in self._summaries.items()
+            }
+        return {"counters": counters, "summaries": summaries}
+
+
+def route_label(scope: Dict[str, Any]) -> str:
+    """ASGIスコープからメトリクス用のルート（パスパラメータを含まないテンプレート）を求める
+
+    APIRouter のルートはプレフィックスを含まないパスを持つ場合があるため、
+    実際のパスの先頭からテンプレートの階層数を除いた部分をプレフィックスとして補う。
+    """
+    path = scope.get("path", "")
+    template = getattr(scope.get("route"), "path", None)
+    if not template:
+        return path
+    if template.startswith("/api/"):
+        return template
+    segments = path.strip("/").split("/")
+    depth = len(template.strip("/").split("/")) if template.strip("/") else 0
+    prefix = "/".join(segments[: max(0, len(segments) - depth)])
+    return f"/{prefix}{template}" if prefix else template
+
+
+# グローバルメトリクスインスタンス
+metrics = Metrics()
@@ -0,0 +1,346 @@
+"""
+RAG（検索拡張生成）用のチャンク分割と永続インデックス
+
+ドキュメントを段落単位でチャンクに分割し、チャンクのエンベディングをコレクションごとに
+ローカルディレクトリへ保存する。再取り込み時は本文が変わったチャンクのみエンベディングし直す。
+チャンクの同一性は前のチャンクからの重複部分を除いた本文で判定し、重複部分はエンベディングする
+文字列にのみ加える（段落の編集が次のチャンクの再エンベディングを引き起こさないようにする）。
+
+保存形式（{RAG_INDEX_DIR}/{collection}/）:
+    - meta.json: エンベディングモデル、ドキュメントとチャンクのメタデータ
+    - vectors.npy: チャンクのエンベディング（meta.json のチャンク順、float32）
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from backend.config import RAG_CHUNK_CHARS, RAG_CHUNK_OVERLAP_CHARS, RAG_INDEX_DIR
+from backend.vector_index import VectorIndex
+
+_COLLECTION_PATTERN = re.compile(r"^[A-Za-z0-9_\-]{1,64}$")
+_PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+_SENTENCE_PATTERN = re.compile(r".+?(?:[。！？!?]+|[.](?=\s)|\n|$)", re.S)
+# 内容から決まるチャンク境界の候補（約8段落に1つ）と、候補の前で区切るチャンクの最小充填率
+_BOUNDARY_ANCHOR_DIVISOR = 8
+_BOUNDARY_ANCHOR_MIN_FILL = 0.75
+
+# 埋め込み関数: (texts) -> embeddings
+EmbedFunc = Callable[[List[str]], Awaitable[List[List[float]]]]
+
+
+def _split_long(paragraph: str, max_chars: int) -> List[str]:
+    """上限を超える段落を文単位（1文が上限を超える場合は文字数）で分割する"""
+    pieces: List[str] = []
+    current = ""
+    for match in _SENTENCE_PATTERN.finditer(paragraph):
+        sentence = match.group(0).strip()
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip() if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _is_boundary_anchor(paragraph: str) -> bool:
+    """段落がチャンク境界の候補かどうか（段落のハッシュで決める）"""
+    return hashlib.sha256(paragraph.encode("utf-8")).digest()[0] % _BOUNDARY_ANCHOR_DIVISOR == 0
+
+
+def chunk_bodies(text: str, max_chars: int = RAG_CHUNK_CHARS) -> List[str]:
+    """テキストを段落の境界でチャンク本文（重複部分を含まない）に分割する
+
+    段落は上限まで詰めてまとめるが、チャンクが上限の3/4以上埋まっていれば、境界の候補となる段落
+    （_is_boundary_anchor）の前でも区切る。境界の一部が段落の内容で決まるため、1つの段落を編集しても
+    以降のチャンクの境界が候補の段落でそろいやすく、後続のチャンクの本文が変わりにくい。
+
+    Args:
+        text: 入力テキスト
+        max_chars: チャンク本文の最大文字数
+
+    Returns:
+        List[str]: チャンク本文のリスト
+
+    Raises:
+        ValueError: max_chars が正の値でない場合
+    """
+    if max_chars <= 0:
+        raise ValueError(f"チャンクの最大文字数は正の値である必要があります: max_chars={max_chars}")
+    paragraphs = [p.strip() for p in _PARAGRAPH_PATTERN.split(text) if p.strip()]
+    bodies: List[str] = []
+    current = ""
+    for paragraph in paragraphs:
+        for piece in _split_long(paragraph, max_chars) if len(paragraph) > max_chars else [paragraph]:
+            if current and (
+                len(current) + len(piece) + 2 > max_chars
+                or (len(current) >= max_chars * _BOUNDARY_ANCHOR_MIN_FILL and _is_boundary_anchor(piece))
+            ):
+                bodies.append(current)
+                current = ""
+            current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        bodies.append(current)
+    return bodies
+
+
+def with_overlap(bodies: List[str], overlap_chars: int = RAG_CHUNK_OVERLAP_CHARS) -> List[str]:
+    """各チャンク本文に前のチャンクの末尾 overlap_chars 文字を前置する（エンベディングする文字列）"""
+    if overlap_chars <= 0:
+        return list(bodies)
+    chunks = bodies[:1]
+    for previous, body in zip(bodies, bodies[1:]):
+        chunks.append(f"{previous[-overlap_chars:].lstrip()}\n\n{body}")
+    return chunks
+
+
+def chunk_text(text: str, max_chars: int = RAG_CHUNK_CHARS, overlap_chars: int = RAG_CHUNK_OVERLAP_CHARS) -> List[str]:
+    """テキストを段落の境界でチャンクに分割する
+
+    各チャンクには前のチャンクの末尾 overlap_chars 文字を前置し、境界をまたぐ文脈を保つ。
+
+    Args:
+        text: 入力テキスト
+        max_chars: チャンク本文の最大文字数（重複部分を除く）
+        overlap_chars: 前のチャンクから引き継ぐ文字数
+
+    Returns:
+        List[str]: チャンクのリスト
+
+    Raises:
+        ValueError: max_chars が正の値でない場合
+    """
+    return with_overlap(chunk_bodies(text, max_chars), overlap_chars)
+
+
+def text_hash(text: str) -> str:
+    """チャンク本文のハッシュ"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:32]
+
+
+@dataclass
+class ChunkRecord:
+    """インデックス済みのチャンク"""
+
+    chunk_id: str
+    document_id: str
+    position: int
+    text: str
+    text_hash: str
+
+
+@dataclass
+class DocumentRecord:
+    """インデックス済みのドキュメント"""
+
+    document_id: str
+    title: Optional[str]
+    content_hash: str
+    chunk_ids: List[str]
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    updated_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class IngestResult:
+    """ドキュメント1件の取り込み結果"""
+
+    document_id: str
+    chunks: int
+    embedded: int  # 新規にエンベディングしたチャンク数
+    reused: int  # 既存のエンベディングを再利用したチャンク数
+    removed: int  # 本文が変わった・なくなったため削除された旧チャンク数
+    unchanged: bool = False
+
+
+class RagCollection:
+    """チャンクとエンベディングを保持するコレクション"""
+
+    def __init__(self, name: str, directory: str) -> None:
+        self.name = name
+        self.directory = directory
+        self.embedding_model: Optional[str] = None
+        self.documents: Dict[str, DocumentRecord] = {}
+        self.chunks: Dict[str, ChunkRecord] = {}
+        self.vectors: Dict[str, np.ndarray] = {}
+        self.index = VectorIndex()
+        self.lock = asyncio.Lock()  # 取り込み・削除の直列化
+        self._file_lock = threading.Lock()
+
+    # --- 永続化 ---
+
+    def load(self) -> None:
+        """ディスクからコレクションを読み込む（存在しない場合は空のまま）"""
+        meta_path = os.path.join(self.directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        matrix = np.load(os.path.join(self.directory, "vectors.npy"))
+        self.embedding_model = meta.get("embedding_model")
+        self.documents = {d["document_id"]: DocumentRecord(**d) for d in meta["documents"]}
+        for row, chunk in enumerate(meta["chunks"]):
+            record = ChunkRecord(**chunk)
+            self.chunks[record.chunk_id] = record
+            self.vectors[record.chunk_id] = matrix[row]
+            self.index.add(record.chunk_id, matrix[row])
+
+    def save(self) -> None:
+        """コレクションをディスクへ書き込む（一時ファイルから置き換えるため途中状態は残らない）"""
+        with self._file_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            chunk_ids = list(self.chunks)
+            dimensions = self.index.dimensions or 0
+            matrix = (
+                np.stack([self.vectors[cid] for cid in chunk_ids]).astype(np.float32)
+                if chunk_ids
+                else np.zeros((0, dimensions), dtype=np.float32)
+            )
+            meta = {
+                "embedding_model": self.embedding_model,
+                "documents": [asdict(d) for d in self.documents.values()],
+                "chunks": [asdict(self.chunks[cid]) for cid in chunk_ids],
+            }
+            vectors_tmp = os.path.join(self.directory, "vectors.npy.tmp")
+            meta_tmp = os.path.join(self.directory, "meta.json.tmp")
+            with open(vectors_tmp, "wb") as f:
+                np.save(f, matrix)
+            with open(meta_tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(vectors_tmp, os.path.join(self.directory, "vectors.npy"))
+            os.replace(meta_tmp, os.path.join(self.directory, "meta.json"))
+
+    # --- 更新 ---
+
+    def _remove_chunk(self, chunk_id: str) -> None:
+        self.chunks.pop(chunk_id, None)
+        self.vectors.pop(chunk_id, None)
+        self.index.remove(chunk_id)
+
+    async def ingest(
+        self,
+        document_id: str,
+        text: str,
+        embed: EmbedFunc,
+        embedding_model: str,
+        title: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+    ) -> IngestResult:
+        """ドキュメントを取り込む（本文が変わったチャンクのみエンベディングする）
+
+        Raises:
+            ValueError: コレクションの既存エンベディングと異なるモデルが指定された場合
+        """
+        if self.embedding_model and self.embedding_model != embedding_model:
+            raise ValueError(
+                f"コレクション '{self.name}' はモデル '{self.embedding_model}' でインデックスされています"
+            )
+        content_hash = text_hash(text)
+        existing = self.documents.get(document_id)
+        if existing and existing.content_hash == content_hash:
+            existing.title = title or existing.title
+            existing.metadata = metadata or existing.metadata
+            return IngestResult(document_id, len(existing.chunk_ids), 0, len(existing.chunk_ids), 0, unchanged=True)
+
+        bodies = chunk_bodies(text)
+        hashes = [text_hash(b) for b in bodies]
+        # 同じ本文のチャンクは（他のドキュメントのものも含め）エンベディングを再利用する
+        known = {chunk.text_hash: self.vectors[cid] for cid, chunk in self.chunks.items()}
+        missing = sorted({h: i for i, h in enumerate(hashes) if h not in known}.items(), key=lambda item: item[1])
+        texts = with_overlap(bodies)
+        new_vectors = await embed([texts[i] for _, i in missing]) if missing else []
+        for (h, _), vector in zip(missing, new_vectors):
+            known[h] = np.asarray(vector, dtype=np.float32)
+
+        old_ids = existing.chunk_ids if existing else []
+        removed = len({self.chunks[cid].text_hash for cid in old_ids} - set(hashes))
+        for chunk_id in old_ids:
+            self._remove_chunk(chunk_id)
+        chunk_ids = []
+        for position, (chunk, h) in enumerate(zip(bodies, hashes)):
+            chunk_id = f"{document_id}#{position}"
+            self.chunks[chunk_id] = ChunkRecord(chunk_id, document_id, position, chunk, h)
+            self.vectors[chunk_id] = known[h]
+            self.index.add(chunk_id, known[h])
+            chunk_ids.append(chunk_id)
+        self.documents[document_id] = DocumentRecord(
+            document_id=document_id,
+            title=title,
+            content_hash=content_hash,
+            chunk_ids=chunk_ids,
+            metadata=metadata or {},
+        )
+        self.embedding_model = embedding_model
+        return IngestResult(document_id, len(chunk_ids), len(missing), len(chunk_ids) - len(missing), removed)
+
+    def delete(self, document_id: str) -> bool:
+        """ドキュメントを削除する（存在しない場合はFalse）"""
+        record = self.documents.pop(document_id, None)
+        if record is None:
+            return False
+        for chunk_id in record.chunk_ids:
+            self._remove_chunk(chunk_id)
+        return True
+
+    # --- 検索 ---
+
+    def search(
+        self, query_vector: List[float], top_k: int, document_ids: Optional[List[str]] = None
+    ) -> List[Tuple[ChunkRecord, float]]:
+        """類似度の高い順にチャンクを返す"""
+        if not self.chunks:
+            return []
+        # ドキュメントを絞り込む場合は多めに取得してから除外する
+        k = top_k if not document_ids else min(len(self.chunks), top_k * 10)
+        results = []
+        allowed = set(document_ids) if document_ids else None
+        for chunk_id, score in self.index.search(query_vector, k):
+            chunk = self.chunks[chunk_id]
+            if allowed is None or chunk.document_id in allowed:
+                results.append((chunk, score))
+            if len(results) >= top_k:
+                break
+        return results
+
+
+class RagStore:
+    """コレクションの読み込みと保持"""
+
+    def __init__(self, root: str = RAG_INDEX_DIR) -> None:
+        self.root = root
+        self._collections: Dict[str, RagCollection] = {}
+        self._lock = threading.Lock()
+
+    def collection(self, name: str) -> RagCollection:
+        """コレクションを取得する（初回はディスクから読み込む）
+
+        Raises:
+            ValueError: コレクション名が不正な場合
+        """
+        if not _COLLECTION_PATTERN.match(name):
+            raise ValueError(f"不正なコレクション名です: '{name}'")
+        with self._lock:
+            collection = self._collections.get(name)
+            if collection is None:
+                collection = RagCollection(name, os.path.join(self.root, name))
+                collection.load()
+                self._collections[name] = collection
+            return collection
+
+
+# グローバルRAGストア
+rag_store = RagStore()
@@ -0,0 +1,116 @@
+"""
+参照画像キャッシュ
+
+画像合成などで繰り返し送信される参照画像（ブランド素材など）を Files API に一度だけアップロードし、
+コンテンツハッシュをキーにファイルハンドル（URI）をリクエスト間で再利用する。
+アップロードしたファイルは作成したAPIキーでのみ参照できるため、キャッシュはAPIキーごとに分ける。
+"""
+import io
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+from google.genai import types
+
+from backend.cache import LRUCache, SingleFlight
+from backend.client_pool import current_key
+from backend.config import REFERENCE_IMAGE_CACHE_SIZE, REFERENCE_IMAGE_TTL_SECONDS
+from backend.images import content_hash
+from backend.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ReferenceImage:
+    """アップロード済みの参照画像"""
+
+    content_hash: str
+    name: str
+    uri: str
+    mime_type: str
+    expires_at: float
+
+    @property
+    def expired(self) -> bool:
+        # 期限切れ直前のファイルを参照しないよう、余裕をもって失効扱いにする
+        return time.time() >= self.expires_at - 300
+
+    def to_part(self) -> types.Part:
+        return types.Part.from_uri(file_uri=self.uri, mime_type=self.mime_type)
+
+
+class ReferenceImageCache:
+    """コンテンツハッシュをキーに Files API のファイルハンドルを保持する"""
+
+    def __init__(self, max_entries: int = REFERENCE_IMAGE_CACHE_SIZE, ttl_seconds: int = REFERENCE_IMAGE_TTL_SECONDS) -> None:
+        # (APIキーID, コンテンツハッシュ) -> 参照画像
+        self._entries: LRUCache[ReferenceImage] = LRUCache(max_entries=max_entries)
+        self._inflight: SingleFlight[ReferenceImage] = SingleFlight()
+        self._ttl_seconds = ttl_seconds
+
+    async def _upload(self, client: Any, key: Tuple[Optional[str], str], data: bytes, mime_type: str) -> ReferenceImage:
+        with metrics.timer("reference_image_upload_seconds"):
+            uploaded = await client.aio.files.upload(
+                file=io.BytesIO(data),
+                config=types.UploadFileConfig(mime_type=mime_type, display_name=f"ref-{key[1]}"),
+            )
+        expires_at = time.time() + self._ttl_seconds
+        if getattr(uploaded, "expiration_time", None):
+            expires_at = min(expires_at, uploaded.expiration_time.timestamp())
+        reference = ReferenceImage(
+            content_hash=key[1],
+            name=uploaded.name,
+            uri=uploaded.uri,
+            mime_type=uploaded.mime_type or mime_type,
+            expires_at=expires_at,
+        )
+        self._entries.set(key, reference)
+        metrics.observe("reference_image_uploaded_bytes", len(data))
+        return reference
+
+    async def get_or_upload(self, client: Any, data: bytes, mime_type: str) -> ReferenceImage:
+        """参照画像を取得する（未アップロードまたは期限切れの場合はアップロードする）
+
+        同じ画像の同時リクエストではアップロードを1回にまとめる。
+        client_pool.session() でAPIキーが固定されている場合は、そのキーのファイルを使用する。
+
+        Args:
+            client: genai.Client
+            data: 画像のバイト列
+            mime_type: 画像のMIMEタイプ
+
+        Returns:
+            ReferenceImage: アップロード済みの参照画像
+        """
+        pinned = current_key()
+        key = (pinned.key_id if pinned else None, content_hash(data))
+        cached = self._entries.get(key)
+        if cached is not None and not cached.expired:
+            metrics.inc("reference_image_requests_total", result="hit")
+            metrics.observe("reference_image_bytes_saved", len(data))
+            return cached
+
+        if self._inflight.in_flight(key):
+            metrics.inc("reference_image_requests_total", result="shared")
+        else:
+            metrics.inc("reference_image_requests_total", result="miss")
+        return await self._inflight.run(key, lambda: self._upload(client, key, data, mime_type))
+
+    async def part(self, client: Any, data: bytes, mime_type: str) -> types.Part:
+        """参照画像のPartを作成する（アップロードに失敗した場合はインラインデータで送信する）"""
+        try:
+            return (await self.get_or_upload(client, data, mime_type)).to_part()
+        except Exception as e:
+            logger.warning(f"Reference image upload failed, falling back to inline data: {type(e).__name__}: {e}")
+            metrics.inc("reference_image_requests_total", result="inline_fallback")
+            return types.Part.from_bytes(data=data, mime_type=mime_type)
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュ統計を返す"""
+        return self._entries.stats()
+
+
+# グローバル参照画像キャッシュ
+reference_images = ReferenceImageCache()
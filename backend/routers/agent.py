@@ -2,10 +2,21 @@
 エージェント・ツールルーター
 """
 from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from backend.client import client
-from backend.config import DEFAULT_TEXT_MODEL, DEFAULT_ANALYSIS_MODEL
+from backend.concurrency import bounded_gather, upstream_slot
+from backend.config import (
+    DEFAULT_TEXT_MODEL,
+    DEFAULT_ANALYSIS_MODEL,
+    AGENT_RESEARCH_MAX_BRANCHES,
+    AGENT_RESEARCH_CONCURRENCY,
+)
+from backend.deadlines import apply_deadline, budget_model, budget_overrides
+from backend.http_transport import http_options_for
+from backend.metrics import metrics
+from backend.streaming import SSE_MEDIA_TYPE, STREAMING_HEADERS, sse_event
 
 router = APIRouter()
 
@@ -14,6 +25,7 @@ class AgentRequest(BaseModel):
     prompt: str
     tools: Optional[List[str]] = None  # 使用するツールのリスト
     model: Optional[str] = DEFAULT_ANALYSIS_MODEL
+    deadline_ms: Optional[int] = None  # 処理時間の上限（ミリ秒。X-Request-Deadline-Ms ヘッダーでも指定可）
 
 
 class AgentResponse(BaseModel):
@@ -22,6 +34,65 @@ class AgentResponse(BaseModel):
     model: str
 
 
+def _build_tools(tool_names: Optional[List[str]]) -> List[Dict[str, Any]]:
+    """ツール名のリストを組み込みツールの設定に変換する"""
+    import logging
+
+    logger = logging.getLogger(__name__)
+
+    # 利用可能なツールを設定
+    # 仕様: https://ai.google.dev/gemini-api/docs/gemini-3
+    # 組み込みツールは {"google_search": {}} の形式で指定
+    tools = []
+    for tool_name in tool_names or []:
+        if tool_name == "google_search":
+            tools.append({"google_search": {}})
+        elif tool_name == "google_maps":
+            # 注意: Gemini 3ではGoogle Mapsはまだサポートされていない
+            logger.warning("Google Maps tool is not yet supported in Gemini 3")
+        elif tool_name == "url_context":
+            tools.append({"url_context": {}})
+        elif tool_name == "code_execution":
+            tools.append({"code_execution": {}})
+        elif tool_name == "file_search":
+            tools.append({"file_search": {}})
+    return tools
+
+
+def _detect_tools_used(candidate: Any) -> List[str]:
+    """候補のメタデータとpartsから実際に使用されたツールを判定する"""
+    tools_used: List[str] = []
+    grounding = getattr(candidate, "grounding_metadata", None)
+    if grounding and (grounding.web_search_queries or grounding.grounding_chunks):
+        tools_used.append("google_search")
+    url_context = getattr(candidate, "url_context_metadata", None)
+    if url_context and url_context.url_metadata:
+        tools_used.append("url_context")
+    content = getattr(candidate, "content", None)
+    for part in (content.parts if content and content.parts else []):
+        if (part.executable_code or part.code_execution_result) and "code_execution" not in tools_used:
+            tools_used.append("code_execution")
+        elif part.function_call and part.function_call.name and part.function_call.name not in tools_used:
+            tools_used.append(part.function_call.name)
+    return tools_used
+
+
+def _enum_value(value: Any) -> Optional[str]:
+    """SDKの列挙値を文字列に変換する"""
+    if value is None:
+        return None
+    return getattr(value, "value", str(value))
+
+
+def _grounding_sources(grounding: Any) -> List[Dict[str, Optional[str]]]:
+    """グラウンディングメタデータから参照元（タイトル・URI）を取り出す"""
+    sources = []
+    for chunk in grounding.grounding_chunks or []:
+        if chunk.web and chunk.web.uri:
+            sources.append({"title": chunk.web.title, "uri": chunk.web.uri})
+    return sources
+
+
 @router.post("/chat", response_model=AgentResponse)
 async def agent_chat(request: AgentRequest):
     """エージェントチャット（ツール使用可能）"""
@@ -32,29 +103,18 @@ async def agent_chat(request: AgentRequest):
     
     try:
         logger.info(f"Agent chat request received: model={request.model}, tools={request.tools}")
+        apply_deadline(request.deadline_ms)
+        model = budget_model(request.model, "agent.chat")
+
+        tools = _build_tools(request.tools)
+        config = types.GenerateContentConfig(
+            tools=tools or None,
+            http_options=http_options_for("default"),
+            **budget_overrides(model),
+        )
         
-        # 利用可能なツールを設定
-        # 仕様: https://ai.google.dev/gemini-api/docs/gemini-3
-        # 組み込みツールは {"google_search": {}} の形式で指定
-        tools = []
-        if request.tools:
-            for tool_name in request.tools:
-                if tool_name == "google_search":
-                    tools.append({"google_search": {}})
-                elif tool_name == "google_maps":
-                    # 注意: Gemini 3ではGoogle Mapsはまだサポートされていない
-                    logger.warning("Google Maps tool is not yet supported in Gemini 3")
-                elif tool_name == "url_context":
-                    tools.append({"url_context": {}})
-                elif tool_name == "code_execution":
-                    tools.append({"code_execution": {}})
-                elif tool_name == "file_search":
-                    tools.append({"file_search": {}})
-
-        config = types.GenerateContentConfig(tools=tools) if tools else None
-        
-        response = client.models.generate_content(
-            model=request.model,
+        response = await client.aio.models.generate_content(
+            model=model,
             contents=request.prompt,
             config=config,
         )
@@ -87,19 +147,13 @@ async def agent_chat(request: AgentRequest):
                     if func_call.name not in tools_used:
                         tools_used.append(func_call.name)
         
-        # 組み込みツールが自動実行された場合、function_callsが空になる可能性がある
-        # この場合、リクエストで指定されたツールが実際に使用されたと判断
-        # （レスポンスに検索結果が含まれている場合など）
-        if not tools_used and request.tools:
-            # レスポンステキストに検索結果が含まれているか確認
-            # 組み込みツールが自動実行された場合、テキストに結果が含まれる
-            if hasattr(response, "text") and response.text:
-                response_text = response.text
-                # リクエストで指定されたツールを記録
-                # 注意: これは推測であり、実際にツールが使用されたかは保証されない
-                # ただし、組み込みツールが自動実行された場合、function_callsが空になることがある
-                tools_used = request.tools.copy()
-        
+        # 組み込みツールが自動実行された場合、function_callsが空になるため、
+        # グラウンディング・URLコンテキストのメタデータやコード実行のpartsから判定する
+        if hasattr(response, "candidates") and response.candidates:
+            for tool_name in _detect_tools_used(response.candidates[0]):
+                if tool_name not in tools_used:
+                    tools_used.append(tool_name)
+
         # テキストレスポンスを取得（まだ取得できていない場合）
         if not response_text:
             if hasattr(response, "text") and response.text:
@@ -112,12 +166,352 @@ async def agent_chat(request: AgentRequest):
             else:
                 response_text = "レスポンスを生成しました。"
 
-        logger.info(f"Agent chat completed: tools_used={tools_used}, model={request.model}")
+        logger.info(f"Agent chat completed: tools_used={tools_used}, model={model}")
         
         return AgentResponse(
-            response=response_text, tools_used=tools_used, model=request.model
+            response=response_text, tools_used=tools_used, model=model
         )
     except Exception as e:
         logger.error(f"Error in agent chat: {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+
+
+@router.post("/chat/stream")
+async def agent_chat_stream(request: AgentRequest):
+    """エージェントチャットのストリーミング（SSE）
+
+    生成途中のテキスト、グラウンディング情報、実行コードとその結果を
+    型付きのSSEイベントとして到着順に送信する。
+
+    イベント:
+        - text: {"text": 差分テキスト}
+        - grounding: {"queries": [...], "sources": [{"title", "uri"}]}（新規分のみ）
+        - url_context: {"urls": [{"url", "status"}]}
+        - code: {"language", "code"}
+        - code_result: {"outcome", "output"}
+        - tool_call: {"name", "arguments"}
+        - done: {"tools_used": [...], "model": ...}
+        - error: {"detail": ...}
+    """
+    import logging
+    import time
+    from google.genai import types
+
+    logger = logging.getLogger(__name__)
+    logger.info(f"Agent chat stream request received: model={request.model}, tools={request.tools}")
+    apply_deadline(request.deadline_ms)
+    model = budget_model(request.model, "agent.chat_stream")
+
+    tools = _build_tools(request.tools)
+    config = types.GenerateContentConfig(
+        tools=tools or None,
+        http_options=http_options_for("streaming"),
+        **budget_overrides(model),
+    )
+
+    async def event_stream():
+        started = time.perf_counter()
+        first_event_logged = False
+        tools_used: List[str] = []
+        seen_queries = set()
+        seen_sources = set()
+        seen_urls = set()
+        try:
+            stream = await client.aio.models.generate_content_stream(
+                model=model,
+                contents=request.prompt,
+                config=config,
+            )
+            async for chunk in stream:
+                if not chunk.candidates:
+                    continue
+                candidate = chunk.candidates[0]
+                events = []
+
+                parts = candidate.content.parts if candidate.content and candidate.content.parts else []
+                for part in parts:
+                    if part.thought:
+                        continue
+                    if part.text:
+                        events.append(("text", {"text": part.text}))
+                    if part.executable_code:
+                        events.append(
+                            (
+                                "code",
+                                {
+                                    "language": _enum_value(part.executable_code.language),
+                                    "code": part.executable_code.code,
+                                },
+                            )
+                        )
+                    if part.code_execution_result:
+                        events.append(
+                            (
+                                "code_result",
+                                {
+                                    "outcome": _enum_value(part.code_execution_result.outcome),
+                                    "output": part.code_execution_result.output,
+                                },
+                            )
+                        )
+                    if part.function_call:
+                        events.append(
+                            (
+                                "tool_call",
+                                {"name": part.function_call.name, "arguments": part.function_call.args or {}},
+                            )
+                        )
+
+                grounding = candidate.grounding_metadata
+                if grounding:
+                    new_queries = [q for q in grounding.web_search_queries or [] if q not in seen_queries]
+                    new_sources = [src for src in _grounding_sources(grounding) if src["uri"] not in seen_sources]
+                    seen_queries.update(new_queries)
+                    seen_sources.update(src["uri"] for src in new_sources)
+                    if new_queries or new_sources:
+                        events.append(("grounding", {"queries": new_queries, "sources": new_sources}))
+
+                url_context = candidate.url_context_metadata
+                if url_context and url_context.url_metadata:
+                    new_urls = [
+                        {"url": meta.retrieved_url, "status": _enum_value(meta.url_retrieval_status)}
+                        for meta in url_context.url_metadata
+                        if meta.retrieved_url not in seen_urls
+                    ]
+                    seen_urls.update(url["url"] for url in new_urls)
+                    if new_urls:
+                        events.append(("url_context", {"urls": new_urls}))
+
+                for tool_name in _detect_tools_used(candidate):
+                    if tool_name not in tools_used:
+                        tools_used.append(tool_name)
+
+                for event, data in events:
+                    if not first_event_logged:
+                        first_event_logged = True
+                        metrics.observe("agent_stream_first_event_seconds", time.perf_counter() - started)
+                    yield sse_event(event, data)
+
+            logger.info(f"Agent chat stream completed: tools_used={tools_used}, elapsed={time.perf_counter() - started:.2f}s")
+            yield sse_event("done", {"tools_used": tools_used, "model": model})
+        except Exception as e:
+            logger.error(f"Error in agent chat stream: {type(e).__name__}: {str(e)}", exc_info=True)
+            yield sse_event("error", {"detail": str(e)})
+
+    return StreamingResponse(event_stream(), media_type=SSE_MEDIA_TYPE, headers=STREAMING_HEADERS)
+
+
+class ResearchRequest(BaseModel):
+    prompt: str
+    model: Optional[str] = DEFAULT_ANALYSIS_MODEL  # 統合回答に使用するモデル
+    branch_model: Optional[str] = DEFAULT_TEXT_MODEL  # 分解・サブクエリに使用するモデル
+    max_branches: Optional[int] = None  # 未指定時は AGENT_RESEARCH_MAX_BRANCHES（指定値もこれを上限とする）
+    concurrency: Optional[int] = None  # 未指定時は AGENT_RESEARCH_CONCURRENCY（指定値もこれを上限とする）
+    deadline_ms: Optional[int] = None  # 処理時間の上限（ミリ秒。X-Request-Deadline-Ms ヘッダーでも指定可）
+
+
+class ResearchSource(BaseModel):
+    index: int
+    title: Optional[str] = None
+    uri: str
+
+
+class ResearchBranch(BaseModel):
+    question: str
+    answer: Optional[str] = None
+    source_indices: List[int] = []
+    latency_ms: float
+    error: Optional[str] = None
+
+
+class ResearchResponse(BaseModel):
+    response: str
+    branches: List[ResearchBranch]
+    sources: List[ResearchSource]
+    model: str
+    decompose_latency_ms: float
+    branches_latency_ms: float
+    synthesis_latency_ms: float
+    total_latency_ms: float
+
+
+async def _decompose_question(prompt: str, model: str, max_branches: int) -> List[str]:
+    """リサーチ質問を独立して調査可能なサブ質問に分解する"""
+    from google.genai import types
+    import json
+
+    schema = {
+        "type": "object",
+        "properties": {
+            "sub_questions": {
+                "type": "array",
+                "items": {"type": "string"},
+                "minItems": 1,
+                "maxItems": max_branches,
+            }
+        },
+        "required": ["sub_questions"],
+    }
+    model = budget_model(model, "agent.research")
+    async with upstream_slot("agent_research"):
+        response = await client.aio.models.generate_content(
+            model=model,
+            contents=(
+                "次のリサーチ質問に答えるために、互いに独立してWeb検索で調査できるサブ質問に分解してください。"
+                f"サブ質問は最大{max_branches}個とし、重複させないでください。\n\n質問: {prompt}"
+            ),
+            config=types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_json_schema=schema,
+                http_options=http_options_for("default"),
+                **budget_overrides(model),
+            ),
+        )
+    questions = [q.strip() for q in json.loads(response.text).get("sub_questions", []) if q and q.strip()]
+    return questions[:max_branches] or [prompt]
+
+
+async def _run_branch(question: str, model: str) -> Dict[str, Any]:
+    """サブ質問をGoogle検索でグラウンディングして回答する"""
+    import time
+    from google.genai import types
+
+    start = time.perf_counter()
+    try:
+        model = budget_model(model, "agent.research")
+        async with upstream_slot("agent_research"):
+            response = await client.aio.models.generate_content(
+                model=model,
+                contents=question,
+                config=types.GenerateContentConfig(
+                    tools=[{"google_search": {}}],
+                    http_options=http_options_for("default"),
+                    **budget_overrides(model),
+                ),
+            )
+        sources = []
+        if response.candidates and response.candidates[0].grounding_metadata:
+            sources = _grounding_sources(response.candidates[0].grounding_metadata)
+        return {
+            "question": question,
+            "answer": response.text,
+            "sources": sources,
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "error": None,
+        }
+    except Exception as e:
+        return {
+            "question": question,
+            "answer": None,
+            "sources": [],
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "error": f"{type(e).__name__}: {e}",
+        }
+
+
+@router.post("/research", response_model=ResearchResponse)
+async def agent_research(request: ResearchRequest):
+    """リサーチモード（サブクエリの並列実行）
+
+    質問をサブ質問に分解し、それぞれをGoogle検索でグラウンディングした呼び出しとして
+    同時実行数の上限付きで並列に実行した後、引用を統合して最終回答を生成する。
+    全体の所要時間はサブクエリの合計ではなく、最も遅いサブクエリに依存する。
+    期限（deadline_ms）までの残り時間が少ない場合は、各段階を軽量なモデルで実行する。
+    """
+    import logging
+    import time
+    from google.genai import types
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        started = time.perf_counter()
+        apply_deadline(request.deadline_ms)
+        # クライアント指定値は設定値を上限とする（サブクエリ数・同時実行数を無制限に増やせないようにする）
+        max_branches = max(1, min(request.max_branches or AGENT_RESEARCH_MAX_BRANCHES, AGENT_RESEARCH_MAX_BRANCHES))
+        concurrency = max(1, min(request.concurrency or AGENT_RESEARCH_CONCURRENCY, AGENT_RESEARCH_CONCURRENCY))
+        logger.info(f"Agent research request received: model={request.model}, max_branches={max_branches}, concurrency={concurrency}")
+
+        questions = await _decompose_question(request.prompt, request.branch_model, max_branches)
+        decompose_latency_ms = (time.perf_counter() - started) * 1000
+
+        branches_start = time.perf_counter()
+        results = await bounded_gather(
+            (_run_branch(question, request.branch_model) for question in questions), limit=concurrency
+        )
+        branches_latency_ms = (time.perf_counter() - branches_start) * 1000
+
+        # 引用をURIで統合し、通し番号を振る
+        sources: List[ResearchSource] = []
+        source_index: Dict[str, int] = {}
+        branches: List[ResearchBranch] = []
+        for result in results:
+            indices = []
+            for src in result["sources"]:
+                if src["uri"] not in source_index:
+                    source_index[src["uri"]] = len(sources) + 1
+                    sources.append(ResearchSource(index=len(sources) + 1, title=src["title"], uri=src["uri"]))
+                if source_index[src["uri"]] not in indices:
+                    indices.append(source_index[src["uri"]])
+            branches.append(
+                ResearchBranch(
+                    question=result["question"],
+                    answer=result["answer"],
+                    source_indices=indices,
+                    latency_ms=result["latency_ms"],
+                    error=result["error"],
+                )
+            )
+            metrics.observe("agent_research_branch_seconds", result["latency_ms"] / 1000, ok=result["error"] is None)
+
+        succeeded = [b for b in branches if b.answer]
+        if not succeeded:
+            raise HTTPException(status_code=502, detail="すべてのサブクエリが失敗しました")
+
+        findings = "\n\n".join(
+            f"### {b.question}\n参照: {', '.join(f'[{i}]' for i in b.source_indices) or 'なし'}\n{b.answer}"
+            for b in succeeded
+        )
+        source_list = "\n".join(f"[{src.index}] {src.title or ''} {src.uri}" for src in sources)
+        synthesis_prompt = (
+            f"以下の調査結果をもとに、元の質問に対する包括的な回答を作成してください。"
+            f"根拠となる記述には [番号] の形式で参照元を引用してください。\n\n"
+            f"元の質問: {request.prompt}\n\n調査結果:\n{findings}\n\n参照元:\n{source_list}"
+        )
+
+        # 分解・サブクエリの後の残り時間が少ない場合は軽量なモデルで統合する
+        model = budget_model(request.model, "agent.research")
+        synthesis_start = time.perf_counter()
+        async with upstream_slot("agent_research"):
+            synthesis = await client.aio.models.generate_content(
+                model=model,
+                contents=synthesis_prompt,
+                config=types.GenerateContentConfig(
+                    http_options=http_options_for("default"),
+                    **budget_overrides(model),
+                ),
+            )
+        synthesis_latency_ms = (time.perf_counter() - synthesis_start) * 1000
+        total_latency_ms = (time.perf_counter() - started) * 1000
+
+        logger.info(
+            f"Agent research completed: branches={len(branches)}, failed={len(branches) - len(succeeded)}, "
+            f"sources={len(sources)}, total_latency_ms={total_latency_ms:.1f}"
+        )
+
+        return ResearchResponse(
+            response=synthesis.text or "",
+            branches=branches,
+            sources=sources,
+            model=model,
+            decompose_latency_ms=decompose_latency_ms,
+            branches_latency_ms=branches_latency_ms,
+            synthesis_latency_ms=synthesis_latency_ms,
+            total_latency_ms=total_latency_ms,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in agent research: {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
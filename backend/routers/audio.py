@@ -1,15 +1,48 @@
 """
 音声生成・理解ルーター
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File
-from pydantic import BaseModel
-from typing import Optional
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Optional, Tuple, Any, Dict
+from backend.audio_utils import (
+    decode_to_pcm,
+    is_raw_pcm,
+    merge_overlap,
+    parse_pcm_mime,
+    pcm_to_wav,
+    plan_segments,
+    slice_pcm,
+    split_text_for_tts,
+    wav_header,
+)
 from backend.client import client
-from backend.config import DEFAULT_TEXT_MODEL
+from backend.concurrency import upstream_slot
+from backend.config import (
+    DEFAULT_TEXT_MODEL,
+    TTS_CHUNK_MAX_CHARS,
+    TTS_FIRST_CHUNK_MAX_CHARS,
+    TTS_STREAM_CONCURRENCY,
+    TRANSCRIBE_SEGMENT_SECONDS,
+    TRANSCRIBE_OVERLAP_SECONDS,
+    TRANSCRIBE_CONCURRENCY,
+)
+from backend.http_transport import http_options_for
+from backend.metrics import metrics
+from backend.serialization import trusted_response
+from backend.streaming import NDJSON_MEDIA_TYPE, STREAMING_HEADERS, ndjson_line
+from backend.uploads import remove_quietly, spool_upload
 import base64
 
 router = APIRouter()
 
+# 区間長・重複秒数として指定できる範囲（極端に短い区間で上流呼び出しが膨らむのを防ぐ）
+_MIN_SEGMENT_SECONDS = 10.0
+_MAX_SEGMENT_SECONDS = 600.0
+_MAX_OVERLAP_SECONDS = 30.0
+# 長文TTSのチャンク文字数の下限（極端に小さいチャンクで上流呼び出しが膨らむのを防ぐ）
+_MIN_TTS_CHUNK_CHARS = 20
+
 
 class AudioGenerateRequest(BaseModel):
     text: str
@@ -22,6 +55,34 @@ class AudioGenerateResponse(BaseModel):
     model: str
 
 
+def _speech_config(voice: Optional[str]) -> Any:
+    """音声設定を作成する"""
+    from google.genai import types
+
+    return types.SpeechConfig(
+        voice_config=types.VoiceConfig(
+            prebuilt_voice_config=types.PrebuiltVoiceConfig(
+                voice_name=voice if voice and voice != "default" else "Kore"
+            )
+        )
+    )
+
+
+def _extract_audio(response: Any) -> Tuple[Optional[bytes], str]:
+    """レスポンスから音声データとMIMEタイプを取得する"""
+    parts = []
+    if hasattr(response, "candidates") and response.candidates:
+        candidate = response.candidates[0]
+        if hasattr(candidate, "content") and hasattr(candidate.content, "parts"):
+            parts = candidate.content.parts or []
+    elif hasattr(response, "parts"):
+        parts = response.parts or []
+    for part in parts:
+        if hasattr(part, "inline_data") and part.inline_data:
+            return part.inline_data.data, part.inline_data.mime_type or "audio/L16;codec=pcm;rate=24000"
+    return None, ""
+
+
 @router.post("/generate", response_model=AudioGenerateResponse)
 async def generate_audio(request: AudioGenerateRequest):
     """音声生成（TTS）"""
@@ -37,21 +98,15 @@ async def generate_audio(request: AudioGenerateRequest):
         # TTSモデルでは、テキストをそのまま渡す（プロンプトは不要）
         # 注意: TTSモデルは現在、APIキーの制限やモデルの可用性により動作しない可能性があります
         try:
-            # 音声設定を追加
-            speech_config = types.SpeechConfig(
-                voice_config=types.VoiceConfig(
-                    prebuilt_voice_config=types.PrebuiltVoiceConfig(
-                        voice_name=request.voice if request.voice != "default" else "Kore"
-                    )
-                )
-            )
+            speech_config = _speech_config(request.voice)
             
-            response = client.models.generate_content(
+            response = await client.aio.models.generate_content(
                 model=request.model,
                 contents=request.text,  # TTSモデルでは、テキストをそのまま渡す
                 config=types.GenerateContentConfig(
                     response_modalities=["AUDIO"],
                     speech_config=speech_config,
+                    http_options=http_options_for("media"),
                 ),
             )
         except Exception as tts_error:
@@ -60,33 +115,25 @@ async def generate_audio(request: AudioGenerateRequest):
             if "TTS" in error_msg or "audio" in error_msg.lower():
                 logger.warning(f"TTS model error (may require special API access): {error_msg}")
                 # TTSモデルが利用できない場合は、プレースホルダーURLを返す
-                return AudioGenerateResponse(
+                return trusted_response(
+                    AudioGenerateResponse,
                     audio_url="https://example.com/generated-audio.mp3",
                     model=request.model
                 )
             raise
         
         # レスポンスから音声データを取得
-        audio_data = None
-        if hasattr(response, "candidates") and response.candidates:
-            candidate = response.candidates[0]
-            if hasattr(candidate, "content") and hasattr(candidate.content, "parts"):
-                for part in candidate.content.parts:
-                    if hasattr(part, "inline_data") and part.inline_data:
-                        audio_data = part.inline_data.data
-                        break
-        elif hasattr(response, "parts"):
-            for part in response.parts:
-                if hasattr(part, "inline_data") and part.inline_data:
-                    audio_data = part.inline_data.data
-                    break
+        audio_data, audio_mime = _extract_audio(response)
         
         # 実際の実装では、生成された音声データを保存してURLを返す
         # ここでは簡易的にbase64エンコードされたデータを返す
         if audio_data:
-            # 音声データをbase64エンコードして返す（実際の実装ではファイルに保存）
-            import base64
-            audio_url = f"data:audio/mpeg;base64,{base64.b64encode(audio_data).decode('utf-8')}"
+            # TTSモデルは生PCM（audio/L16）を返すため、ブラウザで再生できるようWAVに変換する
+            if is_raw_pcm(audio_mime):
+                rate, channels = parse_pcm_mime(audio_mime)
+                audio_data = pcm_to_wav(audio_data, rate, channels)
+                audio_mime = "audio/wav"
+            audio_url = f"data:{audio_mime};base64,{base64.b64encode(audio_data).decode('utf-8')}"
         else:
             # 音声データが取得できない場合はプレースホルダー
             logger.warning("Audio data not found in response, returning placeholder URL")
@@ -94,7 +141,8 @@ async def generate_audio(request: AudioGenerateRequest):
         
         logger.info(f"Audio generation completed: model={request.model}")
         
-        return AudioGenerateResponse(
+        return trusted_response(
+            AudioGenerateResponse,
             audio_url=audio_url, model=request.model
         )
     except Exception as e:
@@ -102,6 +150,119 @@ async def generate_audio(request: AudioGenerateRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class AudioStreamRequest(BaseModel):
+    text: str
+    voice: Optional[str] = "default"
+    model: Optional[str] = "gemini-2.5-flash-preview-tts"
+    max_chunk_chars: Optional[int] = Field(None, ge=_MIN_TTS_CHUNK_CHARS, le=TTS_CHUNK_MAX_CHARS)  # 未指定時は TTS_CHUNK_MAX_CHARS
+    concurrency: Optional[int] = Field(None, ge=1, le=TTS_STREAM_CONCURRENCY)  # 未指定時は TTS_STREAM_CONCURRENCY
+
+
+async def _synthesize_once(text: str, voice: Optional[str], model: str) -> Tuple[bytes, str]:
+    """1チャンク分の音声を合成する"""
+    from google.genai import types
+
+    async with upstream_slot("audio_stream"):
+        response = await client.aio.models.generate_content(
+            model=model,
+            contents=text,
+            config=types.GenerateContentConfig(
+                response_modalities=["AUDIO"],
+                speech_config=_speech_config(voice),
+                http_options=http_options_for("media"),
+            ),
+        )
+    audio_data, audio_mime = _extract_audio(response)
+    if not audio_data:
+        raise ValueError("Audio data not found in response")
+    return audio_data, audio_mime
+
+
+async def _synthesize_chunk(text: str, voice: Optional[str], model: str, retries: int = 1) -> Tuple[bytes, str]:
+    """1チャンク分の音声を合成する（失敗時は retries 回まで再試行し、最後の失敗は送出する）"""
+    for _ in range(retries):
+        try:
+            return await _synthesize_once(text, voice, model)
+        except Exception:
+            continue
+    return await _synthesize_once(text, voice, model)
+
+
+@router.post("/generate/stream")
+async def generate_audio_stream(request: AudioStreamRequest):
+    """長文TTSのストリーミング
+
+    テキストを文の境界でチャンクに分割して並列に合成し、先頭から順に
+    WAV（16bit PCM）としてストリーミングする。最初のチャンクは小さく保つため、
+    再生開始までの時間はテキストの長さに依存しない。最初のチャンクの合成に失敗した場合や
+    PCM以外の形式が返された場合は、レスポンスを開始する前に 500 を返す。
+    """
+    import asyncio
+    import logging
+    import time
+
+    logger = logging.getLogger(__name__)
+
+    chunks = split_text_for_tts(
+        request.text,
+        max_chars=request.max_chunk_chars or TTS_CHUNK_MAX_CHARS,
+        first_chunk_max_chars=min(TTS_FIRST_CHUNK_MAX_CHARS, request.max_chunk_chars or TTS_CHUNK_MAX_CHARS),
+    )
+    if not chunks:
+        raise HTTPException(status_code=400, detail="テキストが空です")
+    concurrency = request.concurrency or TTS_STREAM_CONCURRENCY
+    logger.info(f"Audio stream request received: model={request.model}, text_length={len(request.text)}, chunks={len(chunks)}")
+
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(text: str) -> Tuple[bytes, str]:
+        async with semaphore:
+            return await _synthesize_chunk(text, request.voice, request.model)
+
+    # 先頭から順にタスクを作成するため、セマフォは先頭のチャンクから割り当てられる
+    tasks = [asyncio.create_task(run(text)) for text in chunks]
+
+    # 最初のチャンクはレスポンスの開始前に待ち、失敗やPCM以外の形式はHTTPエラーとして返す
+    try:
+        first_data, first_mime = await tasks[0]
+        if not is_raw_pcm(first_mime):
+            # PCM以外の形式はチャンクを連結できない
+            raise ValueError(f"Unsupported audio format for streaming: {first_mime}")
+    except Exception as e:
+        for task in tasks:
+            task.cancel()
+        logger.error(f"Error in audio stream: {type(e).__name__}: {str(e)}", exc_info=True)
+        metrics.inc("tts_stream_errors_total")
+        raise HTTPException(status_code=500, detail=str(e))
+    metrics.observe("tts_stream_first_audio_seconds", time.perf_counter() - started)
+    rate, channels = parse_pcm_mime(first_mime)
+
+    async def audio_stream():
+        try:
+            yield wav_header(rate, channels)
+            yield first_data
+            for task in tasks[1:]:
+                audio_data, audio_mime = await task
+                if not is_raw_pcm(audio_mime):
+                    raise ValueError(f"Unsupported audio format for streaming: {audio_mime}")
+                yield audio_data
+            logger.info(f"Audio stream completed: chunks={len(chunks)}, elapsed={time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            # ヘッダー送信後はHTTPエラーを返せないため、ログに記録してストリームを終了する
+            logger.error(f"Error in audio stream: {type(e).__name__}: {str(e)}", exc_info=True)
+            metrics.inc("tts_stream_errors_total")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        audio_stream(),
+        media_type="audio/wav",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "X-Audio-Chunks": str(len(chunks))},
+    )
+
+
 class AudioTranscribeRequest(BaseModel):
     language: Optional[str] = "ja"
 
@@ -116,13 +277,15 @@ async def transcribe_audio(
     request: AudioTranscribeRequest, file: UploadFile = File(...)
 ):
     """音声の文字起こし"""
+    from google.genai import types
+
     try:
         # 音声ファイルを読み込む
         audio_data = await file.read()
         audio_base64 = base64.b64encode(audio_data).decode("utf-8")
 
         # Gemini APIで音声を文字起こし
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model=DEFAULT_TEXT_MODEL,
             contents=[
                 {
@@ -136,9 +299,121 @@ async def transcribe_audio(
                     ]
                 }
             ],
+            config=types.GenerateContentConfig(http_options=http_options_for("media")),
         )
 
         return AudioTranscribeResponse(text=response.text, language=request.language)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+
+@router.post("/transcribe/long")
+async def transcribe_long_audio(
+    file: UploadFile = File(...),
+    language: str = Form("ja"),
+    model: str = Form(DEFAULT_TEXT_MODEL),
+    segment_seconds: Optional[float] = Form(None, ge=_MIN_SEGMENT_SECONDS, le=_MAX_SEGMENT_SECONDS),
+    overlap_seconds: Optional[float] = Form(None, ge=0, le=_MAX_OVERLAP_SECONDS),
+):
+    """長時間音声の分割並列文字起こし（NDJSON）
+
+    アップロードをディスクに書き出してデコードし、無音付近で重複付きの区間に分割して
+    並列に文字起こしする。区間の結果は完了順に送信し、最後に重複を除去して連結した全文を送信する。
+
+    イベント:
+        - {"type": "plan", "duration": 秒, "segments": [{"index", "start", "end"}]}
+        - {"type": "segment", "index", "start", "end", "text", "latency_ms"}（完了順）
+        - {"type": "segment_error", "index", "start", "end", "detail"}
+        - {"type": "done", "text": 全文, "segments": [{"index", "start", "end", "text"}], "language"}
+        - {"type": "error", "detail": ...}
+    """
+    import asyncio
+    import logging
+    import time
+    from google.genai import types
+
+    logger = logging.getLogger(__name__)
+    logger.info(f"Long audio transcription request received: filename={file.filename}, model={model}")
+
+    segment_length = segment_seconds or TRANSCRIBE_SEGMENT_SECONDS
+    overlap = TRANSCRIBE_OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds
+    if overlap >= segment_length:
+        raise HTTPException(status_code=400, detail="overlap_seconds は segment_seconds より小さい値を指定してください")
+
+    path = await spool_upload(file)
+    try:
+        pcm, rate = await decode_to_pcm(path)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        remove_quietly(path)
+    if not pcm:
+        raise HTTPException(status_code=400, detail="音声データが空です")
+
+    segments = await asyncio.to_thread(plan_segments, pcm, rate, segment_length, overlap)
+    duration = len(pcm) / 2 / rate
+    logger.info(f"Long audio planned: duration={duration:.1f}s, segments={len(segments)}")
+    instruction = f"この音声を言語コード「{language}」で文字起こししてください。文字起こしのテキストのみを出力してください。"
+
+    async def transcribe_segment(index: int, start: float, end: float) -> Dict[str, Any]:
+        began = time.perf_counter()
+        try:
+            wav = pcm_to_wav(slice_pcm(pcm, rate, start, end), rate)
+            async with upstream_slot("audio_transcribe"):
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=[instruction, types.Part.from_bytes(data=wav, mime_type="audio/wav")],
+                    config=types.GenerateContentConfig(http_options=http_options_for("media")),
+                )
+            return {"type": "segment", "index": index, "start": start, "end": end, "text": (response.text or "").strip(),
+                    "latency_ms": (time.perf_counter() - began) * 1000}
+        except Exception as e:
+            return {"type": "segment_error", "index": index, "start": start, "end": end, "detail": f"{type(e).__name__}: {e}"}
+
+    async def event_stream():
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(TRANSCRIBE_CONCURRENCY)
+
+        async def bounded(index: int, start: float, end: float) -> Dict[str, Any]:
+            async with semaphore:
+                return await transcribe_segment(index, start, end)
+
+        tasks = [asyncio.create_task(bounded(i, start, end)) for i, (start, end) in enumerate(segments)]
+        try:
+            yield ndjson_line({
+                "type": "plan",
+                "duration": duration,
+                "segments": [{"index": i, "start": start, "end": end} for i, (start, end) in enumerate(segments)],
+            })
+            results: Dict[int, Dict[str, Any]] = {}
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                results[result["index"]] = result
+                metrics.inc("transcribe_segments_total", result=result["type"])
+                yield ndjson_line(result)
+
+            # 区間の重複部分を除去して連結する
+            texts = [results[i].get("text", "") for i in range(len(segments))]
+            for i in range(1, len(texts)):
+                if texts[i - 1] and texts[i]:
+                    texts[i - 1], texts[i] = merge_overlap(texts[i - 1], texts[i])
+            stitched = [
+                {"index": i, "start": start, "end": end, "text": texts[i]}
+                for i, (start, end) in enumerate(segments)
+            ]
+            logger.info(f"Long audio transcription completed: segments={len(segments)}, elapsed={time.perf_counter() - started:.2f}s")
+            yield ndjson_line({
+                "type": "done",
+                "text": "\n".join(t for t in texts if t),
+                "segments": stitched,
+                "language": language,
+            })
+        except Exception as e:
+            logger.error(f"Error in long audio transcription: {type(e).__name__}: {str(e)}", exc_info=True)
+            yield ndjson_line({"type": "error", "detail": str(e)})
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(event_stream(), media_type=NDJSON_MEDIA_TYPE, headers=STREAMING_HEADERS)
@@ -1,12 +1,30 @@
 """
 ドキュメント理解ルーター
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from dataclasses import dataclass
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, List, Optional
 from backend.client import client
-from backend.config import DEFAULT_TEXT_MODEL, DEFAULT_ANALYSIS_MODEL
-import base64
+from backend.concurrency import upstream_slot
+from backend.config import (
+    DEFAULT_TEXT_MODEL,
+    DEFAULT_ANALYSIS_MODEL,
+    DOCUMENT_BATCH_CONCURRENCY,
+    DOCUMENT_BATCH_MAX_FILE_BYTES,
+    DOCUMENT_BATCH_MAX_FILES,
+    DOCUMENT_BATCH_MAX_RETRIES,
+    DOCUMENT_BATCH_RETRY_BASE_SECONDS,
+)
+from backend.documents import content_parts, extract_document, guess_mime_type
+from backend.http_transport import http_options_for
+from backend.metrics import metrics
+from backend.streaming import CleanupStreamingResponse, NDJSON_MEDIA_TYPE, STREAMING_HEADERS, ndjson_line
+from backend.uploads import remove_quietly, spool_upload
+import httpx
+import os
+import zipfile
+from google.genai import types
 
 router = APIRouter()
 
@@ -20,6 +38,7 @@ class DocumentAnalyzeResponse(BaseModel):
     analysis: str
     model: str
     page_count: Optional[int] = None
+    extraction: Optional[str] = None  # text / docx / pdf / binary（ローカルでの抽出方法）
 
 
 @router.post("/analyze", response_model=DocumentAnalyzeResponse)
@@ -28,41 +47,237 @@ async def analyze_document(
 ):
     """ドキュメント（PDF等）の理解・分析"""
     try:
-        # ドキュメントを読み込む
+        # ドキュメントを読み込み、テキストをローカルで抽出する（抽出できない部分のみバイナリで送る）
         document_data = await file.read()
-        document_base64 = base64.b64encode(document_data).decode("utf-8")
-
-        # MIMEタイプの判定
-        mime_type = file.content_type or "application/pdf"
-        if file.filename:
-            if file.filename.endswith(".pdf"):
-                mime_type = "application/pdf"
-            elif file.filename.endswith(".docx"):
-                mime_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-            elif file.filename.endswith(".txt"):
-                mime_type = "text/plain"
+        mime_type = guess_mime_type(file.filename or "", file.content_type)
+        extracted = await extract_document(document_data, file.filename or "", file.content_type)
 
         # Gemini APIでドキュメントを分析
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model=request.model,
-            contents=[
-                {
-                    "parts": [
-                        {"text": request.prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": mime_type,
-                                "data": document_base64,
-                            }
-                        },
-                    ]
-                }
-            ],
+            contents=[request.prompt, *content_parts(extracted, mime_type)],
+            config=types.GenerateContentConfig(http_options=http_options_for("media")),
         )
 
         return DocumentAnalyzeResponse(
-            analysis=response.text, model=request.model, page_count=None
+            analysis=response.text,
+            model=request.model,
+            page_count=extracted.page_count,
+            extraction=extracted.method,
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@dataclass
+class _BatchItem:
+    """バッチ分析の1ファイル（ディスク上のファイル、またはアーカイブ内のエントリ）"""
+
+    index: int
+    filename: str
+    content_type: Optional[str]
+    path: str
+    size: int
+    member: Optional[str] = None  # アーカイブ内のパス
+
+    def read(self) -> bytes:
+        if self.member is None:
+            with open(self.path, "rb") as f:
+                return f.read()
+        with zipfile.ZipFile(self.path) as archive:
+            return archive.read(self.member)
+
+
+def _archive_items(path: str, start_index: int) -> List[_BatchItem]:
+    """ZIPアーカイブ内のファイルを列挙する（ディレクトリと隠しファイルは除く）"""
+    items = []
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            name = info.filename
+            basename = name.rsplit("/", 1)[-1]
+            if info.is_dir() or not basename or basename.startswith(".") or name.startswith("__MACOSX/"):
+                continue
+            items.append(_BatchItem(
+                index=start_index + len(items),
+                filename=name,
+                content_type=None,
+                path=path,
+                size=info.file_size,
+                member=name,
+            ))
+    return items
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """再試行で成功する見込みのあるエラーかどうか
+
+    タイムアウト・レート制限・サーバーエラーのAPIエラーと、接続・タイムアウトなどの通信エラーのみ再試行する。
+    リクエスト自体の誤りやファイルの不備、想定外の例外は再試行しても結果が変わらないため再試行しない。
+    """
+    from google.genai import errors
+
+    if isinstance(error, errors.APIError):
+        return error.code in (408, 429) or error.code >= 500
+    return isinstance(error, (httpx.TransportError, httpx.TimeoutException))
+
+
+@router.post("/analyze/batch")
+async def analyze_documents_batch(
+    prompt: str = Form(...),
+    files: Optional[List[UploadFile]] = File(None),
+    archive: Optional[UploadFile] = File(None),
+    model: str = Form(DEFAULT_ANALYSIS_MODEL),
+    concurrency: Optional[int] = Form(None),
+    max_retries: Optional[int] = Form(None),
+):
+    """複数ドキュメントのバッチ分析（NDJSON）
+
+    アップロード（files の複数指定、または archive のZIP）をディスクに書き出し、同じ prompt で各ファイルを分析する。
+    同時に処理するファイル数を制限し、メモリに保持するのは処理中のファイルのみとする。
+    一時的なエラー（429・5xx・タイムアウト）は指数バックオフで再試行し、ファイルごとの結果を完了順に送信する。
+
+    イベント:
+        - {"type": "plan", "files": [{"index", "filename", "size"}]}
+        - {"type": "result", "index", "filename", "analysis", "page_count", "extraction", "attempts", "latency_ms"}（完了順）
+        - {"type": "file_error", "index", "filename", "detail", "attempts"}
+        - {"type": "done", "succeeded", "failed", "elapsed_ms"}
+        - {"type": "error", "detail": ...}
+    """
+    import asyncio
+    import logging
+    import random
+    import time
+
+    logger = logging.getLogger(__name__)
+    logger.info(
+        f"Document batch request received: files={len(files or [])}, archive={archive.filename if archive else None}, model={model}"
+    )
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="files または archive を指定してください")
+
+    limit = max(1, min(concurrency or DOCUMENT_BATCH_CONCURRENCY, DOCUMENT_BATCH_CONCURRENCY))
+    retries = DOCUMENT_BATCH_MAX_RETRIES if max_retries is None else max(0, min(max_retries, DOCUMENT_BATCH_MAX_RETRIES))
+
+    spooled: List[str] = []
+    items: List[_BatchItem] = []
+
+    def remove_spooled() -> None:
+        for path in spooled:
+            remove_quietly(path)
+
+    try:
+        for upload in files or []:
+            path = await spool_upload(upload)
+            spooled.append(path)
+            items.append(_BatchItem(
+                index=len(items),
+                filename=upload.filename or f"document_{len(items)}",
+                content_type=upload.content_type,
+                path=path,
+                size=await asyncio.to_thread(os.path.getsize, path),
+            ))
+        if archive is not None:
+            path = await spool_upload(archive)
+            spooled.append(path)
+            try:
+                items.extend(await asyncio.to_thread(_archive_items, path, len(items)))
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="archive はZIP形式のファイルを指定してください")
+        if not items:
+            raise HTTPException(status_code=400, detail="分析するファイルがありません")
+        if len(items) > DOCUMENT_BATCH_MAX_FILES:
+            raise HTTPException(status_code=400, detail=f"ファイル数が上限（{DOCUMENT_BATCH_MAX_FILES}件）を超えています")
+    except BaseException:
+        remove_spooled()
+        raise
+
+    async def analyze_item(item: _BatchItem) -> Dict[str, Any]:
+        began = time.perf_counter()
+        attempts = 0
+        try:
+            if item.size > DOCUMENT_BATCH_MAX_FILE_BYTES:
+                raise ValueError(f"ファイルサイズが上限（{DOCUMENT_BATCH_MAX_FILE_BYTES}バイト）を超えています")
+            data = await asyncio.to_thread(item.read)
+            extracted = await extract_document(data, item.filename, item.content_type)
+            del data
+            mime_type = guess_mime_type(item.filename, item.content_type)
+            while True:
+                attempts += 1
+                try:
+                    async with upstream_slot("document_batch"):
+                        response = await client.aio.models.generate_content(
+                            model=model,
+                            contents=[prompt, *content_parts(extracted, mime_type)],
+                            config=types.GenerateContentConfig(http_options=http_options_for("media")),
+                        )
+                    break
+                except Exception as e:
+                    if attempts > retries or not _is_retryable(e):
+                        raise
+                    delay = DOCUMENT_BATCH_RETRY_BASE_SECONDS * 2 ** (attempts - 1) * (0.5 + random.random())
+                    logger.warning(
+                        f"Document batch item failed, retrying: index={item.index}, attempt={attempts}, "
+                        f"delay={delay:.1f}s, error={type(e).__name__}: {e}"
+                    )
+                    metrics.inc("document_batch_retries_total")
+                    await asyncio.sleep(delay)
+            return {
+                "type": "result",
+                "index": item.index,
+                "filename": item.filename,
+                "analysis": response.text or "",
+                "page_count": extracted.page_count,
+                "extraction": extracted.method,
+                "attempts": attempts,
+                "latency_ms": (time.perf_counter() - began) * 1000,
+            }
+        except Exception as e:
+            return {
+                "type": "file_error",
+                "index": item.index,
+                "filename": item.filename,
+                "detail": f"{type(e).__name__}: {e}",
+                "attempts": attempts,
+            }
+
+    async def event_stream():
+        started = time.perf_counter()
+        semaphore = asyncio.Semaphore(limit)
+
+        async def bounded(item: _BatchItem) -> Dict[str, Any]:
+            async with semaphore:
+                return await analyze_item(item)
+
+        tasks = [asyncio.create_task(bounded(item)) for item in items]
+        try:
+            yield ndjson_line({
+                "type": "plan",
+                "files": [{"index": item.index, "filename": item.filename, "size": item.size} for item in items],
+            })
+            succeeded = 0
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                succeeded += result["type"] == "result"
+                metrics.inc("document_batch_files_total", result=result["type"])
+                yield ndjson_line(result)
+            logger.info(
+                f"Document batch completed: files={len(items)}, succeeded={succeeded}, "
+                f"elapsed={time.perf_counter() - started:.2f}s"
+            )
+            yield ndjson_line({
+                "type": "done",
+                "succeeded": succeeded,
+                "failed": len(items) - succeeded,
+                "elapsed_ms": (time.perf_counter() - started) * 1000,
+            })
+        except Exception as e:
+            logger.error(f"Error in document batch analysis: {type(e).__name__}: {str(e)}", exc_info=True)
+            yield ndjson_line({"type": "error", "detail": str(e)})
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    # 一時ファイルはジェネレーターではなくレスポンスの終了時に削除する（送信開始前の切断でも削除される）
+    return CleanupStreamingResponse(
+        event_stream(), on_close=remove_spooled, media_type=NDJSON_MEDIA_TYPE, headers=STREAMING_HEADERS
+    )
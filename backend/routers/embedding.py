@@ -2,60 +2,114 @@
 エンベディングルーター
 """
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import Response
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Literal, Optional
 from backend.client import client
 from backend.config import DEFAULT_EMBEDDING_MODEL
+from backend.embeddings import EmbeddingDtype, embed_texts, encode_embeddings
+from backend.metrics import metrics
+from backend.serialization import trusted_response
+import base64
+import numpy as np
 
 router = APIRouter()
 
 
-class EmbeddingRequest(BaseModel):
+# レスポンスのエンコーディング
+# - json: List[float]（従来形式）
+# - base64: dtype で変換したバイト列をbase64文字列としてJSONに格納
+# - binary: dtype で変換したバイト列をそのまま返す（application/octet-stream）
+EmbeddingEncoding = Literal["json", "base64", "binary"]
+
+
+class EmbeddingOptions(BaseModel):
+    output_dimensionality: Optional[int] = Field(None, ge=1, le=3072)  # 出力次元数（モデルが対応する場合）
+    task_type: Optional[str] = None  # RETRIEVAL_DOCUMENT / RETRIEVAL_QUERY / SEMANTIC_SIMILARITY など
+    encoding: EmbeddingEncoding = "json"
+    dtype: EmbeddingDtype = "float32"
+
+    @model_validator(mode="after")
+    def check_dtype(self) -> "EmbeddingOptions":
+        if self.encoding == "json" and self.dtype != "float32":
+            raise ValueError("dtype を指定する場合は encoding に base64 または binary を指定してください")
+        return self
+
+
+class EmbeddingRequest(EmbeddingOptions):
     text: str
     model: Optional[str] = DEFAULT_EMBEDDING_MODEL
 
 
 class EmbeddingResponse(BaseModel):
-    embedding: List[float]
+    embedding: Optional[List[float]] = None  # encoding=json の場合
+    embedding_base64: Optional[str] = None  # encoding=base64 の場合
+    dtype: str = "float32"
+    scale: Optional[float] = None  # dtype=int8 の場合（元の値 ≒ int8値 × scale）
     model: str
     dimensions: int
 
 
+def _binary_response(data: bytes, scales: Optional[List[float]], count: int, dimensions: int, dtype: str, model: str) -> Response:
+    """エンベディングのバイト列をバイナリレスポンスとして返す
+
+    dtype=int8 の場合、本文の先頭に各ベクトルのscale（float32, count個）を置き、その後に量子化値を続ける。
+    """
+    body = np.asarray(scales, dtype="<f4").tobytes() + data if scales is not None else data
+    headers = {
+        "X-Embedding-Count": str(count),
+        "X-Embedding-Dimensions": str(dimensions),
+        "X-Embedding-Dtype": dtype,
+        "X-Embedding-Model": model,
+    }
+    if scales is not None:
+        headers["X-Embedding-Layout"] = "scales+data"
+    return Response(content=body, media_type="application/octet-stream", headers=headers)
+
+
+def _observe_payload(route: str, options: EmbeddingOptions, size: int) -> None:
+    metrics.observe("embedding_payload_bytes", size, route=route, encoding=options.encoding, dtype=options.dtype)
+
+
 @router.post("/generate", response_model=EmbeddingResponse)
 async def generate_embedding(request: EmbeddingRequest):
-    """テキストエンベディング生成"""
+    """テキストエンベディング生成
+
+    encoding=base64 / binary と dtype（float16, int8, binary）を指定すると、
+    ペイロードサイズとシリアライズのCPU負荷を削減できる。
+    """
     import logging
-    from google.genai import types
     
     logger = logging.getLogger(__name__)
     
     try:
-        logger.info(f"Embedding request received: model={request.model}, text_length={len(request.text)}")
+        logger.info(f"Embedding request received: model={request.model}, text_length={len(request.text)}, encoding={request.encoding}, dtype={request.dtype}")
         
-        # エンベディングAPIの実装
-        response = client.models.embed_content(
-            model=request.model,
-            contents=[request.text],
-            config=types.EmbedContentConfig(),
+        embeddings = await embed_texts(
+            client,
+            [request.text],
+            request.model,
+            task_type=request.task_type,
+            output_dimensionality=request.output_dimensionality,
         )
-        
-        # レスポンスの構造: response.embeddings[0].values
-        if hasattr(response, "embeddings") and len(response.embeddings) > 0:
-            embedding = response.embeddings[0].values
-        elif hasattr(response, "embedding"):
-            embedding = response.embedding.values if hasattr(response.embedding, "values") else response.embedding
-        elif hasattr(response, "values"):
-            embedding = response.values
-        else:
-            embedding = []
-        
+        embedding = embeddings[0] if embeddings else []
         if not embedding:
             raise ValueError("Embedding values not found in response")
         
         logger.info(f"Embedding generated: dimensions={len(embedding)}")
         
-        return EmbeddingResponse(
-            embedding=embedding,
+        if request.encoding == "json":
+            return trusted_response(EmbeddingResponse, embedding=embedding, model=request.model, dimensions=len(embedding))
+
+        data, scales = encode_embeddings([embedding], request.dtype)
+        _observe_payload("generate", request, len(data))
+        if request.encoding == "binary":
+            return _binary_response(data, scales, 1, len(embedding), request.dtype, request.model)
+        return trusted_response(
+            EmbeddingResponse,
+            embedding_base64=base64.b64encode(data).decode("ascii"),
+            dtype=request.dtype,
+            scale=scales[0] if scales else None,
             model=request.model,
             dimensions=len(embedding),
         )
@@ -64,65 +118,67 @@ async def generate_embedding(request: EmbeddingRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-class BatchEmbeddingRequest(BaseModel):
+class BatchEmbeddingRequest(EmbeddingOptions):
     texts: List[str]
     model: Optional[str] = DEFAULT_EMBEDDING_MODEL
 
 
 class BatchEmbeddingResponse(BaseModel):
-    embeddings: List[List[float]]
+    embeddings: Optional[List[List[float]]] = None  # encoding=json の場合
+    embeddings_base64: Optional[str] = None  # encoding=base64 の場合（count × 1ベクトルのバイト数の連続領域）
+    dtype: str = "float32"
+    scales: Optional[List[float]] = None  # dtype=int8 の場合
+    count: int = 0
     model: str
     dimensions: int
 
 
 @router.post("/batch", response_model=BatchEmbeddingResponse)
 async def generate_batch_embeddings(request: BatchEmbeddingRequest):
-    """バッチエンベディング生成"""
+    """バッチエンベディング生成
+
+    APIの上限件数ごとのバッチに分けて並行に生成する。
+    """
     import logging
-    from google.genai import types
     
     logger = logging.getLogger(__name__)
     
     try:
-        logger.info(f"Batch embedding request received: model={request.model}, text_count={len(request.texts)}")
+        logger.info(f"Batch embedding request received: model={request.model}, text_count={len(request.texts)}, encoding={request.encoding}, dtype={request.dtype}")
         
-        # バッチエンベディングは複数のテキストを一度に処理
-        response = client.models.embed_content(
-            model=request.model,
-            contents=request.texts,
-            config=types.EmbedContentConfig(),
+        embeddings = await embed_texts(
+            client,
+            request.texts,
+            request.model,
+            task_type=request.task_type,
+            output_dimensionality=request.output_dimensionality,
         )
-        
-        embeddings = []
-        # レスポンスの構造: response.embeddings は ContentEmbedding のリスト
-        if hasattr(response, "embeddings"):
-            for content_embedding in response.embeddings:
-                if hasattr(content_embedding, "values"):
-                    embeddings.append(content_embedding.values)
-                else:
-                    embeddings.append([])
-        elif isinstance(response, list):
-            for item in response:
-                if hasattr(item, "values"):
-                    embeddings.append(item.values)
-                else:
-                    embeddings.append([])
-        else:
-            # 単一のレスポンスの場合
-            if hasattr(response, "values"):
-                embeddings.append(response.values)
-            else:
-                embeddings.append([])
 
         dimensions = len(embeddings[0]) if embeddings else 0
         logger.info(f"Batch embeddings generated: count={len(embeddings)}, dimensions={dimensions}")
         
-        return BatchEmbeddingResponse(
-            embeddings=embeddings,
+        if request.encoding == "json":
+            return trusted_response(
+                BatchEmbeddingResponse,
+                embeddings=embeddings,
+                count=len(embeddings),
+                model=request.model,
+                dimensions=dimensions,
+            )
+
+        data, scales = encode_embeddings(embeddings, request.dtype) if embeddings else (b"", None)
+        _observe_payload("batch", request, len(data))
+        if request.encoding == "binary":
+            return _binary_response(data, scales, len(embeddings), dimensions, request.dtype, request.model)
+        return trusted_response(
+            BatchEmbeddingResponse,
+            embeddings_base64=base64.b64encode(data).decode("ascii"),
+            dtype=request.dtype,
+            scales=scales,
+            count=len(embeddings),
             model=request.model,
             dimensions=dimensions,
         )
     except Exception as e:
         logger.error(f"Error in batch embedding generation: {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
-
@@ -2,10 +2,12 @@
 関数呼び出しルーター
 """
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, model_validator
 from typing import List, Optional, Dict, Any
 from backend.client import client
-from backend.config import DEFAULT_TEXT_MODEL
+from backend.config import DEFAULT_TEXT_MODEL, FUNCTION_MAX_STEPS, TOOLSET_CACHE_TTL_SECONDS
+from backend.tools import ToolResult, tool_registry
+from backend.toolsets import Toolset, ToolsetError, create_cached_prefix, toolset_registry
 
 router = APIRouter()
 
@@ -24,92 +26,164 @@ class FunctionDefinition(BaseModel):
 
 class FunctionCallingRequest(BaseModel):
     prompt: str
-    functions: List[FunctionDefinition]
+    functions: Optional[List[FunctionDefinition]] = None
+    toolset_id: Optional[str] = None  # 登録済みツールセットのIDまたは名前
     model: Optional[str] = DEFAULT_TEXT_MODEL
 
+    @model_validator(mode="after")
+    def _require_functions(self):
+        if not self.functions and not self.toolset_id:
+            raise ValueError("functions または toolset_id のいずれかを指定してください")
+        return self
+
 
 class FunctionCall(BaseModel):
     name: str
     arguments: Dict[str, Any]
+    id: Optional[str] = None
 
 
 class FunctionCallingResponse(BaseModel):
     function_calls: List[FunctionCall]
     text: Optional[str] = None
     model: str
+    toolset_id: Optional[str] = None
+
+
+class ToolsetRegisterRequest(BaseModel):
+    functions: List[FunctionDefinition]
+    name: Optional[str] = None
+    system_instruction: Optional[str] = None
+    # 指定したモデル向けにツール定義をコンテキストキャッシュ化する
+    cache_models: Optional[List[str]] = None
+    cache_ttl_seconds: Optional[int] = None
+
+
+class ToolsetRegisterResponse(BaseModel):
+    toolset_id: str
+    name: Optional[str] = None
+    function_names: List[str]
+    cached_models: List[str] = []
+    cache_errors: Dict[str, str] = {}
+
+
+def _resolve_toolset(request: FunctionCallingRequest) -> Toolset:
+    """リクエストからツールセットを解決する（インラインの定義も登録して再利用する）"""
+    if request.toolset_id:
+        toolset = toolset_registry.get(request.toolset_id)
+        if toolset is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"ツールセット '{request.toolset_id}' は登録されていません。先に /toolsets で登録してください。",
+            )
+        return toolset
+    try:
+        return toolset_registry.register([func.model_dump() for func in request.functions])
+    except ToolsetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _args_to_dict(args: Any) -> Dict[str, Any]:
+    """argsはdictまたはFunctionCallArgsオブジェクトの可能性があるため、dictに変換する"""
+    if isinstance(args, dict):
+        return args
+    if hasattr(args, "model_dump"):
+        return args.model_dump()
+    if hasattr(args, "__dict__"):
+        return args.__dict__
+    return {}
+
+
+def _extract_function_calls(response: Any) -> List[FunctionCall]:
+    """レスポンスから関数呼び出しを抽出する"""
+    function_calls = []
+    if hasattr(response, "function_calls") and response.function_calls:
+        for func_call in response.function_calls:
+            # func_callはFunctionCallオブジェクト（nameとargs属性を持つ）
+            if hasattr(func_call, "name"):
+                function_calls.append(
+                    FunctionCall(
+                        name=func_call.name,
+                        arguments=_args_to_dict(getattr(func_call, "args", None)),
+                        id=getattr(func_call, "id", None),
+                    )
+                )
+    elif response.candidates and response.candidates[0].content:
+        for part in response.candidates[0].content.parts:
+            if hasattr(part, "function_call") and part.function_call:
+                fc = part.function_call
+                function_calls.append(
+                    FunctionCall(
+                        name=fc.name if hasattr(fc, "name") else str(fc),
+                        arguments=_args_to_dict(getattr(fc, "args", None)),
+                        id=getattr(fc, "id", None),
+                    )
+                )
+    return function_calls
+
+
+@router.post("/toolsets", response_model=ToolsetRegisterResponse)
+async def register_toolset(request: ToolsetRegisterRequest):
+    """ツールセットの登録
+
+    関数定義を検証して types.Tool にコンパイル・キャッシュし、以降は toolset_id で参照できるようにする。
+    cache_models を指定した場合は、ツール定義を含むコンテキストキャッシュをモデルごとに作成する。
+    """
+    import logging
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        toolset = toolset_registry.register(
+            [func.model_dump() for func in request.functions],
+            name=request.name,
+            system_instruction=request.system_instruction,
+        )
+    except ToolsetError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    cache_errors: Dict[str, str] = {}
+    ttl_seconds = request.cache_ttl_seconds or TOOLSET_CACHE_TTL_SECONDS
+    for model in request.cache_models or []:
+        if toolset.cached_content_for(model):
+            continue
+        try:
+            await create_cached_prefix(client, toolset, model, ttl_seconds)
+        except Exception as e:
+            # キャッシュには最小トークン数などの制約があるため、失敗時は通常のツール送信にフォールバック
+            logger.warning(f"Failed to create cached prefix: toolset_id={toolset.toolset_id}, model={model}, error={e}")
+            cache_errors[model] = str(e)
+
+    logger.info(f"Toolset registered: toolset_id={toolset.toolset_id}, function_count={len(toolset.functions)}")
+    return ToolsetRegisterResponse(
+        toolset_id=toolset.toolset_id,
+        name=toolset.name,
+        function_names=toolset.function_names,
+        cached_models=[m for m in toolset.cached_prefixes if toolset.cached_content_for(m)],
+        cache_errors=cache_errors,
+    )
 
 
 @router.post("/call", response_model=FunctionCallingResponse)
 async def call_functions(request: FunctionCallingRequest):
     """関数呼び出し"""
     import logging
-    from google.genai import types
     
     logger = logging.getLogger(__name__)
     
     try:
-        logger.info(f"Function calling request received: model={request.model}, function_count={len(request.functions)}")
-        
-        # 関数定義をGemini形式に変換
-        function_declarations = []
-        for func in request.functions:
-            # JSON Schemaをそのまま使用（parameters_json_schemaとして）
-            function_declaration = types.FunctionDeclaration(
-                name=func.name,
-                description=func.description,
-                parameters_json_schema=func.parameters,
-            )
-            function_declarations.append(function_declaration)
-        
-        tool = types.Tool(function_declarations=function_declarations)
-        
-        response = client.models.generate_content(
+        toolset = _resolve_toolset(request)
+        logger.info(f"Function calling request received: model={request.model}, toolset_id={toolset.toolset_id}, function_count={len(toolset.functions)}")
+
+        # コンパイル済みのツール（またはキャッシュ済みプレフィックス）を使用
+        response = await client.aio.models.generate_content(
             model=request.model,
             contents=request.prompt,
-            config=types.GenerateContentConfig(tools=[tool]),
+            config=toolset.generate_config(request.model),
         )
 
         # 関数呼び出しを抽出
-        function_calls = []
-        if hasattr(response, "function_calls") and response.function_calls:
-            for func_call in response.function_calls:
-                # func_callはFunctionCallオブジェクト（nameとargs属性を持つ）
-                if hasattr(func_call, "name"):
-                    # argsはdictまたはFunctionCallArgsオブジェクトの可能性がある
-                    args_dict = {}
-                    if hasattr(func_call, "args"):
-                        if isinstance(func_call.args, dict):
-                            args_dict = func_call.args
-                        elif hasattr(func_call.args, "model_dump"):
-                            args_dict = func_call.args.model_dump()
-                        elif hasattr(func_call.args, "__dict__"):
-                            args_dict = func_call.args.__dict__
-                    
-                    function_calls.append(
-                        FunctionCall(
-                            name=func_call.name,
-                            arguments=args_dict,
-                        )
-                    )
-        elif response.candidates and response.candidates[0].content:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, "function_call"):
-                    fc = part.function_call
-                    args_dict = {}
-                    if hasattr(fc, "args"):
-                        if isinstance(fc.args, dict):
-                            args_dict = fc.args
-                        elif hasattr(fc.args, "model_dump"):
-                            args_dict = fc.args.model_dump()
-                        elif hasattr(fc.args, "__dict__"):
-                            args_dict = fc.args.__dict__
-                    
-                    function_calls.append(
-                        FunctionCall(
-                            name=fc.name if hasattr(fc, "name") else str(fc),
-                            arguments=args_dict,
-                        )
-                    )
+        function_calls = _extract_function_calls(response)
 
         logger.info(f"Function calling completed: function_calls_count={len(function_calls)}")
         
@@ -117,8 +191,181 @@ async def call_functions(request: FunctionCallingRequest):
             function_calls=function_calls,
             text=response.text if not function_calls else None,
             model=request.model,
+            toolset_id=toolset.toolset_id,
         )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in function calling: {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+
+class FunctionRunRequest(BaseModel):
+    prompt: str
+    tools: Optional[List[str]] = None  # 使用するサーバー側ツール名（未指定時は全ツール）
+    model: Optional[str] = DEFAULT_TEXT_MODEL
+    max_steps: Optional[int] = Field(None, ge=1, le=FUNCTION_MAX_STEPS)  # 未指定時は FUNCTION_MAX_STEPS
+    tool_timeout: Optional[float] = Field(None, gt=0)  # ツールごとのタイムアウト（秒。ツールの設定値より長くはできない）
+
+
+class ToolCallTrace(BaseModel):
+    name: str
+    arguments: Dict[str, Any]
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    latency_ms: float
+
+
+class FunctionRunStep(BaseModel):
+    step: int
+    model_latency_ms: float
+    tools_latency_ms: float
+    tool_calls: List[ToolCallTrace]
+
+
+class FunctionRunResponse(BaseModel):
+    text: Optional[str] = None
+    steps: List[FunctionRunStep]
+    completed: bool  # 最終回答まで到達したか（max_steps到達時はFalse）
+    total_latency_ms: float
+    model: str
+
+
+async def _rejected_call(call: FunctionCall) -> ToolResult:
+    """リクエストで許可されていないツールの呼び出しをエラーとして返す"""
+    return ToolResult(
+        name=call.name,
+        arguments=call.arguments,
+        error=f"ツール '{call.name}' はこのリクエストでは使用できません",
+        call_id=call.id,
+    )
+
+
+@router.get("/tools")
+async def list_tools():
+    """サーバー側で実行可能なツールの一覧"""
+    return {
+        "tools": [
+            {"name": spec.name, "description": spec.description, "parameters": spec.parameters}
+            for spec in tool_registry.specs()
+        ]
+    }
+
+
+@router.post("/run", response_model=FunctionRunResponse)
+async def run_functions(request: FunctionRunRequest):
+    """関数呼び出しのサーバーサイド実行ループ
+
+    モデルが返した関数呼び出しをサーバー側ツールで並列実行し、結果をモデルへ返す処理を
+    最終回答が得られるまで（または max_steps に達するまで）繰り返す。
+    """
+    import asyncio
+    import logging
+    import time
+    from google.genai import types
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        try:
+            specs = tool_registry.specs(request.tools)
+        except KeyError as e:
+            raise HTTPException(status_code=400, detail=str(e.args[0]))
+        if not specs:
+            raise HTTPException(status_code=400, detail="使用可能なツールがありません")
+
+        max_steps = request.max_steps or FUNCTION_MAX_STEPS
+        logger.info(f"Function run request received: model={request.model}, tools={[s.name for s in specs]}, max_steps={max_steps}")
+
+        tool = types.Tool(
+            function_declarations=[
+                types.FunctionDeclaration(
+                    name=spec.name,
+                    description=spec.description,
+                    parameters_json_schema=spec.parameters,
+                )
+                for spec in specs
+            ]
+        )
+        config = types.GenerateContentConfig(tools=[tool])
+        allowed = {spec.name for spec in specs}
+
+        contents: List[Any] = [types.Content(role="user", parts=[types.Part(text=request.prompt)])]
+        steps: List[FunctionRunStep] = []
+        started = time.perf_counter()
+        final_text = None
+        completed = False
+
+        for step in range(1, max_steps + 1):
+            model_start = time.perf_counter()
+            response = await client.aio.models.generate_content(
+                model=request.model,
+                contents=contents,
+                config=config,
+            )
+            model_latency_ms = (time.perf_counter() - model_start) * 1000
+
+            function_calls = _extract_function_calls(response)
+            if not function_calls:
+                final_text = response.text
+                completed = True
+                steps.append(
+                    FunctionRunStep(step=step, model_latency_ms=model_latency_ms, tools_latency_ms=0.0, tool_calls=[])
+                )
+                break
+
+            # モデルの発話（関数呼び出し）を履歴に追加し、ツールを並列実行
+            contents.append(response.candidates[0].content)
+            tools_start = time.perf_counter()
+            results = await asyncio.gather(
+                *(
+                    tool_registry.execute(call.name, call.arguments, timeout=request.tool_timeout, call_id=call.id)
+                    if call.name in allowed
+                    else _rejected_call(call)
+                    for call in function_calls
+                )
+            )
+            tools_latency_ms = (time.perf_counter() - tools_start) * 1000
+
+            response_parts = []
+            for call, result in zip(function_calls, results):
+                part = types.Part.from_function_response(name=call.name, response=result.to_function_response())
+                if call.id:
+                    part.function_response.id = call.id
+                response_parts.append(part)
+            contents.append(types.Content(role="user", parts=response_parts))
+
+            steps.append(
+                FunctionRunStep(
+                    step=step,
+                    model_latency_ms=model_latency_ms,
+                    tools_latency_ms=tools_latency_ms,
+                    tool_calls=[
+                        ToolCallTrace(
+                            name=call.name,
+                            arguments=call.arguments,
+                            result=result.result,
+                            error=result.error,
+                            latency_ms=result.latency_ms,
+                        )
+                        for call, result in zip(function_calls, results)
+                    ],
+                )
+            )
+            logger.info(f"Function run step {step}: tool_calls={len(function_calls)}, tools_latency_ms={tools_latency_ms:.1f}")
+
+        total_latency_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Function run completed: steps={len(steps)}, completed={completed}, total_latency_ms={total_latency_ms:.1f}")
+
+        return FunctionRunResponse(
+            text=final_text,
+            steps=steps,
+            completed=completed,
+            total_latency_ms=total_latency_ms,
+            model=request.model,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in function run: {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -2,11 +2,33 @@
 画像生成・理解ルーター
 Nano Banana機能を実装
 """
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query
-from pydantic import BaseModel
-from typing import Optional, List, Literal
-from backend.client import client
-from backend.config import DEFAULT_IMAGE_MODEL, DEFAULT_TEXT_MODEL, DEFAULT_ANALYSIS_MODEL, DEFAULT_IMAGE_ANALYSIS_MODEL
+from dataclasses import dataclass, field
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field, model_validator
+from typing import Optional, Dict, List, Literal, Tuple, Any
+from backend.client import client, client_pool
+from backend.config import (
+    DEFAULT_IMAGE_MODEL,
+    DEFAULT_TEXT_MODEL,
+    DEFAULT_ANALYSIS_MODEL,
+    DEFAULT_IMAGE_ANALYSIS_MODEL,
+    IMAGE_GENERATE_MAX_VARIANTS,
+)
+from backend.images import (
+    MAX_OUTPUT_WIDTH,
+    get_image,
+    get_variant,
+    preprocess_input_image,
+    store_image,
+)
+from backend.concurrency import upstream_slot
+from backend.http_transport import http_options_for
+from backend.metrics import metrics
+from backend.reference_images import reference_images
+from backend.serialization import trusted_response
+from backend.streaming import NDJSON_MEDIA_TYPE, STREAMING_HEADERS, ndjson_line
+import asyncio
 import base64
 from google.genai import types
 
@@ -16,6 +38,114 @@ router = APIRouter()
 ASPECT_RATIOS = ["1:1", "2:3", "3:2", "3:4", "4:3", "4:5", "5:4", "9:16", "16:9", "21:9"]
 # 解像度の選択肢
 RESOLUTIONS = ["1K", "2K", "4K"]
+# 出力形式の選択肢（サーバー側で変換）
+OutputFormat = Literal["webp", "jpeg", "png"]
+
+
+def _extract_image(response: Any) -> Tuple[Optional[Any], str]:
+    """レスポンスから画像データとMIMEタイプを取得する
+
+    仕様によると、partsにinline_dataが含まれる。
+    複数の画像が返される可能性があるため、最後のものを使用する。
+    """
+    image_data = None
+    mime_type = "image/png"
+    parts = []
+    if hasattr(response, "candidates") and response.candidates:
+        candidate = response.candidates[0]
+        if hasattr(candidate, "content") and hasattr(candidate.content, "parts"):
+            parts = candidate.content.parts or []
+    elif hasattr(response, "parts"):
+        parts = response.parts or []
+    for part in parts:
+        if hasattr(part, "inline_data") and part.inline_data:
+            image_data = part.inline_data.data
+            if hasattr(part.inline_data, "mime_type") and part.inline_data.mime_type:
+                mime_type = part.inline_data.mime_type
+    return image_data, mime_type
+
+
+async def _build_image_url(
+    image_data: Any,
+    mime_type: str,
+    output_width: Optional[int] = None,
+    output_format: Optional[str] = None,
+    output_quality: int = 80,
+) -> Tuple[str, str]:
+    """画像データを保存し、data URLと image_id を返す
+
+    output_width / output_format が指定された場合は、変換済みのバリアントを返す。
+    """
+    # image_dataはbytes型（既にbase64エンコードされている場合はstr）
+    if isinstance(image_data, bytes):
+        raw = image_data
+    elif isinstance(image_data, str):
+        raw = base64.b64decode(image_data)
+    else:
+        raise ValueError(f"Unexpected image_data type: {type(image_data)}")
+
+    image_id = store_image(raw, mime_type)
+    if output_width or output_format:
+        raw, mime_type = await get_variant(
+            image_id, raw, output_width, output_format or "webp", output_quality
+        )
+    return f"data:{mime_type};base64,{base64.b64encode(raw).decode('utf-8')}", image_id
+
+
+def _resolve_generation_model(model: Optional[str]) -> str:
+    """画像生成に使用するNano Bananaモデルを決定する
+
+    仕様: https://ai.google.dev/gemini-api/docs/nanobanana
+    サポートされているモデル: gemini-2.5-flash-image, gemini-3-pro-image-preview
+
+    Raises:
+        HTTPException: サポートされていないモデルが指定された場合
+    """
+    import logging
+
+    logger = logging.getLogger(__name__)
+
+    # サポートされていないモデルをチェック
+    if model and model.startswith("imagen"):
+        raise HTTPException(
+            status_code=400,
+            detail=f"画像生成モデル '{model}' は現在サポートされていません。Nano Bananaモデル（gemini-2.5-flash-image または gemini-3-pro-image-preview）を使用してください。"
+        )
+
+    # デフォルトモデルをNano Bananaに設定（空文字列や無効な値の場合）
+    if not model or not model.startswith("gemini"):
+        model = "gemini-2.5-flash-image"
+        logger.info(f"Model not specified or invalid, using default: {model}")
+
+    # 有効なNano Bananaモデルかチェック
+    valid_models = ["gemini-2.5-flash-image", "gemini-3-pro-image-preview"]
+    if model not in valid_models:
+        raise HTTPException(
+            status_code=400,
+            detail=f"無効なモデル '{model}' が指定されました。有効なモデル: {', '.join(valid_models)}"
+        )
+    return model
+
+
+def _generation_config(
+    aspect_ratio: Optional[str], resolution: Optional[str], seed: Optional[int] = None
+) -> types.GenerateContentConfig:
+    """画像生成設定（解像度・アスペクト比・シードとメディア用のタイムアウト）を作成する"""
+    if not (aspect_ratio or resolution or seed is not None):
+        return types.GenerateContentConfig(http_options=http_options_for("media"))
+    image_config = None
+    if aspect_ratio or resolution:
+        image_config = types.ImageConfig()
+        if aspect_ratio:
+            image_config.aspect_ratio = aspect_ratio
+        if resolution:
+            image_config.image_size = resolution
+    return types.GenerateContentConfig(
+        response_modalities=['TEXT', 'IMAGE'],
+        image_config=image_config,
+        seed=seed,
+        http_options=http_options_for("media"),
+    )
 
 
 class ImageGenerateRequest(BaseModel):
@@ -23,6 +153,10 @@ class ImageGenerateRequest(BaseModel):
     model: Optional[str] = DEFAULT_IMAGE_MODEL
     aspect_ratio: Optional[Literal["1:1", "2:3", "3:2", "3:4", "4:3", "4:5", "5:4", "9:16", "16:9", "21:9"]] = None
     resolution: Optional[Literal["1K", "2K", "4K"]] = None
+    # 返却する画像の変換（未指定時は元画像をそのまま返す）
+    output_width: Optional[int] = Field(None, ge=16, le=MAX_OUTPUT_WIDTH)
+    output_format: Optional[OutputFormat] = None
+    output_quality: int = Field(80, ge=1, le=100)
 
 
 class ImageGenerateResponse(BaseModel):
@@ -30,6 +164,7 @@ class ImageGenerateResponse(BaseModel):
     model: str
     aspect_ratio: Optional[str] = None
     resolution: Optional[str] = None
+    image_id: Optional[str] = None  # /variants/{image_id} で別サイズ・形式を取得可能
 
 
 @router.post("/generate", response_model=ImageGenerateResponse)
@@ -45,103 +180,44 @@ async def generate_image(request: ImageGenerateRequest):
     try:
         logger.info(f"Image generation request received: model={request.model}, prompt_length={len(request.prompt)}, aspect_ratio={request.aspect_ratio}, resolution={request.resolution}")
         
-        # Nano Bananaモデルを使用して画像を生成
-        # 仕様: https://ai.google.dev/gemini-api/docs/nanobanana
-        # サポートされているモデル: gemini-2.5-flash-image, gemini-3-pro-image-preview
-        model = request.model
-        
-        # サポートされていないモデルをチェック
-        if model.startswith("imagen") or model == "imagen-4.0":
-            raise HTTPException(
-                status_code=400,
-                detail=f"画像生成モデル '{request.model}' は現在サポートされていません。Nano Bananaモデル（gemini-2.5-flash-image または gemini-3-pro-image-preview）を使用してください。"
-            )
-        
-        # デフォルトモデルをNano Bananaに設定（空文字列や無効な値の場合）
-        if not model or not model.startswith("gemini"):
-            model = "gemini-2.5-flash-image"
-            logger.info(f"Model not specified or invalid, using default: {model}")
-        
-        # 有効なNano Bananaモデルかチェック
-        valid_models = ["gemini-2.5-flash-image", "gemini-3-pro-image-preview"]
-        if model not in valid_models:
-            raise HTTPException(
-                status_code=400,
-                detail=f"無効なモデル '{model}' が指定されました。有効なモデル: {', '.join(valid_models)}"
-            )
+        model = _resolve_generation_model(request.model)
         
         # 画像生成設定（解像度・アスペクト比）
-        config = None
-        if request.aspect_ratio or request.resolution:
-            image_config = types.ImageConfig()
-            if request.aspect_ratio:
-                image_config.aspect_ratio = request.aspect_ratio
-            if request.resolution:
-                image_config.image_size = request.resolution
-            config = types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE'],
-                image_config=image_config
-            )
+        config = _generation_config(request.aspect_ratio, request.resolution)
         
         # 画像生成APIを呼び出し
-        if config:
-            response = client.models.generate_content(
-                model=model,
-                contents=request.prompt,
-                config=config,
-            )
-        else:
-            response = client.models.generate_content(
-                model=model,
-                contents=request.prompt,
-            )
+        response = await client.aio.models.generate_content(
+            model=model,
+            contents=request.prompt,
+            config=config,
+        )
         
         # レスポンスから画像データを取得
-        # 仕様によると、partsにinline_dataが含まれる
-        # 複数のpartがある場合、画像データを含むpartを探す
-        image_data = None
-        mime_type = "image/png"
-        
-        if hasattr(response, "candidates") and response.candidates:
-            candidate = response.candidates[0]
-            if hasattr(candidate, "content") and hasattr(candidate.content, "parts"):
-                for part in candidate.content.parts:
-                    if hasattr(part, "inline_data") and part.inline_data:
-                        image_data = part.inline_data.data
-                        if hasattr(part.inline_data, "mime_type") and part.inline_data.mime_type:
-                            mime_type = part.inline_data.mime_type
-                        # 画像データが見つかったら続行（複数の画像が返される可能性があるため、最後のものを使用）
-        elif hasattr(response, "parts"):
-            for part in response.parts:
-                if hasattr(part, "inline_data") and part.inline_data:
-                    image_data = part.inline_data.data
-                    if hasattr(part.inline_data, "mime_type") and part.inline_data.mime_type:
-                        mime_type = part.inline_data.mime_type
+        image_data, mime_type = _extract_image(response)
         
         if image_data:
             # base64エンコードされた画像データをdata URLとして返す
-            import base64
-            # image_dataはbytes型なので、base64エンコードする
-            if isinstance(image_data, bytes):
-                image_base64 = base64.b64encode(image_data).decode('utf-8')
-            elif isinstance(image_data, str):
-                # 既にbase64エンコードされている場合
-                image_base64 = image_data
-            else:
-                raise ValueError(f"Unexpected image_data type: {type(image_data)}")
-            
-            image_url = f"data:{mime_type};base64,{image_base64}"
+            image_url, image_id = await _build_image_url(
+                image_data,
+                mime_type,
+                request.output_width,
+                request.output_format,
+                request.output_quality,
+            )
             
-            logger.info(f"Image generated successfully: model={model}, size={len(image_data) if isinstance(image_data, bytes) else len(image_base64)} bytes")
-            return ImageGenerateResponse(
+            logger.info(f"Image generated successfully: model={model}, image_id={image_id}, url_length={len(image_url)}")
+            return trusted_response(
+                ImageGenerateResponse,
                 image_url=image_url,
                 model=model,
                 aspect_ratio=request.aspect_ratio,
-                resolution=request.resolution
+                resolution=request.resolution,
+                image_id=image_id,
             )
         else:
             logger.warning(f"No image data found in response, returning placeholder")
-            return ImageGenerateResponse(
+            return trusted_response(
+                ImageGenerateResponse,
                 image_url="https://example.com/generated-image.png",
                 model=model
             )
@@ -152,6 +228,112 @@ async def generate_image(request: ImageGenerateRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class ImageVariantsRequest(BaseModel):
+    prompt: str
+    n: int = Field(4, ge=1, le=IMAGE_GENERATE_MAX_VARIANTS)
+    model: Optional[str] = DEFAULT_IMAGE_MODEL
+    aspect_ratio: Optional[Literal["1:1", "2:3", "3:2", "3:4", "4:3", "4:5", "5:4", "9:16", "16:9", "21:9"]] = None
+    resolution: Optional[Literal["1K", "2K", "4K"]] = None
+    # 候補ごとの指定（長さは n と一致させる。未指定時は共通設定を使用）
+    seeds: Optional[List[int]] = None
+    aspect_ratios: Optional[List[Literal["1:1", "2:3", "3:2", "3:4", "4:3", "4:5", "5:4", "9:16", "16:9", "21:9"]]] = None
+    output_width: Optional[int] = Field(None, ge=16, le=MAX_OUTPUT_WIDTH)
+    output_format: Optional[OutputFormat] = None
+    output_quality: int = Field(80, ge=1, le=100)
+
+    @model_validator(mode="after")
+    def check_per_variant_lengths(self) -> "ImageVariantsRequest":
+        for field_name in ("seeds", "aspect_ratios"):
+            values = getattr(self, field_name)
+            if values is not None and len(values) != self.n:
+                raise ValueError(f"{field_name} の要素数は n（{self.n}）と一致させてください")
+        return self
+
+
+@router.post("/generate/variants")
+async def generate_image_variants(request: ImageVariantsRequest):
+    """複数候補の画像を並行生成し、完成した順にNDJSONで返す
+
+    各候補は上流の同時実行枠（upstream_slot）内で並行に生成されるため、
+    最初の候補は1枚生成する場合とほぼ同じ待ち時間で表示できる。
+
+    イベント:
+        - {"type": "plan", "n", "model", "variants": [{"index", "seed", "aspect_ratio"}]}
+        - {"type": "image", "index", "image_url", "image_id", "seed", "aspect_ratio", "latency_ms"}（完了順）
+        - {"type": "image_error", "index", "detail"}
+        - {"type": "done", "succeeded", "failed", "elapsed_ms"}
+        - {"type": "error", "detail": ...}
+    """
+    import logging
+    import time
+
+    logger = logging.getLogger(__name__)
+    logger.info(f"Image variants request received: model={request.model}, n={request.n}, prompt_length={len(request.prompt)}")
+
+    model = _resolve_generation_model(request.model)
+    plans = [
+        {
+            "index": i,
+            "seed": request.seeds[i] if request.seeds else None,
+            "aspect_ratio": request.aspect_ratios[i] if request.aspect_ratios else request.aspect_ratio,
+        }
+        for i in range(request.n)
+    ]
+
+    async def generate_one(plan: dict) -> dict:
+        began = time.perf_counter()
+        try:
+            config = _generation_config(plan["aspect_ratio"], request.resolution, plan["seed"])
+            async with upstream_slot("image_variants"):
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=request.prompt,
+                    config=config,
+                )
+            image_data, mime_type = _extract_image(response)
+            if not image_data:
+                return {"type": "image_error", "index": plan["index"], "detail": "画像データが取得できませんでした"}
+            image_url, image_id = await _build_image_url(
+                image_data, mime_type, request.output_width, request.output_format, request.output_quality
+            )
+            return {
+                "type": "image",
+                **plan,
+                "image_url": image_url,
+                "image_id": image_id,
+                "latency_ms": (time.perf_counter() - began) * 1000,
+            }
+        except Exception as e:
+            return {"type": "image_error", "index": plan["index"], "detail": f"{type(e).__name__}: {e}"}
+
+    async def event_stream():
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(generate_one(plan)) for plan in plans]
+        succeeded = 0
+        try:
+            yield ndjson_line({"type": "plan", "n": request.n, "model": model, "variants": plans})
+            for future in asyncio.as_completed(tasks):
+                result = await future
+                metrics.inc("image_variants_total", result=result["type"])
+                if result["type"] == "image":
+                    succeeded += 1
+                    if succeeded == 1:
+                        metrics.observe("image_variants_first_image_seconds", time.perf_counter() - started)
+                yield ndjson_line(result)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            logger.info(f"Image variants completed: model={model}, succeeded={succeeded}/{request.n}, elapsed={elapsed_ms:.0f}ms")
+            yield ndjson_line({"type": "done", "succeeded": succeeded, "failed": request.n - succeeded, "elapsed_ms": elapsed_ms})
+        except Exception as e:
+            logger.error(f"Error in image variants generation: {type(e).__name__}: {str(e)}", exc_info=True)
+            yield ndjson_line({"type": "error", "detail": str(e)})
+        finally:
+            # クライアント切断時は未完了の生成をキャンセルする
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(event_stream(), media_type=NDJSON_MEDIA_TYPE, headers=STREAMING_HEADERS)
+
+
 class ImageAnalyzeRequest(BaseModel):
     prompt: str
     model: Optional[str] = DEFAULT_ANALYSIS_MODEL
@@ -168,12 +350,14 @@ async def analyze_image(
 ):
     """画像の理解・分析"""
     try:
-        # 画像を読み込む
-        image_data = await file.read()
+        # 画像を読み込み、向き補正・縮小して送信サイズを抑える
+        image_data, input_mime_type = await preprocess_input_image(
+            await file.read(), file.content_type or "image/jpeg"
+        )
         image_base64 = base64.b64encode(image_data).decode("utf-8")
 
         # Gemini APIで画像を分析
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model=request.model,
             contents=[
                 {
@@ -181,13 +365,14 @@ async def analyze_image(
                         {"text": request.prompt},
                         {
                             "inline_data": {
-                                "mime_type": file.content_type or "image/jpeg",
+                                "mime_type": input_mime_type,
                                 "data": image_base64,
                             }
                         },
                     ]
                 }
             ],
+            config=types.GenerateContentConfig(http_options=http_options_for("media")),
         )
 
         return ImageAnalyzeResponse(analysis=response.text, model=request.model)
@@ -200,6 +385,7 @@ class ImageEditResponse(BaseModel):
     model: str
     aspect_ratio: Optional[str] = None
     resolution: Optional[str] = None
+    image_id: Optional[str] = None
 
 
 @router.post("/edit", response_model=ImageEditResponse)
@@ -208,7 +394,10 @@ async def edit_image(
     prompt: str = Form(...),
     model: Optional[str] = Form(DEFAULT_IMAGE_MODEL),
     aspect_ratio: Optional[str] = Form(None),
-    resolution: Optional[str] = Form(None)
+    resolution: Optional[str] = Form(None),
+    output_width: Optional[int] = Form(None, ge=16, le=MAX_OUTPUT_WIDTH),
+    output_format: Optional[OutputFormat] = Form(None),
+    output_quality: int = Form(80, ge=1, le=100),
 ):
     """画像編集（テキストと画像による画像変換）
     
@@ -221,8 +410,10 @@ async def edit_image(
     try:
         logger.info(f"Image edit request received: model={model}, prompt_length={len(prompt)}")
         
-        # 画像を読み込む
-        image_data = await file.read()
+        # 画像を読み込み、向き補正・縮小して送信サイズを抑える
+        image_data, input_mime_type = await preprocess_input_image(
+            await file.read(), file.content_type or "image/jpeg"
+        )
         image_base64 = base64.b64encode(image_data).decode("utf-8")
         
         # デフォルトモデルをNano Bananaに設定
@@ -231,17 +422,15 @@ async def edit_image(
             model_name = "gemini-3-pro-image-preview"  # 編集にはProモデルを推奨
         
         # 画像編集設定
-        config = None
+        config = types.GenerateContentConfig(http_options=http_options_for("media"))
         if aspect_ratio or resolution:
             image_config = types.ImageConfig()
             if aspect_ratio:
                 image_config.aspect_ratio = aspect_ratio
             if resolution:
                 image_config.image_size = resolution
-            config = types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE'],
-                image_config=image_config
-            )
+            config.response_modalities = ['TEXT', 'IMAGE']
+            config.image_config = image_config
         
         # 画像編集APIを呼び出し
         contents = [
@@ -250,7 +439,7 @@ async def edit_image(
                     {"text": prompt},
                     {
                         "inline_data": {
-                            "mime_type": file.content_type or "image/jpeg",
+                            "mime_type": input_mime_type,
                             "data": image_base64,
                         }
                     },
@@ -258,53 +447,28 @@ async def edit_image(
             }
         ]
         
-        if config:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=contents,
-                config=config,
-            )
-        else:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=contents,
-            )
+        response = await client.aio.models.generate_content(
+            model=model_name,
+            contents=contents,
+            config=config,
+        )
         
         # レスポンスから画像データを取得
-        image_data_result = None
-        mime_type = "image/png"
-        
-        if hasattr(response, "candidates") and response.candidates:
-            candidate = response.candidates[0]
-            if hasattr(candidate, "content") and hasattr(candidate.content, "parts"):
-                for part in candidate.content.parts:
-                    if hasattr(part, "inline_data") and part.inline_data:
-                        image_data_result = part.inline_data.data
-                        if hasattr(part.inline_data, "mime_type") and part.inline_data.mime_type:
-                            mime_type = part.inline_data.mime_type
-        elif hasattr(response, "parts"):
-            for part in response.parts:
-                if hasattr(part, "inline_data") and part.inline_data:
-                    image_data_result = part.inline_data.data
-                    if hasattr(part.inline_data, "mime_type") and part.inline_data.mime_type:
-                        mime_type = part.inline_data.mime_type
+        image_data_result, mime_type = _extract_image(response)
         
         if image_data_result:
-            if isinstance(image_data_result, bytes):
-                image_base64_result = base64.b64encode(image_data_result).decode('utf-8')
-            elif isinstance(image_data_result, str):
-                image_base64_result = image_data_result
-            else:
-                raise ValueError(f"Unexpected image_data type: {type(image_data_result)}")
-            
-            image_url = f"data:{mime_type};base64,{image_base64_result}"
+            image_url, image_id = await _build_image_url(
+                image_data_result, mime_type, output_width, output_format, output_quality
+            )
             
-            logger.info(f"Image edited successfully: model={model_name}")
-            return ImageEditResponse(
+            logger.info(f"Image edited successfully: model={model_name}, image_id={image_id}")
+            return trusted_response(
+                ImageEditResponse,
                 image_url=image_url,
                 model=model_name,
                 aspect_ratio=aspect_ratio,
-                resolution=resolution
+                resolution=resolution,
+                image_id=image_id,
             )
         else:
             raise HTTPException(status_code=500, detail="画像データが取得できませんでした")
@@ -321,6 +485,7 @@ class ImageComposeResponse(BaseModel):
     model: str
     aspect_ratio: Optional[str] = None
     resolution: Optional[str] = None
+    image_id: Optional[str] = None
 
 
 @router.post("/compose", response_model=ImageComposeResponse)
@@ -329,7 +494,10 @@ async def compose_images(
     prompt: str = Form(...),
     model: Optional[str] = Form(DEFAULT_IMAGE_MODEL),
     aspect_ratio: Optional[str] = Form(None),
-    resolution: Optional[str] = Form(None)
+    resolution: Optional[str] = Form(None),
+    output_width: Optional[int] = Form(None, ge=16, le=MAX_OUTPUT_WIDTH),
+    output_format: Optional[OutputFormat] = Form(None),
+    output_quality: int = Form(80, ge=1, le=100),
 ):
     """複数画像の合成
     
@@ -347,81 +515,58 @@ async def compose_images(
         if model_name == "imagen-4.0" or not model_name.startswith("gemini"):
             model_name = "gemini-3-pro-image-preview"  # 合成にはProモデルを推奨
         
-        # 複数の画像を読み込む
-        parts = [{"text": prompt}]
-        for file in files:
-            image_data = await file.read()
-            image_base64 = base64.b64encode(image_data).decode("utf-8")
-            parts.append({
-                "inline_data": {
-                    "mime_type": file.content_type or "image/jpeg",
-                    "data": image_base64,
-                }
-            })
+        # 複数の画像を並行して読み込み・前処理し、参照画像キャッシュ（Files API）経由で参照する
+        # 同じ画像は一度だけアップロードされ、以降のリクエストではファイルハンドルを再利用する
+        async def to_part(file: UploadFile) -> types.Part:
+            image_data, input_mime_type = await preprocess_input_image(
+                await file.read(), file.content_type or "image/jpeg"
+            )
+            return await reference_images.part(client, image_data, input_mime_type)
+
+        # 参照画像はアップロードしたAPIキーでしか参照できないため、アップロードと生成を同じキーで行う
+        pool_key = client_pool.select()
+        with client_pool.session(pool_key):
+            image_parts = await asyncio.gather(*(to_part(file) for file in files))
+        parts = [types.Part.from_text(text=prompt), *image_parts]
         
         # 画像合成設定
-        config = None
+        config = types.GenerateContentConfig(http_options=http_options_for("media"))
         if aspect_ratio or resolution:
             image_config = types.ImageConfig()
             if aspect_ratio:
                 image_config.aspect_ratio = aspect_ratio
             if resolution:
                 image_config.image_size = resolution
-            config = types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE'],
-                image_config=image_config
-            )
+            config.response_modalities = ['TEXT', 'IMAGE']
+            config.image_config = image_config
         
         # 画像合成APIを呼び出し
-        contents = [{"parts": parts}]
+        contents = [types.Content(role="user", parts=parts)]
         
-        if config:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=contents,
-                config=config,
-            )
-        else:
-            response = client.models.generate_content(
-                model=model_name,
-                contents=contents,
-            )
+        async with upstream_slot("image_compose"):
+            with client_pool.session(pool_key):
+                response = await client.aio.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config=config,
+                )
         
         # レスポンスから画像データを取得
-        image_data_result = None
-        mime_type = "image/png"
-        
-        if hasattr(response, "candidates") and response.candidates:
-            candidate = response.candidates[0]
-            if hasattr(candidate, "content") and hasattr(candidate.content, "parts"):
-                for part in candidate.content.parts:
-                    if hasattr(part, "inline_data") and part.inline_data:
-                        image_data_result = part.inline_data.data
-                        if hasattr(part.inline_data, "mime_type") and part.inline_data.mime_type:
-                            mime_type = part.inline_data.mime_type
-        elif hasattr(response, "parts"):
-            for part in response.parts:
-                if hasattr(part, "inline_data") and part.inline_data:
-                    image_data_result = part.inline_data.data
-                    if hasattr(part.inline_data, "mime_type") and part.inline_data.mime_type:
-                        mime_type = part.inline_data.mime_type
+        image_data_result, mime_type = _extract_image(response)
         
         if image_data_result:
-            if isinstance(image_data_result, bytes):
-                image_base64_result = base64.b64encode(image_data_result).decode('utf-8')
-            elif isinstance(image_data_result, str):
-                image_base64_result = image_data_result
-            else:
-                raise ValueError(f"Unexpected image_data type: {type(image_data_result)}")
-            
-            image_url = f"data:{mime_type};base64,{image_base64_result}"
+            image_url, image_id = await _build_image_url(
+                image_data_result, mime_type, output_width, output_format, output_quality
+            )
             
-            logger.info(f"Images composed successfully: model={model_name}")
-            return ImageComposeResponse(
+            logger.info(f"Images composed successfully: model={model_name}, image_id={image_id}")
+            return trusted_response(
+                ImageComposeResponse,
                 image_url=image_url,
                 model=model_name,
                 aspect_ratio=aspect_ratio,
-                resolution=resolution
+                resolution=resolution,
+                image_id=image_id,
             )
         else:
             raise HTTPException(status_code=500, detail="画像データが取得できませんでした")
@@ -433,6 +578,35 @@ async def compose_images(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/variants/{image_id}")
+async def get_image_variant(
+    image_id: str,
+    request: Request,
+    width: Optional[int] = Query(None, ge=16, le=MAX_OUTPUT_WIDTH),
+    output_format: OutputFormat = Query("webp", alias="format"),
+    quality: int = Query(80, ge=1, le=100),
+):
+    """生成画像のバリアント取得
+
+    指定した幅・形式に変換した画像をバイナリで返す。変換結果は
+    (image_id, 幅, 形式, 品質) ごとにキャッシュされ、2回目以降は変換しない。
+    """
+    # 保持期間を過ぎた画像に 304 を返さないよう、ETag の比較より先に存在を確認する
+    original = get_image(image_id)
+    if original is None:
+        raise HTTPException(status_code=404, detail=f"画像 '{image_id}' が見つかりません（保持期間を過ぎた可能性があります）")
+
+    etag = f'"{image_id}-{width or 0}-{output_format}-{quality}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    data, mime_type = await get_variant(image_id, original[0], width, output_format, quality)
+    return Response(
+        content=data,
+        media_type=mime_type,
+        headers={"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"},
+    )
+
+
 class MultiTurnImageChatRequest(BaseModel):
     message: str
     model: Optional[str] = "gemini-3-pro-image-preview"
@@ -448,8 +622,17 @@ class MultiTurnImageChatResponse(BaseModel):
     session_id: str
 
 
+@dataclass
+class _ImageChatSession:
+    """マルチターン画像チャットのセッション（会話履歴はサーバー側で保持する）"""
+
+    model: str
+    image_config: Optional[types.ImageConfig] = None
+    history: List[types.Content] = field(default_factory=list)
+
+
 # 簡易的なセッション管理（本番環境ではRedis等を使用）
-_chat_sessions: dict = {}
+_chat_sessions: Dict[str, _ImageChatSession] = {}
 
 
 @router.post("/chat", response_model=MultiTurnImageChatResponse)
@@ -457,6 +640,7 @@ async def multi_turn_image_chat(request: MultiTurnImageChatRequest):
     """マルチターンの画像編集（チャット形式）
     
     会話形式で画像の生成と編集を続けます。
+    会話履歴を含めた generate_content の呼び出しとして送信するため、上流通信の記録・再生の対象になる。
     """
     import logging
     import uuid
@@ -466,45 +650,39 @@ async def multi_turn_image_chat(request: MultiTurnImageChatRequest):
     try:
         logger.info(f"Multi-turn image chat request received: model={request.model}, session_id={request.session_id}")
         
-        # セッション管理
-        session_id = request.session_id or str(uuid.uuid4())
-        if session_id not in _chat_sessions:
-            # 新しいチャットセッションを作成
-            config = types.GenerateContentConfig(
-                response_modalities=['TEXT', 'IMAGE'],
-            )
-            if request.aspect_ratio or request.resolution:
-                image_config = types.ImageConfig()
-                if request.aspect_ratio:
-                    image_config.aspect_ratio = request.aspect_ratio
-                if request.resolution:
-                    image_config.image_size = request.resolution
-                config.image_config = image_config
-            
-            chat = client.chats.create(
-                model=request.model or "gemini-3-pro-image-preview",
-                config=config
-            )
-            _chat_sessions[session_id] = chat
-        else:
-            chat = _chat_sessions[session_id]
-        
-        # メッセージを送信
-        config = None
+        # メッセージごとの画像設定（指定がなければセッション作成時の設定を使う）
+        image_config = None
         if request.aspect_ratio or request.resolution:
             image_config = types.ImageConfig()
             if request.aspect_ratio:
                 image_config.aspect_ratio = request.aspect_ratio
             if request.resolution:
                 image_config.image_size = request.resolution
-            config = types.GenerateContentConfig(
-                image_config=image_config
+
+        # セッション管理
+        session_id = request.session_id or str(uuid.uuid4())
+        session = _chat_sessions.get(session_id)
+        if session is None:
+            session = _ImageChatSession(
+                model=request.model or "gemini-3-pro-image-preview",
+                image_config=image_config,
             )
-        
-        if config:
-            response = chat.send_message(request.message, config=config)
-        else:
-            response = chat.send_message(request.message)
+            _chat_sessions[session_id] = session
+
+        # 会話履歴にメッセージを加えて送信する
+        message = types.Content(role="user", parts=[types.Part.from_text(text=request.message)])
+        response = await client.aio.models.generate_content(
+            model=session.model,
+            contents=[*session.history, message],
+            config=types.GenerateContentConfig(
+                response_modalities=['TEXT', 'IMAGE'],
+                image_config=image_config or session.image_config,
+                http_options=http_options_for("media"),
+            ),
+        )
+        # 応答が得られたターンのみ履歴に残す
+        if response.candidates and response.candidates[0].content:
+            session.history.extend([message, response.candidates[0].content])
         
         # レスポンスからテキストと画像を取得
         text_result = None
@@ -531,10 +709,11 @@ async def multi_turn_image_chat(request: MultiTurnImageChatRequest):
         
         logger.info(f"Multi-turn chat response: session_id={session_id}, has_text={text_result is not None}, has_image={image_url_result is not None}")
         
-        return MultiTurnImageChatResponse(
+        return trusted_response(
+            MultiTurnImageChatResponse,
             text=text_result,
             image_url=image_url_result,
-            model=request.model or "gemini-3-pro-image-preview",
+            model=session.model,
             session_id=session_id
         )
             
@@ -0,0 +1,340 @@
+"""
+RAG（検索拡張生成）ルーター
+
+ドキュメントをチャンク単位でインデックスし、質問に関連するチャンクのみをコンテキストとして
+回答を生成する。ドキュメント全体を毎回送信する場合に比べ、レイテンシとトークン数を抑えられる。
+"""
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from pydantic import BaseModel, Field
+from typing import Optional, List, Dict, Any
+from backend.client import client
+from backend.concurrency import upstream_slot
+from backend.config import DEFAULT_TEXT_MODEL, DEFAULT_EMBEDDING_MODEL, RAG_MAX_TOP_K
+from backend.deadlines import apply_deadline, budget_model, budget_overrides
+from backend.documents import PDF_MIME_TYPE, extract_document, guess_mime_type
+from backend.embeddings import embed_texts
+from backend.http_transport import http_options_for
+from backend.metrics import metrics
+from backend.rag import rag_store
+import asyncio
+import re
+import time
+
+router = APIRouter()
+
+_CITATION_PATTERN = re.compile(r"\[(\d+)\]")
+
+
+class RagDocument(BaseModel):
+    document_id: str = Field(..., min_length=1, max_length=256)
+    text: str
+    title: Optional[str] = None
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+
+class RagIngestRequest(BaseModel):
+    documents: List[RagDocument]
+    collection: str = "default"
+    embedding_model: str = DEFAULT_EMBEDDING_MODEL
+
+
+class RagIngestResult(BaseModel):
+    document_id: str
+    chunks: int
+    embedded: int
+    reused: int
+    removed: int
+    unchanged: bool = False
+
+
+class RagIngestResponse(BaseModel):
+    collection: str
+    results: List[RagIngestResult]
+    elapsed_ms: float
+
+
+async def _ingest(collection_name: str, documents: List[RagDocument], embedding_model: str) -> RagIngestResponse:
+    """ドキュメントをコレクションに取り込み、ディスクへ保存する"""
+    import logging
+
+    logger = logging.getLogger(__name__)
+    started = time.perf_counter()
+    try:
+        collection = await asyncio.to_thread(rag_store.collection, collection_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def embed(texts: List[str]) -> List[List[float]]:
+        return await embed_texts(client, texts, embedding_model, task_type="RETRIEVAL_DOCUMENT")
+
+    results = []
+    async with collection.lock:
+        try:
+            for document in documents:
+                result = await collection.ingest(
+                    document.document_id,
+                    document.text,
+                    embed,
+                    embedding_model,
+                    title=document.title,
+                    metadata=document.metadata,
+                )
+                results.append(RagIngestResult(**result.__dict__))
+                metrics.inc("rag_chunks_embedded_total", result.embedded, collection=collection_name)
+                metrics.inc("rag_chunks_reused_total", result.reused, collection=collection_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        finally:
+            # 途中で失敗した場合も、それまでに取り込んだドキュメントは保存する
+            if results:
+                await asyncio.to_thread(collection.save)
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    logger.info(
+        f"RAG ingestion completed: collection={collection_name}, documents={len(results)}, "
+        f"embedded={sum(r.embedded for r in results)}, reused={sum(r.reused for r in results)}, elapsed={elapsed_ms:.0f}ms"
+    )
+    return RagIngestResponse(collection=collection_name, results=results, elapsed_ms=elapsed_ms)
+
+
+@router.post("/ingest", response_model=RagIngestResponse)
+async def ingest_documents(request: RagIngestRequest):
+    """テキストドキュメントを取り込む
+
+    同じ document_id で再取り込みした場合は、本文が変わったチャンクのみエンベディングし直す。
+    """
+    import logging
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        logger.info(f"RAG ingest request received: collection={request.collection}, documents={len(request.documents)}")
+        return await _ingest(request.collection, request.documents, request.embedding_model)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in RAG ingestion: {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def _extract_text(data: bytes, filename: str, content_type: Optional[str]) -> str:
+    """アップロードされたファイルから本文テキストを取得する
+
+    テキスト・DOCX・テキスト層のあるPDFはローカルで抽出し、抽出できない部分（スキャンされたページ等）のみ
+    Geminiで本文を書き起こす（取り込み時の1回のみ）。
+    """
+    from google.genai import types
+
+    extracted = await extract_document(data, filename, content_type)
+    if extracted.fallback is None:
+        return extracted.text
+
+    mime_type = PDF_MIME_TYPE if extracted.method == "pdf" else guess_mime_type(filename, content_type)
+    async with upstream_slot("rag_extract"):
+        response = await client.aio.models.generate_content(
+            model=DEFAULT_TEXT_MODEL,
+            contents=[
+                types.Part.from_bytes(data=extracted.fallback, mime_type=mime_type),
+                "このドキュメントの本文を、段落の区切りを空行で保ったままプレーンテキストとして出力してください。"
+                "要約や説明は加えず、本文のみを出力してください。",
+            ],
+        )
+    transcribed = response.text or ""
+    if extracted.method == "binary" or len(extracted.scanned_pages) == extracted.page_count:
+        return transcribed
+    # テキスト層のあるページの後に、書き起こしたスキャンページを続ける
+    pages = ", ".join(str(number) for number in extracted.scanned_pages)
+    return f"{extracted.text}\n\n[スキャンされたページ {pages}]\n{transcribed}"
+
+
+@router.post("/ingest/file", response_model=RagIngestResponse)
+async def ingest_files(
+    files: List[UploadFile] = File(...),
+    collection: str = Form("default"),
+    embedding_model: str = Form(DEFAULT_EMBEDDING_MODEL),
+):
+    """ファイル（テキスト・PDF等）を取り込む（document_id はファイル名）"""
+    import logging
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        logger.info(f"RAG file ingest request received: collection={collection}, files={len(files)}")
+
+        async def to_document(file: UploadFile) -> RagDocument:
+            text = await _extract_text(await file.read(), file.filename or "", file.content_type)
+            return RagDocument(document_id=file.filename or "document", text=text, title=file.filename)
+
+        documents = await asyncio.gather(*(to_document(file) for file in files))
+        return await _ingest(collection, list(documents), embedding_model)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in RAG file ingestion: {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class RagQueryRequest(BaseModel):
+    question: str
+    collection: str = "default"
+    top_k: int = Field(5, ge=1, le=RAG_MAX_TOP_K)
+    min_score: float = Field(0.0, ge=-1.0, le=1.0)
+    document_ids: Optional[List[str]] = None
+    model: Optional[str] = DEFAULT_TEXT_MODEL
+    temperature: Optional[float] = 0.2
+    deadline_ms: Optional[int] = None  # 処理時間の上限（ミリ秒。X-Request-Deadline-Ms ヘッダーでも指定可）
+
+
+class RagCitation(BaseModel):
+    index: int  # 回答中の [n] に対応
+    document_id: str
+    title: Optional[str] = None
+    chunk_id: str
+    position: int
+    score: float
+    text: str
+    cited: bool  # 回答中で参照されたか
+
+
+class RagQueryResponse(BaseModel):
+    answer: str
+    model: str
+    citations: List[RagCitation]
+    retrieval_ms: float
+    generation_ms: float
+
+
+@router.post("/query", response_model=RagQueryResponse)
+async def query(request: RagQueryRequest):
+    """関連するチャンクを検索し、出典付きで回答を生成する"""
+    import logging
+    from google.genai import types
+
+    logger = logging.getLogger(__name__)
+
+    try:
+        logger.info(f"RAG query received: collection={request.collection}, top_k={request.top_k}, question_length={len(request.question)}")
+        apply_deadline(request.deadline_ms)
+        try:
+            collection = await asyncio.to_thread(rag_store.collection, request.collection)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not collection.chunks:
+            raise HTTPException(status_code=404, detail=f"コレクション '{request.collection}' にドキュメントがありません")
+
+        started = time.perf_counter()
+        [query_vector] = await embed_texts(
+            client, [request.question], collection.embedding_model, task_type="RETRIEVAL_QUERY"
+        )
+        hits = [
+            (chunk, score)
+            for chunk, score in collection.search(query_vector, request.top_k, request.document_ids)
+            if score >= request.min_score
+        ]
+        retrieval_ms = (time.perf_counter() - started) * 1000
+        metrics.observe("rag_retrieval_seconds", retrieval_ms / 1000, collection=request.collection)
+
+        if not hits:
+            return RagQueryResponse(
+                answer="関連する情報が見つかりませんでした。",
+                model=request.model,
+                citations=[],
+                retrieval_ms=retrieval_ms,
+                generation_ms=0.0,
+            )
+
+        sources = []
+        for i, (chunk, _) in enumerate(hits, start=1):
+            title = collection.documents[chunk.document_id].title or chunk.document_id
+            sources.append(f"[{i}] {title}\n{chunk.text}")
+        prompt = "資料:\n\n" + "\n\n---\n\n".join(sources) + f"\n\n質問: {request.question}"
+
+        # 検索後の残り時間が少ない場合は軽量なモデルで回答する
+        model = budget_model(request.model, "rag.query")
+        started = time.perf_counter()
+        async with upstream_slot("rag_query"):
+            response = await client.aio.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=types.GenerateContentConfig(
+                    system_instruction=(
+                        "提供された資料のみに基づいて質問に回答してください。"
+                        "根拠とした資料の番号を [1] のように文中に示してください。"
+                        "資料に答えがない場合は、その旨を回答してください。"
+                    ),
+                    temperature=request.temperature,
+                    http_options=http_options_for("default"),
+                    **budget_overrides(model),
+                ),
+            )
+        generation_ms = (time.perf_counter() - started) * 1000
+        answer = response.text or ""
+        cited = {int(n) for n in _CITATION_PATTERN.findall(answer)}
+
+        citations = [
+            RagCitation(
+                index=i,
+                document_id=chunk.document_id,
+                title=collection.documents[chunk.document_id].title,
+                chunk_id=chunk.chunk_id,
+                position=chunk.position,
+                score=score,
+                text=chunk.text,
+                cited=i in cited,
+            )
+            for i, (chunk, score) in enumerate(hits, start=1)
+        ]
+        logger.info(f"RAG query completed: chunks={len(hits)}, cited={len(cited)}, retrieval={retrieval_ms:.0f}ms, generation={generation_ms:.0f}ms")
+        return RagQueryResponse(
+            answer=answer,
+            model=model,
+            citations=citations,
+            retrieval_ms=retrieval_ms,
+            generation_ms=generation_ms,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in RAG query: {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class RagDocumentInfo(BaseModel):
+    document_id: str
+    title: Optional[str] = None
+    chunks: int
+    updated_at: float
+    metadata: Dict[str, Any] = Field(default_factory=dict)
+
+
+@router.get("/collections/{collection}/documents", response_model=List[RagDocumentInfo])
+async def list_documents(collection: str):
+    """コレクション内のドキュメント一覧"""
+    try:
+        store = await asyncio.to_thread(rag_store.collection, collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return [
+        RagDocumentInfo(
+            document_id=d.document_id,
+            title=d.title,
+            chunks=len(d.chunk_ids),
+            updated_at=d.updated_at,
+            metadata=d.metadata,
+        )
+        for d in store.documents.values()
+    ]
+
+
+@router.delete("/collections/{collection}/documents/{document_id}")
+async def delete_document(collection: str, document_id: str):
+    """ドキュメントをインデックスから削除する"""
+    try:
+        store = await asyncio.to_thread(rag_store.collection, collection)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    async with store.lock:
+        if not store.delete(document_id):
+            raise HTTPException(status_code=404, detail=f"ドキュメント '{document_id}' が見つかりません")
+        await asyncio.to_thread(store.save)
+    return {"deleted": document_id}
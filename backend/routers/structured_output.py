@@ -2,63 +2,271 @@
 構造化出力ルーター
 """
 from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, model_validator
+from typing import Optional, Dict, Any, List
 from google.genai import types
 from backend.client import client
-from backend.config import DEFAULT_TEXT_MODEL
+from backend.config import DEFAULT_TEXT_MODEL, STRUCTURED_OUTPUT_MAX_RETRIES
+from backend.deadlines import apply_deadline, budget_model, budget_overrides
+from backend.http_transport import http_options_for
+from backend.json_stream import IncrementalJSONParser
+from backend.metrics import metrics
+from backend.schema_registry import RegisteredSchema, SchemaError, schema_registry
+from backend.streaming import NDJSON_MEDIA_TYPE, STREAMING_HEADERS, ndjson_line
 
 router = APIRouter()
 
 
 class StructuredOutputRequest(BaseModel):
     prompt: str
-    schema: Dict[str, Any]  # JSON Schema
+    schema: Optional[Dict[str, Any]] = None  # JSON Schema
+    schema_id: Optional[str] = None  # 登録済みスキーマのIDまたは名前
     model: Optional[str] = "gemini-2.5-flash"  # 構造化出力に対応したモデル
+    max_retries: Optional[int] = None  # 検証失敗時の再試行回数（未指定時は設定値。指定値も設定値を上限とする）
+    deadline_ms: Optional[int] = None  # 処理時間の上限（ミリ秒。X-Request-Deadline-Ms ヘッダーでも指定可）
+
+    @model_validator(mode="after")
+    def _require_schema(self):
+        if self.schema is None and not self.schema_id:
+            raise ValueError("schema または schema_id のいずれかを指定してください")
+        return self
 
 
 class StructuredOutputResponse(BaseModel):
     data: Dict[str, Any]
     model: str
+    schema_id: Optional[str] = None
+    attempts: int = 1
+
+
+class SchemaRegisterRequest(BaseModel):
+    schema: Dict[str, Any]  # JSON Schema
+    name: Optional[str] = None
+
+
+class SchemaRegisterResponse(BaseModel):
+    schema_id: str
+    name: Optional[str] = None
+
+
+def _resolve_schema(request: StructuredOutputRequest) -> RegisteredSchema:
+    """リクエストからスキーマを解決する（インラインのスキーマは自動登録される）"""
+    if request.schema is not None:
+        try:
+            return schema_registry.register(request.schema)
+        except SchemaError as e:
+            raise HTTPException(status_code=400, detail=f"不正なスキーマです: {e}")
+    entry = schema_registry.get(request.schema_id)
+    if entry is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"スキーマ '{request.schema_id}' は登録されていません。先に /schemas で登録してください。",
+        )
+    return entry
+
+
+def _build_retry_prompt(prompt: str, previous_output: str, errors: List[str]) -> str:
+    """検証エラーをフィードバックした再試行用プロンプトを作成する"""
+    error_lines = "\n".join(f"- {err}" for err in errors[:20])
+    return (
+        f"{prompt}\n\n"
+        "前回の出力はJSON Schemaの検証に失敗しました。以下のエラーを修正し、"
+        "スキーマに厳密に従ったJSONのみを出力してください。\n"
+        f"検証エラー:\n{error_lines}\n"
+        f"前回の出力:\n{previous_output[:4000]}"
+    )
+
+
+@router.post("/schemas", response_model=SchemaRegisterResponse)
+async def register_schema(request: SchemaRegisterRequest):
+    """スキーマの登録
+
+    スキーマを検証関数にコンパイルしてキャッシュし、以降は schema_id で参照できるようにする。
+    """
+    try:
+        entry = schema_registry.register(request.schema, name=request.name)
+    except SchemaError as e:
+        raise HTTPException(status_code=400, detail=f"不正なスキーマです: {e}")
+    return SchemaRegisterResponse(schema_id=entry.schema_id, name=request.name)
+
+
+@router.get("/schemas/{schema_ref}")
+async def get_schema(schema_ref: str):
+    """登録済みスキーマの取得"""
+    entry = schema_registry.get(schema_ref)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"スキーマ '{schema_ref}' は登録されていません")
+    return {"schema_id": entry.schema_id, "name": entry.name, "schema": entry.schema}
 
 
 @router.post("/generate", response_model=StructuredOutputResponse)
 async def generate_structured_output(request: StructuredOutputRequest):
-    """構造化出力（JSON形式）"""
+    """構造化出力（JSON形式）
+
+    レスポンスは登録済みスキーマの検証関数で検証し、失敗した場合は
+    検証エラーをフィードバックして再生成する。
+    """
     import logging
     import json
-    
+    import time
+
     logger = logging.getLogger(__name__)
-    
+
     try:
         logger.info(f"Structured output request received: model={request.model}, prompt_length={len(request.prompt)}")
-        
-        # 構造化出力の設定
-        # 仕様: https://ai.google.dev/gemini-api/docs/gemini-3
-        # response_mime_typeとresponse_json_schemaを使用
-        config = types.GenerateContentConfig(
-            response_mime_type="application/json",
-            response_json_schema=request.schema,  # JSON Schemaを直接渡す
-        )
-        
-        response = client.models.generate_content(
-            model=request.model,
-            contents=request.prompt,
-            config=config,
-        )
 
-        # response.textまたはresponse.parsedを使用
-        if hasattr(response, "parsed") and response.parsed:
-            data = response.parsed
-        elif hasattr(response, "text") and response.text:
-            data = json.loads(response.text)
-        else:
-            raise ValueError("No valid response data found")
-        
-        logger.info(f"Structured output generated: model={request.model}")
-        
-        return StructuredOutputResponse(data=data, model=request.model)
+        entry = _resolve_schema(request)
+        max_retries = STRUCTURED_OUTPUT_MAX_RETRIES if request.max_retries is None else max(0, min(request.max_retries, STRUCTURED_OUTPUT_MAX_RETRIES))
+        apply_deadline(request.deadline_ms)
+
+        prompt = request.prompt
+        errors: List[str] = []
+        for attempt in range(1, max_retries + 2):
+            # 期限までの残り時間が少ない場合（再試行時を含む）は軽量なモデルで生成する
+            model = budget_model(request.model, "structured_output.generate")
+
+            # 構造化出力の設定
+            # 仕様: https://ai.google.dev/gemini-api/docs/gemini-3
+            # response_mime_typeとresponse_json_schemaを使用
+            config = types.GenerateContentConfig(
+                response_mime_type="application/json",
+                response_json_schema=entry.schema,  # JSON Schemaを直接渡す
+                http_options=http_options_for("default"),
+                **budget_overrides(model),
+            )
+            response = await client.aio.models.generate_content(
+                model=model,
+                contents=prompt,
+                config=config,
+            )
+
+            # response.textまたはresponse.parsedを使用
+            raw_text = response.text if hasattr(response, "text") and response.text else ""
+            start = time.perf_counter()
+            if hasattr(response, "parsed") and response.parsed:
+                data = response.parsed
+                errors = entry.validate(data)
+            elif raw_text:
+                try:
+                    data = json.loads(raw_text)
+                    errors = entry.validate(data)
+                except json.JSONDecodeError as e:
+                    data = None
+                    errors = [f"$: JSONとして解析できません: {e}"]
+            else:
+                raise ValueError("No valid response data found")
+            if not errors and not isinstance(data, dict):
+                errors = ["$: トップレベルはオブジェクトである必要があります"]
+            metrics.observe(
+                "structured_output_validation_seconds", time.perf_counter() - start, schema_id=entry.schema_id
+            )
+            metrics.inc(
+                "structured_output_validations_total",
+                schema_id=entry.schema_id,
+                result="invalid" if errors else "valid",
+            )
+
+            if not errors:
+                logger.info(f"Structured output generated: model={model}, attempts={attempt}")
+                return StructuredOutputResponse(
+                    data=data, model=model, schema_id=entry.schema_id, attempts=attempt
+                )
+
+            logger.warning(
+                f"Structured output failed validation: attempt={attempt}, errors={errors[:5]}"
+            )
+            if attempt <= max_retries:
+                metrics.inc("structured_output_retries_total", schema_id=entry.schema_id)
+                prompt = _build_retry_prompt(
+                    request.prompt, raw_text or json.dumps(data, ensure_ascii=False), errors
+                )
+
+        raise HTTPException(
+            status_code=502,
+            detail={
+                "message": "モデルの出力がスキーマの検証に失敗しました",
+                "schema_id": entry.schema_id,
+                "errors": errors[:20],
+            },
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in structured output generation: {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.post("/generate/stream")
+async def stream_structured_output(request: StructuredOutputRequest):
+    """構造化出力のストリーミング（NDJSON）
+
+    ストリーミング生成APIの出力をインクリメンタルにパースし、トップレベルのフィールドや
+    配列要素が構文的に完結した時点で1行ずつ送信する。
+
+    イベント:
+        - {"type": "field", "path": キー, "data": 値}
+        - {"type": "item", "path": キー（ルート配列の場合は空文字）, "index": n, "data": 要素}
+        - {"type": "field_end", "path": キー, "count": 要素数}（配列フィールドの終端）
+        - {"type": "done", "schema_id": ..., "valid": bool, "errors": [...]}
+        - {"type": "error", "detail": ...}
+
+    送信済みの要素は取り消せないため、ストリーミングでは検証失敗時の再試行は行わず、
+    最終的な検証結果を done イベントで通知する。
+    """
+    import logging
+    import json
+    import time
+
+    logger = logging.getLogger(__name__)
+    logger.info(f"Structured output stream request received: model={request.model}, prompt_length={len(request.prompt)}")
+
+    entry = _resolve_schema(request)
+    config = types.GenerateContentConfig(
+        response_mime_type="application/json",
+        response_json_schema=entry.schema,
+        http_options=http_options_for("streaming"),
+    )
+
+    async def event_stream():
+        parser = IncrementalJSONParser()
+        started = time.perf_counter()
+        first_event_at = None
+        try:
+            stream = await client.aio.models.generate_content_stream(
+                model=request.model,
+                contents=request.prompt,
+                config=config,
+            )
+            async for chunk in stream:
+                text = chunk.text if hasattr(chunk, "text") and chunk.text else ""
+                if not text:
+                    continue
+                for event in parser.feed(text):
+                    if first_event_at is None:
+                        first_event_at = time.perf_counter() - started
+                        metrics.observe("structured_output_stream_first_event_seconds", first_event_at)
+                    yield ndjson_line(event)
+
+            try:
+                data = json.loads(parser.text)
+                errors = entry.validate(data)
+            except json.JSONDecodeError as e:
+                errors = [f"$: JSONとして解析できません: {e}"]
+            metrics.inc(
+                "structured_output_validations_total",
+                schema_id=entry.schema_id,
+                result="invalid" if errors else "valid",
+            )
+            logger.info(
+                f"Structured output stream completed: model={request.model}, valid={not errors}, "
+                f"elapsed={time.perf_counter() - started:.2f}s"
+            )
+            yield ndjson_line(
+                {"type": "done", "schema_id": entry.schema_id, "valid": not errors, "errors": errors[:20]}
+            )
+        except Exception as e:
+            logger.error(f"Error in structured output stream: {type(e).__name__}: {str(e)}", exc_info=True)
+            yield ndjson_line({"type": "error", "detail": str(e)})
+
+    return StreamingResponse(event_stream(), media_type=NDJSON_MEDIA_TYPE, headers=STREAMING_HEADERS)
@@ -6,6 +6,9 @@ from pydantic import BaseModel
 from typing import Optional, List
 from backend.client import client
 from backend.config import DEFAULT_TEXT_MODEL, DEFAULT_CHAT_MODEL
+from backend.deadlines import apply_deadline, budget_model, budget_overrides
+from backend.http_transport import http_options_for
+from backend.semantic_cache import embed_prompt, semantic_cache
 
 router = APIRouter()
 
@@ -15,42 +18,111 @@ class TextGenerateRequest(BaseModel):
     model: Optional[str] = DEFAULT_TEXT_MODEL
     temperature: Optional[float] = 0.7
     max_tokens: Optional[int] = None
+    use_cache: bool = True  # セマンティックキャッシュを使用するか
+    deadline_ms: Optional[int] = None  # 処理時間の上限（ミリ秒。X-Request-Deadline-Ms ヘッダーでも指定可）
 
 
 class TextGenerateResponse(BaseModel):
     text: str
     model: str
+    cached: bool = False
+    cache_entry_id: Optional[str] = None  # キャッシュから返した場合のみ。誤ったヒットの報告（/cache/feedback）に使用
+    cache_similarity: Optional[float] = None
 
 
 @router.post("/generate", response_model=TextGenerateResponse)
 async def generate_text(request: TextGenerateRequest):
-    """テキスト生成"""
+    """テキスト生成
+
+    セマンティックキャッシュが有効な場合、類似したプロンプトへの回答済みの結果を返す。
+    期限（deadline_ms）までの残り時間が少ない場合は軽量なモデルで生成する。
+    """
     import logging
     logger = logging.getLogger(__name__)
     
     try:
         logger.info(f"Text generation request received: model={request.model}, prompt_length={len(request.prompt)}")
         
+        route = "text.generate"
+        apply_deadline(request.deadline_ms)
+        model = budget_model(request.model, route)
+
+        # キャッシュは同じモデル・生成設定の回答のみを対象とする
+        use_cache = request.use_cache and semantic_cache.enabled_for(route)
+        namespace = f"{route}|{model}|{request.temperature}|{request.max_tokens}"
+        embedding = None
+        if use_cache:
+            hit = semantic_cache.lookup_exact(route, namespace, request.prompt)
+            if hit is None:
+                try:
+                    embedding = await embed_prompt(client, request.prompt)
+                    hit = semantic_cache.lookup(route, namespace, embedding)
+                except Exception as e:
+                    # キャッシュの障害では生成を止めない
+                    logger.warning(f"Semantic cache lookup failed: {type(e).__name__}: {str(e)}")
+            if hit is not None:
+                logger.info(f"Semantic cache hit: entry_id={hit.entry.entry_id}, similarity={hit.similarity:.4f}, exact={hit.exact}")
+                return TextGenerateResponse(
+                    text=hit.entry.response,
+                    model=model,
+                    cached=True,
+                    cache_entry_id=hit.entry.entry_id,
+                    cache_similarity=hit.similarity,
+                )
+
         config = {}
         if request.temperature is not None:
             config["temperature"] = request.temperature
         if request.max_tokens is not None:
             config["max_output_tokens"] = request.max_tokens
+        config.update(budget_overrides(model))
 
-        logger.info(f"Calling Gemini API with config: {config}")
-        response = client.models.generate_content(
-            model=request.model,
+        logger.info(f"Calling Gemini API with config: model={model}, {config}")
+        response = await client.aio.models.generate_content(
+            model=model,
             contents=request.prompt,
-            config=config if config else None,
+            config={**config, "http_options": http_options_for("default")},
         )
         
         logger.info(f"Gemini API response received: response_length={len(response.text) if response.text else 0}")
-        return TextGenerateResponse(text=response.text, model=request.model)
+        if embedding is not None and response.text:
+            semantic_cache.store(namespace, request.prompt, embedding, response.text)
+        return TextGenerateResponse(text=response.text, model=model)
     except Exception as e:
         logger.error(f"Error in text generation: {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class CacheFeedbackRequest(BaseModel):
+    cache_entry_id: str
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """セマンティックキャッシュの統計（ヒット率・誤ヒット率など）"""
+    return semantic_cache.stats()
+
+
+@router.post("/cache/feedback")
+async def report_cache_false_hit(request: CacheFeedbackRequest):
+    """キャッシュされた回答が質問に合っていなかったことを報告する
+
+    報告されたエントリは削除され、誤ヒットとして集計される。キャッシュから返されていないエントリは報告できない。
+    """
+    if not semantic_cache.report_false_hit(request.cache_entry_id):
+        raise HTTPException(
+            status_code=404, detail=f"キャッシュから返されたエントリ '{request.cache_entry_id}' が見つかりません"
+        )
+    return {"removed": request.cache_entry_id}
+
+
+@router.delete("/cache")
+async def clear_cache():
+    """セマンティックキャッシュを全て削除する"""
+    semantic_cache.clear()
+    return {"cleared": True}
+
+
 class ChatMessage(BaseModel):
     role: str
     content: str
@@ -60,6 +132,7 @@ class ChatRequest(BaseModel):
     messages: List[ChatMessage]
     model: Optional[str] = DEFAULT_CHAT_MODEL
     temperature: Optional[float] = 0.7
+    deadline_ms: Optional[int] = None  # 処理時間の上限（ミリ秒。X-Request-Deadline-Ms ヘッダーでも指定可）
 
 
 class ChatResponse(BaseModel):
@@ -81,12 +154,16 @@ async def chat(request: ChatRequest):
                     {"role": "model", "parts": [{"text": msg.content}]}
                 )
 
-        response = client.models.generate_content(
-            model=request.model,
+        apply_deadline(request.deadline_ms)
+        model = budget_model(request.model, "text.chat")
+        config = {"temperature": request.temperature, **budget_overrides(model)}
+
+        response = await client.aio.models.generate_content(
+            model=model,
             contents=contents,
-            config={"temperature": request.temperature},
+            config={**config, "http_options": http_options_for("default")},
         )
-        return ChatResponse(message=response.text, model=request.model)
+        return ChatResponse(message=response.text, model=model)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1,11 +1,26 @@
 """
-動画生成ルーター（Veo）
+動画生成・分析ルーター
 """
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, List, Optional, Tuple
+from backend.audio_utils import decode_to_pcm, merge_overlap, pcm_to_wav, plan_segments, slice_pcm
 from backend.client import client
-from backend.config import DEFAULT_VIDEO_MODEL
+from backend.concurrency import bounded_gather, upstream_slot
+from backend.config import (
+    DEFAULT_ANALYSIS_MODEL,
+    DEFAULT_TEXT_MODEL,
+    DEFAULT_VIDEO_MODEL,
+    TRANSCRIBE_CONCURRENCY,
+    TRANSCRIBE_OVERLAP_SECONDS,
+    TRANSCRIBE_SEGMENT_SECONDS,
+    VIDEO_ANALYZE_CONCURRENCY,
+    VIDEO_BATCH_FRAMES,
+)
+from backend.http_transport import http_options_for
+from backend.metrics import metrics
+from backend.uploads import remove_quietly, spool_upload
+from backend.video_frames import VideoFrame, extract_keyframes, format_timestamp
 
 router = APIRouter()
 
@@ -45,7 +60,7 @@ async def generate_video(request: VideoGenerateRequest):
             )
         
         # 代替として、動画生成をテキストで説明する
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-2.5-flash",
             contents=f"Describe a video: {request.prompt}",
         )
@@ -64,3 +79,226 @@ async def generate_video(request: VideoGenerateRequest):
         logger.error(f"Error in video generation: {type(e).__name__}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+
+class VideoAnalyzeBatch(BaseModel):
+    index: int
+    start: float
+    end: float
+    frames: int
+    summary: Optional[str] = None
+    error: Optional[str] = None
+
+
+class VideoAnalyzeResponse(BaseModel):
+    analysis: str
+    model: str
+    frames_extracted: int
+    frames_selected: int
+    keyframe_timestamps: List[float]
+    batches: List[VideoAnalyzeBatch]
+    transcript: Optional[str] = None
+
+
+async def _transcribe_video_audio(path: str, language: str) -> List[Tuple[float, float, str]]:
+    """動画の音声を区間ごとに文字起こしする（音声トラックが無い場合は空）"""
+    import asyncio
+    import logging
+    from google.genai import types
+
+    logger = logging.getLogger(__name__)
+    try:
+        pcm, rate = await decode_to_pcm(path)
+    except RuntimeError as e:
+        logger.warning(f"Video audio could not be decoded, skipping transcript: {e}")
+        return []
+    if not pcm:
+        return []
+
+    segments = await asyncio.to_thread(plan_segments, pcm, rate, TRANSCRIBE_SEGMENT_SECONDS, TRANSCRIBE_OVERLAP_SECONDS)
+    instruction = f"この音声を言語コード「{language}」で文字起こししてください。文字起こしのテキストのみを出力してください。"
+
+    async def transcribe_segment(start: float, end: float) -> str:
+        wav = pcm_to_wav(slice_pcm(pcm, rate, start, end), rate)
+        async with upstream_slot("video_transcribe"):
+            response = await client.aio.models.generate_content(
+                model=DEFAULT_TEXT_MODEL,
+                contents=[instruction, types.Part.from_bytes(data=wav, mime_type="audio/wav")],
+                config=types.GenerateContentConfig(http_options=http_options_for("media")),
+            )
+        return (response.text or "").strip()
+
+    results = await bounded_gather(
+        (transcribe_segment(start, end) for start, end in segments), TRANSCRIBE_CONCURRENCY, return_exceptions=True
+    )
+    texts = []
+    for (start, end), result in zip(segments, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Video audio segment transcription failed: start={start:.1f}s, error={type(result).__name__}: {result}")
+            texts.append("")
+        else:
+            texts.append(result)
+    # 区間の重複部分を除去する
+    for i in range(1, len(texts)):
+        if texts[i - 1] and texts[i]:
+            texts[i - 1], texts[i] = merge_overlap(texts[i - 1], texts[i])
+    return [(start, end, text) for (start, end), text in zip(segments, texts) if text]
+
+
+def _transcript_between(transcript: List[Tuple[float, float, str]], start: float, end: float) -> str:
+    """指定した時間帯と重なる区間の文字起こし"""
+    return "\n".join(
+        f"[{format_timestamp(seg_start)}〜{format_timestamp(seg_end)}] {text}"
+        for seg_start, seg_end, text in transcript
+        if seg_start <= end and seg_end >= start
+    )
+
+
+def _frame_parts(frames: List[VideoFrame]) -> List[Any]:
+    """キーフレームを時刻のラベル付きでリクエストのパートにする"""
+    from google.genai import types
+
+    parts: List[Any] = []
+    for frame in frames:
+        parts.append(f"[{format_timestamp(frame.timestamp)}]")
+        parts.append(types.Part.from_bytes(data=frame.data, mime_type="image/jpeg"))
+    return parts
+
+
+@router.post("/analyze", response_model=VideoAnalyzeResponse)
+async def analyze_video(
+    file: UploadFile = File(...),
+    prompt: str = Form("この動画の内容を詳しく説明してください。"),
+    model: str = Form(DEFAULT_ANALYSIS_MODEL),
+    frame_rate: Optional[float] = Form(None, gt=0, le=10),  # 1秒あたりの抽出枚数（未指定時は VIDEO_FRAME_RATE）
+    scene_threshold: Optional[float] = Form(None, ge=0, le=1),  # 除外する差分の上限（未指定時は VIDEO_SCENE_THRESHOLD）
+    include_transcript: bool = Form(False),
+    language: str = Form("ja"),
+):
+    """動画の理解・分析
+
+    アップロードをディスクに書き出し、ffmpeg で一定間隔のフレームを抽出してほぼ同一のフレームを除き、
+    残ったキーフレーム（と任意で音声の文字起こし）のみをモデルに送る。
+    キーフレームが多い長い動画は時間順の区間に分けて並列に分析し、最後に区間ごとの結果を統合する。
+    """
+    import asyncio
+    import logging
+    import time
+    from google.genai import types
+
+    logger = logging.getLogger(__name__)
+    logger.info(f"Video analyze request received: filename={file.filename}, model={model}, include_transcript={include_transcript}")
+
+    path = await spool_upload(file)
+    try:
+        started = time.perf_counter()
+        extract_kwargs: Dict[str, Any] = {}
+        if frame_rate is not None:
+            extract_kwargs["frame_rate"] = frame_rate
+        if scene_threshold is not None:
+            extract_kwargs["threshold"] = scene_threshold
+        try:
+            (frames, extracted), transcript = await asyncio.gather(
+                extract_keyframes(path, **extract_kwargs),
+                _transcribe_video_audio(path, language) if include_transcript else asyncio.sleep(0, result=[]),
+            )
+        except RuntimeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not frames:
+            raise HTTPException(status_code=400, detail="動画からフレームを抽出できませんでした")
+        metrics.observe("video_frames_extracted", extracted)
+        metrics.observe("video_keyframes_selected", len(frames))
+        logger.info(
+            f"Video keyframes selected: extracted={extracted}, selected={len(frames)}, "
+            f"transcript_segments={len(transcript)}, elapsed={time.perf_counter() - started:.2f}s"
+        )
+
+        batches = [frames[i:i + VIDEO_BATCH_FRAMES] for i in range(0, len(frames), max(1, VIDEO_BATCH_FRAMES))]
+        # 区間の終わりは次の区間の先頭（最後の区間は最後のキーフレーム）まで
+        spans = [
+            (batch[0].timestamp, batches[i + 1][0].timestamp if i + 1 < len(batches) else batch[-1].timestamp)
+            for i, batch in enumerate(batches)
+        ]
+
+        async def analyze_batch(index: int) -> str:
+            start, end = spans[index]
+            if len(batches) == 1:
+                instruction = prompt
+            else:
+                instruction = (
+                    f"以下は動画の {format_timestamp(start)}〜{format_timestamp(end)} の区間（全{len(batches)}区間中{index + 1}番目）"
+                    f"から抽出したキーフレームです。次の依頼に答えるために必要な内容を、時刻を添えて詳しく記述してください。\n"
+                    f"依頼: {prompt}"
+                )
+            contents: List[Any] = [instruction]
+            excerpt = _transcript_between(transcript, start, end)
+            if excerpt:
+                contents.append(f"この区間の音声の文字起こし:\n{excerpt}")
+            contents.extend(_frame_parts(batches[index]))
+            async with upstream_slot("video_analyze"):
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=contents,
+                    config=types.GenerateContentConfig(http_options=http_options_for("media")),
+                )
+            return (response.text or "").strip()
+
+        results = await bounded_gather(
+            (analyze_batch(i) for i in range(len(batches))), VIDEO_ANALYZE_CONCURRENCY, return_exceptions=True
+        )
+        batch_results = []
+        for i, (batch, result) in enumerate(zip(batches, results)):
+            failed = isinstance(result, Exception)
+            if failed:
+                logger.warning(f"Video batch analysis failed: index={i}, error={type(result).__name__}: {result}")
+            metrics.inc("video_analyze_batches_total", result="error" if failed else "ok")
+            batch_results.append(VideoAnalyzeBatch(
+                index=i,
+                start=spans[i][0],
+                end=spans[i][1],
+                frames=len(batch),
+                summary=None if failed else result,
+                error=f"{type(result).__name__}: {result}" if failed else None,
+            ))
+        succeeded = [batch for batch in batch_results if batch.summary is not None]
+        if not succeeded:
+            raise HTTPException(status_code=500, detail=batch_results[0].error)
+
+        if len(batch_results) == 1:
+            analysis = succeeded[0].summary
+        else:
+            # 区間ごとの記述を統合して、元の依頼に答える
+            notes = "\n\n".join(
+                f"## {format_timestamp(batch.start)}〜{format_timestamp(batch.end)}\n"
+                + (batch.summary if batch.summary is not None else "（この区間は分析できませんでした）")
+                for batch in batch_results
+            )
+            async with upstream_slot("video_analyze"):
+                response = await client.aio.models.generate_content(
+                    model=model,
+                    contents=(
+                        "以下は1本の動画を時間順の区間に分けて記述したものです。"
+                        f"動画全体について次の依頼に答えてください。\n依頼: {prompt}\n\n{notes}"
+                    ),
+                )
+            analysis = (response.text or "").strip()
+
+        logger.info(
+            f"Video analysis completed: batches={len(batch_results)}, failed={len(batch_results) - len(succeeded)}, "
+            f"elapsed={time.perf_counter() - started:.2f}s"
+        )
+        return VideoAnalyzeResponse(
+            analysis=analysis,
+            model=model,
+            frames_extracted=extracted,
+            frames_selected=len(frames),
+            keyframe_timestamps=[frame.timestamp for frame in frames],
+            batches=batch_results,
+            transcript="\n".join(text for _, _, text in transcript) if include_transcript else None,
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in video analysis: {type(e).__name__}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        remove_quietly(path)
@@ -0,0 +1,357 @@
+"""
+JSON Schemaレジストリ
+
+構造化出力で使用するスキーマを一度だけ登録し、ハッシュまたは名前で参照できるようにする。
+登録時にスキーマを検証関数（クロージャ）へコンパイルしてキャッシュするため、
+レスポンスごとの検証はスキーマの解釈を伴わずに実行される。
+
+対応キーワード（Gemini構造化出力で使われるサブセット）:
+type, enum, const, properties, required, additionalProperties, items,
+minItems, maxItems, minimum, maximum, exclusiveMinimum, exclusiveMaximum,
+minLength, maxLength, pattern, anyOf, oneOf, allOf, nullable, $ref ($defs/definitions)
+"""
+import hashlib
+import json
+import re
+import threading
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.cache import LRUCache
+from backend.config import SCHEMA_CACHE_SIZE
+
+# 検証関数: (値, JSONパス, エラー格納先) -> None
+Validator = Callable[[Any, str, List[str]], None]
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool)
+    or (isinstance(v, float) and v.is_integer()),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+class SchemaError(ValueError):
+    """スキーマ自体が不正な場合の例外"""
+
+
+def schema_hash(schema: Dict[str, Any]) -> str:
+    """スキーマの正規化JSONからIDを計算する"""
+    canonical = json.dumps(schema, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _resolve_pointer(root: Dict[str, Any], ref: str) -> Dict[str, Any]:
+    """ローカル参照（#/$defs/Name など）を解決する"""
+    if not ref.startswith("#"):
+        raise SchemaError(f"外部参照には対応していません: {ref}")
+    node: Any = root
+    for token in ref.lstrip("#").strip("/").split("/"):
+        if not token:
+            continue
+        token = token.replace("~1", "/").replace("~0", "~")
+        if not isinstance(node, dict) or token not in node:
+            raise SchemaError(f"参照を解決できません: {ref}")
+        node = node[token]
+    if not isinstance(node, dict):
+        raise SchemaError(f"参照先がスキーマではありません: {ref}")
+    return node
+
+
+def _optional_int(value: Any) -> Optional[int]:
+    """minItems などの整数のキーワードを変換する（未指定はNone）"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise TypeError(f"整数が必要なキーワードに {value!r} が指定されています")
+    return int(value)
+
+
+def compile_schema(schema: Dict[str, Any]) -> Validator:
+    """JSON Schemaを検証関数にコンパイルする
+
+    Args:
+        schema: JSON Schema（dict）
+
+    Returns:
+        Validator: 値を検証し、エラーメッセージをリストへ追加する関数
+
+    Raises:
+        SchemaError: スキーマが不正な場合
+    """
+    if not isinstance(schema, dict):
+        raise SchemaError("スキーマはオブジェクトである必要があります")
+
+    refs: Dict[str, Validator] = {}
+
+    def compile_ref(ref: str) -> Validator:
+        if ref not in refs:
+            # 再帰的なスキーマに対応するため、先に遅延参照を登録してからコンパイルする
+            holder: List[Validator] = []
+            refs[ref] = lambda v, p, e: holder[0](v, p, e)
+            holder.append(compile_node(_resolve_pointer(schema, ref), ref))
+        return refs[ref]
+
+    def compile_node(node: Any, path: str) -> Validator:
+        """スキーマノードをコンパイルする（キーワードの値の型が不正な場合も SchemaError にする）"""
+        try:
+            return build_node(node, path)
+        except SchemaError:
+            raise
+        except (re.error, TypeError, ValueError, AttributeError) as e:
+            raise SchemaError(f"{path}: 不正なスキーマです（{type(e).__name__}: {e}）") from e
+
+    def build_node(node: Any, path: str) -> Validator:
+        if node is True or node == {}:
+            return lambda v, p, e: None
+        if node is False:
+            return lambda v, p, e: e.append(f"{p}: 値は許可されていません")
+        if not isinstance(node, dict):
+            raise SchemaError(f"{path}: 不正なスキーマノード: {node!r}")
+
+        checks: List[Validator] = []
+
+        if "$ref" in node:
+            checks.append(compile_ref(node["$ref"]))
+
+        types = node.get("type")
+        if types is not None:
+            type_list = [types] if isinstance(types, str) else types
+            if not isinstance(type_list, list) or not all(isinstance(t, str) for t in type_list):
+                raise SchemaError(f"{path}: type は文字列または文字列の配列である必要があります")
+            type_list = [t.lower() for t in type_list]
+            if node.get("nullable") and "null" not in type_list:
+                type_list.append("null")
+            unknown = [t for t in type_list if t not in _TYPE_CHECKS]
+            if unknown:
+                raise SchemaError(f"{path}: 未対応のtype: {unknown}")
+            type_fns = [_TYPE_CHECKS[t] for t in type_list]
+            expected = "|".join(type_list)
+
+            def check_type(v: Any, p: str, e: List[str]) -> None:
+                if not any(fn(v) for fn in type_fns):
+                    e.append(f"{p}: {expected} が必要ですが {type(v).__name__} でした")
+
+            checks.append(check_type)
+        nullable = bool(node.get("nullable"))
+
+        if "enum" in node:
+            allowed = list(node["enum"])
+
+            def check_enum(v: Any, p: str, e: List[str]) -> None:
+                if v not in allowed and not (nullable and v is None):
+                    e.append(f"{p}: {allowed} のいずれかである必要があります")
+
+            checks.append(check_enum)
+
+        if "const" in node:
+            const = node["const"]
+            checks.append(
+                lambda v, p, e: None if v == const else e.append(f"{p}: {const!r} である必要があります")
+            )
+
+        # object
+        properties = {
+            k: compile_node(s, f"{path}.properties.{k}") for k, s in (node.get("properties") or {}).items()
+        }
+        required = list(node.get("required") or [])
+        additional = node.get("additionalProperties", True)
+        additional_fn = None if additional is True else compile_node(additional, f"{path}.additionalProperties")
+        if properties or required or additional_fn is not None:
+
+            def check_object(v: Any, p: str, e: List[str]) -> None:
+                if not isinstance(v, dict):
+                    return
+                for key in required:
+                    if key not in v:
+                        e.append(f"{p}: 必須プロパティ '{key}' がありません")
+                for key, item in v.items():
+                    fn = properties.get(key)
+                    if fn is not None:
+                        fn(item, f"{p}.{key}", e)
+                    elif additional_fn is not None:
+                        additional_fn(item, f"{p}.{key}", e)
+
+            checks.append(check_object)
+
+        # array
+        items_fn = compile_node(node["items"], f"{path}.items") if isinstance(node.get("items"), dict) else None
+        min_items = _optional_int(node.get("minItems"))
+        max_items = _optional_int(node.get("maxItems"))
+        if items_fn is not None or min_items is not None or max_items is not None:
+
+            def check_array(v: Any, p: str, e: List[str]) -> None:
+                if not isinstance(v, list):
+                    return
+                if min_items is not None and len(v) < min_items:
+                    e.append(f"{p}: 要素数は{min_items}以上である必要があります")
+                if max_items is not None and len(v) > max_items:
+                    e.append(f"{p}: 要素数は{max_items}以下である必要があります")
+                if items_fn is not None:
+                    for i, item in enumerate(v):
+                        items_fn(item, f"{p}[{i}]", e)
+
+            checks.append(check_array)
+
+        # number
+        bounds = [
+            (node.get("minimum"), lambda v, b: v >= b, "以上"),
+            (node.get("maximum"), lambda v, b: v <= b, "以下"),
+            (node.get("exclusiveMinimum"), lambda v, b: v > b, "より大きい"),
+            (node.get("exclusiveMaximum"), lambda v, b: v < b, "より小さい"),
+        ]
+        bounds = [(float(b), cmp, label) for b, cmp, label in bounds if isinstance(b, (int, float))]
+        if bounds:
+
+            def check_number(v: Any, p: str, e: List[str]) -> None:
+                if isinstance(v, bool) or not isinstance(v, (int, float)):
+                    return
+                for bound, cmp, label in bounds:
+                    if not cmp(v, bound):
+                        e.append(f"{p}: {bound}{label}である必要があります")
+
+            checks.append(check_number)
+
+        # string
+        min_length = _optional_int(node.get("minLength"))
+        max_length = _optional_int(node.get("maxLength"))
+        pattern = re.compile(node["pattern"]) if node.get("pattern") else None
+        if min_length is not None or max_length is not None or pattern is not None:
+
+            def check_string(v: Any, p: str, e: List[str]) -> None:
+                if not isinstance(v, str):
+                    return
+                if min_length is not None and len(v) < min_length:
+                    e.append(f"{p}: 文字数は{min_length}以上である必要があります")
+                if max_length is not None and len(v) > max_length:
+                    e.append(f"{p}: 文字数は{max_length}以下である必要があります")
+                if pattern is not None and not pattern.search(v):
+                    e.append(f"{p}: パターン {pattern.pattern} に一致しません")
+
+            checks.append(check_string)
+
+        # 合成
+        for keyword in ("anyOf", "oneOf"):
+            if keyword in node:
+                branches = [compile_node(s, f"{path}.{keyword}[{i}]") for i, s in enumerate(node[keyword])]
+                exactly_one = keyword == "oneOf"
+
+                def check_branches(
+                    v: Any, p: str, e: List[str], branches=branches, exactly_one=exactly_one, keyword=keyword
+                ) -> None:
+                    matched = 0
+                    for fn in branches:
+                        branch_errors: List[str] = []
+                        fn(v, p, branch_errors)
+                        if not branch_errors:
+                            matched += 1
+                            if not exactly_one:
+                                return
+                    if matched == 0 or (exactly_one and matched != 1):
+                        e.append(f"{p}: {keyword} の条件を満たしません")
+
+                checks.append(check_branches)
+        for i, sub in enumerate(node.get("allOf") or []):
+            checks.append(compile_node(sub, f"{path}.allOf[{i}]"))
+
+        if not checks:
+            return lambda v, p, e: None
+        if len(checks) == 1:
+            return checks[0]
+
+        def check_all(v: Any, p: str, e: List[str]) -> None:
+            for fn in checks:
+                fn(v, p, e)
+
+        return check_all
+
+    return compile_node(schema, "$")
+
+
+@dataclass(frozen=True)
+class RegisteredSchema:
+    """登録済みスキーマ"""
+
+    schema_id: str
+    schema: Dict[str, Any]
+    validator: Validator
+    name: Optional[str] = None
+
+    def validate(self, value: Any) -> List[str]:
+        """値を検証し、エラーメッセージのリストを返す（空なら妥当）"""
+        errors: List[str] = []
+        self.validator(value, "$", errors)
+        return errors
+
+
+class SchemaRegistry:
+    """スキーマをハッシュ・名前で管理し、コンパイル済み検証関数をキャッシュする
+
+    インラインのスキーマは LRU で保持し、名前を付けて登録したスキーマは
+    インラインのスキーマに追い出されないよう LRU とは別に保持する。
+    """
+
+    def __init__(self, max_entries: int = SCHEMA_CACHE_SIZE) -> None:
+        self._entries: LRUCache[RegisteredSchema] = LRUCache(max_entries=max_entries)
+        self._named: Dict[str, RegisteredSchema] = {}
+        self._named_ids: Dict[str, RegisteredSchema] = {}
+        self._lock = threading.Lock()
+
+    def register(self, schema: Dict[str, Any], name: Optional[str] = None) -> RegisteredSchema:
+        """スキーマを登録する（同一スキーマは再コンパイルしない）
+
+        Args:
+            schema: JSON Schema
+            name: 任意の登録名（指定時は LRU から追い出されない）
+
+        Returns:
+            RegisteredSchema: 登録済みスキーマ
+
+        Raises:
+            SchemaError: スキーマが不正な場合
+        """
+        schema_id = schema_hash(schema)
+        entry = self._lookup(schema_id)
+        if entry is None:
+            entry = RegisteredSchema(schema_id=schema_id, schema=schema, validator=compile_schema(schema))
+        if not name:
+            if schema_id not in self._named_ids:
+                self._entries.set(schema_id, entry)
+            return entry
+        if entry.name != name:
+            entry = replace(entry, name=name)
+        with self._lock:
+            previous = self._named.get(name)
+            self._named[name] = entry
+            self._named_ids = {e.schema_id: e for e in self._named.values()}
+        self._entries.pop(schema_id)
+        # 名前を付け替えられて名前がなくなったスキーマは、IDで参照できるよう LRU に戻す
+        if previous is not None and previous.schema_id not in self._named_ids:
+            self._entries.set(previous.schema_id, replace(previous, name=None))
+        return entry
+
+    def get(self, ref: str) -> Optional[RegisteredSchema]:
+        """スキーマIDまたは登録名で取得する"""
+        with self._lock:
+            entry = self._named.get(ref)
+        return entry or self._lookup(ref)
+
+    def _lookup(self, schema_id: str) -> Optional[RegisteredSchema]:
+        """スキーマIDで取得する（名前付きのスキーマを優先する）"""
+        with self._lock:
+            entry = self._named_ids.get(schema_id)
+        return entry or self._entries.get(schema_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュ統計を返す"""
+        with self._lock:
+            named = len(self._named)
+        return {**self._entries.stats(), "named": named}
+
+
+# グローバルスキーマレジストリ
+schema_registry = SchemaRegistry()
@@ -0,0 +1,205 @@
+"""
+セマンティックレスポンスキャッシュ
+
+言い回しの異なる同一内容のプロンプトに対して、生成済みの回答を再利用する。
+プロンプトをエンベディングし、同じルート・モデル・生成設定（名前空間）の中で
+最も類似した回答済みプロンプトの類似度が閾値以上であればキャッシュを返す。
+完全一致のプロンプトはエンベディングせずに返す。
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from google.genai import types
+
+from backend.config import (
+    SEMANTIC_CACHE_EMBEDDING_MODEL,
+    SEMANTIC_CACHE_MAX_ENTRIES,
+    SEMANTIC_CACHE_ROUTES,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL_SECONDS,
+)
+from backend.http_transport import http_options_for
+from backend.metrics import metrics
+from backend.vector_index import VectorIndex
+
+
+@dataclass
+class SemanticCacheEntry:
+    """キャッシュ済みの回答"""
+
+    entry_id: str
+    namespace: str
+    prompt: str
+    response: str
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+@dataclass
+class SemanticCacheHit:
+    """キャッシュヒットの結果"""
+
+    entry: SemanticCacheEntry
+    similarity: float
+    exact: bool
+
+
+def _prompt_key(namespace: str, prompt: str) -> str:
+    """完全一致判定用のキー（前後の空白と連続空白を正規化）"""
+    normalized = " ".join(prompt.split())
+    return hashlib.sha256(f"{namespace}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """名前空間ごとのベクトルインデックスとLRU追い出しを持つセマンティックキャッシュ"""
+
+    def __init__(
+        self,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        ttl_seconds: int = SEMANTIC_CACHE_TTL_SECONDS,
+        routes: Sequence[str] = SEMANTIC_CACHE_ROUTES,
+    ) -> None:
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.routes = set(routes)
+        self._entries: "OrderedDict[str, SemanticCacheEntry]" = OrderedDict()
+        self._exact: Dict[str, str] = {}
+        self._indexes: Dict[str, VectorIndex] = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.false_hits = 0
+        self.evictions = 0
+
+    def enabled_for(self, route: str) -> bool:
+        """ルートでキャッシュが有効かどうか"""
+        return route in self.routes
+
+    def _expired(self, entry: SemanticCacheEntry) -> bool:
+        return time.time() - entry.created_at > self.ttl_seconds
+
+    def _remove(self, entry_id: str) -> Optional[SemanticCacheEntry]:
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return None
+        self._exact.pop(_prompt_key(entry.namespace, entry.prompt), None)
+        index = self._indexes.get(entry.namespace)
+        if index is not None:
+            index.remove(entry_id)
+        return entry
+
+    def _record_hit(self, route: str, entry: SemanticCacheEntry, similarity: float, exact: bool) -> SemanticCacheHit:
+        self._entries.move_to_end(entry.entry_id)
+        entry.hits += 1
+        self.hits += 1
+        metrics.inc("semantic_cache_requests_total", route=route, result="exact_hit" if exact else "hit")
+        return SemanticCacheHit(entry=entry, similarity=similarity, exact=exact)
+
+    def lookup_exact(self, route: str, namespace: str, prompt: str) -> Optional[SemanticCacheHit]:
+        """完全一致（空白の違いを除く）のキャッシュを検索する"""
+        with self._lock:
+            entry_id = self._exact.get(_prompt_key(namespace, prompt))
+            entry = self._entries.get(entry_id) if entry_id else None
+            if entry is None:
+                return None
+            if self._expired(entry):
+                self._remove(entry.entry_id)
+                return None
+            return self._record_hit(route, entry, 1.0, exact=True)
+
+    def lookup(self, route: str, namespace: str, embedding: Sequence[float]) -> Optional[SemanticCacheHit]:
+        """最も類似したキャッシュを検索する（閾値未満・期限切れの場合はNone）"""
+        with self._lock:
+            index = self._indexes.get(namespace)
+            for entry_id, similarity in index.search(embedding, k=3) if index else []:
+                entry = self._entries.get(entry_id)
+                if entry is None or self._expired(entry):
+                    self._remove(entry_id)
+                    continue
+                metrics.observe("semantic_cache_similarity", similarity, route=route)
+                if similarity >= self.threshold:
+                    return self._record_hit(route, entry, similarity, exact=False)
+                break
+            self.misses += 1
+            metrics.inc("semantic_cache_requests_total", route=route, result="miss")
+            return None
+
+    def store(self, namespace: str, prompt: str, embedding: Sequence[float], response: str) -> SemanticCacheEntry:
+        """回答をキャッシュに追加し、上限を超えた分を古い順に追い出す"""
+        entry = SemanticCacheEntry(entry_id=uuid.uuid4().hex, namespace=namespace, prompt=prompt, response=response)
+        with self._lock:
+            previous = self._exact.get(_prompt_key(namespace, prompt))
+            if previous:
+                self._remove(previous)
+            index = self._indexes.setdefault(namespace, VectorIndex())
+            index.add(entry.entry_id, embedding)
+            self._entries[entry.entry_id] = entry
+            self._exact[_prompt_key(namespace, prompt)] = entry.entry_id
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return entry
+
+    def report_false_hit(self, entry_id: str) -> bool:
+        """誤ったキャッシュヒットを報告し、エントリを削除する
+
+        キャッシュから一度も返されていないエントリは誤ヒットになり得ないため、削除しない。
+
+        Returns:
+            bool: 削除した場合はTrue（存在しない場合・一度も返されていない場合はFalse）
+        """
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None or entry.hits == 0:
+                return False
+            self._remove(entry_id)
+            self.false_hits += 1
+        metrics.inc("semantic_cache_false_hits_total")
+        return True
+
+    def clear(self) -> None:
+        """全エントリを削除する"""
+        with self._lock:
+            self._entries.clear()
+            self._exact.clear()
+            self._indexes.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュ統計を返す"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "namespaces": len(self._indexes),
+                "threshold": self.threshold,
+                "routes": sorted(self.routes),
+                "hits": self.hits,
+                "misses": self.misses,
+                "false_hits": self.false_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+                "false_hit_rate": self.false_hits / self.hits if self.hits else 0.0,
+            }
+
+
+async def embed_prompt(client: Any, prompt: str) -> List[float]:
+    """キャッシュ検索用にプロンプトをエンベディングする"""
+    with metrics.timer("semantic_cache_embed_seconds"):
+        response = await client.aio.models.embed_content(
+            model=SEMANTIC_CACHE_EMBEDDING_MODEL,
+            contents=[prompt],
+            config=types.EmbedContentConfig(task_type="SEMANTIC_SIMILARITY", http_options=http_options_for("embedding")),
+        )
+    return list(response.embeddings[0].values)
+
+
+# グローバルセマンティックキャッシュ
+semantic_cache = SemanticCache()
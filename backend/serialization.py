@@ -0,0 +1,61 @@
+"""
+レスポンスの高速シリアライズ
+
+エンベディング（大量のfloat）や data URL（数MBの文字列）を返すルートでは、
+FastAPI の response_model による検証と jsonable_encoder・json.dumps の変換がCPU時間の大半を占める。
+サーバー内部で生成した信頼できるデータは検証せずにモデルを構築し、orjson で直接JSONにする。
+"""
+import json
+from typing import Any, Type, TypeVar
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson は任意
+    orjson = None
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def _default(value: Any) -> Any:
+    """orjson が直接扱えない値の変換"""
+    if isinstance(value, BaseModel):
+        # フィールドの値はそのまま渡し、入れ子のモデルも同じ経路で変換する
+        return dict(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    """JSONのバイト列に変換する（orjson が無い場合は標準の json を使用）"""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """orjson でシリアライズするJSONレスポンス（pydanticモデルをそのまま渡せる）"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def trusted_response(model_class: Type[ModelT], /, status_code: int = 200, **fields: Any) -> FastJSONResponse:
+    """サーバー内部で生成したデータから検証を省略してレスポンスを作成する
+
+    Response を直接返すため FastAPI による response_model の再検証・変換も行われない。
+    response_model はスキーマ（OpenAPI）の定義として引き続き指定しておく。
+    出力は通常の経路と同じく、未指定のフィールドは既定値、None のフィールドは null になる。
+
+    Args:
+        model_class: レスポンスモデルのクラス
+        status_code: HTTPステータスコード
+        **fields: フィールドの値（型が正しいことは呼び出し側が保証する）
+
+    Returns:
+        FastJSONResponse: JSONレスポンス
+    """
+    return FastJSONResponse(model_class.model_construct(**fields), status_code=status_code)
@@ -0,0 +1,65 @@
+"""
+ストリーミングレスポンス用ヘルパー
+
+NDJSON（1行1JSON）とServer-Sent Eventsのフレーミングを提供する。
+"""
+import json
+from typing import Any, Callable, Optional
+
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+# プロキシによるバッファリングを抑止するヘッダー
+STREAMING_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def ndjson_line(payload: Any) -> str:
+    """NDJSONの1行を作成する"""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def sse_event(event: str, data: Any, event_id: Optional[str] = None) -> str:
+    """SSEイベントを作成する
+
+    Args:
+        event: イベント種別
+        data: JSONシリアライズ可能なデータ
+        event_id: 任意のイベントID
+
+    Returns:
+        str: SSE形式のテキスト
+    """
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+class CleanupStreamingResponse(StreamingResponse):
+    """送信の成否によらず、終了時に後処理を実行する StreamingResponse
+
+    本文のジェネレーターの finally は、送信開始前にクライアントが切断した場合など
+    ジェネレーターが開始されないと実行されず、background も送信が失敗すると実行されない。
+    一時ファイルの削除など必ず必要な後処理は on_close で行う。
+    """
+
+    def __init__(self, content: Any, on_close: Callable[[], None], **kwargs: Any) -> None:
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            try:
+                # 途中で中断されたジェネレーターの finally（タスクのキャンセルなど）を直ちに実行する
+                aclose = getattr(self.body_iterator, "aclose", None)
+                if aclose is not None:
+                    await aclose()
+            finally:
+                self.on_close()
@@ -0,0 +1 @@
+"""バックエンドのテスト"""
@@ -0,0 +1,8 @@
+"""
+テスト共通設定
+
+backend.config はAPIキーが未設定の場合に例外を送出するため、テスト用のダミーキーを設定する。
+"""
+import os
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
@@ -0,0 +1,182 @@
+"""
+アドミッション制御のテスト
+"""
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+from starlette.requests import ClientDisconnect
+from starlette.responses import StreamingResponse
+
+from backend.admission import AdmissionController, AdmissionMiddleware, classify
+
+
+def _controller(max_in_flight: int = 2) -> AdmissionController:
+    return AdmissionController(
+        max_in_flight={"default": max_in_flight, "media": max_in_flight},
+        max_queue_wait=60,
+        large_upload_bytes=100,
+        max_large_uploads=1,
+        upstream_concurrency=8,
+    )
+
+
+def _scope(path: str = "/api/image/generate", content_length: int = 10) -> Dict[str, Any]:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.4"},
+        "method": "POST",
+        "path": path,
+        "headers": [(b"content-length", str(content_length).encode())],
+    }
+
+
+async def _receive() -> Dict[str, Any]:
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+def _streaming_app(started: asyncio.Event, proceed: asyncio.Event):
+    async def body():
+        yield b"first"
+        await proceed.wait()
+        yield b"second"
+
+    async def app(scope, receive, send):
+        started.set()
+        await StreamingResponse(body())(scope, receive, send)
+
+    return app
+
+
+@pytest.mark.parametrize(
+    ("method", "path", "expected"),
+    [
+        ("POST", "/api/image/generate", "media"),
+        ("POST", "/api/agent/chat/stream", "streaming"),
+        ("POST", "/api/embedding/batch", "embedding"),
+        ("POST", "/api/text/generate", "default"),
+        ("GET", "/api/image/variants/x", None),
+        ("POST", "/metrics", None),
+    ],
+)
+def test_classify(method: str, path: str, expected: str) -> None:
+    # Given / When / Then: パスとメソッドからルートの種類が決まる
+    assert classify(method, path) == expected
+
+
+def test_streaming_response_holds_slot_until_body_is_sent() -> None:
+    # Given: 本文の途中で待機するストリーミングレスポンス
+    controller = _controller()
+    started, proceed = asyncio.Event(), asyncio.Event()
+    middleware = AdmissionMiddleware(_streaming_app(started, proceed), controller, enabled=True)
+    messages: List[Dict[str, Any]] = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def main() -> int:
+        task = asyncio.create_task(middleware(_scope(), _receive, send))
+        await started.wait()
+        await asyncio.sleep(0.01)
+        during = controller.in_flight["media"]
+        proceed.set()
+        await task
+        return during
+
+    # When: 本文の送信を完了させる
+    during = asyncio.run(main())
+    # Then: 送信中は実行中として計上され、完了後に解放される
+    assert during == 1
+    assert controller.in_flight["media"] == 0
+    assert messages[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_slot_is_released_when_client_disconnects_before_body() -> None:
+    # Given: 応答の開始時にクライアントが切断済みで send が失敗する
+    controller = _controller()
+    started, proceed = asyncio.Event(), asyncio.Event()
+    middleware = AdmissionMiddleware(_streaming_app(started, proceed), controller, enabled=True)
+
+    async def send(message):
+        raise OSError("client disconnected")
+
+    # When: リクエストを処理する
+    with pytest.raises(ClientDisconnect):
+        asyncio.run(middleware(_scope(content_length=1000), _receive, send))
+    # Then: 本文を送る前に失敗しても、実行枠と大きなアップロードの枠が解放される
+    assert controller.in_flight["media"] == 0
+    assert controller.large_uploads == 0
+
+
+def test_slot_is_released_when_cancelled_before_body() -> None:
+    # Given: 応答の開始前に待機するアプリ
+    controller = _controller()
+    entered = asyncio.Event()
+
+    async def app(scope, receive, send):
+        entered.set()
+        await asyncio.sleep(60)
+
+    middleware = AdmissionMiddleware(app, controller, enabled=True)
+
+    async def main() -> None:
+        task = asyncio.create_task(middleware(_scope(content_length=1000), _receive, lambda message: None))
+        await entered.wait()
+        # When: 切断の検知などでリクエストの処理をキャンセルする
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    # Then: 実行枠と大きなアップロードの枠が解放される
+    assert controller.in_flight["media"] == 0
+    assert controller.large_uploads == 0
+
+
+def test_request_over_limit_is_rejected_with_retry_after() -> None:
+    # Given: 実行中のリクエストが上限に達している
+    controller = _controller(max_in_flight=1)
+    controller.admit("media", None)
+    called = []
+
+    async def app(scope, receive, send):
+        called.append(scope)
+
+    messages: List[Dict[str, Any]] = []
+
+    async def send(message):
+        messages.append(message)
+
+    # When: 新しいリクエストを受け付ける
+    asyncio.run(AdmissionMiddleware(app, controller, enabled=True)(_scope(), _receive, send))
+    # Then: アプリを呼ばずに 503 + Retry-After を返し、実行中の数は変わらない
+    assert called == []
+    assert messages[0]["status"] == 503
+    assert (b"retry-after", b"1") in messages[0]["headers"]
+    assert controller.in_flight["media"] == 1
+
+
+def test_concurrent_large_uploads_are_limited() -> None:
+    # Given: 大きなアップロードを1件受け付けた状態
+    controller = _controller()
+    first = controller.admit("media", 1000)
+    # When: 2件目の大きなアップロードと、小さなリクエストを判定する
+    second = controller.admit("media", 1000)
+    small = controller.admit("media", 10)
+    # Then: 大きなアップロードのみ拒否される
+    assert first.admitted and small.admitted
+    assert not second.admitted and second.reason == "large_upload"
+
+
+def test_excluded_routes_pass_through() -> None:
+    # Given: 制御対象外のリクエスト
+    controller = _controller(max_in_flight=0)
+    called = []
+
+    async def app(scope, receive, send):
+        called.append(scope["path"])
+
+    # When: 処理する
+    asyncio.run(AdmissionMiddleware(app, controller, enabled=True)({**_scope("/metrics"), "method": "GET"}, _receive, None))
+    # Then: 判定せずにアプリを呼ぶ
+    assert called == ["/metrics"]
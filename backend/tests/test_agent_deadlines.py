@@ -0,0 +1,111 @@
+"""
+エージェントのルートでの期限（deadline_ms）による軽量なモデルへの切り替えのテスト
+"""
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+
+from backend.client import client_pool
+from backend.config import AGENT_RESEARCH_MAX_BRANCHES, DEADLINE_FALLBACK_MODEL, DEADLINE_TIGHT_BUDGET_MS
+from backend.main import app
+
+
+def _response(text: str) -> SimpleNamespace:
+    return SimpleNamespace(candidates=[], function_calls=None, text=text)
+
+
+def _generate_content(text: str = "回答です") -> AsyncMock:
+    return AsyncMock(return_value=_response(text))
+
+
+def test_agent_chat_uses_requested_model_without_deadline() -> None:
+    # Given: 期限を指定しないリクエスト
+    mock = _generate_content()
+    # When: エージェントチャットを要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content", mock):
+        response = TestClient(app).post("/api/agent/chat", json={"prompt": "こんにちは", "model": "gemini-3-pro-preview"})
+    # Then: 指定したモデルで思考の設定を変えずに生成する
+    assert response.status_code == 200
+    assert response.json()["model"] == "gemini-3-pro-preview"
+    assert mock.call_args.kwargs["model"] == "gemini-3-pro-preview"
+    assert mock.call_args.kwargs["config"].thinking_config is None
+
+
+def test_agent_chat_downgrades_model_with_tight_deadline() -> None:
+    # Given: 軽量な設定に切り替える閾値より短い期限
+    mock = _generate_content()
+    body = {"prompt": "こんにちは", "model": "gemini-3-pro-preview", "deadline_ms": DEADLINE_TIGHT_BUDGET_MS // 2}
+    # When: エージェントチャットを要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content", mock):
+        response = TestClient(app).post("/api/agent/chat", json=body)
+    # Then: 軽量なモデル・思考なしで生成し、使用したモデルを返す
+    assert response.status_code == 200
+    assert response.json()["model"] == DEADLINE_FALLBACK_MODEL
+    config = mock.call_args.kwargs["config"]
+    assert mock.call_args.kwargs["model"] == DEADLINE_FALLBACK_MODEL
+    assert config.thinking_config.thinking_budget == 0
+    assert config.http_options.timeout <= DEADLINE_TIGHT_BUDGET_MS // 2 + 1000
+
+
+def test_agent_chat_stream_downgrades_model_with_tight_deadline() -> None:
+    # Given: 短い期限と、1チャンクのみ返すストリーム
+    async def stream():
+        yield SimpleNamespace(candidates=[])
+
+    mock = AsyncMock(return_value=stream())
+    body = {"prompt": "こんにちは", "model": "gemini-3-pro-preview", "deadline_ms": DEADLINE_TIGHT_BUDGET_MS // 2}
+    # When: ストリーミングで要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content_stream", mock):
+        response = TestClient(app).post("/api/agent/chat/stream", json=body)
+    # Then: 軽量なモデルで生成し、done イベントにそのモデルが含まれる
+    assert response.status_code == 200
+    assert mock.call_args.kwargs["model"] == DEADLINE_FALLBACK_MODEL
+    assert f'"model":"{DEADLINE_FALLBACK_MODEL}"' in response.text
+
+
+def test_agent_research_downgrades_all_stages_with_tight_deadline() -> None:
+    # Given: 短い期限と、分解・サブクエリ・統合に応答する上流
+    async def generate_content(model, contents, config):
+        if config.response_mime_type == "application/json":
+            return _response('{"sub_questions": ["Q1", "Q2"]}')
+        return _response(f"answer:{contents}")
+
+    mock = AsyncMock(side_effect=generate_content)
+    body = {"prompt": "調査して", "deadline_ms": DEADLINE_TIGHT_BUDGET_MS // 2}
+    # When: リサーチを要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content", mock):
+        response = TestClient(app).post("/api/agent/research", json=body)
+    # Then: すべての段階が軽量なモデルで実行される
+    assert response.status_code == 200
+    assert response.json()["model"] == DEADLINE_FALLBACK_MODEL
+    assert mock.call_count == 4
+    assert {call.kwargs["model"] for call in mock.call_args_list} == {DEADLINE_FALLBACK_MODEL}
+
+
+def test_agent_research_caps_client_max_branches() -> None:
+    # Given: 設定値を大きく超える max_branches と、それ以上のサブ質問を返す上流
+    sub_questions = ", ".join(f'"Q{i}"' for i in range(AGENT_RESEARCH_MAX_BRANCHES * 4))
+
+    async def generate_content(model, contents, config):
+        if config.response_mime_type == "application/json":
+            return _response(f'{{"sub_questions": [{sub_questions}]}}')
+        return _response(f"answer:{contents}")
+
+    mock = AsyncMock(side_effect=generate_content)
+    body = {"prompt": "調査して", "max_branches": 10_000, "concurrency": 10_000}
+    # When: リサーチを要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content", mock):
+        response = TestClient(app).post("/api/agent/research", json=body)
+    # Then: サブクエリは設定値の上限までに抑えられる
+    assert response.status_code == 200
+    assert len(response.json()["branches"]) == AGENT_RESEARCH_MAX_BRANCHES
+    assert mock.call_args_list[0].kwargs["config"].response_json_schema["properties"]["sub_questions"]["maxItems"] == AGENT_RESEARCH_MAX_BRANCHES
+
+
+def test_agent_chat_rejects_invalid_deadline() -> None:
+    # Given: 数値でない期限
+    # When: エージェントチャットを要求する
+    response = TestClient(app).post("/api/agent/chat", json={"prompt": "こんにちは", "deadline_ms": "soon"})
+    # Then: 422 になる
+    assert response.status_code == 422
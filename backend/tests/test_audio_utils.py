@@ -0,0 +1,191 @@
+"""
+音声データ処理ユーティリティ（区間分割・重複除去）と長時間文字起こし・長文TTSストリーミングのテスト
+"""
+from array import array
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.audio_utils import merge_overlap, plan_segments, slice_pcm
+
+_RATE = 1000
+
+
+def _pcm(seconds: float, silent_at: tuple = ()) -> bytes:
+    """一定の振幅の信号（silent_at の秒の前後0.1秒は無音）"""
+    samples = array("h", [1000] * int(seconds * _RATE))
+    for second in silent_at:
+        center = int(second * _RATE)
+        for i in range(max(0, center - 100), min(len(samples), center + 100)):
+            samples[i] = 0
+    return samples.tobytes()
+
+
+def test_short_audio_is_single_segment() -> None:
+    # Given: 区間長＋探索範囲以下の音声（境界値）
+    pcm = _pcm(15)
+    # When: 区間に分割する
+    segments = plan_segments(pcm, _RATE, segment_seconds=10, overlap_seconds=1, search_seconds=5)
+    # Then: 全体が1区間になる
+    assert segments == [(0.0, 15.0)]
+
+
+def test_empty_audio_is_single_empty_segment() -> None:
+    # Given / When: 空のPCM
+    segments = plan_segments(b"", _RATE, segment_seconds=10, overlap_seconds=1)
+    # Then: 長さ0の1区間になる
+    assert segments == [(0.0, 0.0)]
+
+
+def test_long_audio_cuts_near_silence_with_overlap() -> None:
+    # Given: 11秒付近に無音がある35秒の音声
+    pcm = _pcm(35, silent_at=(11,))
+    # When: 10秒の区間・1秒の重複で分割する
+    segments = plan_segments(pcm, _RATE, segment_seconds=10, overlap_seconds=1, search_seconds=2)
+    # Then: 最初の区切りは無音付近になり、以降の区間は前の区切りから1秒重複して全体を覆う
+    assert 10.8 <= segments[0][1] <= 11.2
+    assert segments[1][0] == pytest.approx(segments[0][1] - 1)
+    assert segments[-1][1] == 35.0
+    assert all(start < end for start, end in segments)
+
+
+@pytest.mark.parametrize(
+    ("segment_seconds", "overlap_seconds", "search_seconds", "message"),
+    [
+        (-10, 1, 5, "区間長は正の値である必要があります"),
+        (0, 0, 5, "区間長は正の値である必要があります"),
+        (0.0001, 0, 5, "区間長は正の値である必要があります"),
+        (10, -1, 5, "重複秒数と探索範囲は0以上である必要があります"),
+        (10, 1, -1, "重複秒数と探索範囲は0以上である必要があります"),
+        (10, 10, 5, "重複秒数は区間長未満である必要があります"),
+    ],
+)
+def test_invalid_parameters_raise_instead_of_looping(
+    segment_seconds: float, overlap_seconds: float, search_seconds: float, message: str
+) -> None:
+    # Given: 区間が前進しない・意味を持たない分割パラメータ
+    pcm = _pcm(60)
+    # When / Then: 無限ループせず ValueError になる
+    with pytest.raises(ValueError, match=message):
+        plan_segments(pcm, _RATE, segment_seconds, overlap_seconds, search_seconds)
+
+
+def test_slice_pcm() -> None:
+    # Given: 2秒のPCM
+    pcm = _pcm(2)
+    # When / Then: 秒単位で切り出され、範囲外は切り詰められる
+    assert len(slice_pcm(pcm, _RATE, 0.5, 1.5)) == _RATE * 2
+    assert slice_pcm(pcm, _RATE, 3, 4) == b""
+
+
+def test_merge_overlap_removes_duplicated_text() -> None:
+    # Given: 末尾と先頭が重複した2つの文字起こし
+    previous = "今日は良い天気ですね。散歩に行きましょう"
+    current = "散歩に行きましょう。公園まで歩きます。"
+    # When: 重複を除去する
+    merged_previous, merged_current = merge_overlap(previous, current)
+    # Then: 重複部分は前の区間にのみ残る
+    assert merged_previous + merged_current == "今日は良い天気ですね。散歩に行きましょう。公園まで歩きます。"
+
+
+def test_merge_overlap_keeps_text_without_enough_match() -> None:
+    # Given: 一致が min_match 未満の2つの文字起こし
+    # When / Then: そのまま返る
+    assert merge_overlap("abcdefg", "xyzabc") == ("abcdefg", "xyzabc")
+
+
+@pytest.mark.parametrize(
+    "form",
+    [{"segment_seconds": "-5"}, {"segment_seconds": "0.01"}, {"segment_seconds": "601"}, {"overlap_seconds": "-1"}],
+)
+def test_transcribe_long_rejects_out_of_range_parameters(form: dict) -> None:
+    # Given: 範囲外の区間長・重複秒数
+    from backend.main import app
+
+    # When: 長時間文字起こしを要求する
+    response = TestClient(app).post(
+        "/api/audio/transcribe/long", data=form, files={"file": ("a.wav", b"RIFF", "audio/wav")}
+    )
+    # Then: 処理を始める前に 422 になる
+    assert response.status_code == 422
+
+
+def test_transcribe_long_rejects_overlap_not_shorter_than_segment() -> None:
+    # Given: 区間長以上の重複秒数
+    from backend.main import app
+
+    # When: 長時間文字起こしを要求する
+    response = TestClient(app).post(
+        "/api/audio/transcribe/long",
+        data={"segment_seconds": "10", "overlap_seconds": "10"},
+        files={"file": ("a.wav", b"RIFF", "audio/wav")},
+    )
+    # Then: 400 になる
+    assert response.status_code == 400
+    assert response.json()["detail"] == "overlap_seconds は segment_seconds より小さい値を指定してください"
+
+
+def _audio_response(data: bytes, mime_type: str = "audio/L16;codec=pcm;rate=24000") -> SimpleNamespace:
+    part = SimpleNamespace(inline_data=SimpleNamespace(data=data, mime_type=mime_type))
+    return SimpleNamespace(candidates=[SimpleNamespace(content=SimpleNamespace(parts=[part]))])
+
+
+def test_audio_stream_concatenates_pcm_chunks_after_retry() -> None:
+    # Given: 2チャンクに分かれるテキストと、初回のみ失敗する上流
+    from backend.client import client_pool
+    from backend.main import app
+
+    mock = AsyncMock(side_effect=[RuntimeError("temporary"), _audio_response(b"AA"), _audio_response(b"BB")])
+    body = {"text": "あ" * 30 + "。" + "い" * 30 + "。", "max_chunk_chars": 40, "concurrency": 1}
+    # When: 長文TTSをストリーミングで要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content", mock):
+        response = TestClient(app).post("/api/audio/generate/stream", json=body)
+    # Then: WAVヘッダーに続けて各チャンクのPCMが順に返る
+    assert response.status_code == 200
+    assert response.headers["x-audio-chunks"] == "2"
+    assert response.content[:4] == b"RIFF"
+    assert response.content[44:] == b"AABB"
+
+
+def test_audio_stream_returns_error_when_first_chunk_is_not_pcm() -> None:
+    # Given: PCM以外の形式を返す上流
+    from backend.client import client_pool
+    from backend.main import app
+
+    mock = AsyncMock(return_value=_audio_response(b"ID3", "audio/mpeg"))
+    # When: 長文TTSをストリーミングで要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content", mock):
+        response = TestClient(app).post("/api/audio/generate/stream", json={"text": "こんにちは。"})
+    # Then: 空のWAVではなく 500 になる
+    assert response.status_code == 500
+    assert response.json()["detail"] == "Unsupported audio format for streaming: audio/mpeg"
+
+
+def test_audio_stream_returns_error_when_first_chunk_keeps_failing() -> None:
+    # Given: 再試行しても失敗する上流
+    from backend.client import client_pool
+    from backend.main import app
+
+    mock = AsyncMock(side_effect=RuntimeError("upstream down"))
+    # When: 長文TTSをストリーミングで要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content", mock):
+        response = TestClient(app).post("/api/audio/generate/stream", json={"text": "こんにちは。"})
+    # Then: 1回再試行した後に 500 になる
+    assert response.status_code == 500
+    assert response.json()["detail"] == "upstream down"
+    assert mock.call_count == 2
+
+
+@pytest.mark.parametrize(
+    "body", [{"max_chunk_chars": 1}, {"max_chunk_chars": 100_000}, {"concurrency": 0}, {"concurrency": 1_000}]
+)
+def test_audio_stream_rejects_out_of_range_parameters(body: dict) -> None:
+    # Given: 範囲外のチャンク文字数・同時実行数
+    from backend.main import app
+
+    # When: 長文TTSをストリーミングで要求する
+    response = TestClient(app).post("/api/audio/generate/stream", json={"text": "こんにちは。", **body})
+    # Then: 上流を呼び出す前に 422 になる
+    assert response.status_code == 422
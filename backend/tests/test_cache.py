@@ -0,0 +1,134 @@
+"""
+インメモリLRUキャッシュと SingleFlight のテスト
+"""
+import asyncio
+
+import pytest
+
+from backend.cache import LRUCache, SingleFlight
+
+
+def test_lru_cache_evicts_least_recently_used() -> None:
+    # Given: 2件まで保持するキャッシュ
+    cache: LRUCache[int] = LRUCache(max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    # When: 3件目を格納する
+    cache.set("c", 3)
+    # Then: 最も使われていない "b" が追い出される
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_lru_cache_evicts_by_total_size() -> None:
+    # Given: 合計サイズ上限が10バイトのキャッシュ
+    cache: LRUCache[bytes] = LRUCache(max_entries=10, max_bytes=10, sizeof=len)
+    cache.set("a", b"x" * 6)
+    # When: 上限を超える値を格納する
+    cache.set("b", b"y" * 6)
+    # Then: 古い値が追い出される
+    assert "a" not in cache
+    assert cache.stats()["bytes"] == 6
+
+
+def test_lru_cache_expires_entries_after_ttl() -> None:
+    # Given: 有効期限10秒のキャッシュと、操作できる時計
+    now = [0.0]
+    cache: LRUCache[int] = LRUCache(max_entries=10, ttl_seconds=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    now[0] = 5.0
+    cache.set("b", 2)
+    # When: "a" の格納から10秒経過する
+    now[0] = 10.0
+    # Then: "a" は見つからず、期限内の "b" は取得できる
+    assert cache.get("a") is None
+    assert "a" not in cache
+    assert cache.get("b") == 2
+    assert cache.stats()["expirations"] == 1
+    assert cache.stats()["entries"] == 1
+
+
+def test_lru_cache_set_renews_ttl() -> None:
+    # Given: 有効期限10秒のキャッシュに格納済みの値
+    now = [0.0]
+    cache: LRUCache[int] = LRUCache(max_entries=10, ttl_seconds=10, clock=lambda: now[0])
+    cache.set("a", 1)
+    # When: 期限内に同じキーで格納し直す
+    now[0] = 8.0
+    cache.set("a", 2)
+    now[0] = 15.0
+    # Then: 有効期限は格納し直した時点から数える
+    assert cache.get("a") == 2
+    now[0] = 18.0
+    assert cache.pop("a") is None
+
+
+def test_single_flight_shares_concurrent_calls() -> None:
+    # Given: 同じキーで同時に呼ばれる処理
+    flight: SingleFlight[str] = SingleFlight()
+    calls = []
+
+    async def produce() -> str:
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def main() -> list:
+        return await asyncio.gather(*(flight.run("key", produce) for _ in range(5)))
+
+    # When: 5件同時に実行する
+    results = asyncio.run(main())
+    # Then: 処理は1回だけ実行され、全員が同じ結果を受け取る
+    assert results == ["value"] * 5
+    assert len(calls) == 1
+    assert not flight.in_flight("key")
+
+
+def test_single_flight_runs_again_after_completion() -> None:
+    # Given: 完了済みのキー
+    flight: SingleFlight[int] = SingleFlight()
+    calls = []
+
+    async def produce() -> int:
+        calls.append(1)
+        return len(calls)
+
+    async def main() -> tuple:
+        return await flight.run("key", produce), await flight.run("key", produce)
+
+    # When: 同じキーで順に2回実行する
+    # Then: 結果は共有されず、それぞれ実行される
+    assert asyncio.run(main()) == (1, 2)
+
+
+def test_single_flight_propagates_error_to_all_waiters() -> None:
+    # Given: 失敗する処理
+    flight: SingleFlight[str] = SingleFlight()
+
+    async def produce() -> str:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upload failed")
+
+    async def main() -> list:
+        return await asyncio.gather(*(flight.run("key", produce) for _ in range(3)), return_exceptions=True)
+
+    # When: 3件同時に実行する
+    results = asyncio.run(main())
+    # Then: 全員に同じ例外が送出され、キーは解放される
+    assert all(isinstance(r, RuntimeError) and str(r) == "upload failed" for r in results)
+    assert not flight.in_flight("key")
+
+
+def test_single_flight_failure_without_waiters_is_raised() -> None:
+    # Given: 待機者のいない失敗する処理
+    flight: SingleFlight[str] = SingleFlight()
+
+    async def produce() -> str:
+        raise ValueError("bad")
+
+    # When / Then: 呼び出し元に例外が送出される
+    with pytest.raises(ValueError, match="bad"):
+        asyncio.run(flight.run("key", produce))
+    assert not flight.in_flight("key")
@@ -0,0 +1,182 @@
+"""
+上流通信の記録・再生（カセット）のテスト
+"""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+from google.genai import errors, types
+
+from backend.cassettes import CassetteMiss, CassetteStore, request_key
+from backend.client import client, client_pool
+
+
+def _response(text: str) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part.from_text(text=text)]))]
+    )
+
+
+_PATH = ("aio", "models", "generate_content")
+_KWARGS = {"model": "gemini-2.5-flash", "contents": "hello"}
+
+
+def test_record_then_replay_returns_same_value(tmp_path) -> None:
+    # Given: 記録モードで1回呼び出したカセット
+    recorder = CassetteStore(str(tmp_path), mode="record", latency_scale=0)
+    upstream = AsyncMock(return_value=_response("recorded"))
+    asyncio.run(recorder.call_async(_PATH, (), _KWARGS, upstream))
+    # When: 別のストアで同じリクエストを再生する
+    player = CassetteStore(str(tmp_path), mode="replay", latency_scale=0)
+    replayed = asyncio.run(player.call_async(_PATH, (), _KWARGS, AsyncMock(side_effect=AssertionError)))
+    # Then: 上流を呼び出さずに記録した結果を返す
+    assert isinstance(replayed, types.GenerateContentResponse)
+    assert replayed.text == "recorded"
+    assert upstream.await_count == 1
+
+
+def test_replay_cycles_through_recordings(tmp_path) -> None:
+    # Given: 同じリクエストを3回記録したカセット
+    recorder = CassetteStore(str(tmp_path), mode="record", latency_scale=0)
+    for text in ("a", "b", "c"):
+        asyncio.run(recorder.call_async(_PATH, (), _KWARGS, AsyncMock(return_value=_response(text))))
+    player = CassetteStore(str(tmp_path), mode="replay", latency_scale=0)
+    # When: 4回再生する
+    texts = [asyncio.run(player.call_async(_PATH, (), _KWARGS, AsyncMock())).text for _ in range(4)]
+    # Then: 記録した順に返し、最後まで返したら先頭に戻る
+    assert texts == ["a", "b", "c", "a"]
+
+
+def test_recordings_are_limited_to_max(tmp_path) -> None:
+    # Given: 2件まで保持するカセット
+    recorder = CassetteStore(str(tmp_path), mode="record", latency_scale=0, max_recordings=2)
+    # When: 3回記録する
+    for text in ("a", "b", "c"):
+        asyncio.run(recorder.call_async(_PATH, (), _KWARGS, AsyncMock(return_value=_response(text))))
+    player = CassetteStore(str(tmp_path), mode="replay", latency_scale=0)
+    # Then: 古い記録から削除される
+    texts = [asyncio.run(player.call_async(_PATH, (), _KWARGS, AsyncMock())).text for _ in range(2)]
+    assert texts == ["b", "c"]
+
+
+def test_stream_is_recorded_and_replayed(tmp_path) -> None:
+    # Given: 2チャンクを返すストリーム
+    async def stream():
+        yield _response("Hel")
+        yield _response("lo")
+
+    async def consume(store: CassetteStore, upstream) -> list:
+        result = await store.call_async(("aio", "models", "generate_content_stream"), (), _KWARGS, upstream)
+        return [chunk.text async for chunk in result]
+
+    recorder = CassetteStore(str(tmp_path), mode="record", latency_scale=0)
+    # When: 記録してから再生する
+    recorded = asyncio.run(consume(recorder, AsyncMock(return_value=stream())))
+    player = CassetteStore(str(tmp_path), mode="replay", latency_scale=0)
+    replayed = asyncio.run(consume(player, AsyncMock(side_effect=AssertionError)))
+    # Then: 同じチャンクが同じ順に返る
+    assert recorded == replayed == ["Hel", "lo"]
+
+
+def test_sync_call_is_recorded_and_replayed(tmp_path) -> None:
+    # Given: 同期呼び出しを記録したカセット
+    recorder = CassetteStore(str(tmp_path), mode="record", latency_scale=0)
+    recorder.call(("models", "generate_content"), (), _KWARGS, lambda: _response("sync"))
+    # When: 再生する
+    player = CassetteStore(str(tmp_path), mode="replay", latency_scale=0)
+    # Then: 同期・非同期で同じキーになり、どちらからも再生できる
+    assert player.call(("models", "generate_content"), (), _KWARGS, lambda: None).text == "sync"
+    assert asyncio.run(player.call_async(_PATH, (), _KWARGS, AsyncMock())).text == "sync"
+
+
+def test_request_key_ignores_http_options_and_hashes_bytes() -> None:
+    # Given: タイムアウトのみ異なるリクエストと、画像のバイト列のみ異なるリクエスト
+    config_a = types.GenerateContentConfig(temperature=0.1, http_options=types.HttpOptions(timeout=1000))
+    config_b = types.GenerateContentConfig(temperature=0.1, http_options=types.HttpOptions(timeout=9000))
+    image_a = types.Part.from_bytes(data=b"a", mime_type="image/png")
+    image_b = types.Part.from_bytes(data=b"b", mime_type="image/png")
+    # When / Then: タイムアウトはキーに影響せず、バイト列の違いはキーに反映される
+    assert request_key(_PATH, (), {"config": config_a}) == request_key(_PATH, (), {"config": config_b})
+    assert request_key(_PATH, (), {"contents": [image_a]}) != request_key(_PATH, (), {"contents": [image_b]})
+
+
+def test_replay_miss_raises(tmp_path) -> None:
+    # Given: 空のカセット
+    player = CassetteStore(str(tmp_path), mode="replay", latency_scale=0)
+    # When / Then: 未記録のリクエストは CassetteMiss になる
+    with pytest.raises(CassetteMiss, match="記録済みの結果がありません: method=aio.models.generate_content"):
+        asyncio.run(player.call_async(_PATH, (), _KWARGS, AsyncMock()))
+
+
+def test_api_error_is_recorded_and_replayed(tmp_path) -> None:
+    # Given: 429 を返す上流
+    error = errors.ClientError(429, {"error": {"code": 429, "message": "quota", "status": "RESOURCE_EXHAUSTED"}})
+    recorder = CassetteStore(str(tmp_path), mode="record", latency_scale=0)
+    with pytest.raises(errors.ClientError):
+        asyncio.run(recorder.call_async(_PATH, (), _KWARGS, AsyncMock(side_effect=error)))
+    # When: 再生する
+    player = CassetteStore(str(tmp_path), mode="replay", latency_scale=0)
+    # Then: 同じコードのエラーが送出される
+    with pytest.raises(errors.ClientError, match="429") as raised:
+        asyncio.run(player.call_async(_PATH, (), _KWARGS, AsyncMock()))
+    assert raised.value.code == 429
+
+
+def test_unsupported_result_is_not_recorded(tmp_path) -> None:
+    # Given: JSONで保存できない結果を返す上流
+    result = object()
+    recorder = CassetteStore(str(tmp_path), mode="record", latency_scale=0)
+    # When: 記録モードで呼び出す
+    returned = asyncio.run(recorder.call_async(_PATH, (), _KWARGS, AsyncMock(return_value=result)))
+    # Then: 結果はそのまま返るが記録されず、再生では CassetteMiss になる
+    assert returned is result
+    player = CassetteStore(str(tmp_path), mode="replay", latency_scale=0)
+    with pytest.raises(CassetteMiss):
+        asyncio.run(player.call_async(_PATH, (), _KWARGS, AsyncMock()))
+
+
+def test_invalid_mode_raises(tmp_path) -> None:
+    # Given / When / Then: 未対応のモードは ValueError になる
+    with pytest.raises(ValueError, match="未対応のカセットモードです: playback"):
+        CassetteStore(str(tmp_path), mode="playback")
+
+
+def test_image_chat_is_replayed_from_cassette(tmp_path) -> None:
+    # Given: 記録モードで2ターンの画像チャットを記録したカセット
+    from backend.main import app
+
+    turns = ["猫の絵を描いて", "背景を青にして"]
+    upstream = AsyncMock(side_effect=[_response("1枚目"), _response("2枚目")])
+    with patch.object(client, "cassette", CassetteStore(str(tmp_path), mode="record", latency_scale=0)), \
+            patch.object(client_pool.keys[0].client.aio.models, "generate_content", upstream):
+        recorded = [
+            TestClient(app).post("/api/image/chat", json={"message": m, "session_id": "record"}).json()["text"]
+            for m in turns
+        ]
+    # When: 再生モードで同じ会話を送る
+    unreachable = AsyncMock(side_effect=AssertionError("上流を呼び出しました"))
+    with patch.object(client, "cassette", CassetteStore(str(tmp_path), mode="replay", latency_scale=0)), \
+            patch.object(client_pool.keys[0].client.aio.models, "generate_content", unreachable):
+        responses = [
+            TestClient(app).post("/api/image/chat", json={"message": m, "session_id": "replay"}) for m in turns
+        ]
+    # Then: 上流を呼び出さずに記録した応答が返り、2ターン目は会話履歴を含めて送信されている
+    assert recorded == ["1枚目", "2枚目"]
+    assert [r.status_code for r in responses] == [200, 200]
+    assert [r.json()["text"] for r in responses] == recorded
+    assert len(upstream.call_args_list[1].kwargs["contents"]) == 3
+    assert unreachable.await_count == 0
+
+
+def test_warm_up_is_skipped_in_replay_mode() -> None:
+    # Given: 再生モード
+    from backend import main
+
+    warm_up = AsyncMock()
+    with patch.object(main.cassettes, "mode", "replay"), patch.object(main, "warm_up", warm_up):
+        # When: アプリを起動・終了する
+        with TestClient(main.app):
+            pass
+    # Then: 接続のウォームアップは行わない
+    assert warm_up.call_count == 0
@@ -0,0 +1,44 @@
+"""
+クライアントプールのリソース所有キーの記録のテスト
+"""
+import time
+from types import SimpleNamespace
+
+from backend.client_pool import ClientPool, PooledKey
+
+
+def _pool(**kwargs) -> ClientPool:
+    return ClientPool([PooledKey(key_id="key0", client=None), PooledKey(key_id="key1", client=None)], **kwargs)
+
+
+def test_owner_is_recorded_by_name_and_uri() -> None:
+    # Given: 2つのキーのプール
+    pool = _pool()
+    # When: key1 で作成したファイルの所有キーを記録する
+    pool.register_owner(SimpleNamespace(name="files/abc", uri="https://example.com/files/abc"), pool.keys[1])
+    # Then: 名前・URIのいずれでも所有キーが分かる
+    assert pool.owner_of("files/abc") is pool.keys[1]
+    assert pool.owner_of("https://example.com/files/abc") is pool.keys[1]
+    assert pool.owner_of("files/unknown") is None
+
+
+def test_owners_are_bounded_by_max_entries() -> None:
+    # Given: 所有キーの記録を2件までとするプール
+    pool = _pool(max_owners=2)
+    # When: 3つのリソースの所有キーを記録する
+    for i in range(3):
+        pool.register_owner(SimpleNamespace(name=f"cachedContents/{i}"), pool.keys[0])
+    # Then: 最も古い記録は破棄され、記録数は上限を超えない
+    assert pool.owner_of("cachedContents/0") is None
+    assert pool.owner_of("cachedContents/2") is pool.keys[0]
+    assert pool.stats()["pinned_resources"] == 2
+
+
+def test_owners_expire_after_ttl() -> None:
+    # Given: 所有キーの記録の保持時間が短いプール
+    pool = _pool(owner_ttl_seconds=0.05)
+    pool.register_owner(SimpleNamespace(name="files/old"), pool.keys[0])
+    # When: 保持時間が経過する
+    time.sleep(0.1)
+    # Then: 期限切れの記録は使われない（任意のキーに振り分けられる）
+    assert pool.owner_of("files/old") is None
@@ -0,0 +1,61 @@
+"""
+レスポンス圧縮のエンコーディング選択のテスト
+"""
+import pytest
+
+from backend.compression import available_encodings, negotiate_encoding
+
+_SERVER = ["zstd", "br", "gzip"]
+
+
+@pytest.mark.parametrize(
+    ("accept_encoding", "expected"),
+    [
+        ("gzip", "gzip"),
+        ("gzip, deflate, br, zstd", "zstd"),  # q値が同じ場合はサーバー側の優先順
+        ("GZIP, Br", "br"),  # 大文字小文字を区別しない
+        ("gzip;q=1.0, br;q=0.5", "gzip"),  # q値の高いものを選ぶ
+        ("br;q=0.8, gzip ; q=0.9", "gzip"),  # パラメータ前後の空白を許容する
+        ("*", "zstd"),  # ワイルドカードはすべてを許可する
+        ("zstd;q=0, *;q=0.5", "br"),  # 明示した q=0 はワイルドカードより優先する
+    ],
+)
+def test_negotiate_encoding_selects_best(accept_encoding: str, expected: str) -> None:
+    # Given: クライアントの Accept-Encoding とサーバーの対応エンコーディング
+    # When: エンコーディングを選ぶ
+    # Then: 期待するエンコーディングになる
+    assert negotiate_encoding(accept_encoding, _SERVER) == expected
+
+
+@pytest.mark.parametrize(
+    "accept_encoding",
+    [
+        "",  # ヘッダーなし
+        "identity",  # 圧縮を要求しない
+        "deflate, compress",  # 対応するエンコーディングが無い
+        "gzip;q=0, br;q=0, zstd;q=0",  # すべて拒否
+        "*;q=0",  # ワイルドカードで拒否
+        "gzip;q=abc",  # 不正なq値は0として扱う
+        " , ;q=1, ",  # 名前の無い項目のみ
+    ],
+)
+def test_negotiate_encoding_returns_none_when_nothing_acceptable(accept_encoding: str) -> None:
+    # Given: 対応するエンコーディングを受け付けない Accept-Encoding
+    # When: エンコーディングを選ぶ
+    # Then: 圧縮しない（None）
+    assert negotiate_encoding(accept_encoding, _SERVER) is None
+
+
+def test_negotiate_encoding_without_server_encodings() -> None:
+    # Given: サーバー側の対応エンコーディングが無い（圧縮が無効）
+    # When / Then: 常に圧縮しない
+    assert negotiate_encoding("gzip, br, zstd", []) is None
+
+
+def test_available_encodings_keeps_preferred_order() -> None:
+    # Given: 未知の名前を含む優先順
+    # When: 使用できるエンコーディングを取得する
+    encodings = available_encodings(["gzip", "unknown", "zstd"])
+    # Then: 優先順を保ち、未知の名前は除かれる
+    assert encodings[0] == "gzip"
+    assert "unknown" not in encodings
@@ -0,0 +1,135 @@
+"""
+ドキュメントのバッチ分析の再試行判定と一時ファイルの削除のテスト
+"""
+import asyncio
+import io
+import os
+from types import SimpleNamespace
+from typing import List
+from unittest.mock import AsyncMock, patch
+
+import httpx
+import pytest
+from fastapi import UploadFile
+from google.genai import errors
+from starlette.requests import ClientDisconnect
+
+from backend.client import client_pool
+from backend.routers import document
+from backend.routers.document import _is_retryable, analyze_documents_batch
+
+
+def _api_error(code: int) -> errors.APIError:
+    cls = errors.ServerError if code >= 500 else errors.ClientError
+    return cls(code, {"error": {"code": code, "message": "error", "status": "ERROR"}})
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        _api_error(408),
+        _api_error(429),
+        _api_error(500),
+        _api_error(503),
+        httpx.ConnectError("connection refused"),
+        httpx.ReadTimeout("read timed out"),
+        httpx.RemoteProtocolError("server disconnected"),
+    ],
+)
+def test_transient_errors_are_retried(error: BaseException) -> None:
+    # Given: タイムアウト・レート制限・サーバーエラー・通信エラー
+    # When / Then: 再試行する
+    assert _is_retryable(error) is True
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        _api_error(400),
+        _api_error(403),
+        _api_error(404),
+        ValueError("ファイルサイズが上限を超えています"),
+        KeyError("text"),
+        TypeError("unexpected"),
+        RuntimeError("unexpected"),
+        httpx.HTTPStatusError("bad", request=httpx.Request("GET", "https://example.com"), response=httpx.Response(500)),
+    ],
+)
+def test_other_errors_are_not_retried(error: BaseException) -> None:
+    # Given: リクエストの誤り、ファイルの不備、想定外の例外
+    # When / Then: 再試行しない
+    assert _is_retryable(error) is False
+
+
+def _recording_spool(paths: List[str]):
+    spool_upload = document.spool_upload
+
+    async def spool(upload: UploadFile) -> str:
+        path = await spool_upload(upload)
+        paths.append(path)
+        return path
+
+    return spool
+
+
+async def _batch_response():
+    files = [UploadFile(io.BytesIO(b"hello"), filename="a.txt"), UploadFile(io.BytesIO(b"world"), filename="b.txt")]
+    return await analyze_documents_batch(
+        prompt="要約して", files=files, archive=None, model="gemini-2.5-flash", concurrency=None, max_retries=None
+    )
+
+
+def test_batch_removes_spooled_files_after_streaming() -> None:
+    # Given: 2ファイルのバッチと、常に成功する上流
+    paths: List[str] = []
+    messages: list = []
+    mock = AsyncMock(return_value=SimpleNamespace(text="要約"))
+
+    async def receive() -> dict:
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        messages.append(message)
+
+    async def run() -> None:
+        response = await _batch_response()
+        assert all(os.path.exists(path) for path in paths)
+        await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+
+    # When: レスポンスを最後まで送信する
+    with patch.object(document, "spool_upload", _recording_spool(paths)), patch.object(
+        client_pool.keys[0].client.aio.models, "generate_content", mock
+    ):
+        asyncio.run(run())
+    # Then: 全ファイルの結果が送信され、一時ファイルは削除される
+    body = b"".join(message.get("body", b"") for message in messages)
+    assert body.count(b'"type":"result"') == 2
+    assert len(paths) == 2
+    assert not any(os.path.exists(path) for path in paths)
+
+
+def test_batch_removes_spooled_files_when_client_disconnects_before_body() -> None:
+    # Given: 応答の開始時点で切断しているクライアント
+    paths: List[str] = []
+    mock = AsyncMock(return_value=SimpleNamespace(text="要約"))
+
+    async def receive() -> dict:
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        raise OSError("connection reset")
+
+    async def run() -> None:
+        response = await _batch_response()
+        with pytest.raises(ClientDisconnect):
+            await response({"type": "http", "asgi": {"spec_version": "2.4"}}, receive, send)
+
+    # When: レスポンスを送信する
+    with patch.object(document, "spool_upload", _recording_spool(paths)), patch.object(
+        client_pool.keys[0].client.aio.models, "generate_content", mock
+    ):
+        asyncio.run(run())
+    # Then: 本文のジェネレーターが開始されなくても一時ファイルは削除され、上流も呼び出されない
+    assert len(paths) == 2
+    assert not any(os.path.exists(path) for path in paths)
+    assert mock.call_count == 0
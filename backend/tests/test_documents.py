@@ -0,0 +1,191 @@
+"""
+ドキュメントのテキスト抽出（DOCX・PDF・フォールバック・キャッシュ・プロセスプール）のテスト
+"""
+import asyncio
+import io
+import zipfile
+from concurrent.futures import Executor, Future
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+from unittest.mock import patch
+
+import pypdf
+import pytest
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from backend import documents
+from backend.documents import extract_document, extract_document_sync
+
+_W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+
+def _docx(body: str) -> bytes:
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("word/document.xml", f"<w:document {_W}><w:body>{body}</w:body></w:document>")
+    return out.getvalue()
+
+
+def _pdf(pages: List[Optional[str]]) -> bytes:
+    """ページごとのテキスト（None はテキスト層の無いページ）からPDFを作成する"""
+    writer = pypdf.PdfWriter()
+    for text in pages:
+        page = writer.add_blank_page(612, 792)
+        if text is None:
+            continue
+        font = DictionaryObject({
+            NameObject("/Type"): NameObject("/Font"),
+            NameObject("/Subtype"): NameObject("/Type1"),
+            NameObject("/BaseFont"): NameObject("/Helvetica"),
+        })
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+        stream = DecodedStreamObject()
+        stream.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode())
+        page.replace_contents(stream)
+    out = io.BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+class _FakeExecutor(Executor):
+    """submit の結果を差し替えられる Executor"""
+
+    def __init__(self, error: Optional[BaseException] = None) -> None:
+        self.error = error
+        self.shut_down = False
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        if self.error is not None:
+            raise self.error
+        return Future()  # 完了しない
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self.shut_down = True
+
+
+def test_docx_paragraphs_tabs_and_breaks() -> None:
+    # Given: 段落・タブ・改行を含むDOCX
+    data = _docx(
+        "<w:p><w:r><w:t>見出し</w:t></w:r></w:p>"
+        "<w:p><w:r><w:t>項目</w:t><w:tab/><w:t>値</w:t><w:br/><w:t>次の行</w:t></w:r></w:p>"
+    )
+    # When: テキストを抽出する
+    result = extract_document_sync(data, "a.docx", None)
+    # Then: 段落は行、タブ・改行はそのまま文字として取り出される
+    assert result.method == "docx"
+    assert result.text == "見出し\n項目\t値\n次の行"
+    assert result.fallback is None
+
+
+def test_docx_exceeding_decompressed_limit_falls_back_to_binary() -> None:
+    # Given: 展開後のサイズが上限を超える（圧縮率の高い）DOCX
+    data = _docx("<w:p><w:r><w:t>" + "a" * 10_000 + "</w:t></w:r></w:p>")
+    # When: 上限を小さくしてテキストを抽出する
+    with patch.object(documents, "DOCUMENT_DOCX_MAX_XML_BYTES", 1_000):
+        result = extract_document_sync(data, "bomb.docx", None)
+    # Then: 展開せずに元のファイルを送る
+    assert result.method == "binary"
+    assert result.fallback == data
+
+
+def test_pdf_sends_only_scanned_pages_as_pdf() -> None:
+    # Given: テキスト層のあるページと無いページが混在するPDF
+    data = _pdf(["This page has a text layer long enough", None, "Another page with a text layer here"])
+    # When: テキストを抽出する
+    result = extract_document_sync(data, "mixed.pdf", None)
+    # Then: テキスト層の無いページのみを切り出したPDFが添付される
+    assert result.method == "pdf"
+    assert result.page_count == 3
+    assert result.scanned_pages == [2]
+    assert "This page has a text layer long enough" in result.text
+    assert "[ページ 2]\n（テキスト層なし: 添付のPDFを参照）" in result.text
+    assert len(pypdf.PdfReader(io.BytesIO(result.fallback)).pages) == 1
+
+
+def test_fully_scanned_pdf_sends_original_file() -> None:
+    # Given: すべてのページにテキスト層が無いPDF
+    data = _pdf([None, None])
+    # When: テキストを抽出する
+    result = extract_document_sync(data, "scan.pdf", None)
+    # Then: 元のファイルをそのまま添付する
+    assert result.scanned_pages == [1, 2]
+    assert result.fallback == data
+
+
+@pytest.mark.parametrize(
+    ("data", "filename"),
+    [(b"\x00\x01binary", "image.bin"), (b"%PDF-1.4 broken", "broken.pdf"), (b"not a zip", "broken.docx")],
+)
+def test_unknown_or_broken_files_fall_back_to_binary(data: bytes, filename: str) -> None:
+    # Given: 未対応の形式・壊れたPDF・壊れたDOCX
+    # When: テキストを抽出する
+    result = asyncio.run(extract_document(data, filename, None))
+    # Then: 元のファイルをそのまま送る
+    assert result.method == "binary"
+    assert result.fallback == data
+
+
+def test_extraction_is_cached_by_content_hash() -> None:
+    # Given: 同じ内容でファイル名の異なるテキストファイル
+    data = "キャッシュのテスト".encode("utf-8")
+
+    async def run():
+        return await extract_document(data, "a.txt", None), await extract_document(data, "b.txt", None)
+
+    # When: 2回抽出する（スレッドで実行する）
+    with patch.object(documents, "_get_executor", return_value=None), patch.object(
+        documents, "extract_document_sync", wraps=extract_document_sync
+    ) as sync:
+        first, second = asyncio.run(run())
+    # Then: 2回目はキャッシュから返す
+    assert first is second
+    assert first.text == "キャッシュのテスト"
+    assert sync.call_count == 1
+
+
+def test_broken_process_pool_falls_back_to_thread_and_recycles_pool() -> None:
+    # Given: ワーカーが異常終了したプロセスプール
+    executor = _FakeExecutor(BrokenProcessPool("worker died"))
+    data = "プール異常のテスト".encode("utf-8")
+    # When: テキストを抽出する
+    with patch.object(documents, "_executor", executor), patch.object(documents, "_get_executor", return_value=executor):
+        result = asyncio.run(extract_document(data, "a.txt", None))
+        recycled = documents._executor
+    # Then: スレッドで抽出し、壊れたプールは破棄される
+    assert result.method == "text"
+    assert result.text == "プール異常のテスト"
+    assert executor.shut_down is True
+    assert recycled is None
+
+
+def test_extraction_timeout_recycles_pool_and_sends_original_file() -> None:
+    # Given: 抽出が終わらないプロセスプール
+    executor = _FakeExecutor()
+    data = "タイムアウトのテスト".encode("utf-8")
+    # When: 制限時間を短くしてテキストを抽出する
+    with patch.object(documents, "_executor", executor), patch.object(
+        documents, "_get_executor", return_value=executor
+    ), patch.object(documents, "DOCUMENT_EXTRACT_TIMEOUT_SECONDS", 0.05):
+        result = asyncio.run(extract_document(data, "a.txt", None))
+        recycled = documents._executor
+    # Then: 元のファイルを送り、プールは作り直される（結果はキャッシュしない）
+    assert result.method == "binary"
+    assert result.fallback == data
+    assert executor.shut_down is True
+    assert recycled is None
+    with patch.object(documents, "_get_executor", return_value=None):
+        assert asyncio.run(extract_document(data, "a.txt", None)).method == "text"
+
+
+def test_shutdown_executor_stops_pool() -> None:
+    # Given: 起動済みのプロセスプール
+    executor = _FakeExecutor()
+    # When: アプリケーションの終了時の停止処理を呼び出す
+    with patch.object(documents, "_executor", executor):
+        documents.shutdown_executor()
+        remaining = documents._executor
+    # Then: プールは停止され、参照も外される
+    assert executor.shut_down is True
+    assert remaining is None
@@ -0,0 +1,65 @@
+"""
+エンベディングのバイナリ表現への変換のテスト
+"""
+import numpy as np
+import pytest
+
+from backend.embeddings import encode_embeddings
+
+_EMBEDDINGS = [[0.5, -0.25, 0.0, 1.0], [-2.0, 1.0, 0.5, 0.0]]
+
+
+@pytest.mark.parametrize(("dtype", "numpy_dtype"), [("float32", "<f4"), ("float16", "<f2")])
+def test_float_encoding_round_trips(dtype: str, numpy_dtype: str) -> None:
+    # Given: 2件の4次元エンベディング
+    # When: 浮動小数点の型に変換する
+    data, scales = encode_embeddings(_EMBEDDINGS, dtype)
+    # Then: 行優先のリトルエンディアンとして復元でき、scale は無い
+    restored = np.frombuffer(data, dtype=numpy_dtype).reshape(2, 4)
+    assert np.allclose(restored, _EMBEDDINGS)
+    assert scales is None
+
+
+def test_int8_encoding_scales_each_vector() -> None:
+    # Given: 最大絶対値が異なる2件のエンベディング
+    # When: int8 に変換する
+    data, scales = encode_embeddings(_EMBEDDINGS, "int8")
+    # Then: ベクトルごとの最大絶対値が127に対応し、int8値 × scale で元の値に近い値が得られる
+    quantized = np.frombuffer(data, dtype=np.int8).reshape(2, 4)
+    assert scales == pytest.approx([1.0 / 127, 2.0 / 127])
+    assert quantized[0, 3] == 127 and quantized[1, 0] == -127
+    assert np.allclose(quantized * np.asarray(scales)[:, None], _EMBEDDINGS, atol=0.01)
+
+
+def test_int8_encoding_of_zero_vector() -> None:
+    # Given: すべて0のエンベディング
+    # When: int8 に変換する
+    data, scales = encode_embeddings([[0.0, 0.0]], "int8")
+    # Then: 0除算せず、scale は1になる
+    assert data == b"\x00\x00"
+    assert scales == [1.0]
+
+
+def test_binary_encoding_packs_sign_bits() -> None:
+    # Given: 9次元のエンベディング（正の要素のみ1）
+    embedding = [1.0, -1.0, 0.0, 2.0, 0.1, -0.1, 0.0, 0.0, 3.0]
+    # When: binary に変換する
+    data, scales = encode_embeddings([embedding], "binary")
+    # Then: 上位ビットから詰められ、1ベクトル ceil(9/8)=2 バイトになる
+    assert data == bytes([0b10011000, 0b10000000])
+    assert scales is None
+
+
+@pytest.mark.parametrize("embeddings", [[[1.0, 2.0], [3.0]], [1.0, 2.0]])
+def test_ragged_embeddings_raise(embeddings: list) -> None:
+    # Given: 次元数が揃っていない、または2次元でないエンベディング
+    # When / Then: ValueError になる
+    with pytest.raises(ValueError, match="エンベディングの次元数が揃っていません"):
+        encode_embeddings(embeddings, "float32")
+
+
+def test_unsupported_dtype_raises() -> None:
+    # Given: 未対応の型
+    # When / Then: ValueError になる
+    with pytest.raises(ValueError, match="未対応の型です: bfloat16"):
+        encode_embeddings(_EMBEDDINGS, "bfloat16")
@@ -0,0 +1,53 @@
+"""
+ルートの種類ごとのHTTPタイムアウト設定のテスト
+"""
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend import deadlines
+from backend.client import client_pool
+from backend.http_transport import ROUTE_TIMEOUTS, http_options_for
+from backend.main import app
+
+
+@pytest.mark.parametrize("route_class", ["default", "streaming", "media", "embedding"])
+def test_http_options_use_route_timeout(route_class: str) -> None:
+    # Given: 期限の無いリクエスト
+    # When: ルートの種類ごとの HttpOptions を作成する
+    options = http_options_for(route_class)
+    # Then: ルートの種類のタイムアウト（ミリ秒）が設定される
+    assert options.timeout == int(ROUTE_TIMEOUTS[route_class] * 1000)
+
+
+def test_http_options_are_shortened_by_deadline() -> None:
+    # Given: 残り2秒の期限があるリクエスト
+    token = deadlines._current.set(deadlines.RequestDeadline(2000))
+    try:
+        # When: メディア用の HttpOptions を作成する
+        options = http_options_for("media")
+    finally:
+        deadlines._current.reset(token)
+    # Then: タイムアウトは残り時間＋猶予以下になる
+    assert options.timeout <= 3000
+    assert options.timeout < ROUTE_TIMEOUTS["media"] * 1000
+
+
+def test_unknown_route_class_raises() -> None:
+    # Given / When / Then: 未定義のルートの種類は KeyError になる
+    with pytest.raises(KeyError, match="batch"):
+        http_options_for("batch")
+
+
+def test_image_generation_uses_media_timeout() -> None:
+    # Given: 画像を返さない上流の応答
+    response = SimpleNamespace(candidates=[], parts=None, text=None)
+    mock = AsyncMock(return_value=response)
+    # When: 画像生成を要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content", mock):
+        TestClient(app).post("/api/image/generate", json={"prompt": "a cat"})
+    # Then: 上流呼び出しにメディア用のタイムアウトが指定される
+    config = mock.call_args.kwargs["config"]
+    assert config.http_options.timeout == int(ROUTE_TIMEOUTS["media"] * 1000)
@@ -0,0 +1,60 @@
+"""
+生成画像のバリアント取得のテスト
+"""
+import io
+
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from backend.images import store_image
+from backend.main import app
+
+
+def _png() -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (64, 32), (200, 30, 30)).save(out, format="PNG")
+    return out.getvalue()
+
+
+def test_variant_is_converted_and_has_etag() -> None:
+    # Given: 保存済みの画像
+    image_id = store_image(_png(), "image/png")
+    # When: 幅と形式を指定してバリアントを取得する
+    response = TestClient(app).get(f"/api/image/variants/{image_id}", params={"width": 16, "format": "jpeg"})
+    # Then: 変換された画像と ETag が返る
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/jpeg"
+    assert response.headers["etag"] == f'"{image_id}-16-jpeg-80"'
+    assert Image.open(io.BytesIO(response.content)).size[0] == 16
+
+
+def test_variant_returns_304_for_matching_etag() -> None:
+    # Given: 保存済みの画像と、その ETag
+    image_id = store_image(_png(), "image/png")
+    etag = f'"{image_id}-0-webp-80"'
+    # When: If-None-Match を付けて取得する
+    response = TestClient(app).get(f"/api/image/variants/{image_id}", headers={"If-None-Match": etag})
+    # Then: 304 になる
+    assert response.status_code == 304
+    assert response.headers["etag"] == etag
+
+
+def test_variant_of_missing_image_returns_404() -> None:
+    # Given: 存在しない画像ID
+    image_id = "0" * 64
+    # When: バリアントを取得する
+    response = TestClient(app).get(f"/api/image/variants/{image_id}")
+    # Then: 404 になる
+    assert response.status_code == 404
+    assert "見つかりません" in response.json()["detail"]
+
+
+def test_variant_of_missing_image_returns_404_even_with_matching_etag() -> None:
+    # Given: 存在しない画像IDと、その形式に一致する ETag
+    image_id = "f" * 64
+    etag = f'"{image_id}-0-webp-80"'
+    # When: If-None-Match を付けて取得する
+    response = TestClient(app).get(f"/api/image/variants/{image_id}", headers={"If-None-Match": etag})
+    # Then: 304 ではなく 404 になる
+    assert response.status_code == 404
+    assert "見つかりません" in response.json()["detail"]
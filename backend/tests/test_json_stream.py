@@ -0,0 +1,76 @@
+"""
+インクリメンタルJSONパーサーのテスト
+"""
+import json
+
+import pytest
+
+from backend.json_stream import IncrementalJSONParser
+
+
+def _feed_chars(parser: IncrementalJSONParser, text: str) -> list:
+    events = []
+    for ch in text:
+        events.extend(parser.feed(ch))
+    return events
+
+
+def test_root_object_fields_and_array_items_one_char_at_a_time() -> None:
+    # Given: スカラー・配列・オブジェクトのフィールドを持つJSON（1文字ずつ受信する）
+    text = '{"title": "a,\\"b\\"", "items": [1, {"x": [2]}, "c"], "meta": {"k": null}, "n": 3}'
+    parser = IncrementalJSONParser()
+    # When: 1文字ずつ渡す
+    events = _feed_chars(parser, text)
+    # Then: フィールドと配列要素が完結した順に発行される
+    assert events == [
+        {"type": "field", "path": "title", "data": 'a,"b"'},
+        {"type": "item", "path": "items", "index": 0, "data": 1},
+        {"type": "item", "path": "items", "index": 1, "data": {"x": [2]}},
+        {"type": "item", "path": "items", "index": 2, "data": "c"},
+        {"type": "field_end", "path": "items", "count": 3},
+        {"type": "field", "path": "meta", "data": {"k": None}},
+        {"type": "field", "path": "n", "data": 3},
+    ]
+    assert parser.finished
+    assert parser.text == text
+
+
+def test_root_array_items() -> None:
+    # Given: ルートが配列のJSON
+    parser = IncrementalJSONParser()
+    # When: 要素の途中で区切って渡す
+    first = parser.feed('[{"a": 1}, {"a"')
+    second = parser.feed(": 2}]")
+    # Then: 完結した要素のみがその時点で発行される
+    assert first == [{"type": "item", "path": "", "index": 0, "data": {"a": 1}}]
+    assert second == [{"type": "item", "path": "", "index": 1, "data": {"a": 2}}]
+    assert parser.finished
+
+
+def test_empty_containers() -> None:
+    # Given / When: 空のオブジェクト・空の配列・空の配列フィールド
+    empty_object = IncrementalJSONParser()
+    empty_array = IncrementalJSONParser()
+    empty_field = IncrementalJSONParser()
+    # Then: 要素のイベントは発行されず、空の配列フィールドは件数0で終わる
+    assert empty_object.feed("{}") == [] and empty_object.finished
+    assert empty_array.feed("[]") == [] and empty_array.finished
+    assert empty_field.feed('{"xs": []}') == [{"type": "field_end", "path": "xs", "count": 0}]
+
+
+def test_incomplete_input_is_not_finished() -> None:
+    # Given: 途中までのJSON
+    parser = IncrementalJSONParser()
+    # When: 最後のフィールドの値が完結する前で止まる
+    events = parser.feed('{"a": 1, "b": "unterminated')
+    # Then: 完結したフィールドのみ発行され、finished にはならない
+    assert events == [{"type": "field", "path": "a", "data": 1}]
+    assert not parser.finished
+
+
+def test_invalid_complete_value_raises() -> None:
+    # Given: 構文的に区切られたが不正な値
+    parser = IncrementalJSONParser()
+    # When / Then: 要素の完結時に JSONDecodeError になる
+    with pytest.raises(json.JSONDecodeError):
+        parser.feed('{"a": tru,')
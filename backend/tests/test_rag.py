@@ -0,0 +1,101 @@
+"""
+RAG のチャンク分割と再取り込み時のエンベディングの再利用のテスト
+"""
+import asyncio
+from typing import List
+
+import pytest
+
+from backend.config import RAG_CHUNK_CHARS, RAG_CHUNK_OVERLAP_CHARS
+from backend.rag import RagCollection, chunk_bodies, chunk_text
+
+
+def test_short_paragraphs_are_merged_into_one_chunk() -> None:
+    # Given: 上限に収まる2つの段落
+    text = "最初の段落です。\n\n次の段落です。"
+    # When: チャンクに分割する
+    chunks = chunk_text(text, max_chars=100, overlap_chars=0)
+    # Then: 段落区切りを保ったまま1チャンクになる
+    assert chunks == ["最初の段落です。\n\n次の段落です。"]
+
+
+def test_paragraphs_are_split_at_boundaries() -> None:
+    # Given: 合わせると上限を超える3つの段落
+    text = "a" * 30 + "\n\n" + "b" * 30 + "\n\n" + "c" * 30
+    # When: 上限50文字で分割する
+    chunks = chunk_text(text, max_chars=50, overlap_chars=0)
+    # Then: 段落の途中では切られない
+    assert chunks == ["a" * 30, "b" * 30, "c" * 30]
+
+
+def test_long_paragraph_is_split_by_sentence_then_by_length() -> None:
+    # Given: 上限を超える段落（文が短いものと、1文が上限を超えるもの）
+    text = "短い文です。" * 5 + "\n\n" + "x" * 25
+    # When: 上限10文字で分割する
+    chunks = chunk_text(text, max_chars=10, overlap_chars=0)
+    # Then: すべてのチャンクが上限以下で、本文は失われない
+    assert all(len(chunk) <= 10 for chunk in chunks)
+    assert "".join(chunks).replace(" ", "").replace("\n", "") == "短い文です。" * 5 + "x" * 25
+
+
+def test_chunks_carry_overlap_from_previous_chunk() -> None:
+    # Given: 2チャンクになるテキスト
+    text = "a" * 20 + "\n\n" + "b" * 20
+    # When: 5文字の重複を指定して分割する
+    chunks = chunk_text(text, max_chars=30, overlap_chars=5)
+    # Then: 2番目のチャンクに前のチャンクの末尾が前置される
+    assert chunks == ["a" * 20, "aaaaa\n\n" + "b" * 20]
+
+
+@pytest.mark.parametrize("text", ["", "   \n\n  \n"])
+def test_blank_text_has_no_chunks(text: str) -> None:
+    # Given / When: 空白のみのテキスト
+    # Then: チャンクは作られない
+    assert chunk_text(text, max_chars=10, overlap_chars=2) == []
+
+
+@pytest.mark.parametrize("max_chars", [0, -1])
+def test_non_positive_max_chars_raises(max_chars: int) -> None:
+    # Given: 正でない最大文字数
+    # When / Then: 無限ループせず ValueError になる
+    with pytest.raises(ValueError, match="チャンクの最大文字数は正の値である必要があります"):
+        chunk_text("本文です。", max_chars=max_chars)
+
+
+def _paragraphs(count: int) -> List[str]:
+    """それぞれが1チャンクになる長さの段落"""
+    return [f"段落{i}:" + chr(0x3042 + i) * (RAG_CHUNK_CHARS - 100) for i in range(count)]
+
+
+def test_editing_paragraph_reembeds_only_its_chunk(tmp_path) -> None:
+    # Given: 4チャンクのドキュメントを取り込んだコレクション
+    embedded: List[List[str]] = []
+
+    async def embed(texts: List[str]) -> List[List[float]]:
+        embedded.append(texts)
+        return [[1.0, float(i)] for i in range(len(texts))]
+
+    collection = RagCollection("docs", str(tmp_path))
+    paragraphs = _paragraphs(4)
+    asyncio.run(collection.ingest("doc", "\n\n".join(paragraphs), embed, "model"))
+    # When: 2番目の段落のみを編集して再取り込みする
+    paragraphs[1] = paragraphs[1][:-10] + "編集した末尾です。"
+    result = asyncio.run(collection.ingest("doc", "\n\n".join(paragraphs), embed, "model"))
+    # Then: 重複部分が変わった3番目のチャンクは再エンベディングせず、編集したチャンクのみエンベディングする
+    assert (result.embedded, result.reused, result.removed) == (1, 3, 1)
+    assert len(embedded[1]) == 1
+    # エンベディングする文字列には前のチャンクの末尾を前置し、保存する本文には含めない
+    assert embedded[1][0] == f"{paragraphs[0][-RAG_CHUNK_OVERLAP_CHARS:]}\n\n{paragraphs[1]}"
+    assert collection.chunks["doc#1"].text == paragraphs[1]
+
+
+def test_chunk_boundaries_resynchronize_after_edit() -> None:
+    # Given: 1チャンクに複数の段落が入る、短い段落が多数のドキュメント
+    paragraphs = [f"段落{i}の本文です。" * (1 + i % 5) for i in range(300)]
+    before = chunk_bodies("\n\n".join(paragraphs), max_chars=400)
+    # When: 先頭の段落を長くする
+    paragraphs[0] += "追記です。" * 20
+    after = chunk_bodies("\n\n".join(paragraphs), max_chars=400)
+    # Then: 境界は候補の段落でそろい、後続のチャンクの多くは本文が変わらない（境界が候補で決まらない場合は全チャンクが変わる）
+    assert len(set(after) - set(before)) <= len(before) // 2
+    assert all(len(body) <= 400 for body in after)
@@ -0,0 +1,160 @@
+"""
+スキーマレジストリ（compile_schema / SchemaRegistry）と構造化出力の再試行のテスト
+"""
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.client import client_pool
+from backend.config import STRUCTURED_OUTPUT_MAX_RETRIES
+from backend.main import app
+from backend.schema_registry import SchemaError, SchemaRegistry, compile_schema
+
+
+def _validate(schema: dict, value: object) -> list:
+    errors: list = []
+    compile_schema(schema)(value, "$", errors)
+    return errors
+
+
+def test_valid_object_passes() -> None:
+    # Given: 必須プロパティと型を持つスキーマ
+    schema = {
+        "type": "object",
+        "properties": {"name": {"type": "string"}, "age": {"type": "integer", "minimum": 0}},
+        "required": ["name"],
+    }
+    # When: 条件を満たす値を検証する
+    errors = _validate(schema, {"name": "a", "age": 0})
+    # Then: エラーは無い（minimum=0 の境界値を含む）
+    assert errors == []
+
+
+def test_missing_required_and_wrong_type_are_reported() -> None:
+    # Given: name を必須とし age を整数とするスキーマ
+    schema = {"type": "object", "properties": {"age": {"type": "integer"}}, "required": ["name"]}
+    # When: name が無く age が文字列の値を検証する
+    errors = _validate(schema, {"age": "x"})
+    # Then: 両方のエラーがパス付きで報告される
+    assert "$: 必須プロパティ 'name' がありません" in errors
+    assert any(e.startswith("$.age: integer が必要です") for e in errors)
+
+
+def test_array_length_boundaries() -> None:
+    # Given: 要素数が1〜2のスキーマ
+    schema = {"type": "array", "items": {"type": "number"}, "minItems": 1, "maxItems": 2}
+    # When / Then: 最小・最大は通り、0件と3件はエラーになる
+    assert _validate(schema, [1]) == []
+    assert _validate(schema, [1, 2]) == []
+    assert _validate(schema, []) == ["$: 要素数は1以上である必要があります"]
+    assert _validate(schema, [1, 2, 3]) == ["$: 要素数は2以下である必要があります"]
+
+
+def test_recursive_ref() -> None:
+    # Given: 自身を参照する木構造のスキーマ
+    schema = {
+        "$defs": {"Node": {"type": "object", "properties": {"children": {"type": "array", "items": {"$ref": "#/$defs/Node"}}}}},
+        "$ref": "#/$defs/Node",
+    }
+    # When: 入れ子の子要素の型が不正な値を検証する
+    errors = _validate(schema, {"children": [{"children": "x"}]})
+    # Then: 入れ子のパスでエラーが報告される
+    assert errors == ["$.children[0].children: array が必要ですが str でした"]
+
+
+def test_invalid_pattern_raises_schema_error() -> None:
+    # Given: 不正な正規表現を含むスキーマ
+    schema = {"type": "object", "properties": {"code": {"type": "string", "pattern": "("}}}
+    # When / Then: re.error ではなくノードのパス付きの SchemaError になる
+    with pytest.raises(SchemaError, match=r"^\$\.properties\.code: 不正なスキーマです（error: "):
+        compile_schema(schema)
+
+
+@pytest.mark.parametrize("type_value", [5, True, {"a": 1}, ["string", 1]])
+def test_non_string_type_raises_schema_error(type_value: object) -> None:
+    # Given: type に文字列・文字列の配列以外を指定したスキーマ
+    schema = {"type": "object", "properties": {"x": {"type": type_value}}}
+    # When / Then: TypeError ではなく SchemaError になる
+    with pytest.raises(SchemaError, match=r"^\$\.properties\.x: type は文字列または文字列の配列である必要があります"):
+        compile_schema(schema)
+
+
+def test_unknown_type_raises_schema_error() -> None:
+    # Given: 未対応の type を指定したスキーマ
+    # When / Then: パス付きの SchemaError になる
+    with pytest.raises(SchemaError, match=r"^\$: 未対応のtype: \['date'\]"):
+        compile_schema({"type": "date"})
+
+
+def test_non_integer_length_keyword_raises_schema_error() -> None:
+    # Given: maxLength に文字列を指定したスキーマ
+    schema = {"type": "object", "properties": {"s": {"type": "string", "maxLength": "10"}}}
+    # When / Then: 検証時ではなくコンパイル時に SchemaError になる
+    with pytest.raises(SchemaError, match=r"^\$\.properties\.s: 不正なスキーマです（TypeError: "):
+        compile_schema(schema)
+
+
+def test_unresolvable_ref_and_non_object_schema() -> None:
+    # Given / When / Then: 解決できない参照と、オブジェクトでないスキーマは SchemaError になる
+    with pytest.raises(SchemaError, match="参照を解決できません: #/\\$defs/Missing"):
+        compile_schema({"$ref": "#/$defs/Missing"})
+    with pytest.raises(SchemaError, match="スキーマはオブジェクトである必要があります"):
+        compile_schema([])  # type: ignore[arg-type]
+
+
+def test_registry_reuses_compiled_schema_and_resolves_name() -> None:
+    # Given: 空のレジストリ
+    registry = SchemaRegistry(max_entries=4)
+    schema = {"type": "string"}
+    # When: 同じスキーマを2回登録し、2回目に名前を付ける
+    first = registry.register(schema)
+    second = registry.register(schema, name="text")
+    # Then: 検証関数は再利用され、名前でもIDでも取得できる
+    assert first.validator is second.validator
+    assert registry.get("text").schema_id == first.schema_id
+    assert registry.get(first.schema_id).validate(1) == ["$: string が必要ですが int でした"]
+    assert registry.get("missing") is None
+
+
+def test_registry_keeps_named_schemas_when_inline_schemas_are_evicted() -> None:
+    # Given: 保持件数 2 のレジストリに名前付きで登録したスキーマ
+    registry = SchemaRegistry(max_entries=2)
+    named = registry.register({"type": "string"}, name="text")
+    # When: 保持件数を超えるインラインのスキーマを登録する
+    inline = [registry.register({"type": "integer", "minimum": i}) for i in range(5)]
+    # Then: 名前付きのスキーマは名前でもIDでも取得でき、古いインラインのスキーマは追い出される
+    assert registry.get("text") is named
+    assert registry.get(named.schema_id) is named
+    assert registry.get(inline[0].schema_id) is None
+    assert registry.get(inline[-1].schema_id) is inline[-1]
+    assert registry.stats()["named"] == 1
+
+
+def test_registry_rebinding_name_keeps_previous_schema_by_id() -> None:
+    # Given: 名前付きで登録したスキーマ
+    registry = SchemaRegistry(max_entries=2)
+    first = registry.register({"type": "string"}, name="item")
+    # When: 同じ名前で別のスキーマを登録する
+    second = registry.register({"type": "integer"}, name="item")
+    # Then: 名前は新しいスキーマを指し、以前のスキーマは名前なしでIDから取得できる
+    assert registry.get("item") is second
+    assert registry.get(first.schema_id).name is None
+    assert registry.get(first.schema_id).validator is first.validator
+
+
+def test_structured_output_caps_client_max_retries() -> None:
+    # Given: 設定値を大きく超える max_retries と、常にスキーマに合わない出力を返す上流
+    mock = AsyncMock(return_value=SimpleNamespace(text='{"name": 1}', parsed=None))
+    body = {
+        "prompt": "名前を返して",
+        "schema": {"type": "object", "properties": {"name": {"type": "string"}}},
+        "max_retries": 1_000,
+    }
+    # When: 構造化出力を要求する
+    with patch.object(client_pool.keys[0].client.aio.models, "generate_content", mock):
+        response = TestClient(app).post("/api/structured-output/generate", json=body)
+    # Then: 再試行は設定値までで打ち切られ、502 になる
+    assert response.status_code == 502
+    assert mock.call_count == STRUCTURED_OUTPUT_MAX_RETRIES + 1
@@ -0,0 +1,42 @@
+"""
+セマンティックキャッシュの誤ヒット報告のテスト
+"""
+from backend.semantic_cache import SemanticCache
+
+
+def _cache() -> SemanticCache:
+    return SemanticCache(max_entries=10, threshold=0.9, ttl_seconds=3600, routes=["text.generate"])
+
+
+def test_false_hit_report_removes_served_entry() -> None:
+    # Given: キャッシュから一度返されたエントリ
+    cache = _cache()
+    entry = cache.store("ns", "東京の天気は？", [1.0, 0.0], "晴れです")
+    hit = cache.lookup("text.generate", "ns", [1.0, 0.0])
+    assert hit is not None and hit.entry.entry_id == entry.entry_id
+    # When: 誤ったヒットとして報告する
+    removed = cache.report_false_hit(entry.entry_id)
+    # Then: エントリは削除され、誤ヒットとして集計される
+    assert removed is True
+    assert cache.lookup_exact("text.generate", "ns", "東京の天気は？") is None
+    assert cache.stats()["false_hits"] == 1
+
+
+def test_false_hit_report_rejects_entry_never_served() -> None:
+    # Given: 格納しただけで一度もキャッシュから返されていないエントリ
+    cache = _cache()
+    entry = cache.store("ns", "東京の天気は？", [1.0, 0.0], "晴れです")
+    # When: 誤ったヒットとして報告する
+    removed = cache.report_false_hit(entry.entry_id)
+    # Then: 削除されず、誤ヒットにも集計されない
+    assert removed is False
+    assert cache.lookup_exact("text.generate", "ns", "東京の天気は？") is not None
+    assert cache.stats()["false_hits"] == 0
+
+
+def test_false_hit_report_for_unknown_entry() -> None:
+    # Given: 空のキャッシュ
+    cache = _cache()
+    # When / Then: 存在しないエントリの報告は False になる
+    assert cache.report_false_hit("missing") is False
+    assert cache.stats()["false_hits"] == 0
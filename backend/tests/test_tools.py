@@ -0,0 +1,109 @@
+"""
+組み込みツールとツールレジストリのテスト
+"""
+import asyncio
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from backend.config import FUNCTION_MAX_STEPS
+from backend.main import app
+from backend.tools import ToolRegistry, calculate
+
+
+@pytest.mark.parametrize(
+    ("expression", "expected"),
+    [("(1 + 2) * 3", 9), ("-2 ** 2", -4), ("7 // 2 + 7 % 2", 4), ("2 ** 100", 2**100), ("10 ** -2", 0.01)],
+)
+def test_calculate_arithmetic(expression: str, expected: float) -> None:
+    # Given / When: 四則演算・べき乗の式を評価する
+    # Then: Python の演算と同じ結果になる（指数100は上限の境界値）
+    assert calculate(expression) == expected
+
+
+@pytest.mark.parametrize(
+    ("expression", "message"),
+    [
+        ("2 ** 101", "指数が大きすぎます"),
+        ("((9 ** 99) ** 99) ** 99", "計算結果が大きすぎます"),
+        ("(10 ** 100) ** 11", "計算結果が大きすぎます"),
+        ("(9 ** 99) * (9 ** 99) * (9 ** 99) * (9 ** 99) * (9 ** 99) * (9 ** 99) * (9 ** 99) * (9 ** 99) * (9 ** 99) * (9 ** 99) * (9 ** 99) * (9 ** 99)", "計算結果が大きすぎます"),
+        ("(-8) ** 0.5", "計算結果が実数ではありません"),
+        ("__import__('os')", "四則演算以外の式は評価できません"),
+        ("'a' * 3", "四則演算以外の式は評価できません"),
+    ],
+)
+def test_calculate_rejects_unsafe_or_huge_expressions(expression: str, message: str) -> None:
+    # Given: 巨大な整数を生む式・実数にならない式・四則演算以外の式
+    started = time.perf_counter()
+    # When / Then: 計算する前に ValueError で拒否される
+    with pytest.raises(ValueError, match=message):
+        calculate(expression)
+    assert time.perf_counter() - started < 1.0
+
+
+def test_calculate_division_by_zero() -> None:
+    # Given / When / Then: ゼロ除算は ZeroDivisionError になる
+    with pytest.raises(ZeroDivisionError):
+        calculate("1 / 0")
+
+
+def test_execute_records_result_error_and_timeout() -> None:
+    # Given: 正常終了・例外・タイムアウトするツールを登録したレジストリ
+    registry = ToolRegistry()
+
+    @registry.register(name="ok", description="", parameters={})
+    def ok(x: int) -> int:
+        return x + 1
+
+    @registry.register(name="fail", description="", parameters={})
+    def fail() -> None:
+        raise RuntimeError("boom")
+
+    @registry.register(name="slow", description="", parameters={}, timeout=0.01)
+    async def slow() -> None:
+        await asyncio.sleep(1)
+
+    async def run() -> list:
+        return [
+            await registry.execute("ok", {"x": 1}),
+            await registry.execute("fail", {}),
+            await registry.execute("slow", {}),
+            await registry.execute("missing", {}),
+        ]
+
+    # When: それぞれ実行する
+    ok_result, fail_result, slow_result, missing_result = asyncio.run(run())
+    # Then: 結果またはエラーが ToolResult に格納される
+    assert ok_result.result == 2 and ok_result.error is None
+    assert fail_result.error == "RuntimeError: boom"
+    assert slow_result.error == "ツール 'slow' が0.01秒以内に完了しませんでした"
+    assert missing_result.error == "未登録のツールです: missing"
+    with pytest.raises(KeyError, match="未登録のツールです: missing"):
+        registry.specs(["ok", "missing"])
+
+
+def test_execute_does_not_extend_tool_timeout() -> None:
+    # Given: タイムアウト 0.01 秒のツール
+    registry = ToolRegistry()
+
+    @registry.register(name="slow", description="", parameters={}, timeout=0.01)
+    async def slow() -> None:
+        await asyncio.sleep(1)
+
+    # When: ツールの設定より長いタイムアウトを指定して実行する
+    started = time.perf_counter()
+    result = asyncio.run(registry.execute("slow", {}, timeout=60))
+    # Then: ツールに設定されたタイムアウトで打ち切られる
+    assert result.error == "ツール 'slow' が0.01秒以内に完了しませんでした"
+    assert time.perf_counter() - started < 0.5
+
+
+@pytest.mark.parametrize("body", [{"max_steps": 0}, {"max_steps": FUNCTION_MAX_STEPS + 1}, {"tool_timeout": 0}])
+def test_function_run_rejects_out_of_range_limits(body: dict) -> None:
+    # Given: 範囲外の max_steps・tool_timeout
+    # When: ツール実行ループを要求する
+    response = TestClient(app).post("/api/function-calling/run", json={"prompt": "計算して", **body})
+    # Then: 上流を呼び出す前に 422 になる
+    assert response.status_code == 422
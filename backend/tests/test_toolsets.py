@@ -0,0 +1,67 @@
+"""
+ツールセットレジストリのテスト
+"""
+import pytest
+
+from backend.toolsets import ToolsetError, ToolsetRegistry
+
+_WEATHER = {
+    "name": "get_weather",
+    "description": "天気を取得する",
+    "parameters": {"type": "object", "properties": {"city": {"type": "string"}}, "required": ["city"]},
+}
+
+
+def test_register_reuses_toolset_and_resolves_name() -> None:
+    # Given: 空のレジストリ
+    registry = ToolsetRegistry(max_entries=4)
+    # When: 同じ関数定義を2回登録し、2回目に名前を付ける
+    first = registry.register([_WEATHER])
+    second = registry.register([_WEATHER], name="weather")
+    # Then: 検証済みの定義とプレフィックスを共有し、名前でも取得できる（最初のインスタンスは書き換えない）
+    assert second.tool is first.tool
+    assert second.cached_prefixes is first.cached_prefixes
+    assert first.name is None and second.name == "weather"
+    assert second.function_names == ["get_weather"]
+    assert registry.get("weather") is second
+    assert registry.get(first.toolset_id) is second
+    assert registry.get("missing") is None
+
+
+def test_named_toolsets_survive_eviction_and_rebinding() -> None:
+    # Given: 保持件数 1 のレジストリに名前付きで登録したツールセット
+    registry = ToolsetRegistry(max_entries=1)
+    named = registry.register([_WEATHER], name="weather")
+    # When: 保持件数を超える名前なしのツールセットを登録し、同じ名前で別の定義を登録する
+    unnamed = [registry.register([{"name": f"f{i}"}]) for i in range(3)]
+    rebound = registry.register([{"name": "g"}], name="weather")
+    # Then: 名前付きのものは追い出されず、付け替え前の定義は名前なしでIDから取得できる
+    assert registry.get(unnamed[0].toolset_id) is None
+    assert registry.get("weather") is rebound
+    assert registry.get(named.toolset_id).name is None
+    assert registry.get(named.toolset_id).tool is named.tool
+    assert registry.stats()["named"] == 1
+
+
+@pytest.mark.parametrize(
+    ("functions", "message"),
+    [
+        ([], "関数定義が空です"),
+        ([{"name": "1bad"}], "不正な関数名です: '1bad'"),
+        ([_WEATHER, _WEATHER], "関数名が重複しています: 'get_weather'"),
+        (
+            [{"name": "f", "parameters": {"type": "object", "properties": {"q": {"type": "string", "pattern": "["}}}}],
+            "関数 'f' のパラメータスキーマが不正です: \\$.properties.q: 不正なスキーマです",
+        ),
+        (
+            [{"name": "f", "parameters": {"type": 5}}],
+            "関数 'f' のパラメータスキーマが不正です: \\$: type は文字列または文字列の配列である必要があります",
+        ),
+    ],
+)
+def test_register_rejects_invalid_functions(functions: list, message: str) -> None:
+    # Given: 空・不正な名前・重複・不正なパラメータスキーマの関数定義
+    registry = ToolsetRegistry(max_entries=4)
+    # When / Then: ToolsetError（APIでは400）になる
+    with pytest.raises(ToolsetError, match=message):
+        registry.register(functions)
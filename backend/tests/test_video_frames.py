@@ -0,0 +1,115 @@
+"""
+動画のキーフレーム選択のテスト
+"""
+from typing import List, Tuple
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image, ImageDraw
+
+from backend.video_frames import format_timestamp, select_keyframes
+
+
+def _frames(tmp_path, specs: List[Tuple[int, str]]) -> List[str]:
+    """(輝度, 模様) の指定からフレーム画像を作成する"""
+    paths = []
+    for index, (brightness, pattern) in enumerate(specs):
+        image = Image.new("RGB", (64, 48), (brightness, brightness, brightness))
+        draw = ImageDraw.Draw(image)
+        if pattern == "left":
+            draw.rectangle((0, 0, 31, 47), fill=(255, 255, 255))
+        elif pattern == "stripes":
+            for x in range(0, 64, 8):
+                draw.rectangle((x, 0, x + 3, 47), fill=(255, 255, 255))
+        path = tmp_path / f"frame_{index:06d}.jpg"
+        image.save(path, format="JPEG", quality=90)
+        paths.append(str(path))
+    return paths
+
+
+def test_identical_frames_are_collapsed(tmp_path) -> None:
+    # Given: 同じ画面が続く5フレーム
+    paths = _frames(tmp_path, [(40, "none")] * 5)
+    # When: キーフレームを選ぶ
+    frames = select_keyframes(paths, frame_rate=1.0, threshold=0.1, max_frames=10)
+    # Then: 先頭のフレームのみが残る
+    assert [f.index for f in frames] == [0]
+    assert frames[0].distance == 1.0
+    assert frames[0].data.startswith(b"\xff\xd8")
+
+
+def test_scene_changes_are_selected_with_timestamps(tmp_path) -> None:
+    # Given: 構図の変化と単色の画面の切り替わりを含むフレーム
+    paths = _frames(tmp_path, [(40, "none"), (40, "none"), (40, "left"), (40, "left"), (220, "none"), (40, "stripes")])
+    # When: 2fps で抽出したものとしてキーフレームを選ぶ
+    frames = select_keyframes(paths, frame_rate=2.0, threshold=0.1, max_frames=10)
+    # Then: 変化したフレームのみが選ばれ、時刻は通し番号 / フレームレートになる
+    assert [f.index for f in frames] == [0, 2, 4, 5]
+    assert [f.timestamp for f in frames] == [0.0, 1.0, 2.0, 2.5]
+    assert all(0.1 < f.distance <= 1.0 for f in frames)
+
+
+def test_keyframes_are_thinned_evenly(tmp_path) -> None:
+    # Given: すべて異なる8フレーム（輝度が大きく変わる）
+    paths = _frames(tmp_path, [(0 if i % 2 == 0 else 255, "none") for i in range(8)])
+    # When: 最大4枚に制限する
+    frames = select_keyframes(paths, frame_rate=1.0, threshold=0.1, max_frames=4)
+    # Then: 動画全体を均等にカバーするよう間引かれる
+    assert [f.index for f in frames] == [0, 2, 4, 6]
+
+
+def test_threshold_one_keeps_only_first_frame(tmp_path) -> None:
+    # Given: すべて異なるフレームと、上限の閾値
+    paths = _frames(tmp_path, [(0, "none"), (255, "none"), (0, "stripes")])
+    # When: 閾値1でキーフレームを選ぶ
+    frames = select_keyframes(paths, frame_rate=1.0, threshold=1.0, max_frames=10)
+    # Then: 先頭のフレームは常に採用される
+    assert [f.index for f in frames] == [0]
+
+
+def test_no_frames(tmp_path) -> None:
+    # Given / When: フレームが無い
+    # Then: キーフレームも無い
+    assert select_keyframes([], frame_rate=1.0, threshold=0.1, max_frames=10) == []
+
+
+@pytest.mark.parametrize("frame_rate", [0, -1])
+def test_non_positive_frame_rate_raises(tmp_path, frame_rate: float) -> None:
+    # Given: 正でないフレームレート
+    paths = _frames(tmp_path, [(40, "none")])
+    # When / Then: ValueError になる
+    with pytest.raises(ValueError, match="フレームレートは正の値である必要があります"):
+        select_keyframes(paths, frame_rate=frame_rate, threshold=0.1, max_frames=10)
+
+
+def test_missing_frame_file_raises(tmp_path) -> None:
+    # Given: 存在しないフレーム画像のパス
+    # When / Then: FileNotFoundError になる
+    with pytest.raises(FileNotFoundError):
+        select_keyframes([str(tmp_path / "missing.jpg")], frame_rate=1.0, threshold=0.1, max_frames=10)
+
+
+@pytest.mark.parametrize(("seconds", "expected"), [(0, "00:00"), (65.9, "01:05"), (3725, "1:02:05")])
+def test_format_timestamp(seconds: float, expected: str) -> None:
+    # Given / When / Then: [h:]mm:ss 形式になる
+    assert format_timestamp(seconds) == expected
+
+
+@pytest.mark.parametrize(
+    "form",
+    [
+        {"frame_rate": "0"},
+        {"frame_rate": "-1"},
+        {"frame_rate": "10.5"},
+        {"scene_threshold": "-0.1"},
+        {"scene_threshold": "1.5"},
+    ],
+)
+def test_analyze_video_rejects_out_of_range_parameters(form: dict) -> None:
+    # Given: 範囲外のフレームレート・閾値
+    from backend.main import app
+
+    # When: 動画の分析を要求する
+    response = TestClient(app).post("/api/video/analyze", data=form, files={"file": ("a.mp4", b"\x00", "video/mp4")})
+    # Then: アップロードを処理する前に 422 になる
+    assert response.status_code == 422
@@ -0,0 +1,219 @@
+"""
+サーバーサイドツールレジストリ
+
+関数呼び出しでモデルが提案したツールをサーバー側で実行するための登録・実行機構。
+同期関数はスレッドプールで、非同期関数はイベントループ上で実行し、
+ツールごとのタイムアウトを適用する。
+"""
+import ast
+import asyncio
+import inspect
+import math
+import operator
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+from zoneinfo import ZoneInfo
+
+from backend.config import FUNCTION_TOOL_TIMEOUT_SECONDS
+
+
+@dataclass
+class ToolSpec:
+    """登録済みツール"""
+
+    name: str
+    description: str
+    parameters: Dict[str, Any]  # JSON Schema
+    func: Callable[..., Any]
+    timeout: float = FUNCTION_TOOL_TIMEOUT_SECONDS
+
+
+@dataclass
+class ToolResult:
+    """ツール実行結果"""
+
+    name: str
+    arguments: Dict[str, Any]
+    result: Optional[Any] = None
+    error: Optional[str] = None
+    latency_ms: float = 0.0
+    call_id: Optional[str] = None
+
+    def to_function_response(self) -> Dict[str, Any]:
+        """モデルへ返す function_response の内容を作成する"""
+        if self.error is not None:
+            return {"error": self.error}
+        return {"result": self.result}
+
+
+class ToolRegistry:
+    """サーバー側で実行可能なツールの登録先"""
+
+    def __init__(self) -> None:
+        self._tools: Dict[str, ToolSpec] = {}
+
+    def register(
+        self,
+        name: str,
+        description: str,
+        parameters: Dict[str, Any],
+        timeout: Optional[float] = None,
+    ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        """ツールを登録するデコレーター
+
+        Args:
+            name: ツール名（モデルに公開される関数名）
+            description: ツールの説明
+            parameters: 引数のJSON Schema
+            timeout: 実行タイムアウト（秒）。未指定時は FUNCTION_TOOL_TIMEOUT_SECONDS
+
+        Returns:
+            Callable: 関数をそのまま返すデコレーター
+        """
+
+        def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+            self._tools[name] = ToolSpec(
+                name=name,
+                description=description,
+                parameters=parameters,
+                func=func,
+                timeout=timeout or FUNCTION_TOOL_TIMEOUT_SECONDS,
+            )
+            return func
+
+        return decorator
+
+    def get(self, name: str) -> Optional[ToolSpec]:
+        """ツールを名前で取得する"""
+        return self._tools.get(name)
+
+    def names(self) -> List[str]:
+        """登録済みツール名の一覧"""
+        return list(self._tools)
+
+    def specs(self, names: Optional[List[str]] = None) -> List[ToolSpec]:
+        """指定名（未指定時は全件）のツール定義を返す
+
+        Raises:
+            KeyError: 未登録のツール名が含まれる場合
+        """
+        if names is None:
+            return list(self._tools.values())
+        missing = [n for n in names if n not in self._tools]
+        if missing:
+            raise KeyError(f"未登録のツールです: {', '.join(missing)}")
+        return [self._tools[n] for n in names]
+
+    async def execute(
+        self,
+        name: str,
+        arguments: Dict[str, Any],
+        timeout: Optional[float] = None,
+        call_id: Optional[str] = None,
+    ) -> ToolResult:
+        """ツールを実行する（例外・タイムアウトは ToolResult.error に格納）
+
+        timeout はツールに設定されたタイムアウトを短くする方向にのみ適用する。
+        """
+        start = time.perf_counter()
+        result = ToolResult(name=name, arguments=arguments, call_id=call_id)
+        spec = self._tools.get(name)
+        if spec is None:
+            result.error = f"未登録のツールです: {name}"
+            return result
+        limit = min(timeout, spec.timeout) if timeout else spec.timeout
+        try:
+            if inspect.iscoroutinefunction(spec.func):
+                value = await asyncio.wait_for(spec.func(**arguments), timeout=limit)
+            else:
+                value = await asyncio.wait_for(asyncio.to_thread(spec.func, **arguments), timeout=limit)
+            result.result = value
+        except asyncio.TimeoutError:
+            result.error = f"ツール '{name}' が{limit}秒以内に完了しませんでした"
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+        result.latency_ms = (time.perf_counter() - start) * 1000
+        return result
+
+
+# グローバルツールレジストリ
+tool_registry = ToolRegistry()
+
+
+# --- 組み込みツール ---
+
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_UNARY_OPS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+# 計算結果の整数の最大桁数（巨大な整数の演算でワーカースレッドを占有しないよう、計算前に拒否する）
+_MAX_RESULT_DIGITS = 1000
+
+
+def _digits(value: float) -> float:
+    """数値の10進の桁数の概算（0は0桁）"""
+    value = abs(value)
+    if value < 1:
+        return 0.0
+    if isinstance(value, int):
+        return value.bit_length() * math.log10(2)
+    return math.log10(value)
+
+
+def _eval_node(node: ast.AST) -> float:
+    """四則演算のみを評価する（任意コード実行を防ぐ）"""
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        right = _eval_node(node.right)
+        if isinstance(node.op, ast.Pow) and abs(right) > 100:
+            raise ValueError("指数が大きすぎます")
+        left = _eval_node(node.left)
+        if isinstance(node.op, ast.Pow) and right > 0 and right * _digits(left) > _MAX_RESULT_DIGITS:
+            raise ValueError("計算結果が大きすぎます")
+        if isinstance(node.op, ast.Mult) and _digits(left) + _digits(right) > _MAX_RESULT_DIGITS:
+            raise ValueError("計算結果が大きすぎます")
+        result = _BIN_OPS[type(node.op)](left, right)
+        if isinstance(result, complex):
+            raise ValueError("計算結果が実数ではありません")
+        return result
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        return _UNARY_OPS[type(node.op)](_eval_node(node.operand))
+    raise ValueError("四則演算以外の式は評価できません")
+
+
+@tool_registry.register(
+    name="calculate",
+    description="四則演算の式を評価して結果を返します。",
+    parameters={
+        "type": "object",
+        "properties": {"expression": {"type": "string", "description": "評価する式（例: (1 + 2) * 3）"}},
+        "required": ["expression"],
+    },
+)
+def calculate(expression: str) -> float:
+    """四則演算の式を評価する"""
+    return _eval_node(ast.parse(expression, mode="eval"))
+
+
+@tool_registry.register(
+    name="get_current_time",
+    description="指定したタイムゾーンの現在時刻をISO 8601形式で返します。",
+    parameters={
+        "type": "object",
+        "properties": {"timezone": {"type": "string", "description": "IANAタイムゾーン名（例: Asia/Tokyo）"}},
+    },
+)
+def get_current_time(timezone: str = "Asia/Tokyo") -> str:
+    """現在時刻を返す"""
+    return datetime.now(ZoneInfo(timezone)).isoformat()
@@ -0,0 +1,218 @@
+"""
+ツールセットレジストリ
+
+関数定義の集合を一度だけ登録・検証し、`types.Tool` にコンパイルしてキャッシュする。
+リクエストは toolset_id で参照できるため、大きな関数定義を毎回送信・変換する必要がない。
+任意でツール定義を含むキャッシュ済みコンテンツ（Context Caching）をモデルごとに作成し、
+プレフィックスとして再利用する。
+"""
+import re
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, List, Optional
+
+from google.genai import types
+
+from backend.cache import LRUCache
+from backend.config import TOOLSET_CACHE_SIZE
+from backend.schema_registry import SchemaError, compile_schema, schema_hash
+
+# Gemini API の関数名の制約
+_FUNCTION_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_.\-]{0,63}$")
+
+
+class ToolsetError(ValueError):
+    """ツールセットの定義が不正な場合の例外"""
+
+
+@dataclass
+class CachedPrefix:
+    """モデルごとのキャッシュ済みコンテンツ"""
+
+    name: str
+    expires_at: float
+
+    @property
+    def expired(self) -> bool:
+        # 期限切れ直前のリクエスト失敗を避けるため、余裕をもって失効扱いにする
+        return time.time() >= self.expires_at - 30
+
+
+@dataclass
+class Toolset:
+    """登録済みツールセット"""
+
+    toolset_id: str
+    functions: List[Dict[str, Any]]
+    tool: types.Tool
+    name: Optional[str] = None
+    system_instruction: Optional[str] = None
+    cached_prefixes: Dict[str, CachedPrefix] = field(default_factory=dict)
+
+    @property
+    def function_names(self) -> List[str]:
+        return [func["name"] for func in self.functions]
+
+    def cached_content_for(self, model: str) -> Optional[str]:
+        """モデルに対応する有効なキャッシュ済みコンテンツ名を返す"""
+        prefix = self.cached_prefixes.get(model)
+        if prefix is None or prefix.expired:
+            return None
+        return prefix.name
+
+    def generate_config(self, model: str, **kwargs: Any) -> types.GenerateContentConfig:
+        """生成設定を作成する（キャッシュ済みプレフィックスがあれば利用する）"""
+        cached_content = self.cached_content_for(model)
+        if cached_content:
+            # ツール定義とシステム指示はキャッシュ側に含まれるため再送しない
+            return types.GenerateContentConfig(cached_content=cached_content, **kwargs)
+        return types.GenerateContentConfig(
+            tools=[self.tool], system_instruction=self.system_instruction, **kwargs
+        )
+
+
+def _validate_functions(functions: List[Dict[str, Any]]) -> None:
+    """関数定義を検証する
+
+    Raises:
+        ToolsetError: 関数名の重複・不正、パラメータスキーマが不正な場合
+    """
+    if not functions:
+        raise ToolsetError("関数定義が空です")
+    seen = set()
+    for func in functions:
+        name = func.get("name") or ""
+        if not _FUNCTION_NAME_PATTERN.match(name):
+            raise ToolsetError(f"不正な関数名です: '{name}'")
+        if name in seen:
+            raise ToolsetError(f"関数名が重複しています: '{name}'")
+        seen.add(name)
+        try:
+            compile_schema(func.get("parameters") or {})
+        except SchemaError as e:
+            raise ToolsetError(f"関数 '{name}' のパラメータスキーマが不正です: {e}")
+
+
+def compile_tool(functions: List[Dict[str, Any]]) -> types.Tool:
+    """関数定義を types.Tool に変換する"""
+    return types.Tool(
+        function_declarations=[
+            types.FunctionDeclaration(
+                name=func["name"],
+                description=func.get("description"),
+                # JSON Schemaをそのまま使用（parameters_json_schemaとして）
+                parameters_json_schema=func.get("parameters"),
+            )
+            for func in functions
+        ]
+    )
+
+
+class ToolsetRegistry:
+    """ツールセットをID・名前で管理する
+
+    名前を付けずに登録したツールセットは LRU で保持し、名前を付けて登録したツールセットは
+    追い出されないよう LRU とは別に保持する。同じ定義に別の名前を付けた場合も、
+    検証済みの定義とキャッシュ済みプレフィックスは共有する。
+    """
+
+    def __init__(self, max_entries: int = TOOLSET_CACHE_SIZE) -> None:
+        self._toolsets: LRUCache[Toolset] = LRUCache(max_entries=max_entries)
+        self._named: Dict[str, Toolset] = {}
+        self._named_ids: Dict[str, Toolset] = {}
+        self._lock = threading.Lock()
+
+    def register(
+        self,
+        functions: List[Dict[str, Any]],
+        name: Optional[str] = None,
+        system_instruction: Optional[str] = None,
+    ) -> Toolset:
+        """ツールセットを登録する（同一定義は再検証・再コンパイルしない）
+
+        Args:
+            functions: 関数定義（name, description, parameters）のリスト
+            name: 任意の登録名（指定時は LRU から追い出されない）
+            system_instruction: キャッシュ済みプレフィックスに含めるシステム指示
+
+        Returns:
+            Toolset: 登録済みツールセット
+
+        Raises:
+            ToolsetError: 定義が不正な場合
+        """
+        toolset_id = schema_hash({"functions": functions, "system_instruction": system_instruction})
+        toolset = self._lookup(toolset_id)
+        if toolset is None:
+            _validate_functions(functions)
+            toolset = Toolset(
+                toolset_id=toolset_id,
+                functions=functions,
+                tool=compile_tool(functions),
+                system_instruction=system_instruction,
+            )
+        if not name:
+            if toolset_id not in self._named_ids:
+                self._toolsets.set(toolset_id, toolset)
+            return toolset
+        if toolset.name != name:
+            # 共有しているインスタンスは書き換えず、名前だけを変えたコピーを登録する
+            toolset = replace(toolset, name=name)
+        with self._lock:
+            previous = self._named.get(name)
+            self._named[name] = toolset
+            self._named_ids = {t.toolset_id: t for t in self._named.values()}
+        self._toolsets.pop(toolset_id)
+        # 名前を付け替えられて名前がなくなったツールセットは、IDで参照できるよう LRU に戻す
+        if previous is not None and previous.toolset_id not in self._named_ids:
+            self._toolsets.set(previous.toolset_id, replace(previous, name=None))
+        return toolset
+
+    def get(self, ref: str) -> Optional[Toolset]:
+        """ツールセットIDまたは登録名で取得する"""
+        with self._lock:
+            toolset = self._named.get(ref)
+        return toolset or self._lookup(ref)
+
+    def _lookup(self, toolset_id: str) -> Optional[Toolset]:
+        """ツールセットIDで取得する（名前付きのツールセットを優先する）"""
+        with self._lock:
+            toolset = self._named_ids.get(toolset_id)
+        return toolset or self._toolsets.get(toolset_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """キャッシュ統計を返す"""
+        with self._lock:
+            named = len(self._named)
+        return {**self._toolsets.stats(), "named": named}
+
+
+async def create_cached_prefix(client: Any, toolset: Toolset, model: str, ttl_seconds: int) -> CachedPrefix:
+    """ツール定義を含むキャッシュ済みコンテンツを作成する
+
+    Args:
+        client: genai.Client
+        toolset: 対象のツールセット
+        model: キャッシュを作成するモデル
+        ttl_seconds: キャッシュの有効期間（秒）
+
+    Returns:
+        CachedPrefix: 作成したキャッシュ
+    """
+    cached = await client.aio.caches.create(
+        model=model,
+        config=types.CreateCachedContentConfig(
+            display_name=f"toolset-{toolset.toolset_id}",
+            tools=[toolset.tool],
+            system_instruction=toolset.system_instruction,
+            ttl=f"{ttl_seconds}s",
+        ),
+    )
+    prefix = CachedPrefix(name=cached.name, expires_at=time.time() + ttl_seconds)
+    toolset.cached_prefixes[model] = prefix
+    return prefix
+
+
+# グローバルツールセットレジストリ
+toolset_registry = ToolsetRegistry()
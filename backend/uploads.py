@@ -0,0 +1,50 @@
+"""
+アップロードファイルの一時保存
+
+大きなアップロードをメモリに保持せず、チャンク単位でディスクへ書き出す。
+"""
+import asyncio
+import os
+import tempfile
+from typing import Optional
+
+from fastapi import UploadFile
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+async def spool_upload(upload: UploadFile, directory: Optional[str] = None) -> str:
+    """アップロードファイルを一時ファイルに保存し、そのパスを返す
+
+    呼び出し側は使用後に remove_quietly() で削除すること。
+
+    Args:
+        upload: アップロードファイル
+        directory: 保存先ディレクトリ（未指定時はシステムの一時ディレクトリ）
+
+    Returns:
+        str: 一時ファイルのパス
+    """
+    suffix = os.path.splitext(upload.filename or "")[1]
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await upload.read(_CHUNK_SIZE)
+                if not chunk:
+                    break
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        remove_quietly(path)
+        raise
+    return path
+
+
+def remove_quietly(path: Optional[str]) -> None:
+    """ファイルを削除する（存在しない場合は無視）"""
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
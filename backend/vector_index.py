@@ -0,0 +1,96 @@
+"""
+インメモリベクトルインデックス
+
+正規化したエンベディングを1つの行列に保持し、内積（コサイン類似度）で近傍を検索する。
+削除は末尾の行との入れ替えで行うため、追加・削除ともに行列の再構築は不要。
+"""
+import threading
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize(vector: Sequence[float]) -> np.ndarray:
+    """ベクトルをL2正規化した float32 配列に変換する"""
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm > 0 else array
+
+
+class VectorIndex:
+    """コサイン類似度による総当たり検索インデックス（スレッドセーフ）"""
+
+    def __init__(self, dimensions: Optional[int] = None, initial_capacity: int = 64) -> None:
+        self.dimensions = dimensions
+        self._capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._keys: List[Hashable] = []
+        self._rows: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._rows
+
+    def _ensure_capacity(self, size: int) -> None:
+        if self._matrix is None:
+            self._matrix = np.zeros((max(self._capacity, size), self.dimensions), dtype=np.float32)
+        elif size > self._matrix.shape[0]:
+            grown = np.zeros((max(size, self._matrix.shape[0] * 2), self.dimensions), dtype=np.float32)
+            grown[: len(self._keys)] = self._matrix[: len(self._keys)]
+            self._matrix = grown
+
+    def add(self, key: Hashable, vector: Sequence[float]) -> None:
+        """ベクトルを追加する（同じキーが存在する場合は置き換える）
+
+        Raises:
+            ValueError: 次元数がインデックスと一致しない場合
+        """
+        normalized = normalize(vector)
+        with self._lock:
+            if self.dimensions is None:
+                self.dimensions = normalized.shape[0]
+            if normalized.shape[0] != self.dimensions:
+                raise ValueError(f"次元数が一致しません: {normalized.shape[0]} != {self.dimensions}")
+            row = self._rows.get(key)
+            if row is None:
+                self._ensure_capacity(len(self._keys) + 1)
+                row = len(self._keys)
+                self._keys.append(key)
+                self._rows[key] = row
+            self._matrix[row] = normalized
+
+    def remove(self, key: Hashable) -> bool:
+        """ベクトルを削除する（存在しない場合はFalse）"""
+        with self._lock:
+            row = self._rows.pop(key, None)
+            if row is None:
+                return False
+            last = len(self._keys) - 1
+            if row != last:
+                # 末尾の行を削除位置へ移動する
+                moved_key = self._keys[last]
+                self._matrix[row] = self._matrix[last]
+                self._keys[row] = moved_key
+                self._rows[moved_key] = row
+            self._keys.pop()
+            return True
+
+    def search(self, vector: Sequence[float], k: int = 1) -> List[Tuple[Hashable, float]]:
+        """類似度の高い順に最大k件の (キー, コサイン類似度) を返す"""
+        with self._lock:
+            if not self._keys:
+                return []
+            query = normalize(vector)
+            if query.shape[0] != self.dimensions:
+                raise ValueError(f"次元数が一致しません: {query.shape[0]} != {self.dimensions}")
+            scores = self._matrix[: len(self._keys)] @ query
+            k = min(k, len(self._keys))
+            if k < len(self._keys):
+                top = np.argpartition(-scores, k - 1)[:k]
+                top = top[np.argsort(-scores[top])]
+            else:
+                top = np.argsort(-scores)
+            return [(self._keys[i], float(scores[i])) for i in top]
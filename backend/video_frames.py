@@ -0,0 +1,154 @@
+"""
+動画のキーフレーム抽出
+
+動画ファイル全体を上流に送るとアップロードとトークン消費が大きいため、ffmpeg で一定間隔のフレームを
+縮小したJPEGとして抽出し、直前に採用したフレームとの差分（dHash のハミング距離と平均輝度の差）が小さい
+ほぼ同一のフレームを除外して、シーンが変化したフレームのみを分析に使用する。
+"""
+import asyncio
+import glob
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from backend.config import (
+    VIDEO_FRAME_RATE,
+    VIDEO_FRAME_WIDTH,
+    VIDEO_MAX_FRAMES,
+    VIDEO_SCENE_THRESHOLD,
+)
+
+# dHash の一辺のサイズ（size × size ビットのハッシュ）
+_HASH_SIZE = 8
+
+
+@dataclass
+class VideoFrame:
+    """抽出したキーフレーム"""
+
+    index: int  # 抽出したフレームの通し番号
+    timestamp: float  # 動画の先頭からの秒数
+    data: bytes  # JPEGデータ
+    distance: float  # 直前のキーフレームとの差分（0〜1。先頭のフレームは1）
+
+
+def frame_signature(image: Image.Image, size: int = _HASH_SIZE) -> Tuple[int, float]:
+    """フレームの比較用の特徴（隣接画素の明暗の差による知覚ハッシュ dHash と平均輝度）"""
+    gray = image.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR)
+    pixels = list(gray.tobytes())  # 8ビットグレースケールのため1画素1バイト
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value, sum(pixels) / len(pixels) / 255
+
+
+def signature_distance(a: Tuple[int, float], b: Tuple[int, float], size: int = _HASH_SIZE) -> float:
+    """2つのフレームの差分（0〜1）
+
+    構図の変化はハッシュの異なるビットの割合、単色の画面の切り替わりやフェードは平均輝度の差で検出する。
+    """
+    return max(bin(a[0] ^ b[0]).count("1") / (size * size), abs(a[1] - b[1]))
+
+
+def select_keyframes(paths: Sequence[str], frame_rate: float, threshold: float, max_frames: int) -> List[VideoFrame]:
+    """抽出したフレームから、直前のキーフレームと十分に異なるものを選ぶ
+
+    キーフレームが max_frames を超える場合は、動画全体を均等にカバーするよう間引く。
+
+    Args:
+        paths: 時刻順のフレーム画像のパス
+        frame_rate: 抽出時のフレームレート（タイムスタンプの計算に使用）
+        threshold: 差分がこの値以下のフレームを除外する
+        max_frames: キーフレームの最大数
+
+    Returns:
+        List[VideoFrame]: キーフレーム（時刻順）
+
+    Raises:
+        ValueError: frame_rate が正の値でない場合
+    """
+    if frame_rate <= 0:
+        raise ValueError(f"フレームレートは正の値である必要があります: frame_rate={frame_rate}")
+    selected: List[Tuple[int, str, float]] = []
+    previous: Optional[Tuple[int, float]] = None
+    for index, path in enumerate(paths):
+        with Image.open(path) as image:
+            current = frame_signature(image)
+        distance = 1.0 if previous is None else signature_distance(previous, current)
+        # 先頭のフレームは閾値によらず採用する
+        if previous is None or distance > threshold:
+            selected.append((index, path, distance))
+            previous = current
+
+    if max_frames > 0 and len(selected) > max_frames:
+        step = len(selected) / max_frames
+        selected = [selected[int(i * step)] for i in range(max_frames)]
+
+    frames = []
+    for index, path, distance in selected:
+        with open(path, "rb") as f:
+            frames.append(VideoFrame(index=index, timestamp=index / frame_rate, data=f.read(), distance=distance))
+    return frames
+
+
+async def extract_keyframes(
+    path: str,
+    frame_rate: float = VIDEO_FRAME_RATE,
+    threshold: float = VIDEO_SCENE_THRESHOLD,
+    max_frames: int = VIDEO_MAX_FRAMES,
+    width: int = VIDEO_FRAME_WIDTH,
+) -> Tuple[List[VideoFrame], int]:
+    """動画ファイルからキーフレームを抽出する
+
+    Args:
+        path: 動画ファイルのパス
+        frame_rate: フレームを抽出する間隔（1秒あたりの枚数）
+        threshold: 直前のキーフレームとの差分がこの値以下のフレームを除外する
+        max_frames: キーフレームの最大数
+        width: フレームの最大幅（px。これより小さい動画は拡大しない）
+
+    Returns:
+        Tuple[List[VideoFrame], int]: キーフレームと、抽出したフレームの総数
+
+    Raises:
+        RuntimeError: ffmpegが利用できない、または抽出に失敗した場合
+    """
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("動画からフレームを抽出するには ffmpeg が必要です")
+    directory = tempfile.mkdtemp(prefix="frames_")
+    try:
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-nostdin", "-v", "error", "-i", path,
+            "-vf", f"fps={frame_rate},scale='min({width},iw)':-2",
+            "-q:v", "4",
+            os.path.join(directory, "frame_%06d.jpg"),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpegによるフレーム抽出に失敗しました: {stderr.decode(errors='ignore')[:500]}")
+        paths = sorted(glob.glob(os.path.join(directory, "frame_*.jpg")))
+        frames = await asyncio.to_thread(select_keyframes, paths, frame_rate, threshold, max_frames)
+        return frames, len(paths)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, directory, True)
+
+
+def format_timestamp(seconds: float) -> str:
+    """秒数を [h:]mm:ss 形式にする"""
+    total = int(seconds)
+    hours, rest = divmod(total, 3600)
+    minutes, secs = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"